@@ -178,3 +178,5 @@ class BaseAddonAppConfig(AppConfig):
         # Set up Flask routes
         for route_group in self.routes:
             process_rules(app, **route_group)
+        # Connect the invalidation receivers of the WaterButler auth cache in every process
+        from addons.base import auth_cache  # noqa
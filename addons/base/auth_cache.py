@@ -0,0 +1,175 @@
+"""Short-lived cache for the WaterButler auth callback (``get_auth``).
+
+WaterButler calls back for every file operation, so listing a folder or uploading a batch of
+files repeats the same permission check and credential serialization for one node many times
+within a few seconds. Successful permission decisions and serialized provider credentials are
+reused for ``WATERBUTLER_AUTH_CACHE_TIMEOUT`` seconds.
+
+Entries are keyed by a per-target generation token, which is replaced whenever contributors or
+addon settings of the target change, and by the target's ``modified`` date. Changes that cannot
+be traced back to a single target (permission groups, external accounts, storage regions) replace
+a global generation token instead. The entries themselves live in a per-process cache, but the
+generation tokens are kept in ``WATERBUTLER_AUTH_GENERATION_CACHE_NAME``, a cache shared by all
+processes, so an invalidation in one worker is seen by every other worker on its next lookup.
+"""
+import uuid
+
+from django.conf import settings as django_settings
+from django.core.cache import caches
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from guardian.models import GroupObjectPermission
+
+from addons.base.models import BaseNodeSettings
+from addons.osfstorage.models import Region
+from osf.models import (
+    Contributor,
+    ExternalAccount,
+    FileVersionUserMetadata,
+    OSFUser,
+    Preprint,
+    PreprintContributor,
+    RegionExternalAccount,
+)
+from website import settings
+
+KEY_PREFIX = 'waterbutler-auth'
+
+
+GLOBAL_GENERATION_KEY = '{}:generation'.format(KEY_PREFIX)
+
+
+def get_cache():
+    return caches[django_settings.WATERBUTLER_AUTH_CACHE_NAME]
+
+
+def get_generation_cache():
+    return caches[django_settings.WATERBUTLER_AUTH_GENERATION_CACHE_NAME]
+
+
+def is_enabled():
+    return bool(settings.WATERBUTLER_AUTH_CACHE_TIMEOUT)
+
+
+def _target_label(target):
+    return 'preprint' if isinstance(target, Preprint) else 'node'
+
+
+def _generation_key(label, pk):
+    return '{}:generation:{}:{}'.format(KEY_PREFIX, label, pk)
+
+
+def _generations(*keys):
+    cache = get_generation_cache()
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # Tokens are random rather than counters so that entries written under an evicted
+            # generation can never match again.
+            cache.add(key, uuid.uuid4().hex, None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def _target_key(target):
+    label = _target_label(target)
+    global_generation, target_generation = _generations(GLOBAL_GENERATION_KEY, _generation_key(label, target.pk))
+    return '{}:{}:{}:{}:{}'.format(
+        global_generation,
+        label,
+        target.pk,
+        target_generation,
+        target.modified.timestamp() if target.modified else '',
+    )
+
+
+def invalidate_target(label, pk):
+    """Drop every cached entry of the node (``label='node'``) or preprint with the given pk."""
+    if is_enabled():
+        get_generation_cache().set(_generation_key(label, pk), uuid.uuid4().hex, None)
+
+
+def clear():
+    """Drop every cached entry in all processes."""
+    get_generation_cache().set(GLOBAL_GENERATION_KEY, uuid.uuid4().hex, None)
+    get_cache().clear()
+
+
+def _access_key(target, auth, action):
+    return '{}:access:{}:{}:{}:{}'.format(
+        KEY_PREFIX,
+        _target_key(target),
+        auth.user.pk if auth.user else '',
+        auth.private_key or '',
+        action,
+    )
+
+
+def check_access(target, auth, action, cas_resp, check):
+    """Run ``check(target, auth, action, cas_resp)`` unless it recently granted the same access.
+
+    Only granted access is cached; a denied request raises every time. Requests authenticated
+    with an OAuth bearer token are never cached because the token scopes are part of the decision.
+    """
+    if not is_enabled() or cas_resp is not None:
+        return check(target, auth, action, cas_resp)
+    key = _access_key(target, auth, action)
+    cache = get_cache()
+    if cache.get(key):
+        return True
+    result = check(target, auth, action, cas_resp)
+    cache.set(key, True, settings.WATERBUTLER_AUTH_CACHE_TIMEOUT)
+    return result
+
+
+def serialize_waterbutler(target, provider_name):
+    """Return the ``(credentials, settings)`` WaterButler needs for ``provider_name`` of the target."""
+    if not is_enabled():
+        return (
+            target.serialize_waterbutler_credentials(provider_name),
+            target.serialize_waterbutler_settings(provider_name),
+        )
+    key = '{}:serialized:{}:{}'.format(KEY_PREFIX, _target_key(target), provider_name)
+    cache = get_cache()
+    serialized = cache.get(key)
+    if serialized is None:
+        serialized = (
+            target.serialize_waterbutler_credentials(provider_name),
+            target.serialize_waterbutler_settings(provider_name),
+        )
+        cache.set(key, serialized, settings.WATERBUTLER_AUTH_CACHE_TIMEOUT)
+    return serialized
+
+
+def mark_version_seen(user, file_version):
+    """Record that ``user`` has seen ``file_version``, skipping the lookup for recent repeats."""
+    if not is_enabled():
+        FileVersionUserMetadata.objects.get_or_create(user=user, file_version=file_version)
+        return
+    key = '{}:seen:{}:{}'.format(KEY_PREFIX, user.pk, file_version.pk)
+    cache = get_cache()
+    if cache.get(key):
+        return
+    FileVersionUserMetadata.objects.get_or_create(user=user, file_version=file_version)
+    cache.set(key, True, settings.WATERBUTLER_AUTH_CACHE_TIMEOUT)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_on_change(sender, instance, **kwargs):
+    if not is_enabled():
+        return
+    if issubclass(sender, BaseNodeSettings):
+        invalidate_target('node', instance.owner_id)
+    elif issubclass(sender, Contributor):
+        invalidate_target('node', instance.node_id)
+    elif issubclass(sender, PreprintContributor):
+        invalidate_target('preprint', instance.preprint_id)
+    elif issubclass(sender, (ExternalAccount, Region, RegionExternalAccount, GroupObjectPermission)):
+        clear()
+
+
+@receiver(m2m_changed, sender=OSFUser.groups.through)
+def invalidate_on_group_change(sender, **kwargs):
+    if is_enabled() and kwargs['action'] in ('post_add', 'post_remove', 'post_clear'):
+        clear()
@@ -39,6 +39,7 @@ from framework.routing import json_renderer, proxy_url
 from framework.transactions.handlers import no_auto_transaction
 from website import mails
 from website import settings
+from addons.base import auth_cache
 from addons.base import signals as file_signals
 from addons.base.utils import format_last_known_metadata, get_mfr_url
 from osf import features
@@ -52,7 +53,6 @@ from osf.models import (
     NodeLog,
     DraftRegistration,
     Guid,
-    FileVersionUserMetadata,
     FileVersion,
     ExportDataLocation,
     ExportData,
@@ -284,7 +284,9 @@ def get_metric_class_for_action(action, from_mfr):
 
 @collect_auth
 def get_auth(auth, **kwargs):
-    logger.debug('----{}:{}::{} from {}:{}::{}'.format(*inspect_info(inspect.currentframe(), inspect.stack())))
+    if logger.isEnabledFor(logging.DEBUG):
+        # inspect.stack() reads the source of every frame, which costs more than the rest of the callback
+        logger.debug('----{}:{}::{} from {}:{}::{}'.format(*inspect_info(inspect.currentframe(), inspect.stack())))
     cas_resp = None
     if not auth.user:
         # Central Authentication Server OAuth Bearer Token
@@ -350,7 +352,7 @@ def get_auth(auth, **kwargs):
         elif not node:
             raise HTTPError(http_status.HTTP_404_NOT_FOUND)
 
-        check_access(node, auth, action, cas_resp)
+        auth_cache.check_access(node, auth, action, cas_resp, check_access)
         provider_settings = None
         if hasattr(node, 'get_addon'):
             provider_settings = node.get_addon(provider_name)
@@ -382,7 +384,12 @@ def get_auth(auth, **kwargs):
             filenode = OsfStorageFileNode.load(path.strip('/'))
             if filenode and filenode.is_file:
                 # default to most recent version if none is provided in the response
-                version = int(data['version']) if data.get('version') else filenode.versions.count()
+                if data.get('version'):
+                    version = int(data['version'])
+                elif filenode.version_count is not None:
+                    version = filenode.version_count
+                else:
+                    version = filenode.versions.count()
                 try:
                     fileversion = FileVersion.objects.filter(
                         basefilenode___id=file_id,
@@ -392,7 +399,7 @@ def get_auth(auth, **kwargs):
                     raise HTTPError(http_status.HTTP_400_BAD_REQUEST)
                 if auth.user:
                     # mark fileversion as seen
-                    FileVersionUserMetadata.objects.get_or_create(user=auth.user, file_version=fileversion)
+                    auth_cache.mark_version_seen(auth.user, fileversion)
                 if not node.is_contributor_or_group_member(auth.user):
                     from_mfr = download_is_from_mfr(request, payload=data)
                     # version index is 0 based
@@ -430,8 +437,7 @@ def get_auth(auth, **kwargs):
             )
     # If they haven't been set by version region, use the NodeSettings or Preprint directly
     if is_node_process and not (credentials and waterbutler_settings):
-        credentials = node.serialize_waterbutler_credentials(provider_name)
-        waterbutler_settings = node.serialize_waterbutler_settings(provider_name)
+        credentials, waterbutler_settings = auth_cache.serialize_waterbutler(node, provider_name)
 
     if not is_node_process:
         # for only location_id value
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 20:00
+from __future__ import unicode_literals
+import logging
+
+from django.db import connection, migrations
+import osf.utils.fields
+
+logger = logging.getLogger(__name__)
+
+
+def remove_duplicated_erad_records(*args):
+    # Keeps the newest record of each set of ERadRecords with the same key
+    sql = """
+    DELETE FROM addons_metadata_eradrecord r
+    USING addons_metadata_eradrecord newer
+    WHERE r.recordset_id = newer.recordset_id
+      AND r.kenkyusha_no = newer.kenkyusha_no
+      AND r.kadai_id = newer.kadai_id
+      AND r.nendo = newer.nendo
+      AND r.id < newer.id;
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        logger.info('Deleted {} duplicated ERadRecords.'.format(cursor.rowcount))
+
+
+def noop(*args):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('addons_metadata', '0012_registrationreportformat_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicated_erad_records, noop),
+        migrations.AddField(
+            model_name='eradrecord',
+            name='removed',
+            field=osf.utils.fields.NonNaiveDateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='eradrecord',
+            unique_together=set([('recordset', 'kenkyusha_no', 'kadai_id', 'nendo')]),
+        ),
+    ]
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import logging
 import json
+from collections import defaultdict
 import os
 import re
 import requests
@@ -10,7 +11,8 @@ from addons.base.models import BaseUserSettings, BaseNodeSettings
 from addons.osfstorage.models import OsfStorageFileNode
 from api.base.utils import waterbutler_api_url_for
 from django.core.exceptions import MultipleObjectsReturned
-from django.db import models, transaction
+from django.db import connection, models, transaction
+from django.db.models import Q
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.contenttypes.models import ContentType
@@ -57,18 +59,6 @@ def schema_has_field(schema, name):
 class ERadRecordSet(BaseModel):
     code = models.CharField(max_length=64, primary_key=True)
 
-    def get_or_create_record(self, kenkyusha_no, kadai_id, nendo):
-        objs = ERadRecord.objects.filter(
-            recordset=self, kenkyusha_no=kenkyusha_no, kadai_id=kadai_id,
-            nendo=nendo,
-        )
-        if objs.exists():
-            return objs.first()
-        return ERadRecord.objects.create(
-            recordset=self, kenkyusha_no=kenkyusha_no, kadai_id=kadai_id,
-            nendo=nendo,
-        )
-
     @classmethod
     def get_or_create(cls, code):
         objs = cls.objects.filter(code=code)
@@ -76,8 +66,47 @@ class ERadRecordSet(BaseModel):
             return objs.first()
         return cls.objects.create(code=code)
 
+    def upsert_records(self, rows, imported):
+        """Insert or update the records of ``rows``, dicts of ERadRecord field name -> value,
+        with one INSERT ... ON CONFLICT statement. The records get ``imported`` as their
+        modified date and are no longer marked as removed.
+        """
+        if not rows:
+            return
+        field_names = list(rows[0].keys())
+        fields = [ERadRecord._meta.get_field(name) for name in field_names]
+        columns = ['recordset_id', 'created', 'modified', 'removed'] + [field.column for field in fields]
+        updated_columns = ['modified', 'removed'] + [
+            field.column for field in fields if field.name not in ERadRecord.RECORD_KEY
+        ]
+        sql = (
+            'INSERT INTO {table} ({columns}) VALUES {values} '
+            'ON CONFLICT (recordset_id, kenkyusha_no, kadai_id, nendo) DO UPDATE SET {updates}'
+        ).format(
+            table=ERadRecord._meta.db_table,
+            columns=', '.join(columns),
+            values=', '.join(['({})'.format(', '.join(['%s'] * len(columns)))] * len(rows)),
+            updates=', '.join('{0} = EXCLUDED.{0}'.format(column) for column in updated_columns),
+        )
+        params = []
+        for row in rows:
+            params.extend([self.pk, imported, imported, None])
+            params.extend(field.get_db_prep_save(row[field.name], connection) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def mark_removed_records(self, imported):
+        """Mark the records that were not imported at ``imported`` as removed.
+
+        Returns the number of records newly marked as removed.
+        """
+        return self.records.filter(modified__lt=imported, removed__isnull=True).update(removed=imported)
+
 
 class ERadRecord(BaseModel):
+    # Fields identifying a record of a recordset
+    RECORD_KEY = ('kenkyusha_no', 'kadai_id', 'nendo')
+
     recordset = models.ForeignKey(ERadRecordSet, related_name='records',
                                   db_index=True, null=True, blank=True,
                                   on_delete=models.CASCADE)
@@ -110,10 +139,14 @@ class ERadRecord(BaseModel):
     program_name_en = models.TextField(blank=True, null=True)
     funding_stream_code = models.TextField(blank=True, null=True)
 
+    # Set when the latest import of the recordset did not contain the record anymore
+    removed = NonNaiveDateTimeField(blank=True, null=True)
+
     class Meta:
         indexes = [
             models.Index(fields=['kenkyusha_no', 'kadai_id', 'nendo'])
         ]
+        unique_together = ('recordset', 'kenkyusha_no', 'kadai_id', 'nendo')
 
 
 class RegistrationReportFormat(BaseModel):
@@ -150,45 +183,38 @@ class NodeSettings(BaseNodeSettings):
 
     def get_file_metadatas(self):
         files = []
-        for m in self.file_metadata.filter(deleted__isnull=True):
+        file_metadatas = list(self.file_metadata.filter(deleted__isnull=True))
+        urlpaths = FileMetadata.resolve_urlpaths(file_metadatas)
+        for m in file_metadatas:
             r = {
                 'generated': False,
                 'path': m.path,
                 'hash': m.hash,
                 'folder': m.folder,
-                'urlpath': m.resolve_urlpath(),
+                'urlpath': urlpaths[m.id],
             }
             r.update(self._get_file_metadata(m))
             files.append(r)
         return files
 
+    def get_file_metadata_tree(self, paths=None, resolve_parent=True):
+        """Load the file metadata of ``paths`` and, with ``resolve_parent``, of their
+        parent folders, or all file metadata of the project if ``paths`` is None.
+        """
+        return FileMetadataTree(self, paths=paths, resolve_parent=resolve_parent)
+
     def get_file_metadata_for_path(self, path, resolve_parent=True):
-        q = self.file_metadata.filter(deleted__isnull=True, path=path)
-        if not q.exists():
-            if not resolve_parent:
-                return None
-            parent, _ = os.path.split(path.strip('/'))
-            if len(parent) == 0:
-                return None
-            r = self.get_file_metadata_for_path(parent + '/')
-            if r is None:
-                return None
-            r['generated'] = True
-            r['hash'] = None
-            r['path'] = path
-            return r
-        m = q.first()
-        r = {
-            'generated': False,
-            'path': m.path,
-            'folder': m.folder,
-            'hash': m.hash,
-            'urlpath': m.resolve_urlpath(),
-            'created': m.created.isoformat(),
-            'modified': m.modified.isoformat(),
-        }
-        r.update(self._get_file_metadata(m))
-        return r
+        return self.get_file_metadata_for_paths([path], resolve_parent=resolve_parent)[path]
+
+    def get_file_metadata_for_paths(self, paths, resolve_parent=True):
+        """Get the file metadata of many paths at once, see get_file_metadata_for_path.
+
+        Returns path -> file metadata, or None if neither the path nor, with
+        ``resolve_parent``, one of its parent folders has metadata.
+        """
+        paths = list(paths)
+        tree = self.get_file_metadata_tree(paths=paths, resolve_parent=resolve_parent)
+        return tree.get_file_metadatas(paths, resolve_parent=resolve_parent)
 
     def set_file_metadata(self, filepath, file_metadata, auth=None):
         self._validate_file_metadata(file_metadata)
@@ -500,6 +526,90 @@ class NodeSettings(BaseNodeSettings):
             r.append(repo)
         return r
 
+class FileMetadataTree(object):
+    """Non-deleted file metadata of a project in a trie of path segments.
+
+    Looks up the metadata of a path, falling back to the metadata of its
+    nearest parent folder, in memory. The URL paths of the metadata are
+    resolved in bulk.
+    """
+
+    class _Node(object):
+        __slots__ = ('children', 'folder_metadata')
+
+        def __init__(self):
+            self.children = {}
+            self.folder_metadata = None
+
+    def __init__(self, node_settings, paths=None, resolve_parent=True):
+        self.node_settings = node_settings
+        self._metadatas = {}
+        self._root = self._Node()
+        self._urlpaths = {}
+
+        q = node_settings.file_metadata.filter(deleted__isnull=True)
+        if paths is not None:
+            q = q.filter(path__in={
+                p for path in paths
+                for p in [path] + (self._parent_folder_paths(path) if resolve_parent else [])
+            })
+        for m in q.order_by('id'):
+            if m.path in self._metadatas:
+                continue
+            self._metadatas[m.path] = m
+            # Only folder paths in this form are looked up as parents
+            if len(m.path) > 1 and m.path == m.path.strip('/') + '/':
+                node = self._root
+                for segment in m.path.strip('/').split('/'):
+                    node = node.children.setdefault(segment, self._Node())
+                node.folder_metadata = m
+
+    @staticmethod
+    def _parent_folder_paths(path):
+        segments = path.strip('/').split('/')
+        return ['/'.join(segments[:i]) + '/' for i in range(1, len(segments))]
+
+    def _find(self, path, resolve_parent):
+        m = self._metadatas.get(path)
+        if m is not None or not resolve_parent:
+            return m, False
+        nearest = None
+        node = self._root
+        for segment in path.strip('/').split('/')[:-1]:
+            node = node.children.get(segment)
+            if node is None:
+                break
+            nearest = node.folder_metadata or nearest
+        return nearest, True
+
+    def get_file_metadatas(self, paths, resolve_parent=True):
+        """Returns path -> serialized file metadata, or None, of each path"""
+        found = {path: self._find(path, resolve_parent) for path in paths}
+        unresolved = {m.id: m for m, _ in found.values() if m is not None and m.id not in self._urlpaths}
+        self._urlpaths.update(FileMetadata.resolve_urlpaths(unresolved.values()))
+        return {
+            path: None if m is None else self._serialize(path, m, generated)
+            for path, (m, generated) in found.items()
+        }
+
+    def _serialize(self, path, m, generated):
+        r = {
+            'generated': False,
+            'path': m.path,
+            'folder': m.folder,
+            'hash': m.hash,
+            'urlpath': self._urlpaths[m.id],
+            'created': m.created.isoformat(),
+            'modified': m.modified.isoformat(),
+        }
+        r.update(self.node_settings._get_file_metadata(m))
+        if generated:
+            r['generated'] = True
+            r['hash'] = None
+            r['path'] = path
+        return r
+
+
 class FileMetadata(BaseModel):
     project = models.ForeignKey(NodeSettings, related_name='file_metadata',
                                 db_index=True, null=True, blank=True,
@@ -560,15 +670,24 @@ class FileMetadata(BaseModel):
             return None
         return self.project.owner
 
-    def resolve_urlpath(self):
-        node = self.project.owner
-        if self.folder:
-            return node.url + 'files/dir/' + self.path
+    def _split_path(self):
         m = re.match(r'([^\/]+)(/.*)', self.path)
         if not m:
             raise ValueError('Malformed path: ' + self.path)
-        provider = m.group(1)
-        path = m.group(2)
+        return m.group(1), m.group(2)
+
+    def resolve_urlpath(self, file_nodes=None):
+        """Resolve the URL path of the file or folder.
+
+        :param dict file_nodes: materialized path -> file nodes of the node and
+            provider of the file, with their guids prefetched, see resolve_urlpaths
+        """
+        node = self.project.owner
+        if self.folder:
+            return node.url + 'files/dir/' + self.path
+        provider, path = self._split_path()
+        if file_nodes is not None and not path.endswith('/'):
+            return self._resolve_urlpath_from(node, provider, path, file_nodes)
         if provider == 'osfstorage':
             # materialized path -> object path
             content_type = ContentType.objects.get_for_model(node)
@@ -600,6 +719,68 @@ class FileMetadata(BaseModel):
             logger.exception(f'Multiple file nodes returned for {path} @ {node._id}')
             return None
 
+    def _resolve_urlpath_from(self, node, provider, path, file_nodes):
+        if provider == 'osfstorage':
+            matches = file_nodes.get(path, [])[:1]
+            if len(matches) == 0:
+                logger.warn('No files: ' + self.path)
+                return None
+            # materialized path -> object path
+            path = matches[0].path
+        else:
+            matches = file_nodes.get('/' + path.lstrip('/'), [])
+            if len(matches) > 1:
+                # Multiple file nodes returned due to the duplicate file node
+                logger.error(f'Multiple file nodes returned for {path} @ {node._id}')
+                return None
+        guids = sorted(matches[0].guids.all(), key=lambda guid: guid.pk) if matches else []
+        if len(guids) == 0:
+            logger.info('No guid: ' + self.path + '(provider=' + provider + ')')
+            return node.url + 'files/' + provider + path
+        return '/' + guids[0]._id + '/'
+
+    @classmethod
+    def resolve_urlpaths(cls, file_metadatas):
+        """Bulk version of resolve_urlpath: returns file metadata id -> URL path.
+        The file nodes and guids of each node and provider are loaded with one query.
+        """
+        files = defaultdict(list)
+        for m in file_metadatas:
+            provider = None if m.folder else m._split_path()[0]
+            files[(m.project.owner, provider)].append(m)
+
+        urlpaths = {}
+        for (node, provider), file_metadatas in files.items():
+            file_nodes = None
+            if provider is not None:
+                file_nodes = cls._load_file_nodes(node, provider, {m._split_path()[1] for m in file_metadatas})
+            for m in file_metadatas:
+                urlpaths[m.id] = m.resolve_urlpath(file_nodes=file_nodes)
+        return urlpaths
+
+    @classmethod
+    def _load_file_nodes(cls, node, provider, paths):
+        content_type = ContentType.objects.get_for_model(node)
+        file_nodes = defaultdict(list)
+        if provider == 'osfstorage':
+            q = OsfStorageFileNode.objects.filter(
+                Q(_stored_materialized_path__in=paths) | Q(_stored_materialized_path__isnull=True),
+                target_content_type=content_type,
+                target_object_id=node.id,
+            )
+            for fn in q.order_by('id').prefetch_related('guids'):
+                if fn.materialized_path in paths:
+                    file_nodes[fn.materialized_path].append(fn)
+        else:
+            q = BaseFileNode.resolve_class(provider, BaseFileNode.FILE).objects.filter(
+                target_content_type=content_type,
+                target_object_id=node.id,
+                _materialized_path__in={'/' + path.lstrip('/') for path in paths},
+            )
+            for fn in q.prefetch_related('guids'):
+                file_nodes[fn._materialized_path].append(fn)
+        return dict(file_nodes)
+
     def update_search(self):
         from website import search
         try:
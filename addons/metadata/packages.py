@@ -306,6 +306,8 @@ class BaseROCrateFactory(object):
         self.node = node
         self.work_dir = work_dir
         self.include_users = False
+        # node id -> file metadata of the node, loaded once per package
+        self._file_metadata_trees = {}
 
     def _build_ro_crate_as_json(self):
         crate = ROCrate()
@@ -508,7 +510,10 @@ class BaseROCrateFactory(object):
         metadata = node.get_addon(SHORT_NAME)
         if metadata is None:
             return
-        file_metadata = metadata.get_file_metadata_for_path(file_path, resolve_parent=False)
+        if node.id not in self._file_metadata_trees:
+            self._file_metadata_trees[node.id] = metadata.get_file_metadata_tree()
+        tree = self._file_metadata_trees[node.id]
+        file_metadata = tree.get_file_metadatas([file_path], resolve_parent=False)[file_path]
         if file_metadata is None:
             return
         file_entity_id = path
@@ -18,3 +18,7 @@ DEFAULT_DATASET_TIMEOUT = 60  # seconds
 # List of addons that are not allowed to be exported
 EXCLUDED_ADDONS_FOR_EXPORT = ['mendeley', 'zotero', 'iqbrims']
 EXCLUDED_ADDONS_FOR_EXPORT += ['dropboxbusiness', 'nextcloudinstitutions', 'ociinstitutions', 'onedrivebusiness', 's3compatinstitutions']
+
+# ROR organization searches are cached per keyword for the metadata editor's suggestions
+ROR_SUGGESTION_CACHE_TTL = 60 * 60  # seconds
+ROR_SUGGESTION_CACHE_SIZE = 1024  # keywords
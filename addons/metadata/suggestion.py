@@ -1,4 +1,7 @@
+from collections import OrderedDict, defaultdict
 import logging
+import threading
+import time
 
 import requests
 from rest_framework import status as http_status
@@ -6,9 +9,9 @@ from rest_framework import status as http_status
 from framework.exceptions import HTTPError
 from osf.models import BaseFileNode
 from osf.models.files import UnableToResolveFileClass
-from osf.utils.fields import EncryptedTextField, EncryptedJSONField
 from . import SHORT_NAME
 from .models import ERadRecord
+from .settings import ROR_SUGGESTION_CACHE_SIZE, ROR_SUGGESTION_CACHE_TTL
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +26,92 @@ ERAD_COLUMNS = [
 ROR_URL = 'https://api.ror.org/organizations'
 
 
+class TTLCache(object):
+    """In-process LRU cache whose entries expire ``ttl`` seconds after they were stored"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+ror_cache = TTLCache(ROR_SUGGESTION_CACHE_SIZE, ROR_SUGGESTION_CACHE_TTL)
+
+
+class SuggestionCandidates(object):
+    """Contributors of a node and their e-Rad records for the suggestions of one request.
+
+    Both are loaded once, with one query each, on first use, so that several keys can be
+    suggested from them.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self._contributors = None
+        self._erad_records = None
+        self._serialized_contributors = None
+
+    @property
+    def contributors(self):
+        if self._contributors is None:
+            self._contributors = list(self.node.contributors)
+        return self._contributors
+
+    @property
+    def serialized_contributors(self):
+        if self._serialized_contributors is None:
+            self._serialized_contributors = _serialize_contributors(self.contributors)
+        return self._serialized_contributors
+
+    @property
+    def erad_records(self):
+        """e-Rad records of the contributors, in the order of the contributors"""
+        if self._erad_records is None:
+            numbers = [user.erad for user in self.contributors if user.erad is not None]
+            records = defaultdict(list)
+            if numbers:
+                for record in _erad_candidates(kenkyusha_no__in=set(numbers)):
+                    records[record['kenkyusha_no']].append(record)
+            self._erad_records = [record for number in numbers for record in records[number]]
+        return self._erad_records
+
+    def search(self, candidates, get_texts, keyword):
+        """Return the candidates with a text containing ``keyword``.
+
+        :param get_texts: Function returning the texts of a candidate, ``None`` texts never match
+        """
+        return [
+            candidate for candidate in candidates
+            if any(text is not None and keyword in text for text in get_texts(candidate))
+        ]
+
+
 def valid_suggestion_key(key):
     if key == 'file-data-number':
         return True
@@ -37,18 +126,22 @@ def valid_suggestion_key(key):
     return False
 
 
-def suggestion_metadata(key, keyword, filepath, node):
+def suggestion_metadata(key, keyword, filepath, node, candidates=None):
+    """Return the suggestions of ``key`` for ``keyword``.
+
+    Pass the same ``SuggestionCandidates`` of the node to suggest several keys in one request.
+    """
     suggestions = []
     if key == 'file-data-number':
         suggestions.extend(suggestion_file_data_number(key, filepath, node))
     elif key == 'ror':
         suggestions.extend(suggestion_ror(key, keyword))
     elif key.startswith('erad:'):
-        suggestions.extend(suggestion_erad(key, keyword, node))
+        suggestions.extend(suggestion_erad(key, keyword, node, candidates=candidates))
     elif key.startswith('asset:'):
         suggestions.extend(suggestion_asset(key, keyword, node))
     elif key.startswith('contributor:'):
-        suggestions.extend(suggestion_contributor(key, keyword, node))
+        suggestions.extend(suggestion_contributor(key, keyword, node, candidates=candidates))
     else:
         raise KeyError('Invalid key: {}'.format(key))
     return suggestions
@@ -75,16 +168,24 @@ def suggestion_file_data_number(key, filepath, node):
     }]
 
 
+def _search_ror(keyword):
+    items = ror_cache.get(keyword)
+    if items is None:
+        response = requests.get(
+            ROR_URL,
+            params={
+                'query': keyword,
+            }
+        )
+        response.raise_for_status()
+        items = response.json()['items']
+        ror_cache.set(keyword, items)
+    return items
+
+
 def suggestion_ror(key, keyword):
-    response = requests.get(
-        ROR_URL,
-        params={
-            'query': keyword,
-        }
-    )
-    response.raise_for_status()
     res = []
-    for item in response.json()['items']:
+    for item in _search_ror(keyword):
         labels = item.get('labels', [])
         name_ja = next((l['label'] for l in labels if l['iso639'] == 'ja'), item['name'])
         res.append({
@@ -114,20 +215,24 @@ def _to_msfullname(name, lang):
     return ' '.join(names[::-1])
 
 
-def suggestion_erad(key, keyword, node):
+def _erad_search_text(value):
+    # Matches case-insensitively, as the icontains lookup on the database did
+    return None if value is None else str(value).lower()
+
+
+def suggestion_erad(key, keyword, node, candidates=None):
+    if candidates is None:
+        candidates = SuggestionCandidates(node)
     filter_field_name = key[5:]
-    filter_field = ERadRecord._meta.get_field(filter_field_name)
-    if isinstance(filter_field, EncryptedTextField) or isinstance(filter_field, EncryptedJSONField):
-        # cannot filter by encrypted field
-        candidates = [
-            r
-            for r in _erad_candidates_for_node(node)
-            if keyword.lower() in r[filter_field_name].lower()
-        ]
-    else:
-        candidates = _erad_candidates_for_node(node, **{f'{filter_field_name}__icontains': keyword})
+    # Raises FieldDoesNotExist for unknown fields
+    ERadRecord._meta.get_field(filter_field_name)
+    records = candidates.search(
+        candidates.erad_records,
+        lambda r: [_erad_search_text(r[filter_field_name])],
+        keyword.lower(),
+    )
     res = []
-    for candidate in candidates:
+    for candidate in records:
         names = candidate.get('kenkyusha_shimei', '').split('|')
         ja_parts = names[:len(names) // 2]
         en_parts = names[len(names) // 2:]
@@ -159,21 +264,14 @@ def suggestion_erad(key, keyword, node):
     return res
 
 
-def _erad_candidates_for_node(node, **pred):
-    return sum([  # flatten
-        _erad_candidates(**{**pred, 'kenkyusha_no': user.erad})
-        for user in node.contributors
-        if user.erad is not None
-    ], [])
-
-
 def _erad_candidates(**pred):
     return [
         dict([
             (k.lower(), getattr(record, k.lower()))
             for k in ERAD_COLUMNS
         ])
-        for record in ERadRecord.objects.filter(**pred)
+        # Records missing from the latest import of their recordset are not suggested
+        for record in ERadRecord.objects.filter(removed__isnull=True, **pred)
     ]
 
 
@@ -207,8 +305,8 @@ def _contributor_to_name_en(user):
     }
 
 
-def suggestion_contributor(key, keyword, node):
-    contributors = [
+def _serialize_contributors(users):
+    return [
         {
             'erad': user.erad,
             'name-ja-full': '|'.join([
@@ -232,24 +330,25 @@ def suggestion_contributor(key, keyword, node):
             'name-ja-msfullname': _to_msfullname(_contributor_to_name_ja(user), 'ja'),
             'name-en-msfullname': _to_msfullname(_contributor_to_name_en(user), 'en'),
         }
-        for user in node.contributors
+        for user in users
     ]
+
+
+def suggestion_contributor(key, keyword, node, candidates=None):
     search_key = key.split(':')[1]
     if search_key == 'erad':
-        contributors = [
-            cont for cont in contributors
-            if keyword in cont['erad']
-        ]
+        fields = ['erad']
     elif search_key == 'name':
-        contributors = [
-            cont for cont in contributors
-            if any([
-                keyword in cont['name-ja-full'],
-                keyword in cont['name-en-full'],
-            ])
-        ]
+        fields = ['name-ja-full', 'name-en-full']
     else:
         raise KeyError('Invalid key: {}'.format(key))
+    if candidates is None:
+        candidates = SuggestionCandidates(node)
+    contributors = candidates.search(
+        candidates.serialized_contributors,
+        lambda cont: [cont[field] for field in fields],
+        keyword,
+    )
     return [
         {
             'key': key,
@@ -851,3 +851,65 @@ class TestFileMetadata(unittest.TestCase):
                 folder=False,
                 project=self.node_settings,
             )
+
+    def _create_file_metadata(self, path, folder):
+        return FileMetadata.objects.create(
+            path=path,
+            folder=folder,
+            hash='1234567890',
+            metadata='{"items": []}',
+            project=self.node_settings,
+        )
+
+    def test_get_file_metadata_for_paths(self):
+        self._create_file_metadata('osfstorage/dir/', True)
+        self._create_file_metadata('osfstorage/dir/sub/file', False)
+
+        with mock.patch.object(FileMetadata, 'resolve_urlpath', return_value='/testFileGUID/'):
+            metadatas = self.node_settings.get_file_metadata_for_paths([
+                'osfstorage/dir/',
+                'osfstorage/dir/sub/',
+                'osfstorage/dir/sub/file',
+                'osfstorage/dir/sub/other',
+                'osfstorage/other',
+            ])
+
+        assert_false(metadatas['osfstorage/dir/']['generated'])
+        assert_equal(metadatas['osfstorage/dir/']['hash'], '1234567890')
+        # Falls back to the nearest parent folder with metadata
+        assert_true(metadatas['osfstorage/dir/sub/']['generated'])
+        assert_equal(metadatas['osfstorage/dir/sub/']['path'], 'osfstorage/dir/sub/')
+        assert_equal(metadatas['osfstorage/dir/sub/']['hash'], None)
+        assert_true(metadatas['osfstorage/dir/sub/other']['generated'])
+        assert_equal(metadatas['osfstorage/dir/sub/other']['path'], 'osfstorage/dir/sub/other')
+        assert_false(metadatas['osfstorage/dir/sub/file']['generated'])
+        assert_equal(metadatas['osfstorage/other'], None)
+
+    def test_get_file_metadata_for_paths_without_parent(self):
+        self._create_file_metadata('osfstorage/dir/', True)
+
+        metadatas = self.node_settings.get_file_metadata_for_paths(
+            ['osfstorage/dir/', 'osfstorage/dir/file'], resolve_parent=False,
+        )
+
+        assert_equal(metadatas['osfstorage/dir/']['path'], 'osfstorage/dir/')
+        assert_equal(metadatas['osfstorage/dir/file'], None)
+
+    def test_resolve_urlpaths(self):
+        root = self.node.get_addon('osfstorage').get_root()
+        folder = root.append_folder('dir')
+        file_node = folder.append_file('file')
+        guid = file_node.get_guid(create=True)
+        folder_metadata = self._create_file_metadata('osfstorage/dir/', True)
+        file_metadata = self._create_file_metadata('osfstorage/dir/file', False)
+        missing_metadata = self._create_file_metadata('osfstorage/dir/missing', False)
+
+        urlpaths = FileMetadata.resolve_urlpaths([folder_metadata, file_metadata, missing_metadata])
+
+        assert_equal(urlpaths, {
+            folder_metadata.id: '{}files/dir/osfstorage/dir/'.format(self.node.url),
+            file_metadata.id: '/{}/'.format(guid._id),
+            missing_metadata.id: None,
+        })
+        for m in [folder_metadata, file_metadata, missing_metadata]:
+            assert_equal(urlpaths[m.id], m.resolve_urlpath())
@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 import logging
 import mock
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from nose.tools import *  # noqa
 
 from tests.base import OsfTestCase
 from osf_tests.factories import UserFactory
 
 from .utils import BaseAddonTestCase
-from addons.metadata.suggestion import suggestion_metadata
+from addons.metadata.suggestion import suggestion_metadata, ror_cache, SuggestionCandidates
 from addons.metadata.models import ERadRecord
 
 
@@ -20,6 +22,7 @@ class TestSuggestion(BaseAddonTestCase, OsfTestCase):
         self.mock_fetch_metadata_asset_files = mock.patch('addons.metadata.models.fetch_metadata_asset_files')
         self.mock_fetch_metadata_asset_files.start()
         super(TestSuggestion, self).setUp()
+        ror_cache.clear()
         self.erad = ERadRecord.objects.create(
             kenkyusha_no='0123456',
             kenkyusha_shimei='姓|名|Last|First',
@@ -67,6 +70,68 @@ class TestSuggestion(BaseAddonTestCase, OsfTestCase):
         mock_requests.get.assert_called_once()
         assert mock_requests.get.call_args[1]['params']['query'] == 'searchkey'
 
+    @mock.patch('addons.metadata.suggestion.requests')
+    def test_suggestion_ror_cached(self, mock_requests):
+        ror_data = {
+            'items': [
+                {
+                    'id': 'https://ror.org/0123456789',
+                    'name': 'Example University',
+                    'labels': [],
+                },
+            ],
+        }
+        mock_requests.get.return_value = mock.Mock(status_code=200, json=lambda: ror_data)
+        r1 = suggestion_metadata('ror', 'searchkey', None, self.project)
+        r2 = suggestion_metadata('ror', 'searchkey', None, self.project)
+
+        assert r1 == r2
+        assert r2[0]['value']['name-ja'] == 'Example University'
+        mock_requests.get.assert_called_once()
+
+        suggestion_metadata('ror', 'otherkey', None, self.project)
+        assert mock_requests.get.call_count == 2
+
+    def test_candidates_search(self):
+        candidates = SuggestionCandidates(self.project)
+        texts = ['abcab', 'bca', None, '']
+
+        def get_texts(i):
+            return [texts[i]]
+
+        assert candidates.search(range(4), get_texts, 'ab') == [0]
+        assert candidates.search(range(4), get_texts, 'bc') == [0, 1]
+        assert candidates.search(range(4), get_texts, '') == [0, 1, 3]
+        assert candidates.search(range(4), get_texts, 'x') == []
+
+    def test_suggestion_shared_candidates(self):
+        self.user.erad = '0123456'
+        self.user.save()
+        self.contributor.erad = '9999999'
+        self.contributor.save()
+        ERadRecord.objects.create(
+            kenkyusha_no='9999999',
+            kenkyusha_shimei='姓2|名2|Last2|First2',
+            kenkyukikan_mei='研究機関名2|Research Institute Name2',
+        )
+
+        candidates = SuggestionCandidates(self.project)
+        with CaptureQueriesContext(connection) as queries:
+            r = suggestion_metadata('erad:kenkyusha_no', '9', None, self.project, candidates=candidates)
+            r += suggestion_metadata('erad:kenkyusha_shimei', 'last', None, self.project, candidates=candidates)
+            r += suggestion_metadata('contributor:erad', '0', None, self.project, candidates=candidates)
+        # Contributors and their e-Rad records
+        assert len(queries) == 2
+        assert [s['key'] for s in r] == [
+            'erad:kenkyusha_no',
+            'erad:kenkyusha_shimei',
+            'erad:kenkyusha_shimei',
+            'contributor:erad',
+        ]
+        assert r[0]['value']['kenkyusha_no'] == '9999999'
+        assert [s['value']['kenkyusha_no'] for s in r[1:3]] == ['0123456', '9999999']
+        assert r[3]['value']['erad'] == '0123456'
+
     def test_suggestion_erad(self):
         r = suggestion_metadata('erad:kenkyusha_no', '0', None, self.project)
         logger.info('erad suggestion: {}'.format(r))
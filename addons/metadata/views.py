@@ -9,7 +9,7 @@ import logging
 from . import SHORT_NAME
 from .models import RegistrationReportFormat, get_draft_files, FIELD_GRDM_FILES, schema_has_field
 from .utils import make_report_as_csv
-from .suggestion import suggestion_metadata, _erad_candidates, valid_suggestion_key
+from .suggestion import suggestion_metadata, valid_suggestion_key, SuggestionCandidates
 from .packages import import_project, export_project, get_task_result
 from framework.exceptions import HTTPError
 from framework.auth.decorators import must_be_logged_in
@@ -131,12 +131,7 @@ def metadata_update_config(auth, **kwargs):
 @must_have_permission('write')
 def metadata_get_erad_candidates(auth, **kwargs):
     node = kwargs['node'] or kwargs['project']
-    candidates = []
-    for user in node.contributors:
-        rn = user.erad
-        if rn is None:
-            continue
-        candidates += _erad_candidates(kenkyusha_no=rn)
+    candidates = SuggestionCandidates(node).erad_records
     return {
         'data': {
             'id': node._id,
@@ -366,10 +361,10 @@ def metadata_file_metadata_suggestions(auth, filepath=None, **kwargs):
         raise HTTPError(http_status.HTTP_400_BAD_REQUEST)
     keyword = request.args.get('keyword', '').lower()
     node = kwargs['node'] or kwargs['project']
-    suggestions = sum([  # flatten
-        suggestion_metadata(key, keyword, filepath, node)
-        for key in key_list
-    ], [])
+    candidates = SuggestionCandidates(node)
+    suggestions = []
+    for key in key_list:
+        suggestions.extend(suggestion_metadata(key, keyword, filepath, node, candidates=candidates))
     return {
         'data': {
             'id': node._id,
@@ -35,6 +35,46 @@ settings = apps.get_app_config('addons_osfstorage')
 logger = logging.getLogger(__name__)
 
 
+# The materialized paths of every osfstorage node below the given folders, derived from the
+# folders' own paths. root_ids and root_paths are parallel arrays
+MATERIALIZED_PATH_TREE_SQL = """
+    WITH RECURSIVE descendants(id, path) AS (
+        SELECT T.id, R.path || T.name || CASE WHEN T.type IN %(file_types)s THEN '' ELSE '/' END
+        FROM unnest(%(root_ids)s::INTEGER[], %(root_paths)s::TEXT[]) AS R(id, path)
+        JOIN %(table)s AS T ON T.parent_id = R.id
+        WHERE T.type IN %(types)s
+        UNION ALL
+        SELECT T.id, D.path || T.name || CASE WHEN T.type IN %(file_types)s THEN '' ELSE '/' END
+        FROM descendants AS D
+        JOIN %(table)s AS T ON T.parent_id = D.id
+        WHERE T.type IN %(types)s
+    )
+"""
+
+DESCENDANT_MATERIALIZED_PATHS_SQL = MATERIALIZED_PATH_TREE_SQL + """
+    UPDATE %(table)s AS T
+    SET _stored_materialized_path = descendants.path
+    FROM descendants
+    WHERE T.id = descendants.id
+    AND T._stored_materialized_path IS DISTINCT FROM descendants.path
+"""
+
+ROOT_MATERIALIZED_PATHS_SQL = """
+    UPDATE %(table)s AS T
+    SET _stored_materialized_path = R.path
+    FROM unnest(%(root_ids)s::INTEGER[], %(root_paths)s::TEXT[]) AS R(id, path)
+    WHERE T.id = R.id
+    AND T._stored_materialized_path IS DISTINCT FROM R.path
+"""
+
+DRIFTED_MATERIALIZED_PATHS_SQL = MATERIALIZED_PATH_TREE_SQL + """
+    SELECT T.id, T._stored_materialized_path, descendants.path
+    FROM descendants
+    JOIN %(table)s AS T ON T.id = descendants.id
+    WHERE T._stored_materialized_path IS DISTINCT FROM descendants.path
+"""
+
+
 class OsfStorageFolderManager(BaseFileNodeManager):
 
     def get_root(self, target):
@@ -46,8 +86,26 @@ class OsfStorageFolderManager(BaseFileNodeManager):
 class OsfStorageFileNode(BaseFileNode):
     _provider = 'osfstorage'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(OsfStorageFileNode, cls).from_db(db, field_names, values)
+        # Remember what the stored materialized path was derived from, see _update_stored_materialized_path
+        instance._materialized_path_source = (instance.__dict__.get('parent_id'), instance.__dict__.get('name'))
+        return instance
+
     @property
     def materialized_path(self):
+        if self._stored_materialized_path is not None:
+            return self._stored_materialized_path
+        return self.compute_materialized_path()
+
+    @materialized_path.setter
+    def materialized_path(self, val):
+        # raise Exception('Cannot set materialized path on OSFStorage as it is computed.')
+        logger.warn('Cannot set materialized path on OSFStorage because it\'s computed.')
+
+    def compute_materialized_path(self):
+        """Build the materialized path by walking up the parent chain, ignoring the stored value."""
         sql = """
             WITH RECURSIVE materialized_path_cte(parent_id, GEN_PATH) AS (
               SELECT
@@ -79,10 +137,26 @@ class OsfStorageFileNode(BaseFileNode):
                 path = path + '/'
             return path
 
-    @materialized_path.setter
-    def materialized_path(self, val):
-        # raise Exception('Cannot set materialized path on OSFStorage as it is computed.')
-        logger.warn('Cannot set materialized path on OSFStorage because it\'s computed.')
+    def _update_stored_materialized_path(self):
+        """Derive the stored materialized path from the parent's when the name or parent changed.
+
+        :return: whether the stored path changed
+        """
+        source = (self.parent_id, self.name)
+        if self._stored_materialized_path is not None and getattr(self, '_materialized_path_source', None) == source:
+            return False
+        path = self.name + ('' if self.is_file else '/')
+        if self.parent_id is not None:
+            path = self.parent.materialized_path + path
+        changed = path != self._stored_materialized_path
+        self._stored_materialized_path = path
+        self._materialized_path_source = source
+        return changed
+
+    def update_descendant_materialized_paths(self):
+        """Rewrite the stored materialized paths of the whole subtree below this folder in one statement."""
+        with connection.cursor() as cursor:
+            cursor.execute(DESCENDANT_MATERIALIZED_PATHS_SQL, materialized_path_tree_params([self.id], [self.materialized_path]))
 
     @classmethod
     def get(cls, _id, target):
@@ -232,7 +306,19 @@ class OsfStorageFileNode(BaseFileNode):
     def save(self, *args, **kwargs):
         self._path = ''
         self._materialized_path = ''
-        return super(OsfStorageFileNode, self).save(*args, **kwargs)
+        materialized_path_changed = self._update_stored_materialized_path()
+        if not materialized_path_changed and self.pk is not None and not self._state.adding and not args and \
+                kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # The stored path may have been rewritten by a folder move since this instance was
+            # loaded, so only write it when it was recomputed here
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname != '_stored_materialized_path'
+            ]
+        ret = super(OsfStorageFileNode, self).save(*args, **kwargs)
+        if materialized_path_changed and not self.is_file:
+            self.update_descendant_materialized_paths()
+        return ret
 
 
 class OsfStorageFile(OsfStorageFileNode, File):
@@ -483,6 +569,63 @@ class OsfStorageFolder(OsfStorageFileNode, Folder):
         for child in self.children.all().prefetch_related('versions'):
             child.update_region_from_latest_version(destination_parent)
 
+def materialized_path_tree_params(root_ids, root_paths):
+    return {
+        'table': AsIs(BaseFileNode._meta.db_table),
+        'root_ids': list(root_ids),
+        'root_paths': list(root_paths),
+        'types': tuple(OsfStorageFileNode._typedmodels_subtypes),
+        'file_types': tuple(OsfStorageFile._typedmodels_subtypes),
+    }
+
+
+def get_root_folder_materialized_paths(root_ids):
+    """Return ``{id: materialized path}`` of the given root folders, computed from their names."""
+    return {
+        root_id: name + '/'
+        for root_id, name in OsfStorageFolder.objects.filter(id__in=root_ids, parent__isnull=True).values_list('id', 'name')
+    }
+
+
+def rebuild_materialized_paths(root_ids):
+    """Recompute the stored materialized paths of the osfstorage trees below the given root folders.
+
+    :return: the number of file nodes whose stored path changed
+    """
+    root_paths = get_root_folder_materialized_paths(root_ids)
+    if not root_paths:
+        return 0
+    params = materialized_path_tree_params(root_paths.keys(), root_paths.values())
+    with connection.cursor() as cursor:
+        cursor.execute(ROOT_MATERIALIZED_PATHS_SQL, params)
+        updated = cursor.rowcount
+        cursor.execute(DESCENDANT_MATERIALIZED_PATHS_SQL, params)
+        updated += cursor.rowcount
+    return updated
+
+
+def find_drifted_materialized_paths(root_ids):
+    """Compare the stored materialized paths of the trees below the given root folders with their parent chains.
+
+    :return: a list of ``(id, stored path, expected path)`` for the file nodes that drifted
+    """
+    root_paths = get_root_folder_materialized_paths(root_ids)
+    if not root_paths:
+        return []
+    drifted = [
+        (root_id, stored, root_paths[root_id])
+        for root_id, stored in OsfStorageFolder.objects.filter(id__in=root_paths.keys()).values_list('id', '_stored_materialized_path')
+        if stored != root_paths[root_id]
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            DRIFTED_MATERIALIZED_PATHS_SQL,
+            materialized_path_tree_params(root_paths.keys(), root_paths.values()),
+        )
+        drifted.extend(cursor.fetchall())
+    return drifted
+
+
 class Region(models.Model):
     # GRDM ver.: Region._id may be Institution._id
     _id = models.CharField(max_length=255, db_index=True)
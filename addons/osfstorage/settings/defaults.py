@@ -38,3 +38,6 @@ MAX_UPLOAD_SIZE = 5 * 1024  # 5 GB
 
 # Max file size permitted by frontend in megabytes for verified users
 HIGH_MAX_UPLOAD_SIZE = 5 * 1024  # 5 GB
+
+# Largest page of children a paginated folder listing returns
+MAX_CHILDREN_PAGE_SIZE = 1000
@@ -312,6 +312,47 @@ class TestOsfstorageFileNode(StorageTestCase):
         child = self.node_settings.get_root().append_folder('Cloud').append_file('Carp')
         assert_equals('/Cloud/Carp', child.materialized_path)
 
+    def test_materialized_path_is_stored(self):
+        child = self.node_settings.get_root().append_folder('Cloud').append_file('Carp')
+        child = OsfStorageFileNode.load(child._id)
+        assert_equals('/Cloud/Carp', child._stored_materialized_path)
+        assert_equals(child.compute_materialized_path(), child.materialized_path)
+
+    def test_materialized_path_not_backfilled(self):
+        child = self.node_settings.get_root().append_folder('Cloud').append_file('Carp')
+        BaseFileNode.objects.filter(id=child.id).update(_stored_materialized_path=None)
+        child = OsfStorageFileNode.load(child._id)
+        assert_equals('/Cloud/Carp', child.materialized_path)
+
+    def test_materialized_path_folder_rename_and_move(self):
+        root = self.node_settings.get_root()
+        folder = root.append_folder('Cloud')
+        nested = folder.append_folder('Rain')
+        child = nested.append_file('Carp')
+        move_to = root.append_folder('Sky')
+
+        folder.move_under(folder.parent, name='Fog')
+        nested.reload()
+        child.reload()
+        assert_equals('/Fog/Rain/', nested.materialized_path)
+        assert_equals('/Fog/Rain/Carp', child.materialized_path)
+
+        folder.move_under(move_to)
+        child.reload()
+        assert_equals('/Sky/Fog/Rain/Carp', child.materialized_path)
+        assert_equals(child.compute_materialized_path(), child.materialized_path)
+
+    def test_materialized_path_not_reverted_by_stale_instance(self):
+        folder = self.node_settings.get_root().append_folder('Cloud')
+        child = folder.append_file('Carp')
+        stale_child = OsfStorageFileNode.load(child._id)
+
+        folder.move_under(folder.parent, name='Fog')
+        stale_child.save()
+
+        child.reload()
+        assert_equals('/Fog/Carp', child.materialized_path)
+
     def test_copy(self):
         to_copy = self.node_settings.get_root().append_file('Carp')
         copy_to = self.node_settings.get_root().append_folder('Cloud')
@@ -412,6 +453,28 @@ class TestOsfstorageFileNode(StorageTestCase):
         assert_equal(copied.parent, copy_to)
         assert_equal(to_copy.parent, self.node_settings.get_root())
 
+    def test_add_version_updates_version_aggregates(self):
+        record = self.node_settings.get_root().append_file('Carp')
+        assert_equal(record.version_count, None)
+
+        versions = [factories.FileVersionFactory() for _ in range(2)]
+        for version in versions:
+            record.add_version(version)
+        record.reload()
+        assert_equal(record.version_count, 2)
+        assert_equal(record.latest_version, versions[-1])
+
+    def test_copy_has_own_version_aggregates(self):
+        to_copy = self.node_settings.get_root().append_file('Carp')
+        copy_to = self.node_settings.get_root().append_folder('Cloud')
+        for _ in range(3):
+            to_copy.add_version(factories.FileVersionFactory())
+
+        copied = to_copy.copy_under(copy_to, name='But')
+        copied.reload()
+        assert_equal(copied.version_count, 3)
+        assert_equal(copied.latest_version, copied.versions.order_by('-created').first())
+
     def test_move(self):
         to_move = self.node_settings.get_root().append_file('Carp')
         move_to = self.node_settings.get_root().append_folder('Cloud')
@@ -2,8 +2,11 @@
 from __future__ import unicode_literals
 
 import json
+import logging
 import mock
 import datetime
+import os
+import time
 
 import pytest
 import responses
@@ -12,7 +15,7 @@ from nose.tools import *  # noqa
 from dateutil.parser import parse as parse_datetime
 from website import settings
 
-from addons.osfstorage.models import OsfStorageFileNode, OsfStorageFolder
+from addons.osfstorage.models import OsfStorageFile, OsfStorageFileNode, OsfStorageFolder
 from framework.auth.core import Auth
 from addons.osfstorage.tests.utils import (
     StorageTestCase, Delta, AssertDeltas,
@@ -38,6 +41,9 @@ from api.caching.settings import STORAGE_USAGE_KEY
 
 from osf_tests.factories import ProjectFactory, ApiOAuth2PersonalTokenFactory, PreprintFactory
 from website.files.utils import attach_versions
+from osf.management.commands.backfill_file_version_aggregates import backfill_file_version_aggregates
+
+logger = logging.getLogger(__name__)
 
 def create_record_with_version(path, node_settings, **kwargs):
     version = factories.FileVersionFactory(**kwargs)
@@ -172,6 +178,67 @@ class TestGetMetadataHook(HookTestCase):
         assert_equal(res_date_modified, expected_date_modified)
         assert_equal(res_date_created, expected_date_created)
 
+    def test_children_pages(self):
+        root = self.node_settings.get_root()
+        records = [create_record_with_version('file{}'.format(i), self.node_settings) for i in range(5)]
+        root.append_folder('folder')
+
+        listed = []
+        cursor = None
+        for _ in range(3):
+            view_kwargs = {'fid': root._id, 'user_id': self.user._id, 'limit': 2}
+            if cursor:
+                view_kwargs['cursor'] = cursor
+            res = self.send_hook('osfstorage_get_children', view_kwargs, {}, self.node)
+            assert_true(len(res.json['data']) <= 2)
+            listed.extend(res.json['data'])
+            cursor = res.json['next_cursor']
+        assert_equal(cursor, None)
+
+        res = self.send_hook(
+            'osfstorage_get_children',
+            {'fid': root._id, 'user_id': self.user._id},
+            {},
+            self.node
+        )
+        assert_equal(listed, res.json)
+        assert_equal(
+            [child['id'] for child in listed],
+            list(root.children.order_by('id').values_list('_id', flat=True)),
+        )
+        assert_equal(
+            [child['version'] for child in listed if child['kind'] == 'file'],
+            [1] * len(records),
+        )
+
+    def test_children_without_version_aggregates(self):
+        record = create_record_with_version('file', self.node_settings, size=123)
+        expected = self.send_hook(
+            'osfstorage_get_children',
+            {'fid': record.parent._id, 'user_id': self.user._id},
+            {},
+            self.node
+        ).json
+
+        # Rows written before the aggregates existed are listed the same until they are backfilled
+        models.BaseFileNode.objects.filter(id=record.id).update(version_count=None, latest_version=None)
+        res = self.send_hook(
+            'osfstorage_get_children',
+            {'fid': record.parent._id, 'user_id': self.user._id},
+            {},
+            self.node
+        )
+        assert_equal(res.json, expected)
+        assert_equal(res.json[0]['size'], 123)
+        assert_equal(res.json[0]['version'], 1)
+
+    def test_children_invalid_page_arguments(self):
+        root = self.node_settings.get_root()
+        for view_kwargs in ({'limit': 'many'}, {'limit': 0}, {'limit': 2, 'cursor': -1}):
+            view_kwargs.update({'fid': root._id, 'user_id': self.user._id})
+            res = self.send_hook('osfstorage_get_children', view_kwargs, {}, self.node, expect_errors=True)
+            assert_equal(res.status_code, 400)
+
     def test_osf_storage_root(self):
         auth = Auth(self.project.creator)
         result = osf_storage_root(self.node_settings.config, self.node_settings, auth)
@@ -1762,3 +1829,50 @@ class TestPreprintFileViews(StorageTestCase):
         assert mock_get_client.called
         assert settings.WATERBUTLER_URL in redirect.location
         assert redirect.status_code == 302
+
+
+@pytest.mark.django_db
+class TestGetChildrenBenchmark(HookTestCase):
+
+    def create_synthetic_folder(self, children_numb):
+        folder = self.node_settings.get_root().append_folder('synthetic{}'.format(children_numb))
+        files = models.BaseFileNode.objects.bulk_create([
+            OsfStorageFile(name='file{}'.format(i), parent=folder, target=self.node, provider='osfstorage')
+            for i in range(children_numb)
+        ])
+        versions = models.FileVersion.objects.bulk_create([
+            models.FileVersion(creator=self.user, identifier='1', size=i, location={'object': str(i)})
+            for i in range(children_numb)
+        ])
+        models.BaseFileVersionsThrough.objects.bulk_create([
+            models.BaseFileVersionsThrough(basefilenode=file_node, fileversion=version, version_name=file_node.name)
+            for file_node, version in zip(files, versions)
+        ])
+        backfill_file_version_aggregates()
+        return folder
+
+    def list_children(self, folder, **page_kwargs):
+        page_kwargs.update({'fid': folder._id, 'user_id': self.user._id})
+        start = time.time()
+        res = self.send_hook('osfstorage_get_children', page_kwargs, {}, self.node)
+        return res, time.time() - start
+
+    def test_benchmark(self):
+        sizes = [int(size) for size in os.environ.get('OSFSTORAGE_CHILDREN_BENCHMARK_SIZES', '1000').split(',')]
+        limit = int(os.environ.get('OSFSTORAGE_CHILDREN_BENCHMARK_LIMIT', 100))
+        for children_numb in sizes:
+            folder = self.create_synthetic_folder(children_numb)
+
+            res, elapsed_all = self.list_children(folder)
+            assert_equal(len(res.json), children_numb)
+
+            res, elapsed_first = self.list_children(folder, limit=limit)
+            assert_equal(len(res.json['data']), min(limit, children_numb))
+            middle_id = folder._children.order_by('id').values_list('id', flat=True)[children_numb // 2]
+            res, elapsed_middle = self.list_children(folder, limit=limit, cursor=middle_id)
+            assert_true(len(res.json['data']) <= limit)
+
+            logger.info(
+                'Listing %d children: %.3fs for the whole folder, %.3fs for the first page and %.3fs for a middle page of %d',
+                children_numb, elapsed_all, elapsed_first, elapsed_middle, limit,
+            )
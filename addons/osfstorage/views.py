@@ -1,6 +1,6 @@
 from __future__ import unicode_literals
 
-from django.db.models import IntegerField
+from django.db.models import IntegerField, Sum
 from django.db.models.functions import Cast
 from rest_framework import status as http_status
 import logging
@@ -176,15 +176,42 @@ def osfstorage_get_metadata(file_node, **kwargs):
     return file_node.serialize(version=version, include_full=True)
 
 
+def get_children_page_arguments():
+    """Read the optional ``cursor`` and ``limit`` arguments of a folder listing.
+
+    :return: ``(cursor, limit)``; ``limit`` is None when the whole folder is requested
+    """
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit')
+    try:
+        cursor = int(cursor) if cursor else 0
+        limit = int(limit) if limit else None
+    except ValueError:
+        raise make_error(http_status.HTTP_400_BAD_REQUEST, message_short='Invalid cursor or limit')
+    if cursor < 0 or (limit is not None and limit < 1):
+        raise make_error(http_status.HTTP_400_BAD_REQUEST, message_short='Invalid cursor or limit')
+    if limit is not None:
+        limit = min(limit, osf_storage_settings.MAX_CHILDREN_PAGE_SIZE)
+    return cursor, limit
+
+
 @must_be_signed
 @decorators.autoload_filenode(must_be='folder')
 def osfstorage_get_children(file_node, **kwargs):
+    """List the children of a folder.
+
+    Without a ``limit`` the whole folder is returned as a list. With one, the children are
+    returned in pages ordered by id: the response is ``{'data': [...], 'next_cursor': ...}``
+    and the next page is requested by passing ``next_cursor`` back as ``cursor``, until it is null.
+    """
     from django.contrib.contenttypes.models import ContentType
     user_id = request.args.get('user_id')
+    page_cursor, limit = get_children_page_arguments()
     user_content_type_id = ContentType.objects.get_for_model(OSFUser).id
     user_pk = OSFUser.objects.filter(guids___id=user_id, guids___id__isnull=False).values_list('pk', flat=True).first()
     with connection.cursor() as cursor:
         # Read the documentation on FileVersion's fields before reading this code
+        # The page of children is selected first so that the per-file lookups below only run for that page
         cursor.execute("""
             SELECT json_agg(CASE
                 WHEN F.type = 'osf.osfstoragefile' THEN
@@ -195,7 +222,7 @@ def osfstorage_get_children(file_node, **kwargs):
                         , 'kind', 'file'
                         , 'size', LATEST_VERSION.size
                         , 'downloads',  COALESCE(DOWNLOAD_COUNT, 0)
-                        , 'version', (SELECT COUNT(*) FROM osf_basefileversionsthrough WHERE osf_basefileversionsthrough.basefilenode_id = F.id)
+                        , 'version', COALESCE(F.version_count, (SELECT COUNT(*) FROM osf_basefileversionsthrough WHERE osf_basefileversionsthrough.basefilenode_id = F.id))
                         , 'contentType', LATEST_VERSION.content_type
                         , 'modified', LATEST_VERSION.created
                         , 'created', EARLIEST_VERSION.created
@@ -213,14 +240,25 @@ def osfstorage_get_children(file_node, **kwargs):
                         , 'kind', 'folder'
                     )
                 END
-            )
-            FROM osf_basefilenode AS F
+                ORDER BY F.id
+            ), MAX(F.id), COUNT(*)
+            FROM (
+                SELECT * FROM osf_basefilenode
+                WHERE parent_id = %s
+                AND (NOT type IN ('osf.trashedfilenode', 'osf.trashedfile', 'osf.trashedfolder'))
+                AND id > %s
+                ORDER BY id
+                LIMIT %s
+            ) AS F
             LEFT JOIN LATERAL (
-                SELECT * FROM osf_fileversion
-                JOIN osf_basefileversionsthrough ON osf_fileversion.id = osf_basefileversionsthrough.fileversion_id
-                WHERE osf_basefileversionsthrough.basefilenode_id = F.id
-                ORDER BY created DESC
-                LIMIT 1
+                SELECT osf_fileversion.id AS fileversion_id, size, content_type, created, metadata FROM osf_fileversion
+                WHERE osf_fileversion.id = COALESCE(F.latest_version_id, (
+                    SELECT osf_basefileversionsthrough.fileversion_id FROM osf_basefileversionsthrough
+                    JOIN osf_fileversion ON osf_fileversion.id = osf_basefileversionsthrough.fileversion_id
+                    WHERE osf_basefileversionsthrough.basefilenode_id = F.id
+                    ORDER BY created DESC
+                    LIMIT 1
+                ))
             ) LATEST_VERSION ON TRUE
             LEFT JOIN LATERAL (
                 SELECT * FROM osf_fileversion
@@ -271,18 +309,26 @@ def osfstorage_get_children(file_node, **kwargs):
                   NULL
                 END
             ) SEEN_LATEST_VERSION ON TRUE
-            WHERE parent_id = %s
-            AND (NOT F.type IN ('osf.trashedfilenode', 'osf.trashedfile', 'osf.trashedfolder'))
         """, [
+            file_node.id,
+            page_cursor,
+            limit,
             user_content_type_id,
             file_node.target.guids.first().id,
             user_pk,
             user_pk,
             user_id,
             user_id,
-            file_node.id
         ])
-        return cursor.fetchone()[0] or []
+        children, last_id, count = cursor.fetchone()
+    children = children or []
+    if limit is None:
+        return children
+    return {
+        'data': children,
+        # A short page is the last one
+        'next_cursor': str(last_id) if count == limit else None,
+    }
 
 
 @must_be_signed
@@ -358,7 +404,7 @@ def osfstorage_create_child(file_node, payload, **kwargs):
         new_version = file_node.create_version(user, location, metadata)
 
         if not current_version or not current_version.is_duplicate(new_version):
-            update_storage_usage(file_node.target)
+            update_storage_usage(file_node.target, delta=new_version.size or 0)
 
         version_id = new_version._id
         archive_exists = new_version.archive is not None
@@ -387,6 +433,11 @@ def osfstorage_delete(file_node, payload, target, **kwargs):
     if file_node == OsfStorageFolder.objects.get_root(target=target):
             raise HTTPError(http_status.HTTP_400_BAD_REQUEST)
 
+    # the size removed from the storage usage, the storage usage is recomputed for a folder
+    delta = None
+    if file_node.is_file:
+        delta = -(file_node.versions.aggregate(size=Sum('size'))['size'] or 0)
+
     try:
         file_node.delete(user=user)
 
@@ -397,7 +448,7 @@ def osfstorage_delete(file_node, payload, target, **kwargs):
             'message_long': 'Cannot delete file as it is the primary file of preprint.'
         })
 
-    update_storage_usage(file_node.target)
+    update_storage_usage(file_node.target, delta=delta)
     return {'status': 'success'}
 
 
@@ -353,3 +353,23 @@ TEMPORARY_PATH = '/tmp/'
 
 # Time out for calling copy API in Export/Restore processes
 EACH_FILE_EXPORT_RESTORE_TIME_OUT = 1800
+
+# Number of files and folders read per query while building the export file information
+EXPORT_DATA_MANIFEST_CHUNK_SIZE = 500
+
+# Number of file versions copied at the same time in Export process
+EXPORT_DATA_COPY_MAX_WORKERS = 4
+# Retries of a file version copy after a timeout or connection error, and the first backoff in seconds
+EXPORT_DATA_COPY_MAX_RETRIES = 3
+EXPORT_DATA_COPY_RETRY_BACKOFF = 2
+# Take over the data files of the latest completed export of the same source and location
+# instead of copying them again, only new data files are copied
+EXPORT_DATA_INCREMENTAL = True
+
+# Number of files copied and folders created at the same time in Restore process
+EXPORT_DATA_RESTORE_MAX_WORKERS = 4
+
+# Number of projects gathered at a time and of add-on storages crawled at the same time
+# by the statistics gather view in database mode
+RDM_STATISTICS_GATHER_CHUNK_SIZE = 1000
+RDM_STATISTICS_GATHER_MAX_WORKERS = 8
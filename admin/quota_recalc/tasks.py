@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+import time
+
+from celery.contrib.abortable import AbortableTask
+from django.db import transaction
+from django.utils import timezone
+
+from api.base import settings as api_settings
+from framework.celery_tasks import app as celery_app
+from osf.models import OSFUser, QuotaRecalcTask
+from website.util.quota import bulk_recalculate_used_quota
+
+__all__ = [
+    'run_recalculate_all_users_quota',
+]
+
+logger = logging.getLogger(__name__)
+
+
+def recalculate_all_users_quota(task, recalc_task_id, batch_size=None):
+    """Recalculate the used quota of every non-deleted user, one batch of
+    users at a time, saving the cursor after each batch so that an
+    interrupted job resumes where it stopped.
+    """
+    batch_size = batch_size or api_settings.QUOTA_RECALC_BATCH_SIZE
+    recalc_task = QuotaRecalcTask.objects.get(id=recalc_task_id)
+    recalc_task.task_id = task.request.id or ''
+    recalc_task.save()
+
+    users = OSFUser.objects.exclude(deleted__isnull=False).order_by('id')
+    while True:
+        if task.request.id and task.is_aborted():
+            logger.info(u'Quota recalculation aborted at user id {}'.format(recalc_task.last_user_id))
+            return
+        started = time.time()
+        user_ids = list(
+            users.filter(id__gt=recalc_task.last_user_id).values_list('id', flat=True)[:batch_size]
+        )
+        if not user_ids:
+            break
+        with transaction.atomic():
+            bulk_recalculate_used_quota(user_ids)
+            recalc_task.last_user_id = user_ids[-1]
+            recalc_task.processed_users += len(user_ids)
+            recalc_task.elapsed += time.time() - started
+            recalc_task.save()
+
+    recalc_task.finished = timezone.now()
+    recalc_task.save()
+    logger.info(u'Quota of {} users recalculated in {:.1f}s'.format(
+        recalc_task.processed_users, recalc_task.elapsed))
+
+
+@celery_app.task(bind=True, base=AbortableTask, track_started=True)
+def run_recalculate_all_users_quota(self, recalc_task_id, **kwargs):
+    return recalculate_all_users_quota(self, recalc_task_id, **kwargs)
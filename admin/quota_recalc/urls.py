@@ -5,5 +5,6 @@ app_name = 'quota_recalc'
 
 urlpatterns = [
     url(r'^$', views.all_users, name='all_users'),
+    url(r'^status/$', views.status, name='status'),
     url(r'^(?P<guid>[a-z0-9]+)/$', views.user, name='user'),
 ]
@@ -1,11 +1,17 @@
+from datetime import timedelta
+
+from celery import states
+from celery.contrib.abortable import AbortableAsyncResult
 from django.http import JsonResponse
 from django.db import transaction, IntegrityError
+from django.utils import timezone
 
 from addons.osfstorage.models import Region
+from admin.quota_recalc.tasks import run_recalculate_all_users_quota
 from api.base import settings as api_settings
-from osf.models import OSFUser, UserQuota
+from osf.models import OSFUser, QuotaRecalcTask, UserQuota
 from osf.utils.requests import check_select_for_update
-from website.util.quota import used_quota
+from website.util.quota import rebuild_project_storage_usage
 
 
 def calculate_quota(user):
@@ -17,7 +23,8 @@ def calculate_quota(user):
 
     with transaction.atomic():
         for storage_type in storage_type_list:
-            used = used_quota(user._id, storage_type)
+            # recalculation recomputes from FileInfo and corrects the project rollups
+            used = rebuild_project_storage_usage(user._id, storage_type)
             try:
                 if check_select_for_update():
                     user_quota = UserQuota.objects.filter(
@@ -41,7 +48,6 @@ def calculate_quota(user):
                             used=used,
                         )
                 except IntegrityError:
-                    used = used_quota(user._id, storage_type)
                     if check_select_for_update():
                         user_quota = UserQuota.objects.filter(
                             user=user,
@@ -55,14 +61,68 @@ def calculate_quota(user):
                     user_quota.used = used
                     user_quota.save()
 
+def _is_running(recalc_task):
+    if recalc_task.modified < timezone.now() - timedelta(seconds=api_settings.QUOTA_RECALC_STALE_TIMEOUT):
+        # no batch committed for too long: the worker died, let the job resume
+        return False
+    if not recalc_task.task_id:
+        # dispatched, the worker has not picked the job up yet
+        return True
+    return AbortableAsyncResult(recalc_task.task_id).state in states.UNREADY_STATES
+
+def _recalc_status(recalc_task):
+    return {
+        'task_id': recalc_task.task_id,
+        'total': recalc_task.total_users,
+        'processed': recalc_task.processed_users,
+        'last_user_id': recalc_task.last_user_id,
+        'elapsed': recalc_task.elapsed,
+        'throughput': recalc_task.throughput,
+        'finished': recalc_task.finished.isoformat() if recalc_task.finished else None,
+    }
+
 def all_users(request, **kwargs):
-    c = 0
-    for osf_user in OSFUser.objects.exclude(deleted__isnull=False):
-        calculate_quota(osf_user)
-        c += 1
+    with transaction.atomic():
+        # the lock makes concurrent requests wait for the job dispatched by the first one
+        recalc_task = QuotaRecalcTask.objects.filter(finished__isnull=True).order_by('-created')
+        if check_select_for_update():
+            recalc_task = recalc_task.select_for_update()
+        recalc_task = recalc_task.first()
+        if recalc_task is not None and _is_running(recalc_task):
+            return JsonResponse({
+                'status': 'OK',
+                'message': 'Recalculating quota of {} users: {} done.'.format(
+                    recalc_task.total_users, recalc_task.processed_users),
+                'progress': _recalc_status(recalc_task),
+            })
+
+        total = OSFUser.objects.exclude(deleted__isnull=False).count()
+        if recalc_task is None:
+            recalc_task = QuotaRecalcTask.objects.create(total_users=total)
+        else:
+            recalc_task.total_users = total
+            recalc_task.task_id = ''
+            recalc_task.save()
+    # dispatched once the record is committed, so that the worker can load it
+    result = run_recalculate_all_users_quota.delay(recalc_task.id)
+    QuotaRecalcTask.objects.filter(id=recalc_task.id, task_id='').update(task_id=result.id)
+    recalc_task.refresh_from_db()
+    return JsonResponse({
+        'status': 'OK',
+        'message': str(total) + ' users\' quota recalculation started!',
+        'progress': _recalc_status(recalc_task),
+    })
+
+def status(request, **kwargs):
+    recalc_task = QuotaRecalcTask.objects.order_by('-created').first()
+    if recalc_task is None:
+        return JsonResponse({
+            'status': 'failed',
+            'message': 'No quota recalculation found.'
+        }, status=404)
     return JsonResponse({
         'status': 'OK',
-        'message': str(c) + ' users\' quota successfully recalculated!'
+        'progress': _recalc_status(recalc_task),
     })
 
 def user(request, guid, **kwargs):
@@ -443,10 +443,14 @@ def count_files_ng_ok(exported_file_versions, storage_file_versions, exclude_key
 
 def check_for_file_existent_on_export_location(
         file_info_json, node_id, provider, file_path, location_id,
-        cookies, cookie):
+        cookies, cookie, other_file_paths=None):
     # Get list file in export storage location
     file_list = get_files_in_path(node_id, provider, file_path, cookies,
                                   location_id=location_id, cookie=cookie)
+    # and in the files folders of earlier exports an incremental export took data files over from
+    for other_file_path in other_file_paths or []:
+        file_list = (file_list or []) + (get_files_in_path(node_id, provider, other_file_path, cookies,
+                                                           location_id=location_id, cookie=cookie) or [])
 
     if not file_list:
         return None
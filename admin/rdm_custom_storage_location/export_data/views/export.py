@@ -3,8 +3,11 @@ import copy
 import inspect  # noqa
 import logging
 import os
+import threading
 import time
 import traceback
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from celery import states
 from celery.contrib.abortable import AbortableAsyncResult, ABORTED
 from celery.exceptions import Ignore, CeleryError
@@ -21,8 +24,9 @@ from rest_framework.views import APIView
 from requests.exceptions import ReadTimeout, ConnectionError
 
 from addons.osfstorage.models import Region
+from admin.base import settings as admin_settings
 from admin.rdm_custom_storage_location import tasks
-from osf.models import Institution, ExportDataLocation, ExportData
+from osf.models import Institution, ExportDataLocation, ExportData, ExportDataCopiedFile
 from website.util import inspect_info  # noqa
 from .location import ExportStorageLocationViewBaseView
 from ..utils import write_json_file
@@ -238,14 +242,24 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         export_data.status = ExportData.STATUS_RUNNING
         export_data.save()
         logger.info(f'Export process status is changed to {export_data.status}.')
+        # a resumed process finds its folders already created
+        created_status_codes = [201, 409] if export_data.copied_files.exists() else [201]
 
         # [Important] check process status before each step
         _prev_time = check_export_data_process_status(
             _prev_time, task_id, export_data_id, location_id, source_id)
 
-        # extract file information
+        # temporary file
+        temp_file_path = export_data.export_data_temp_file_path
+        # every file information file of this run is written from one snapshot of the database
+        snapshot_file_path = export_data.export_data_snapshot_temp_file_path
+        if os.path.exists(snapshot_file_path):
+            os.remove(snapshot_file_path)
+
+        # extract file information into the temporary file
         _step_start_time = time.time()
-        export_data_json, file_info_json = export_data.extract_file_information_json_from_source_storage()
+        export_data_json, _ = export_data.write_file_information_json(
+            temp_file_path, snapshot_file=snapshot_file_path)
         logger.info(f'Extracted file information.'
                     f' ({time.time() - _step_start_time}s)')
 
@@ -257,20 +271,15 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         logger.debug(f'creating export data process folder')
         _step_start_time = time.time()
         response = export_data.create_export_data_folder(cookies, **kwargs)
-        if not task.is_aborted() and response.status_code != 201:
+        if not task.is_aborted() and response.status_code not in created_status_codes:
             raise ExportDataTaskException(MSG_EXPORT_FAILED_UPLOAD_TO_LOCATION)
         logger.info(f'Created \'{export_data.export_data_folder_path}\' folder path.'
                     f' ({time.time() - _step_start_time}s)')
 
-        # temporary file
-        temp_file_path = export_data.export_data_temp_file_path
-        logger.debug(f'created temporary file')
-
         if task.is_aborted():  # check before each steps
             raise ExportDataTaskException(MSG_EXPORT_ABORTED)
-        # create files' information file
+        # upload files' information file
         logger.debug(f'creating files information file')
-        write_json_file(file_info_json, temp_file_path)
         response = export_data.upload_file_info_full_data_file(cookies, temp_file_path, **kwargs)
         if not task.is_aborted() and response.status_code not in [201, 204]:
             raise ExportDataTaskException(MSG_EXPORT_FAILED_UPLOAD_TO_LOCATION)
@@ -286,7 +295,7 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         logger.debug(f'creating files folder')
         _step_start_time = time.time()
         response = export_data.create_export_data_files_folder(cookies, **kwargs)
-        if not task.is_aborted() and response.status_code != 201:
+        if not task.is_aborted() and response.status_code not in created_status_codes:
             raise ExportDataTaskException(MSG_EXPORT_FAILED_UPLOAD_TO_LOCATION)
         logger.info(f'Created \'{export_data.export_data_files_folder_path}\' folder path.'
                     f' ({time.time() - _step_start_time}s)')
@@ -297,7 +306,7 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
 
         logger.debug(f'prepare list of file versions data to upload')
         _step_start_time = time.time()
-        file_versions = export_data.get_source_file_versions_min(file_info_json)
+        file_versions = export_data.get_source_file_versions_min(snapshot_file=snapshot_file_path)
         _length = len(file_versions)
         logger.info(f'There is {_length} file versions needed to upload to the export storage destination.'
                     f' ({time.time() - _step_start_time}s)')
@@ -305,51 +314,15 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         # upload file versions
         logger.debug(f'upload file versions')
         _step_start_time = time.time()
-        # cached the filename in hash value
-        created_filename_list = []
-        files_versions_not_found = {}
-        for index, file in enumerate(file_versions):
-            project_id, provider, file_path, version, file_name, file_id = file
-            logger.debug(f'[{1 + index}/{_length}] file: '
-                         f'projects/{project_id}/providers/{provider}/files/{file_id}/versions/{version}/'
-                         f'?hash={file_name}&path={file_path}')
-
-            # prevent uploading duplicate file_name in hash value
-            if file_name in created_filename_list:
-                logger.debug(f'Ignore uploaded file')
-                continue
 
+        def check_status():
+            nonlocal _prev_time
             # [Important] check process status before each step
             _prev_time = check_export_data_process_status(
                 _prev_time, task_id, export_data_id, location_id, source_id)
 
-            _up_file_start_time = time.time()
-            kwargs.update({'version': version})
-            # copy data file from source storage to location storage
-
-            try:
-                response = export_data.copy_export_data_file_to_location(
-                    cookies, project_id, provider, file_path, file_name, **kwargs)
-                # 201: created -> update cache list
-                if response.status_code == 201:
-                    created_filename_list.append(file_name)
-                    logger.debug(f'Upload file successfully.'
-                                 f' ({time.time() - _up_file_start_time}s)')
-                else:
-                    if file_id not in files_versions_not_found:
-                        files_versions_not_found[file_id] = [version]
-                    else:
-                        files_versions_not_found[file_id].append(version)
-                    logger.debug(f'File upload failed.'
-                                 f' ({time.time() - _up_file_start_time}s)')
-                    continue
-            except (ReadTimeout, ConnectionError):
-                logger.error(f'Timeout exception occurs. Add file_id to list failed files. file_id: {file_id}')
-                if file_id not in files_versions_not_found:
-                    files_versions_not_found[file_id] = [version]
-                else:
-                    files_versions_not_found[file_id].append(version)
-                continue
+        files_versions_not_found = copy_export_data_files(
+            export_data, cookies, file_versions, check_status, **kwargs)
         logger.info(f'Have gone through the entire list of file versions.'
                     f' ({time.time() - _step_start_time}s)')
 
@@ -357,14 +330,13 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         _prev_time = check_export_data_process_status(
             _prev_time, task_id, export_data_id, location_id, source_id)
 
-        # Separate the failed file list from the file_info_json
-        logger.debug('Separate the failed file list from the file_info_json')
+        # Separate the failed file list while rewriting the files' information file
+        logger.debug('Separate the failed file list from the files information file')
         _step_start_time = time.time()
-        files = file_info_json.get('files', [])
-        files_not_found, sub_size, sub_files_numb = separate_failed_files(files, files_versions_not_found)
-        export_data_json['size'] -= sub_size
-        export_data_json['files_numb'] -= sub_files_numb
-        logger.info(f'Separated the failed file list from the file_info_json.')
+        export_data_json, files_not_found = export_data.write_file_information_json(
+            temp_file_path, exclude_versions=files_versions_not_found, snapshot_file=snapshot_file_path)
+        sub_files_numb = sum(len(file['version']) for file in files_not_found)
+        logger.info(f'Separated the failed file list from the files information file.')
         logger.info(f'Uploaded {_length - sub_files_numb}/{_length} file versions.'
                     f' Failed {sub_files_numb} file versions.'
                     f' ({time.time() - _step_start_time}s)')
@@ -373,13 +345,9 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         _prev_time = check_export_data_process_status(
             _prev_time, task_id, export_data_id, location_id, source_id)
 
-        # temporary file
-        # temp_file_path = export_data.export_data_temp_file_path
-
-        # create files' information JSON file
+        # upload files' information JSON file
         logger.debug(f'creating files information JSON file')
         _step_start_time = time.time()
-        write_json_file(file_info_json, temp_file_path)
         response = export_data.upload_file_info_file(cookies, temp_file_path, **kwargs)
         if not task.is_aborted() and response.status_code not in [201, 204]:
             raise ExportDataTaskException(MSG_EXPORT_FAILED_UPLOAD_TO_LOCATION)
@@ -402,9 +370,10 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         logger.info(f'Created export data JSON file.'
                     f' ({time.time() - _step_start_time}s)')
 
-        # remove temporary file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        # remove temporary files
+        for path in [temp_file_path, snapshot_file_path]:
+            if os.path.exists(path):
+                os.remove(path)
         logger.debug(f'removed temporary file')
 
         # [Important] check process status before each step
@@ -444,6 +413,98 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
             task, cookies, export_data_id, location_id, source_id, **kwargs)
 
 
+def copy_export_data_file_with_retry(export_data, cookies, project_id, provider, file_path, file_name, **kwargs):
+    """Copy one file version to the export location, retrying with exponential
+    backoff on timeouts and connection errors. Returns True if it was created."""
+    max_retries = admin_settings.EXPORT_DATA_COPY_MAX_RETRIES
+    for attempt in range(max_retries + 1):
+        try:
+            response = export_data.copy_export_data_file_to_location(
+                cookies, project_id, provider, file_path, file_name, **kwargs)
+            return response.status_code == 201
+        except (ReadTimeout, ConnectionError) as e:
+            if attempt == max_retries:
+                logger.error(f'Timeout exception occurs. file: {file_path} ({e})')
+                return False
+            time.sleep(admin_settings.EXPORT_DATA_COPY_RETRY_BACKOFF * 2 ** attempt)
+
+
+def copy_export_data_files(export_data, cookies, file_versions, check_status, max_workers=None, **kwargs):
+    """Copy the file versions listed by ExportData.get_source_file_versions_min
+    to the export location with a pool of workers.
+
+    Each hashed data file is copied once: the versions sharing a hash are tried
+    in order until one of them is copied. Copied hashes are recorded in
+    ExportDataCopiedFile and skipped when the process is resumed.
+    ``check_status`` is called between copies and raises to stop the stage.
+
+    With EXPORT_DATA_INCREMENTAL, the data files already held by the latest
+    completed export of the same source and location are taken over instead
+    of being copied again.
+
+    Returns the dict of file id -> versions that could not be copied.
+    """
+    max_workers = max_workers or admin_settings.EXPORT_DATA_COPY_MAX_WORKERS
+    if admin_settings.EXPORT_DATA_INCREMENTAL:
+        taken_over = export_data.take_over_copied_files(file_version[4] for file_version in file_versions)
+        logger.info(f'{len(taken_over)} data files are taken over from the previous export.')
+    copied_file_names = set(export_data.copied_files.values_list('file_name', flat=True))
+    versions_by_file_name = OrderedDict()
+    for file_version in file_versions:
+        file_name = file_version[4]
+        if file_name not in copied_file_names:
+            versions_by_file_name.setdefault(file_name, []).append(file_version)
+    logger.info(f'{len(copied_file_names)} data files are already copied,'
+                f' {len(versions_by_file_name)} data files to copy.')
+
+    stopped = threading.Event()
+
+    def copy_file(file_name, versions):
+        failed_versions = []
+        for project_id, provider, file_path, version, _, file_id in versions:
+            if stopped.is_set():
+                break
+            logger.debug(f'file: projects/{project_id}/providers/{provider}/files/{file_id}/versions/{version}/'
+                         f'?hash={file_name}&path={file_path}')
+            if copy_export_data_file_with_retry(
+                    export_data, cookies, project_id, provider, file_path, file_name,
+                    **dict(kwargs, version=version)):
+                return True, failed_versions
+            failed_versions.append((file_id, version))
+        return False, failed_versions
+
+    files_versions_not_found = {}
+
+    def collect(future, file_name):
+        is_copied, failed_versions = future.result()
+        if is_copied:
+            ExportDataCopiedFile.objects.create(export_data=export_data, file_name=file_name)
+        for file_id, version in failed_versions:
+            files_versions_not_found.setdefault(file_id, []).append(version)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        try:
+            for file_name, versions in versions_by_file_name.items():
+                pending[executor.submit(copy_file, file_name, versions)] = file_name
+                # keep a bounded number of copies queued
+                while len(pending) >= 2 * max_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future, pending.pop(future))
+                    check_status()
+            for future in as_completed(list(pending)):
+                collect(future, pending.pop(future))
+                check_status()
+        except Exception:
+            stopped.set()
+            for future in pending:
+                future.cancel()
+            raise
+
+    return files_versions_not_found
+
+
 def separate_failed_files(files, files_versions_not_found):
     files_not_found = []
     for file_id, ver_ids in files_versions_not_found.items():
@@ -580,9 +641,9 @@ def export_data_rollback_process(task, cookies, export_data_id, location_id, sou
         _prev_time = check_export_data_process_status(
             _prev_time, task_id, export_data_id, location_id, source_id)
 
-        file_path = export_data.export_data_temp_file_path
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        for file_path in [export_data.export_data_temp_file_path, export_data.export_data_snapshot_temp_file_path]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
         logger.debug(f'Removed temporary file.')
 
         # delete export data file
@@ -595,6 +656,7 @@ def export_data_rollback_process(task, cookies, export_data_id, location_id, sou
                         f' ({time.time() - _step_start_time}s)')
         else:
             _msg = MSG_EXPORT_STOPPED
+            export_data.copied_files.all().delete()
             logger.info(f'Deleted \'{export_data.export_data_folder_path}\' folder path.'
                         f' ({time.time() - _step_start_time}s)')
 
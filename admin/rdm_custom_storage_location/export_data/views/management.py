@@ -380,7 +380,12 @@ class DeleteExportDataView(ExportStorageLocationViewBaseView, View):
         # Delete export data
         check_delete_permanently = True if request.POST.get('delete_permanently') == 'on' else False
         if check_delete_permanently:
-            for item in ExportData.objects.filter(id__in=list_export_data_delete, is_deleted=True):
+            export_data_delete = list(ExportData.objects.filter(id__in=list_export_data_delete, is_deleted=True))
+            # Validate every selected export data before deleting any of them
+            if any(item.holds_taken_over_files() for item in export_data_delete):
+                message = 'Cannot delete the export data permanently, its data files are used by a later export data.'
+                return render_bad_request_response(request=request, error_msgs=message)
+            for item in export_data_delete:
                 response = item.delete_export_data_folder(cookies, cookie=cookie)
                 if response.status_code == 204:
                     item.delete()
@@ -660,8 +665,10 @@ class CheckExportData(RdmPermissionMixin, UserPassesTestMixin, View):
             provider = self.export_data.location.provider_name
             location_id = self.export_data.location.id
             file_path = f'/{self.export_data.export_data_folder_name}/files/'
+            other_file_paths = sorted({f'{path}/' for path in self.export_data.get_data_files_folders().values()})
             file_list = check_for_file_existent_on_export_location(
-                exported_file_info, node_id, provider, file_path, location_id, cookies, cookie)
+                exported_file_info, node_id, provider, file_path, location_id, cookies, cookie,
+                other_file_paths=other_file_paths)
             file_fails_list = data.get('list_file_ng') + file_list
             for file in file_list:
                 if not any(d['path'] == file['path'] for d in data.get('list_file_ng')):
@@ -4,6 +4,10 @@ from __future__ import absolute_import
 import inspect  # noqa
 import json
 import logging
+import threading
+from collections import OrderedDict
+from distutils.util import strtobool
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from functools import partial
 
 from celery.states import PENDING
@@ -18,12 +22,13 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from addons.osfstorage.models import Region, NodeSettings
+from admin.base import settings as admin_settings
 from admin.rdm.utils import RdmPermissionMixin
 from admin.rdm_custom_storage_location import tasks
 from admin.rdm_custom_storage_location.export_data import utils
 from admin.rdm_custom_storage_location.export_data.views import export
-from osf.models import ExportData, ExportDataRestore, BaseFileNode, Tag, RdmFileTimestamptokenVerifyResult, Institution, OSFUser, FileVersion, AbstractNode, \
-    ProjectStorageType, UserQuota
+from osf.models import ExportData, ExportDataRestore, ExportDataRestoredFile, BaseFileNode, Tag, RdmFileTimestamptokenVerifyResult, Institution, \
+    OSFUser, FileVersion, AbstractNode, ProjectStorageType, UserQuota
 from framework.transactions.handlers import no_auto_transaction
 from website.util.quota import update_user_used_quota
 from django.contrib.auth.mixins import UserPassesTestMixin
@@ -207,10 +212,17 @@ def prepare_for_restore_export_data_process(cookies, export_id, destination_id,
     if any_process_running:
         return Response({'message': f'Cannot restore in this time.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Try to add new process record to DB
-    export_data_restore = ExportDataRestore(export_id=export_id, destination_id=destination_id,
-                                            status=ExportData.STATUS_RUNNING, creator=creator)
-    export_data_restore.save()
+    # Resume the last restore of this export data stopped while copying files, else add new process record to DB
+    export_data_restore = ExportDataRestore.objects.filter(
+        export_id=export_id, destination_id=destination_id,
+        status=ExportData.STATUS_STOPPED, process_step__gte=2,
+    ).order_by('-process_start').first()
+    if export_data_restore is not None:
+        export_data_restore.update(status=ExportData.STATUS_RUNNING, creator=creator, process_end=None)
+    else:
+        export_data_restore = ExportDataRestore(export_id=export_id, destination_id=destination_id,
+                                                status=ExportData.STATUS_RUNNING, creator=creator)
+        export_data_restore.save()
     # If user clicked 'Restore' button in confirm dialog, start restore data task and return task id
     process = tasks.run_restore_export_data_process.delay(cookies, export_id, export_data_restore.pk, list_project_id, **kwargs)
     return Response({'task_id': process.task_id}, status=status.HTTP_200_OK)
@@ -222,6 +234,8 @@ def restore_export_data_process(task, cookies, export_id, export_data_restore_id
         update_restore_process_state(task, current_process_step)
         export_data_restore = ExportDataRestore.objects.get(pk=export_data_restore_id)
         export_data_restore.update(task_id=task.request.id)
+        # The step reached by the stopped restore process which is resumed
+        resumed_process_step = export_data_restore.process_step
 
         export_data = ExportData.objects.filter(id=export_id, is_deleted=False)[0]
 
@@ -242,7 +256,7 @@ def restore_export_data_process(task, cookies, export_id, export_data_restore_id
 
         destination_region = export_data_restore.destination
         destination_provider = destination_region.provider_name
-        if utils.is_add_on_storage(destination_provider):
+        if utils.is_add_on_storage(destination_provider) and resumed_process_step < 2:
             # Move all existing files/folders in destination to backup_{process_start} folder
             for project_id in list_project_id:
                 move_all_files_to_backup_folder(task, current_process_step, project_id, export_data_restore, cookies, **kwargs)
@@ -250,6 +264,7 @@ def restore_export_data_process(task, cookies, export_id, export_data_restore_id
         check_if_restore_process_stopped(task, current_process_step)
         current_process_step = 2
         update_restore_process_state(task, current_process_step)
+        export_data_restore.update(process_step=current_process_step)
 
         # create folders in destination
         create_folder_in_destination(task, current_process_step, export_data_folders, export_data_restore, cookies, **kwargs)
@@ -263,13 +278,14 @@ def restore_export_data_process(task, cookies, export_id, export_data_restore_id
         check_if_restore_process_stopped(task, current_process_step)
         current_process_step = 3
         update_restore_process_state(task, current_process_step)
+        export_data_restore.update(process_step=current_process_step)
 
         # Add tags, timestamp to created file nodes
         add_tag_and_timestamp_to_database(task, current_process_step, list_created_file_nodes)
 
         # Update process data with process_end timestamp and 'Completed' status
         export_data_restore.update(process_end=timezone.make_naive(timezone.now(), timezone.utc),
-                                   status=ExportData.STATUS_COMPLETED)
+                                   status=ExportData.STATUS_COMPLETED, process_step=4)
 
         check_if_restore_process_stopped(task, current_process_step)
         current_process_step = 4
@@ -420,6 +436,13 @@ class StopRestoreDataActionView(RdmPermissionMixin, UserPassesTestMixin, APIView
             return Response({'message': f'Cannot stop restore process at this time.'},
                              status=status.HTTP_400_BAD_REQUEST)
 
+        # Keep the restored files, the restore process is resumed when the same export data is restored again
+        keep_progress = bool(strtobool(request.POST.get('keep_progress', 'false')))
+        if keep_progress and current_progress_step >= 2:
+            self.export_data_restore.update(process_end=timezone.make_naive(timezone.now(), timezone.utc),
+                                            status=ExportData.STATUS_STOPPED)
+            return Response({'message': f'Stop restore data successfully.'}, status=status.HTTP_200_OK)
+
         # Start rollback restore export data process
         process = tasks.run_restore_export_data_rollback_process.delay(
             cookies,
@@ -434,7 +457,8 @@ class StopRestoreDataActionView(RdmPermissionMixin, UserPassesTestMixin, APIView
 def restore_export_data_rollback_process(task, cookies, export_id,
                                           export_data_restore_id, process_step, **kwargs):
     export_data_restore = ExportDataRestore.objects.get(pk=export_data_restore_id)
-    export_data_restore.update(task_id=task.request.id)
+    export_data_restore.update(task_id=task.request.id, process_step=0)
+    export_data_restore.restored_files.all().delete()
 
     destination_provider = export_data_restore.destination.provider_name
     if process_step == 0 or not utils.is_add_on_storage(destination_provider):
@@ -527,34 +551,7 @@ class CheckTaskStatusRestoreDataActionView(RdmPermissionMixin, UserPassesTestMix
         return Response(response, status=status.HTTP_200_OK if task.state != 'FAILURE' else status.HTTP_400_BAD_REQUEST)
 
 
-def add_tags_to_file_node(file_node, tags):
-    if len(tags) == 0 or not file_node:
-        return
-
-    for tag in tags:
-        if not file_node.tags.filter(system=False, name=tag).exists():
-            new_tag = Tag.load(tag)
-            if not new_tag:
-                new_tag = Tag(name=tag)
-            new_tag.save()
-            file_node.tags.add(new_tag)
-            file_node.save()
-
-
-def add_timestamp_to_file_node(file_node, project_id, timestamp):
-    if not file_node or not project_id or not timestamp:
-        return
-    verify_data = None
-    timestamp_obj = RdmFileTimestamptokenVerifyResult.objects.filter(id=timestamp.get('timestamp_id')).first()
-    try:
-        verify_data = RdmFileTimestamptokenVerifyResult.objects.get(
-            file_id=file_node._id)
-    except RdmFileTimestamptokenVerifyResult.DoesNotExist:
-        verify_data = RdmFileTimestamptokenVerifyResult()
-        verify_data.file_id = file_node._id
-        verify_data.project_id = timestamp.get('project_id', project_id)
-        verify_data.provider = timestamp.get('provider', file_node.provider)
-
+def set_timestamp_data(verify_data, file_node, timestamp, timestamp_obj):
     if timestamp_obj:
         verify_data.timestamp_token = timestamp_obj.timestamp_token
         verify_data.verify_date = timestamp_obj.verify_date
@@ -570,7 +567,6 @@ def add_timestamp_to_file_node(file_node, project_id, timestamp):
     verify_data.upload_file_size = timestamp.get('upload_file_size', None)
     verify_data.verify_file_size = timestamp.get('verify_file_size', None)
     verify_data.verify_user = timestamp.get('verify_user', None)
-    verify_data.save()
 
 
 def read_export_data_and_check_schema(export_data, cookies, **kwargs):
@@ -642,8 +638,8 @@ def recalculate_user_quota(destination_region):
     # Recalculate quota of default storage and custom storage
     institution = Institution.load(destination_region.guid)
     for user in OSFUser.objects.filter(affiliated_institutions=institution.id):
-        update_user_used_quota(user)
-        update_user_used_quota(user, storage_type=UserQuota.CUSTOM_STORAGE)
+        update_user_used_quota(user, recompute=True)
+        update_user_used_quota(user, storage_type=UserQuota.CUSTOM_STORAGE, recompute=True)
 
 
 def generate_new_file_path(file_materialized_path, version_id, is_file_not_latest_version):
@@ -703,23 +699,74 @@ def move_all_files_to_backup_folder(task, current_process_step,
         raise ProcessError(f'Failed to move files to backup folder.')
 
 
+def run_in_workers(func, items, check_abort_task, max_workers=None):
+    """Call ``func`` on each item with a pool of worker threads and yield the
+    (item, result) pairs as they complete.
+
+    ``check_abort_task`` is called in the calling thread before each item is
+    submitted and raises to stop the pool. ``func`` must not use the database,
+    the results are handled in the calling thread.
+    """
+    max_workers = max_workers or admin_settings.EXPORT_DATA_RESTORE_MAX_WORKERS
+    if max_workers <= 1:
+        for item in items:
+            check_abort_task()
+            yield item, func(item)
+        return
+
+    stopped = threading.Event()
+
+    def run(item):
+        if stopped.is_set():
+            return None
+        return func(item)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        try:
+            for item in items:
+                check_abort_task()
+                pending[executor.submit(run, item)] = item
+                # keep a bounded number of items queued
+                while len(pending) >= 2 * max_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield pending.pop(future), future.result()
+            for future in as_completed(list(pending)):
+                yield pending.pop(future), future.result()
+        except BaseException:
+            stopped.set()
+            for future in pending:
+                future.cancel()
+            raise
+
+
 def create_folder_in_destination(task, current_process_step, export_data_folders,
                                  export_data_restore, cookies, **kwargs):
     destination_region = export_data_restore.destination
     destination_base_url = destination_region.waterbutler_url
-    list_updated_projects = []
-    for folder in export_data_folders:
-        check_if_restore_process_stopped(task, current_process_step)
-        folder_materialized_path = folder.get('materialized_path')
-        folder_project_id = folder.get('project', {}).get('id')
+    check_task_aborted_function = partial(check_if_restore_process_stopped, task, current_process_step)
 
-        # Update region_id for folder's project
+    # Update region_id for folders' projects
+    list_updated_projects = []
+    for folder_project_id in OrderedDict.fromkeys(folder.get('project', {}).get('id') for folder in export_data_folders):
         list_updated_projects = update_region_id(task, current_process_step,
                                                   destination_region, folder_project_id, list_updated_projects)
 
-        utils.create_folder_path(folder_project_id, destination_region, folder_materialized_path,
+    # Create the folders level by level, the folders of a level are created at the same time
+    folders_by_depth = {}
+    for folder in export_data_folders:
+        folder_materialized_path = folder.get('materialized_path') or ''
+        folders_by_depth.setdefault(folder_materialized_path.count('/'), []).append(folder)
+
+    def create_folder(folder):
+        utils.create_folder_path(folder.get('project', {}).get('id'), destination_region, folder.get('materialized_path'),
                                  cookies, base_url=destination_base_url, **kwargs)
 
+    for depth in sorted(folders_by_depth):
+        for _ in run_in_workers(create_folder, folders_by_depth[depth], check_task_aborted_function):
+            pass
+
     # recalculate user quota for all updated projects
     if list_updated_projects:
         # recalculate user quota
@@ -729,34 +776,40 @@ def create_folder_in_destination(task, current_process_step, export_data_folders
 def copy_files_from_export_data_to_destination(task, current_process_step,
                                                export_data_files, export_data_restore, cookies, **kwargs):
     export_data = export_data_restore.export
+    # load the export location here, it is read by the copy workers
+    export_data.location
+    files_folder_path = f'/{export_data.export_data_folder_name}/{ExportData.EXPORT_DATA_FILES_FOLDER}'
+    # data files taken over by an incremental export stay in the folder of an earlier export
+    data_files_folders = export_data.get_data_files_folders()
 
     destination_region = export_data_restore.destination
     destination_provider = INSTITUTIONAL_STORAGE_PROVIDER_NAME
     destination_base_url = destination_region.waterbutler_url
     is_destination_addon_storage = utils.is_add_on_storage(destination_provider)
+    check_task_aborted_function = partial(check_if_restore_process_stopped, task, current_process_step)
+
+    # File versions already copied by the stopped restore process which is resumed
+    restored_versions = {
+        (file_id, version_id): file_node_id
+        for file_id, version_id, file_node_id in export_data_restore.restored_files.values_list(
+            'file_id', 'version_id', 'file_node_id')
+    }
+    restored_nodes = {}
+    if restored_versions:
+        restored_nodes = BaseFileNode.objects.in_bulk([node_id for node_id in restored_versions.values() if node_id])
 
     list_created_file_nodes = []
     files_versions_restore_fail = {}
-    for file in export_data_files:
-        check_if_restore_process_stopped(task, current_process_step)
 
+    def copy_file_versions(file):
+        # Copy the versions of a file in order, returns list of (version, response body)
         file_id = file.get('id')
         file_materialized_path = file.get('materialized_path')
         file_versions = file.get('version')
         file_project_id = file.get('project', {}).get('id')
-        file_tags = file.get('tags')
-        file_timestamp = file.get('timestamp', {})
-        file_checkout_id = file.get('checkout_id')
-        file_created = file.get('created_at')
-        file_modified = file.get('modified_at')
-
-        # Sort file by version id
-        file_versions.sort(key=lambda k: k.get('identifier', 0))
-
+        results = []
         for index, version in enumerate(file_versions):
             try:
-                check_if_restore_process_stopped(task, current_process_step)
-
                 # Prepare file name and file path for uploading
                 metadata = version.get('metadata', {})
                 file_hash = metadata.get('sha256', metadata.get('md5'))
@@ -764,8 +817,10 @@ def copy_files_from_export_data_to_destination(task, current_process_step,
                 if file_hash is None or version_id is None:
                     # Cannot get path in export data storage, pass this file
                     continue
+                if (file_id, version_id) in restored_versions:
+                    continue
 
-                file_hash_path = f'/{export_data.export_data_folder_name}/{ExportData.EXPORT_DATA_FILES_FOLDER}/{file_hash}'
+                file_hash_path = f'{data_files_folders.get(file_hash, files_folder_path)}/{file_hash}'
 
                 # If the destination storage is add-on institutional storage:
                 # - for past version files, rename and save each version as filename_{version} in '_version_files' folder
@@ -783,85 +838,183 @@ def copy_files_from_export_data_to_destination(task, current_process_step,
                 response_body = utils.copy_file_from_location_to_destination(
                     export_data, file_project_id, destination_provider, file_hash_path, new_file_path,
                     cookies, base_url=destination_base_url, **kwargs)
-                if response_body is None:
-                    if file_id not in files_versions_restore_fail:
-                        files_versions_restore_fail[file_id] = [version_id]
-                    else:
-                        files_versions_restore_fail[file_id].append(version_id)
-                    continue
-
-                response_id = response_body.get('data', {}).get('id')
-                response_file_version_id = response_body.get('data', {}).get('attributes', {}).get('extra', {}).get('version', version_id)
-                if response_id.startswith('osfstorage'):
-                    # If id is osfstorage/[_id] then get _id
-                    file_path_splits = response_id.split('/')
-                    # Check if path is file (/_id)
-                    if len(file_path_splits) == 2:
-                        file_node_id = file_path_splits[1]
-                        node_set = BaseFileNode.objects.filter(_id=file_node_id)
-                        if node_set.exists():
-                            node = node_set.first()
-
-                            # update creator, created, modified back to the file version
-                            file_version = node.get_version(response_file_version_id, required=False)
-
-                            if file_version is not None:
-                                file_version_created_at = version.get('created_at')
-                                file_version_modified_at = version.get('modified_at')
-
-                                # Find records of old versions with the same 'created_at' and 'modified_at' values
-                                same_file_versions = node.versions.exclude(
-                                    identifier=response_file_version_id
-                                ).filter(
-                                    created=file_version_created_at,
-                                    modified=file_version_modified_at
-                                )
-
-                                if same_file_versions.exists():
-                                    # delete duplicate new record
-                                    file_version.delete()
-
-                            if file_checkout_id:
-                                node.checkout_id = file_checkout_id
-
-                            # update created/modified date to basefilenode
-                            node.created = file_created
-                            node.modified = file_modified
-                            # ignore storing the value of `django.utils.timezone.now()` to `modified` field
-                            node.save(update_modified=False)
-
-                            list_created_file_nodes.append({
-                                'node': node,
-                                'file_tags': file_tags,
-                                'file_timestamp': file_timestamp,
-                                'project_id': file_project_id
-                            })
+                results.append((version, response_body))
             except Exception as e:
                 logger.error(f'Download or upload exception: {e}')
-                check_if_restore_process_stopped(task, current_process_step)
                 # Did not download or upload, pass this file
                 continue
+        return results
+
+    def restore_file_version(file, version, response_body):
+        # Update the file node created by copying a file version, returns the file node
+        file_checkout_id = file.get('checkout_id')
+        file_created = file.get('created_at')
+        file_modified = file.get('modified_at')
+        version_id = version.get('identifier')
+
+        response_id = response_body.get('data', {}).get('id')
+        response_file_version_id = response_body.get('data', {}).get('attributes', {}).get('extra', {}).get('version', version_id)
+        if not response_id.startswith('osfstorage'):
+            return None
+        # If id is osfstorage/[_id] then get _id
+        file_path_splits = response_id.split('/')
+        # Check if path is file (/_id)
+        if len(file_path_splits) != 2:
+            return None
+        file_node_id = file_path_splits[1]
+        node_set = BaseFileNode.objects.filter(_id=file_node_id)
+        if not node_set.exists():
+            return None
+        node = node_set.first()
+
+        # update creator, created, modified back to the file version
+        file_version = node.get_version(response_file_version_id, required=False)
+
+        if file_version is not None:
+            file_version_created_at = version.get('created_at')
+            file_version_modified_at = version.get('modified_at')
+
+            # Find records of old versions with the same 'created_at' and 'modified_at' values
+            same_file_versions = node.versions.exclude(
+                identifier=response_file_version_id
+            ).filter(
+                created=file_version_created_at,
+                modified=file_version_modified_at
+            )
+
+            if same_file_versions.exists():
+                # delete duplicate new record
+                file_version.delete()
+
+        if file_checkout_id:
+            node.checkout_id = file_checkout_id
+
+        # update created/modified date to basefilenode
+        node.created = file_created
+        node.modified = file_modified
+        # ignore storing the value of `django.utils.timezone.now()` to `modified` field
+        node.save(update_modified=False)
+        return node
+
+    def add_created_file_node(file, node):
+        list_created_file_nodes.append({
+            'node': node,
+            'file_tags': file.get('tags'),
+            'file_timestamp': file.get('timestamp', {}),
+            'project_id': file.get('project', {}).get('id')
+        })
+
+    files_to_copy = []
+    for file in export_data_files:
+        file_id = file.get('id')
+        # Sort file by version id
+        file.get('version').sort(key=lambda k: k.get('identifier', 0))
+        for version in file.get('version'):
+            restored_node = restored_nodes.get(restored_versions.get((file_id, version.get('identifier'))))
+            if restored_node is not None:
+                add_created_file_node(file, restored_node)
+        files_to_copy.append(file)
+
+    # Copy the files at the same time, the created file nodes are updated here in order
+    for file, results in run_in_workers(copy_file_versions, files_to_copy, check_task_aborted_function):
+        file_id = file.get('id')
+        for version, response_body in results:
+            version_id = version.get('identifier')
+            if response_body is None:
+                if file_id not in files_versions_restore_fail:
+                    files_versions_restore_fail[file_id] = [version_id]
+                else:
+                    files_versions_restore_fail[file_id].append(version_id)
+                continue
+
+            try:
+                node = restore_file_version(file, version, response_body)
+                if node is not None:
+                    add_created_file_node(file, node)
+                ExportDataRestoredFile.objects.create(
+                    export_data_restore=export_data_restore, file_id=file_id, version_id=version_id,
+                    file_node_id=node.pk if node is not None else None)
+            except Exception as e:
+                logger.error(f'Restore file version exception: {e}')
+                check_if_restore_process_stopped(task, current_process_step)
+                continue
 
     # Separate the failed file list from the file_info_json
     list_file_restore_fail, _, _ = export.separate_failed_files(export_data_files, files_versions_restore_fail)
     return list_created_file_nodes, list_file_restore_fail
 
 
-def add_tag_and_timestamp_to_database(task, current_process_step, list_created_file_nodes):
-    with transaction.atomic():
-        for item in list_created_file_nodes:
-            check_if_restore_process_stopped(task, current_process_step)
+def bulk_add_tags_to_file_nodes(list_created_file_nodes):
+    tag_names_by_node = OrderedDict()
+    for item in list_created_file_nodes:
+        node = item.get('node')
+        if node and item.get('file_tags'):
+            tag_names_by_node.setdefault(node.id, set()).update(item.get('file_tags'))
+    if not tag_names_by_node:
+        return
+
+    # Create the missing tags
+    tag_names = set().union(*tag_names_by_node.values())
+    tags = {tag.name: tag for tag in Tag.all_tags.filter(system=False, name__in=tag_names)}
+    new_tags = [Tag(name=name) for name in sorted(tag_names - set(tags))]
+    if new_tags:
+        Tag.all_tags.bulk_create(new_tags)
+        tags.update({tag.name: tag for tag in Tag.all_tags.filter(system=False, name__in=[tag.name for tag in new_tags])})
+
+    # Add the tags not added to the file nodes yet
+    FileNodeTag = BaseFileNode.tags.through
+    existing = set(FileNodeTag.objects.filter(
+        basefilenode_id__in=tag_names_by_node.keys(), tag__system=False,
+    ).values_list('basefilenode_id', 'tag__name'))
+    FileNodeTag.objects.bulk_create([
+        FileNodeTag(basefilenode_id=node_id, tag_id=tags[name].id)
+        for node_id, names in tag_names_by_node.items()
+        for name in sorted(names)
+        if (node_id, name) not in existing
+    ])
+
+
+def bulk_add_timestamps_to_file_nodes(list_created_file_nodes):
+    timestamps_by_file_id = OrderedDict()
+    for item in list_created_file_nodes:
+        node = item.get('node')
+        project_id = item.get('project_id')
+        timestamp = item.get('file_timestamp')
+        if node and project_id and timestamp:
+            timestamps_by_file_id[node._id] = (node, project_id, timestamp)
+    if not timestamps_by_file_id:
+        return
+
+    timestamp_objs = RdmFileTimestamptokenVerifyResult.objects.in_bulk(
+        [timestamp.get('timestamp_id') for _, _, timestamp in timestamps_by_file_id.values() if timestamp.get('timestamp_id')])
+    existing = {
+        verify_data.file_id: verify_data
+        for verify_data in RdmFileTimestamptokenVerifyResult.objects.filter(file_id__in=timestamps_by_file_id.keys())
+    }
+    new_verify_data = []
+    for file_id, (node, project_id, timestamp) in timestamps_by_file_id.items():
+        verify_data = existing.get(file_id)
+        if verify_data is None:
+            verify_data = RdmFileTimestamptokenVerifyResult()
+            verify_data.file_id = file_id
+            verify_data.project_id = timestamp.get('project_id', project_id)
+            verify_data.provider = timestamp.get('provider', node.provider)
+            new_verify_data.append(verify_data)
+        set_timestamp_data(verify_data, node, timestamp, timestamp_objs.get(timestamp.get('timestamp_id')))
+
+    RdmFileTimestamptokenVerifyResult.objects.bulk_create(new_verify_data)
+    # restored file nodes are new, so the timestamps existing already are few
+    for verify_data in existing.values():
+        verify_data.save()
 
-            node = item.get('node')
-            file_tags = item.get('file_tags')
-            file_timestamp = item.get('file_timestamp')
-            project_id = item.get('project_id')
 
-            # Add tags to DB
-            add_tags_to_file_node(node, file_tags)
+def add_tag_and_timestamp_to_database(task, current_process_step, list_created_file_nodes):
+    with transaction.atomic():
+        # Add tags to DB
+        bulk_add_tags_to_file_nodes(list_created_file_nodes)
 
-            # Add timestamp to DB
-            add_timestamp_to_file_node(node, project_id, file_timestamp)
+        # Add timestamp to DB
+        bulk_add_timestamps_to_file_nodes(list_created_file_nodes)
         check_if_restore_process_stopped(task, current_process_step)
 
 
@@ -1,13 +1,21 @@
+import codecs
 import csv
 from io import StringIO
 import logging
 import os
+
+from django.db import transaction
+from django.utils import timezone
+
 from addons.metadata.models import ERadRecordSet
 from addons.metadata.suggestion import ERAD_COLUMNS
 
 
 logger = logging.getLogger(__name__)
 
+# Number of records upserted with one statement
+CHUNK_SIZE = 1000
+
 
 def validate_record(record_num, row):
     for column in ERAD_COLUMNS:
@@ -16,23 +24,46 @@ def validate_record(record_num, row):
         raise ValueError(f'Column "{column}" not exists (record={record_num})')
 
 
-def do_populate(filename, content):
-    code, _ = os.path.splitext(filename)
+def import_records(code, rows, chunk_size=CHUNK_SIZE):
+    """Upsert the e-Rad records of ``rows``, dicts of ERAD_COLUMNS -> value, into the
+    recordset ``code`` chunk by chunk, and mark the records of the recordset that are
+    not in ``rows`` anymore as removed. Nothing is imported if a row is invalid.
 
+    Returns the number of rows imported.
+    """
     recordset = ERadRecordSet.get_or_create(code=code)
-
-    reader = csv.DictReader(StringIO(content), delimiter='\t', quotechar='"')
+    imported = timezone.now()
     records = 0
-    for record_num, row in enumerate(reader):
-        validate_record(record_num, row)
-        kenkyusha_no = row['KENKYUSHA_NO']
-        kadai_id = row['KADAI_ID']
-        nendo = int(row['NENDO'])
-        record = recordset.get_or_create_record(kenkyusha_no, kadai_id, nendo)
-        for key in ERAD_COLUMNS:
-            setattr(record, key.lower(), row[key])
-        record.save()
-        logger.info(f'Row inserted: {kenkyusha_no}, {kadai_id}')
-        records += 1
-    recordset.save()
+    chunk = {}
+    with transaction.atomic():
+        for record_num, row in enumerate(rows):
+            validate_record(record_num, row)
+            record = {key.lower(): row[key] for key in ERAD_COLUMNS}
+            record['nendo'] = int(row['NENDO'])
+            # The last row of a record wins, an upsert cannot update the same record twice
+            chunk[(record['kenkyusha_no'], record['kadai_id'], record['nendo'])] = record
+            records += 1
+            if len(chunk) >= chunk_size:
+                recordset.upsert_records(list(chunk.values()), imported)
+                chunk = {}
+                logger.info(f'Importing {code}: {records} rows')
+        recordset.upsert_records(list(chunk.values()), imported)
+        removed = recordset.mark_removed_records(imported)
+        recordset.save()
+    logger.info(f'Imported {code}: {records} rows, {removed} records removed')
     return records
+
+
+def do_populate(filename, content):
+    return _populate(filename, StringIO(content))
+
+
+def do_populate_file(uploaded_file):
+    """Import an uploaded TSV file, reading it line by line."""
+    return _populate(uploaded_file.name, codecs.iterdecode(uploaded_file, 'utf-8-sig'))
+
+
+def _populate(filename, lines):
+    code, _ = os.path.splitext(filename)
+    reader = csv.DictReader(lines, delimiter='\t', quotechar='"')
+    return import_records(code, reader)
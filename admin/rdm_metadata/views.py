@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+import functools
 import json
 import logging
 from django.http import HttpResponse
@@ -41,13 +42,21 @@ class ERadRecords(RdmPermissionMixin, UserPassesTestMixin, View):
         return False
 
     def post(self, request):
-        files = json.loads(request.body)
+        if request.content_type == 'application/json':
+            # Names and texts of the files, as read by the browser
+            files = [
+                (file['name'], functools.partial(erad.do_populate, file['name'], file['text']))
+                for file in json.loads(request.body)
+            ]
+        else:
+            # Uploaded files, read line by line
+            files = [(file.name, functools.partial(erad.do_populate_file, file)) for file in request.FILES.getlist('files')]
         logger.info('Update Records: {} files'.format(len(files)))
         records = 0
-        for file in files:
-            logger.info('Updating... {}'.format(file['name']))
+        for name, populate in files:
+            logger.info('Updating... {}'.format(name))
             try:
-                records += erad.do_populate(file['name'], file['text'])
+                records += populate()
             except ValueError as e:
                 return HttpResponse(
                     json.dumps({'status': 'error', 'message': str(e)}),
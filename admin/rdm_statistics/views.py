@@ -13,8 +13,13 @@ import csv
 import pandas as pd
 import numpy as np
 import hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django_bulk_update.helper import bulk_update
 from django.views.generic import TemplateView, View
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.shortcuts import redirect
@@ -29,7 +34,9 @@ from osf.models import (
     Institution,
     OSFUser,
     AbstractNode,
+    Guid,
     RdmStatistics)
+from addons.osfstorage.models import OsfStorageFile
 from website import settings as website_settings
 from website.settings import SUPPORT_EMAIL
 from api.base.utils import waterbutler_api_url_for
@@ -52,6 +59,31 @@ STATISTICS_IMAGE_HEIGHT = 4
 RECURSIVE_LIMIT = 10000
 WB_MAX_RETRY = 3
 SITE_KEY = 'rdm_statistics'
+GATHER_MODE_CRAWL = 'crawl'
+GATHER_MODE_DATABASE = 'db'
+
+# number and size of the osfstorage files of projects per extension.
+# The extension is taken from the file name as os.path.splitext does.
+OSFSTORAGE_STATISTICS_SQL = """
+    SELECT F.target_object_id,
+           substring(F.name from '^\\.*[^.].*(\\.[^.]*)$') AS ext,
+           COUNT(*),
+           COALESCE(SUM(V.size), 0)
+    FROM osf_basefilenode AS F
+      LEFT JOIN LATERAL (
+        SELECT FV.size
+        FROM osf_basefileversionsthrough AS T
+          JOIN osf_fileversion AS FV ON FV.id = T.fileversion_id
+        WHERE T.basefilenode_id = F.id
+        ORDER BY FV.created DESC, FV.id DESC
+        LIMIT 1
+      ) AS V ON TRUE
+    WHERE F.target_content_type_id = %(content_type_id)s
+      AND F.target_object_id = ANY(%(node_ids)s)
+      AND F.type = ANY(%(file_types)s)
+      AND F.deleted_on IS NULL
+    GROUP BY F.target_object_id, ext;
+"""
 
 class InstitutionListViewStat(RdmPermissionMixin, UserPassesTestMixin, TemplateView):
     """institlutions list view for statistics"""
@@ -454,33 +486,19 @@ class GatherView(TemplateView):
             response_json = json.dumps(response_hash)
             response = HttpResponse(response_json, content_type='application/json')
             return response
-        # user
-        user = self.request.user
         self.cnt = 0
         self.stat_list = []
         current_date = get_current_date()
+        mode = self.request.GET.get('mode', GATHER_MODE_CRAWL)
         try:
             # create session
             self.session = requests.Session()
             self.adapter = requests.adapters.HTTPAdapter(max_retries=WB_MAX_RETRY)
-            # user crawling
-            for user in self.get_users():
-                if user.affiliated_institutions.first():
-                    institution = user.affiliated_institutions.first()
-                else:
-                    institution = get_dummy_institution()
-                cookie = self.get_cookie(user)
-                for node in self.get_user_nodes(user):
-                    providers = node.get_addon_names()
-                    for guid in node.guids.all():
-                        for provider in providers:
-                            self.count_list = []
-                            path = '/'
-                            self.count_project_files(node_id=guid._id, provider=provider, path=path, cookies=cookie)
-                            if len(self.count_list) > 0:
-                                self.regist_database(node=node, guid=guid, owner=user, institution=institution,
-                                             provider=provider, date_acquired=current_date, count_list=self.count_list)
-                                self.stat_list.append([institution.name, guid._id, provider])
+            if mode == GATHER_MODE_DATABASE:
+                self.stat_list = self.gather_from_database(current_date)
+            else:
+                # user crawling
+                self.gather_by_crawling(current_date)
             response_json = json.dumps(self.stat_list)
             response = HttpResponse(response_json, content_type='application/json')
             # statistics mail send
@@ -527,6 +545,112 @@ class GatherView(TemplateView):
     def gather(**kwargs):
         """gathering storage data"""
 
+    def gather_by_crawling(self, current_date):
+        """gathering storage data of the projects of each user by crawling WaterButler"""
+        for user in self.get_users():
+            if user.affiliated_institutions.first():
+                institution = user.affiliated_institutions.first()
+            else:
+                institution = get_dummy_institution()
+            cookie = self.get_cookie(user)
+            for node in self.get_user_nodes(user):
+                providers = node.get_addon_names()
+                for guid in node.guids.all():
+                    for provider in providers:
+                        self.count_list = []
+                        path = '/'
+                        self.count_project_files(node_id=guid._id, provider=provider, path=path, cookies=cookie)
+                        if len(self.count_list) > 0:
+                            self.regist_database(node=node, guid=guid, owner=user, institution=institution,
+                                         provider=provider, date_acquired=current_date, count_list=self.count_list)
+                            self.stat_list.append([institution.name, guid._id, provider])
+
+    def gather_from_database(self, current_date):
+        """gathering storage data of all projects, chunk by chunk.
+        osfstorage files are counted in database, the other storages are crawled
+        by a pool of workers."""
+        stat_list = []
+        date_acquired = current_date.strftime('%Y-%m-%d')
+        content_type_id = ContentType.objects.get_for_model(AbstractNode).id
+        self.session.mount('http://', requests.adapters.HTTPAdapter(
+            pool_maxsize=settings.RDM_STATISTICS_GATHER_MAX_WORKERS, max_retries=WB_MAX_RETRY))
+        projects = AbstractNode.objects.filter(category='project', is_deleted=False, creator__isnull=False)
+        last_id = 0
+        while True:
+            chunk = list(projects.filter(id__gt=last_id).order_by('id').values_list(
+                'id', 'creator_id')[:settings.RDM_STATISTICS_GATHER_CHUNK_SIZE])
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            stat_list.extend(self.gather_projects(dict(chunk), content_type_id, date_acquired))
+        return stat_list
+
+    def gather_projects(self, project_creators, content_type_id, date_acquired):
+        """gathering storage data of projects given as project id -> creator id"""
+        node_ids = list(project_creators)
+        guids = dict(Guid.objects.filter(
+            content_type_id=content_type_id, object_id__in=node_ids,
+        ).order_by('created').values_list('object_id', '_id'))
+        creators = OSFUser.objects.filter(
+            id__in=set(project_creators.values())).prefetch_related('affiliated_institutions').in_bulk()
+        institutions = {
+            user_id: min(user.affiliated_institutions.all(), key=lambda institution: institution.id, default=None)
+            for user_id, user in creators.items()
+        }
+
+        # (project id, provider, extension) -> [number, size]
+        subtotals = defaultdict(lambda: [0, 0])
+        with connection.cursor() as cursor:
+            cursor.execute(OSFSTORAGE_STATISTICS_SQL, {
+                'content_type_id': content_type_id,
+                'node_ids': node_ids,
+                'file_types': list(OsfStorageFile._typedmodels_subtypes),
+            })
+            for node_id, ext, number, size in cursor.fetchall():
+                subtotal = subtotals[(node_id, 'osfstorage', get_statistics_extension(ext))]
+                subtotal[0] += number
+                subtotal[1] += size
+
+        # the other storages are crawled, cookies are made here as they are saved in database
+        crawls = [
+            (node_id, provider)
+            for node_id, providers in get_projects_addon_names(node_ids).items()
+            for provider in providers if provider != 'osfstorage' and node_id in guids
+        ]
+        cookies = {user_id: self.get_cookie(creators[user_id])
+                   for user_id in {project_creators[node_id] for node_id, _ in crawls}}
+        with ThreadPoolExecutor(max_workers=settings.RDM_STATISTICS_GATHER_MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(self.crawl_project_files, guids[node_id], provider,
+                                cookies[project_creators[node_id]]): (node_id, provider)
+                for node_id, provider in crawls
+            }
+            for future in as_completed(futures):
+                node_id, provider = futures[future]
+                for kind, _, size, ext in future.result():
+                    if kind == 'file':
+                        subtotal = subtotals[(node_id, provider, ext)]
+                        subtotal[0] += 1
+                        subtotal[1] += size
+
+        # register
+        stats = {}
+        stat_list = []
+        for (node_id, provider, ext), (number, size) in subtotals.items():
+            institution = institutions.get(project_creators[node_id])
+            stats[(node_id, provider, ext)] = {
+                'owner_id': project_creators[node_id],
+                'institution_id': institution.id if institution else None,
+                'storage_account_id': guids.get(node_id),
+                'subtotal_file_number': number,
+                'subtotal_file_size': size,
+            }
+            stat = [institution.name if institution else '', guids.get(node_id), provider]
+            if stat not in stat_list:
+                stat_list.append(stat)
+        bulk_upsert_statistics(stats, date_acquired)
+        return stat_list
+
     def get_users(self):
         return OSFUser.objects.all()
 
@@ -542,6 +666,29 @@ class GatherView(TemplateView):
         url = waterbutler_api_url_for(node_id=node_id, _internal=True, meta=True, provider=provider, path=path, cookie=cookie)
         return url
 
+    def crawl_project_files(self, node_id, provider, cookies):
+        """list the files and folders of a project storage folder by folder.
+        runs in worker threads, so it must not use database."""
+        count_list = []
+        paths = ['/']
+        cnt = 0
+        headers = {'content-type': 'application/json'}
+        while paths and cnt < RECURSIVE_LIMIT:
+            path = paths.pop()
+            url_api = self.get_wb_url(node_id=node_id, provider=provider, path=re.sub(r'^//', '/', path), cookie=cookies)
+            # connect timeout:10sec, read timeout:300sec
+            res = self.session.get(url=url_api, headers=headers, timeout=(10.0, 300.0))
+            cnt += 1
+            if not res.status_code == requests.codes.ok:
+                continue
+            for obj in res.json().get('data', []):
+                count_data = get_count_data(obj, provider)
+                if count_data is not None:
+                    count_list.append(count_data)
+                if obj['attributes']['kind'] == 'folder':
+                    paths.append('/' + re.sub('^' + provider, '', obj['id']))
+        return count_list
+
     def count_project_files(self, node_id, provider, path, cookies):
         """recursive count"""
         url_api = self.get_wb_url(node_id=node_id, provider=provider, path=re.sub(r'^//', '/', path), cookie=cookies)
@@ -558,37 +705,80 @@ class GatherView(TemplateView):
         # parse response json
         if 'data' in response_json.keys():
             for obj in response_json['data']:
-                if provider != 'osfstorage':
-                    root, ext = os.path.splitext(obj['id'])
-                else:
-                    root, ext = os.path.splitext(obj['attributes']['materialized'])
-                if not ext:
-                    ext = 'none'
-                if len(ext) > RdmStatistics._meta.get_field('extention_type').max_length:
-                    ext = 'unknown'
-                if obj['attributes']['kind'] == 'file':
-                    try:
-                        self.count_list.append(['file', obj['id'], int(obj['attributes']['size'] if obj['attributes']['size'] else 0), ext])
-                    except Exception as err:
-                        logger.error('resource:{} {}{} error occured (file size:{}). - {}'.format(obj['attributes']['resource'],
-                                                                                                  obj['attributes']['provider'],
-                                                                                                  obj['attributes']['path'],
-                                                                                                  obj['attributes']['size'],
-                                                                                                  err))
-                        pass
-                elif obj['attributes']['kind'] == 'folder':
+                count_data = get_count_data(obj, provider)
+                if count_data is not None:
+                    self.count_list.append(count_data)
+                if obj['attributes']['kind'] == 'folder':
                     path = re.sub('^' + provider, '', obj['id'])
-                    try:
-                        self.count_list.append(['folder', obj['id'], int(obj['attributes']['size'] if obj['attributes']['size'] else 0), ext])
-                    except Exception as err:
-                        logger.error('resource:{} {}{} error occured (file size:{}). - {}'.format(obj['attributes']['resource'],
-                                                                                                  obj['attributes']['provider'],
-                                                                                                  obj['attributes']['path'],
-                                                                                                  obj['attributes']['size'],
-                                                                                                  err))
-                        pass
                     self.count_project_files(provider=provider, node_id=node_id, path='/' + path, cookies=cookies)
 
+
+def get_statistics_extension(ext):
+    """extension stored in RdmStatistics"""
+    if not ext:
+        return 'none'
+    if len(ext) > RdmStatistics._meta.get_field('extention_type').max_length:
+        return 'unknown'
+    return ext
+
+
+def get_count_data(obj, provider):
+    """[kind, id, size, extension] of a WaterButler file or folder metadata"""
+    if provider != 'osfstorage':
+        root, ext = os.path.splitext(obj['id'])
+    else:
+        root, ext = os.path.splitext(obj['attributes']['materialized'])
+    ext = get_statistics_extension(ext)
+    if obj['attributes']['kind'] not in ('file', 'folder'):
+        return None
+    try:
+        return [obj['attributes']['kind'], obj['id'], int(obj['attributes']['size'] if obj['attributes']['size'] else 0), ext]
+    except Exception as err:
+        logger.error('resource:{} {}{} error occured (file size:{}). - {}'.format(obj['attributes']['resource'],
+                                                                                  obj['attributes']['provider'],
+                                                                                  obj['attributes']['path'],
+                                                                                  obj['attributes']['size'],
+                                                                                  err))
+        return None
+
+
+def get_projects_addon_names(node_ids):
+    """names of the addons of projects, as AbstractNode.get_addon_names for each project"""
+    addon_names = {node_id: [] for node_id in node_ids}
+    for config in AbstractNode.ADDONS_AVAILABLE:
+        settings_model = getattr(config, 'node_settings', None)
+        if not settings_model:
+            continue
+        owner_ids = settings_model.objects.filter(
+            owner_id__in=node_ids, is_deleted=False).values_list('owner_id', flat=True)
+        for owner_id in owner_ids:
+            addon_names[owner_id].append(config.short_name)
+    return addon_names
+
+
+def bulk_upsert_statistics(stats, date_acquired):
+    """update or create RdmStatistics of (project id, provider, extension) in bulk"""
+    existing = {
+        (stat.project_id, stat.provider, stat.extention_type): stat
+        for stat in RdmStatistics.objects.filter(
+            date_acquired=date_acquired, project_id__in={key[0] for key in stats})
+    }
+    to_create = []
+    to_update = []
+    for (project_id, provider, ext), values in stats.items():
+        stat = existing.get((project_id, provider, ext))
+        if stat is None:
+            stat = RdmStatistics(project_id=project_id, provider=provider, extention_type=ext,
+                                 date_acquired=date_acquired, project_root_path='/')
+            to_create.append(stat)
+        else:
+            to_update.append(stat)
+        for name, value in values.items():
+            setattr(stat, name, value)
+    RdmStatistics.objects.bulk_create(to_create)
+    bulk_update(to_update, update_fields=[
+        'owner', 'institution', 'storage_account_id', 'subtotal_file_number', 'subtotal_file_size'])
+
 def simple_auth(access_token):
     digest = hashlib.sha512(SITE_KEY.encode('utf-8')).hexdigest()
     if digest == access_token.lower():
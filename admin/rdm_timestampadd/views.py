@@ -8,7 +8,7 @@ from django.core.urlresolvers import reverse
 from django.http import HttpResponse
 from django.shortcuts import redirect
 from django.views.generic import ListView, View, TemplateView
-from osf.models import Institution, Node, AbstractNode, TimestampTask
+from osf.models import Institution, Node, AbstractNode
 from website.util import timestamp
 import json
 
@@ -111,11 +111,10 @@ class VerifyTimestamp(RdmPermissionMixin, UserPassesTestMixin, View):
         return self.has_auth(institution_id)
 
     def post(self, request, *args, **kwargs):
-        async_task = timestamp.celery_verify_timestamp_token.delay(self.request.user.id, self.kwargs['guid'])
-        TimestampTask.objects.update_or_create(
-            node=AbstractNode.objects.get(id=self.kwargs['guid']),
-            defaults={'task_id': async_task.id, 'requester': self.request.user}
-        )
+        timestamp.start_celery_task(
+            timestamp.celery_verify_timestamp_token,
+            AbstractNode.objects.get(id=self.kwargs['guid']), self.request.user,
+            self.request.user.id, self.kwargs['guid'])
 
         # Admin User
         ctx = {'status': 'OK'}
@@ -159,12 +158,10 @@ class AddTimestamp(RdmPermissionMixin, UserPassesTestMixin, View):
 
     def post(self, request, *args, **kwargs):
         data = json.loads(self.request.body)
-        async_task = timestamp.celery_add_timestamp_token.delay(
+        timestamp.start_celery_task(
+            timestamp.celery_add_timestamp_token,
+            AbstractNode.objects.get(id=self.kwargs['guid']), self.request.user,
             self.request.user.id, self.kwargs['guid'], data)
-        TimestampTask.objects.update_or_create(
-            node=AbstractNode.objects.get(id=self.kwargs['guid']),
-            defaults={'task_id': async_task.id, 'requester': self.request.user}
-        )
         return HttpResponse(
             json.dumps({'status': 'OK'}),
             content_type='application/json'
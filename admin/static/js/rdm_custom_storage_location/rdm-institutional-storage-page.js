@@ -1632,6 +1632,8 @@ $('#stop_restore_button').on('click', function () {
     var data = {
         task_id: restore_task_id,
         destination_id: $('#destination_storage').val(),
+        // Keep the files restored so far, the next restore of the same export data resumes from them
+        keep_progress: true,
     };
     closeGrowl();
     $.ajax({
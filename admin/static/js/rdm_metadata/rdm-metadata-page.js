@@ -28,12 +28,18 @@ function init() {
     });
 }
 
-function updateRecords(records, callback) {
+function updateRecords(files, callback) {
+    // The files are uploaded as they are, so that the server can read them line by line
+    var fd = new FormData();
+    for (var i = 0; i < files.length; i ++) {
+        fd.append('files', files[i]);
+    }
     $.ajax({
         url: 'erad/records',
         type: 'POST',
-        data: JSON.stringify(records),
-        contentType: 'application/json; charset=utf-8',
+        data: fd,
+        processData: false,
+        contentType: false,
         timeout: 120000,
         success: function (data) {
             if (callback) {
@@ -65,36 +71,15 @@ $('#e-rad-update').on('click', function() {
         return;
     }
     $('#e-rad-update').attr('disabled', true);
-    const textPromises = [];
-    for (var i = 0; i < uploadedFiles.length; i ++) {
-        const file = uploadedFiles[i];
-        textPromises.push(file.text());
-    }
-    Promise.all(textPromises)
-        .then(function(texts) {
-            console.log(logPrefix, 'Files', texts.map(function(text, textIndex) {
-                return {
-                    name: uploadedFiles[textIndex].name,
-                    textLength: text.length,
-                };
-            }));
-            const records = texts.map(function(text, textIndex) {
-                return {
-                    name: uploadedFiles[textIndex].name,
-                    text: text,
-                };
-            });
-            updateRecords(records, function() {
-                $('#e-rad-update').attr('disabled', false);
-            });
-        })
-        .catch(function(error) {
-            $('#e-rad-update').attr('disabled', false);
-            bootbox.alert({
-                message: error,
-                backdrop: true
-            });
-        });
+    console.log(logPrefix, 'Files', Array.prototype.map.call(uploadedFiles, function(file) {
+        return {
+            name: file.name,
+            size: file.size,
+        };
+    }));
+    updateRecords(uploadedFiles, function() {
+        $('#e-rad-update').attr('disabled', false);
+    });
 });
 
 init();
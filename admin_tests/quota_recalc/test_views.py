@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
+from datetime import timedelta
+
 from django.test import RequestFactory
+from django.utils import timezone
 import json
 import mock
 from nose import tools as nt
 
-from admin.quota_recalc import views
+from addons.osfstorage.models import OsfStorageFileNode
+from admin.quota_recalc import tasks, views
 from api.base import settings as api_settings
-from osf.models import UserQuota
-from osf_tests.factories import AuthUserFactory, InstitutionFactory, RegionFactory
+from osf.models import FileInfo, OSFUser, ProjectStorageType, ProjectStorageUsage, QuotaRecalcTask, UserQuota
+from osf_tests.factories import AuthUserFactory, InstitutionFactory, ProjectFactory, RegionFactory
+from website.util import quota
 from tests.base import AdminTestCase
 
 
@@ -16,7 +21,7 @@ class TestQuotaRecalcView(AdminTestCase):
     def get_request(view, **kwargs):
         return view(RequestFactory().get('/fake_path'), **kwargs)
 
-    @mock.patch('admin.quota_recalc.views.used_quota')
+    @mock.patch('admin.quota_recalc.views.rebuild_project_storage_usage')
     def test_user_create_userquota_record(self, mock_usedquota):
         mock_usedquota.return_value = 1500
 
@@ -31,7 +36,7 @@ class TestQuotaRecalcView(AdminTestCase):
         nt.assert_equal(user_quota.max_quota, api_settings.DEFAULT_MAX_QUOTA)
         nt.assert_equal(user_quota.used, 1500)
 
-    @mock.patch('admin.quota_recalc.views.used_quota')
+    @mock.patch('admin.quota_recalc.views.rebuild_project_storage_usage')
     def test_user_update_userquota_record(self, mock_usedquota):
         mock_usedquota.return_value = 7000
 
@@ -51,7 +56,7 @@ class TestQuotaRecalcView(AdminTestCase):
         nt.assert_equal(user_quota.max_quota, 200)
         nt.assert_equal(user_quota.used, 7000)
 
-    @mock.patch('admin.quota_recalc.views.used_quota')
+    @mock.patch('admin.quota_recalc.views.rebuild_project_storage_usage')
     def test_user_invalid_guid(self, mock_usedquota):
         mock_usedquota.return_value = 3000
 
@@ -61,7 +66,7 @@ class TestQuotaRecalcView(AdminTestCase):
         nt.assert_equal(res_json['status'], 'failed')
         nt.assert_equal(res_json['message'], 'User not found.')
 
-    @mock.patch('admin.quota_recalc.views.used_quota')
+    @mock.patch('admin.quota_recalc.views.rebuild_project_storage_usage')
     def test_users_create_userquota_record(self, mock_usedquota):
         mock_usedquota.return_value = 1500
         user = AuthUserFactory()
@@ -94,7 +99,7 @@ class TestCalculateQuota(AdminTestCase):
         super(TestCalculateQuota, self).setUp()
         self.user = AuthUserFactory()
 
-    @mock.patch('admin.quota_recalc.views.used_quota')
+    @mock.patch('admin.quota_recalc.views.rebuild_project_storage_usage')
     def test_user_without_institution(self, mock_usedquota):
         mock_usedquota.return_value = 5000
 
@@ -104,7 +109,7 @@ class TestCalculateQuota(AdminTestCase):
         nt.assert_equal(len(user_quota), 1)
         nt.assert_equal(user_quota[0].used, 5000)
 
-    @mock.patch('admin.quota_recalc.views.used_quota')
+    @mock.patch('admin.quota_recalc.views.rebuild_project_storage_usage')
     def test_user_institution_without_custom_storage(self, mock_usedquota):
         mock_usedquota.return_value = 6000
 
@@ -117,7 +122,7 @@ class TestCalculateQuota(AdminTestCase):
         nt.assert_equal(len(user_quota), 1)
         nt.assert_equal(user_quota[0].used, 6000)
 
-    @mock.patch('admin.quota_recalc.views.used_quota')
+    @mock.patch('admin.quota_recalc.views.rebuild_project_storage_usage')
     def test_user_institution_with_custom_storage(self, mock_usedquota):
         mock_usedquota.side_effect = \
             lambda uid, storage_type: 300 if storage_type == UserQuota.NII_STORAGE else 7000
@@ -138,3 +143,109 @@ class TestCalculateQuota(AdminTestCase):
 
         nt.assert_equal(user_quota[0].used, expected[user_quota[0].storage_type])
         nt.assert_equal(user_quota[1].used, expected[user_quota[1].storage_type])
+
+
+class TestRecalculateAllUsersQuota(AdminTestCase):
+
+    def setUp(self):
+        super(TestRecalculateAllUsersQuota, self).setUp()
+        self.users = [AuthUserFactory() for _ in range(3)]
+        UserQuota.objects.all().delete()
+        self.task = mock.Mock()
+        self.task.request.id = None
+
+    def add_file(self, node, size, name='file'):
+        file_node = OsfStorageFileNode.create(target=node, name=name)
+        file_node.save()
+        FileInfo.objects.create(file=file_node, file_size=size)
+
+    def test_bulk_matches_used_quota(self):
+        institution = InstitutionFactory()
+        self.users[1].affiliated_institutions.add(institution)
+        RegionFactory(_id=institution._id)
+        nii_node = ProjectFactory(creator=self.users[0])
+        custom_node = ProjectFactory(creator=self.users[1])
+        ProjectStorageType.objects.filter(node=custom_node).update(
+            storage_type=ProjectStorageType.CUSTOM_STORAGE
+        )
+        self.add_file(nii_node, 500, 'file0')
+        self.add_file(nii_node, 700, 'file1')
+        self.add_file(custom_node, 1000)
+        deleted_node = ProjectFactory(creator=self.users[0], is_deleted=True)
+        self.add_file(deleted_node, 9000)
+
+        quota.bulk_recalculate_used_quota([user.id for user in self.users])
+
+        for user in self.users:
+            for user_quota in UserQuota.objects.filter(user=user):
+                nt.assert_equal(user_quota.used, quota.used_quota(user._id, user_quota.storage_type))
+                nt.assert_equal(user_quota.max_quota, api_settings.DEFAULT_MAX_QUOTA)
+        nt.assert_equal(UserQuota.objects.get(user=self.users[0]).used, 1200)
+        nt.assert_equal(UserQuota.objects.filter(user=self.users[1]).count(), 2)
+        nt.assert_equal(
+            UserQuota.objects.get(user=self.users[1], storage_type=UserQuota.CUSTOM_STORAGE).used, 1000
+        )
+        nt.assert_equal(ProjectStorageUsage.objects.get(node=nii_node).used, 1200)
+        nt.assert_equal(ProjectStorageUsage.objects.get(node=custom_node).used, 1000)
+
+    def test_resume_from_cursor(self):
+        for user in self.users:
+            self.add_file(ProjectFactory(creator=user), 100)
+        UserQuota.objects.all().delete()
+        user_ids = list(OSFUser.objects.exclude(deleted__isnull=False).order_by('id').values_list('id', flat=True))
+        done = user_ids.index(self.users[0].id) + 1
+        recalc_task = QuotaRecalcTask.objects.create(
+            total_users=len(user_ids),
+            last_user_id=self.users[0].id,
+            processed_users=done,
+        )
+
+        tasks.recalculate_all_users_quota(self.task, recalc_task.id, batch_size=1)
+
+        recalc_task.refresh_from_db()
+        nt.assert_equal(recalc_task.last_user_id, user_ids[-1])
+        nt.assert_equal(recalc_task.processed_users, len(user_ids))
+        nt.assert_is_not_none(recalc_task.finished)
+        nt.assert_false(UserQuota.objects.filter(user=self.users[0]).exists())
+        for user in self.users[1:]:
+            nt.assert_equal(UserQuota.objects.get(user=user).used, 100)
+
+    def test_status(self):
+        request = RequestFactory().get('/fake_path')
+        nt.assert_equal(views.status(request).status_code, 404)
+
+        views.all_users(request)
+        response = views.status(request)
+        res_json = json.loads(response.content)
+        nt.assert_equal(response.status_code, 200)
+        progress = res_json['progress']
+        nt.assert_equal(progress['total'], OSFUser.objects.exclude(deleted__isnull=False).count())
+        nt.assert_equal(progress['processed'], progress['total'])
+        nt.assert_is_not_none(progress['finished'])
+
+    @mock.patch('admin.quota_recalc.views.run_recalculate_all_users_quota.delay')
+    def test_all_users_not_dispatched_twice(self, mock_delay):
+        mock_delay.return_value = mock.Mock(id='fake-task-id')
+        request = RequestFactory().get('/fake_path')
+        QuotaRecalcTask.objects.create(total_users=3)
+
+        # a fresh record the worker has not picked up yet is running
+        views.all_users(request)
+        mock_delay.assert_not_called()
+
+        QuotaRecalcTask.objects.update(
+            modified=timezone.now() - timedelta(seconds=api_settings.QUOTA_RECALC_STALE_TIMEOUT + 1)
+        )
+        views.all_users(request)
+        mock_delay.assert_called_once()
+        nt.assert_equal(QuotaRecalcTask.objects.get().task_id, 'fake-task-id')
+
+    def test_bulk_updates_existing_userquota(self):
+        node = ProjectFactory(creator=self.users[0])
+        self.add_file(node, 100)
+        UserQuota.objects.create(user=self.users[0], storage_type=UserQuota.NII_STORAGE, used=5)
+
+        quota.bulk_recalculate_used_quota([self.users[0].id])
+
+        nt.assert_equal(UserQuota.objects.get(user=self.users[0]).used, 100)
+        nt.assert_equal(UserQuota.objects.filter(user=self.users[0]).count(), 1)
@@ -1,3 +1,4 @@
+import datetime
 import json
 import logging
 import mock
@@ -12,11 +13,12 @@ from django.db import IntegrityError
 from django.test import RequestFactory
 from django_celery_results.models import TaskResult
 from nose import tools as nt
+from requests.exceptions import ConnectionError, ReadTimeout
 from rest_framework import status
 
 from admin.rdm_custom_storage_location.export_data.views import export
 from framework.celery_tasks import app as celery_app
-from osf.models import ExportData
+from osf.models import ExportData, ExportDataCopiedFile
 from osf_tests.factories import (
     InstitutionFactory,
     ExportDataLocationFactory,
@@ -415,6 +417,143 @@ class TestSeparateFailedFiles(unittest.TestCase):
         self.assertEqual(_sub_files_numb, len(versions))
 
 
+@pytest.mark.django_db
+@mock.patch(f'{EXPORT_DATA_PATH}.time.sleep')
+@mock.patch(f'{EXPORT_DATA_PATH}.ExportData.copy_export_data_file_to_location')
+class TestCopyExportDataFiles(AdminTestCase):
+    def setUp(self):
+        super(TestCopyExportDataFiles, self).setUp()
+        self.export_data = ExportDataFactory()
+        self.check_status = mock.MagicMock()
+        self.file_versions = [
+            ('prj01', 'osfstorage', '/file1', 1, 'hash1', 1001),
+            ('prj01', 'osfstorage', '/file2', 1, 'hash1', 1002),
+            ('prj01', 'osfstorage', '/file3', 1, 'hash2', 1003),
+            ('prj01', 'osfstorage', '/file3', 2, 'hash3', 1003),
+        ]
+
+    def response(self, status_code):
+        return mock.MagicMock(status_code=status_code)
+
+    def copied_file_names(self):
+        return set(self.export_data.copied_files.values_list('file_name', flat=True))
+
+    def test_copy_each_hash_once(self, mock_copy, mock_sleep):
+        mock_copy.return_value = self.response(status.HTTP_201_CREATED)
+
+        not_found = export.copy_export_data_files(
+            self.export_data, 'cookies', self.file_versions, self.check_status)
+
+        nt.assert_equal(not_found, {})
+        nt.assert_equal(mock_copy.call_count, 3)
+        nt.assert_equal(self.copied_file_names(), {'hash1', 'hash2', 'hash3'})
+        nt.assert_true(self.check_status.called)
+
+    def test_failed_version_falls_back_to_same_hash(self, mock_copy, mock_sleep):
+        def copy(cookies, project_id, provider, file_path, file_name, **kwargs):
+            if file_path == '/file1':
+                return self.response(status.HTTP_400_BAD_REQUEST)
+            return self.response(status.HTTP_201_CREATED)
+        mock_copy.side_effect = copy
+
+        not_found = export.copy_export_data_files(
+            self.export_data, 'cookies', self.file_versions, self.check_status)
+
+        nt.assert_equal(not_found, {1001: [1]})
+        nt.assert_equal(self.copied_file_names(), {'hash1', 'hash2', 'hash3'})
+
+    def test_retry_on_timeout(self, mock_copy, mock_sleep):
+        mock_copy.side_effect = [
+            ReadTimeout(), ConnectionError(), self.response(status.HTTP_201_CREATED),
+        ]
+
+        not_found = export.copy_export_data_files(
+            self.export_data, 'cookies', self.file_versions[:1], self.check_status)
+
+        nt.assert_equal(not_found, {})
+        nt.assert_equal(mock_copy.call_count, 3)
+        nt.assert_equal([call[0][0] for call in mock_sleep.call_args_list], [2, 4])
+
+    def test_give_up_after_retries(self, mock_copy, mock_sleep):
+        mock_copy.side_effect = ReadTimeout()
+
+        not_found = export.copy_export_data_files(
+            self.export_data, 'cookies', self.file_versions[2:3], self.check_status)
+
+        nt.assert_equal(not_found, {1003: [1]})
+        nt.assert_equal(mock_copy.call_count, 4)
+        nt.assert_equal(self.copied_file_names(), set())
+
+    def test_resume_skips_copied_files(self, mock_copy, mock_sleep):
+        ExportDataCopiedFile.objects.create(export_data=self.export_data, file_name='hash1')
+        ExportDataCopiedFile.objects.create(export_data=self.export_data, file_name='hash2')
+        mock_copy.return_value = self.response(status.HTTP_201_CREATED)
+
+        export.copy_export_data_files(
+            self.export_data, 'cookies', self.file_versions, self.check_status)
+
+        nt.assert_equal(mock_copy.call_count, 1)
+        nt.assert_equal(mock_copy.call_args[0][4], 'hash3')
+        nt.assert_equal(mock_copy.call_args[1]['version'], 2)
+
+    def test_stop_on_status_check(self, mock_copy, mock_sleep):
+        mock_copy.return_value = self.response(status.HTTP_201_CREATED)
+        self.check_status.side_effect = export.ExportDataTaskException(export.MSG_EXPORT_ABORTED)
+
+        with nt.assert_raises(export.ExportDataTaskException):
+            export.copy_export_data_files(
+                self.export_data, 'cookies', self.file_versions, self.check_status, max_workers=1)
+
+    def create_base_export(self, **kwargs):
+        base_export = ExportDataFactory(
+            source=self.export_data.source,
+            location=self.export_data.location,
+            process_start=self.export_data.process_start - datetime.timedelta(days=1),
+            **kwargs
+        )
+        ExportDataCopiedFile.objects.create(export_data=base_export, file_name='hash1')
+        ExportDataCopiedFile.objects.create(export_data=base_export, file_name='hash2')
+        return base_export
+
+    def test_incremental_takes_over_base_export_files(self, mock_copy, mock_sleep):
+        base_export = self.create_base_export()
+        mock_copy.return_value = self.response(status.HTTP_201_CREATED)
+
+        not_found = export.copy_export_data_files(
+            self.export_data, 'cookies', self.file_versions, self.check_status)
+
+        nt.assert_equal(not_found, {})
+        nt.assert_equal(mock_copy.call_count, 1)
+        nt.assert_equal(mock_copy.call_args[0][4], 'hash3')
+        nt.assert_equal(self.copied_file_names(), {'hash1', 'hash2', 'hash3'})
+        base_files_folder = f'/{base_export.export_data_folder_name}/{ExportData.EXPORT_DATA_FILES_FOLDER}'
+        nt.assert_equal(self.export_data.get_data_files_folders(), {
+            'hash1': base_files_folder,
+            'hash2': base_files_folder,
+        })
+
+    def test_incremental_ignores_unavailable_base_export(self, mock_copy, mock_sleep):
+        self.create_base_export(status=ExportData.STATUS_ERROR)
+        self.create_base_export(is_deleted=True)
+        mock_copy.return_value = self.response(status.HTTP_201_CREATED)
+
+        export.copy_export_data_files(
+            self.export_data, 'cookies', self.file_versions, self.check_status)
+
+        nt.assert_equal(mock_copy.call_count, 3)
+        nt.assert_equal(self.export_data.get_data_files_folders(), {})
+
+    @mock.patch.object(export.admin_settings, 'EXPORT_DATA_INCREMENTAL', False)
+    def test_incremental_disabled(self, mock_copy, mock_sleep):
+        self.create_base_export()
+        mock_copy.return_value = self.response(status.HTTP_201_CREATED)
+
+        export.copy_export_data_files(
+            self.export_data, 'cookies', self.file_versions, self.check_status)
+
+        nt.assert_equal(mock_copy.call_count, 3)
+
+
 class TestExportDataProcess(unittest.TestCase):
     def setUp(self):
         super(TestExportDataProcess, self).setUp()
@@ -506,7 +645,7 @@ class TestExportDataProcess(unittest.TestCase):
 
     @pytest.mark.django_db
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.delete_export_data_folder')
-    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.extract_file_information_json_from_source_storage')
+    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.write_file_information_json')
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.objects')
     def test_export_data_process__raise_exception(
             self, mock_export_data,
@@ -538,19 +677,19 @@ class TestExportDataProcess(unittest.TestCase):
             nt.assert_not_equal(_task_result.get('traceback'), None)
 
     @pytest.mark.django_db
-    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.extract_file_information_json_from_source_storage')
+    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.write_file_information_json')
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.objects')
     def test_export_data_process__raise_task_aborted(
             self, mock_export_data, mock_extract_json):
         mock_export_data.filter.return_value.first.return_value = self.export_data
         mock_export_data.filter.return_value.exists.return_value = True
         mock_export_data.get.return_value = self.export_data
-        export_data_json = file_info_json = {}
+        export_data_json = {}
 
-        def do_something():
+        def do_something(*args, **kwargs):
             _task = AbortableAsyncResult(self.task.request.id)
             _task.abort()
-            return export_data_json, file_info_json
+            return export_data_json, []
 
         mock_extract_json.side_effect = do_something
 
@@ -575,7 +714,7 @@ class TestExportDataProcess(unittest.TestCase):
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.delete_export_data_folder')
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.create_export_data_files_folder')
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.create_export_data_folder')
-    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.extract_file_information_json_from_source_storage')
+    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.write_file_information_json')
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.objects')
     def test_export_data_process__rollback_raise(
             self, mock_export_data,
@@ -587,8 +726,8 @@ class TestExportDataProcess(unittest.TestCase):
         mock_export_data.filter.return_value.first.return_value = self.export_data
         mock_export_data.filter.return_value.exists.return_value = True
         mock_export_data.get.return_value = self.export_data
-        export_data_json = file_info_json = {}
-        mock_extract_json.return_value = export_data_json, file_info_json
+        export_data_json = {}
+        mock_extract_json.return_value = export_data_json, []
         mock_create_export_data_folder.return_value.status_code = status.HTTP_201_CREATED
         mock_create_export_data_files_folder.return_value.status_code = status.HTTP_400_BAD_REQUEST
         mock_delete_export_data_folder.return_value.status_code = status.HTTP_204_NO_CONTENT
@@ -619,7 +758,7 @@ class TestExportDataProcess(unittest.TestCase):
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.get_source_file_versions_min')
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.create_export_data_files_folder')
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.create_export_data_folder')
-    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.extract_file_information_json_from_source_storage')
+    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.write_file_information_json')
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.objects')
     def test_export_data_process__return_completed(
             self, mock_export_data,
@@ -654,8 +793,7 @@ class TestExportDataProcess(unittest.TestCase):
             'size': 0,
             'file_path': self.export_data.get_file_info_file_path(),
         }
-        file_info_json = {}
-        mock_extract_json.return_value = export_data_json, file_info_json
+        mock_extract_json.return_value = export_data_json, []
         mock_create_export_data_folder.return_value.status_code = status.HTTP_201_CREATED
         mock_create_export_data_files_folder.return_value.status_code = status.HTTP_201_CREATED
         file_versions = []
@@ -690,7 +828,7 @@ class TestExportDataProcess(unittest.TestCase):
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.get_source_file_versions_min')
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.create_export_data_files_folder')
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.create_export_data_folder')
-    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.extract_file_information_json_from_source_storage')
+    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.write_file_information_json')
     @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.objects')
     def test_export_data_process__connection_timeout(
             self, mock_export_data,
@@ -724,8 +862,7 @@ class TestExportDataProcess(unittest.TestCase):
             'size': 0,
             'file_path': self.export_data.get_file_info_file_path(),
         }
-        file_info_json = {}
-        mock_extract_json.return_value = export_data_json, file_info_json
+        mock_extract_json.return_value = export_data_json, []
         mock_create_export_data_folder.return_value.status_code = status.HTTP_201_CREATED
         mock_create_export_data_files_folder.return_value.status_code = status.HTTP_201_CREATED
         file_versions = []
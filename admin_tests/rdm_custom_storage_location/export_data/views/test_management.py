@@ -11,7 +11,7 @@ from nose import tools as nt
 
 from admin.rdm_custom_storage_location.export_data.views import management
 from admin_tests.utilities import setup_view
-from osf.models import ExportData, ExportDataRestore
+from osf.models import ExportData, ExportDataCopiedFile, ExportDataRestore
 from osf_tests.factories import (
     AuthUserFactory,
     InstitutionFactory,
@@ -1029,6 +1029,46 @@ class TestDeleteExportDataView(AdminTestCase):
         res = view.post(request)
         nt.assert_equal(res.status_code, 400)
 
+    @mock.patch(f'{MANAGEMENT_EXPORT_DATA_PATH}.ExportData.objects')
+    @mock.patch('osf.models.export_data.requests')
+    @mock.patch(f'{MANAGEMENT_EXPORT_DATA_PATH}.render_bad_request_response')
+    def test_delete_permanently_data_files_taken_over(self, mock_render, mock_request, mock_export_data):
+        later_export_data = ExportDataFactory(source=self.export_data.source, location=self.export_data.location)
+        ExportDataCopiedFile.objects.create(
+            export_data=later_export_data, file_name='hash1', stored_in=self.export_data)
+        mock_render.return_value = HttpResponseBadRequest(content='fake')
+        mock_export_data.filter.return_value = [self.export_data]
+        request = RequestFactory().post('/fake_path')
+        request.user = self.user
+        request.COOKIES = '213919sdasdn823193929'
+        request.POST = {'list_id_export_data': '3#', 'delete_permanently': 'on',
+                         'selected_source_id': '100', 'selected_location_id': '100'}
+        view = setup_view(self.view, request)
+        res = view.post(request)
+        nt.assert_equal(res.status_code, 400)
+        mock_request.delete.assert_not_called()
+
+    @mock.patch(f'{MANAGEMENT_EXPORT_DATA_PATH}.ExportData.objects')
+    @mock.patch('osf.models.export_data.requests')
+    @mock.patch(f'{MANAGEMENT_EXPORT_DATA_PATH}.render_bad_request_response')
+    def test_delete_permanently_validates_all_before_deleting(self, mock_render, mock_request, mock_export_data):
+        later_export_data = ExportDataFactory(source=self.export_data.source, location=self.export_data.location)
+        ExportDataCopiedFile.objects.create(
+            export_data=later_export_data, file_name='hash1', stored_in=self.export_data)
+        mock_render.return_value = HttpResponseBadRequest(content='fake')
+        # The export data that can be deleted comes first
+        mock_export_data.filter.return_value = [self.export_data_01, self.export_data]
+        mock_request.delete.return_value = JsonResponse({'message': ''}, status=204)
+        request = RequestFactory().post('/fake_path')
+        request.user = self.user
+        request.COOKIES = '213919sdasdn823193929'
+        request.POST = {'list_id_export_data': '3#4#', 'delete_permanently': 'on',
+                         'selected_source_id': '100', 'selected_location_id': '100'}
+        view = setup_view(self.view, request)
+        res = view.post(request)
+        nt.assert_equal(res.status_code, 400)
+        mock_request.delete.assert_not_called()
+
     def test_delete_not_permanently(self):
         request = RequestFactory().post('/fake_path')
         request.user = self.user
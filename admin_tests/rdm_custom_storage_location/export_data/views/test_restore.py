@@ -1,4 +1,5 @@
 import json
+from urllib.parse import urlencode
 
 import mock
 import pytest
@@ -6,7 +7,8 @@ import requests
 from celery import states
 from celery.contrib.abortable import AbortableTask, AbortableAsyncResult
 from celery.utils.threads import LocalStack
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
 from nose import tools as nt
 from rest_framework import status
 from rest_framework.response import Response
@@ -15,7 +17,7 @@ from rest_framework.test import APIRequestFactory
 from admin.rdm_custom_storage_location.export_data.views import restore
 from admin.rdm_custom_storage_location.export_data.views.restore import ProcessError
 from framework.celery_tasks import app as celery_app
-from osf.models import RdmFileTimestamptokenVerifyResult, ExportData, ExportDataRestore, FileVersion
+from osf.models import RdmFileTimestamptokenVerifyResult, ExportData, ExportDataRestore, ExportDataRestoredFile, FileVersion, Tag
 from osf_tests.factories import (
     AuthUserFactory,
     ExportDataFactory,
@@ -563,6 +565,11 @@ class TestRestoreDataFunction(AdminTestCase):
         self.bulk_mount_data_restore = ExportDataRestoreFactory.create(destination=bulkmount_region)
         self.user = UserFactory()
 
+        # copy files in the test thread, the mocked copies below create file nodes in DB
+        max_workers_patcher = mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.admin_settings.EXPORT_DATA_RESTORE_MAX_WORKERS', 1)
+        max_workers_patcher.start()
+        self.addCleanup(max_workers_patcher.stop)
+
     # check_before_restore_export_data
     @mock.patch(f'{EXPORT_DATA_UTIL_PATH}.get_file_data')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.read_file_info_and_check_schema')
@@ -731,6 +738,23 @@ class TestRestoreDataFunction(AdminTestCase):
                 nt.assert_equal(response.data, {'task_id': FAKE_TASK_ID})
                 nt.assert_equal(response.status_code, status.HTTP_200_OK)
 
+    def test_prepare_for_restore_export_data_process_resume_stopped_restore(self):
+        stopped_restore = ExportDataRestoreFactory.create(
+            export=self.export_data, destination=self.region,
+            status=ExportData.STATUS_STOPPED, process_step=2)
+        mock_task = mock.MagicMock()
+        mock_task.return_value = AbortableAsyncResult(FAKE_TASK_ID)
+        with mock.patch(f'{EXPORT_DATA_UTIL_PATH}.check_for_any_running_restore_process', return_value=False):
+            with mock.patch(f'{EXPORT_DATA_TASK_PATH}.run_restore_export_data_process.delay', mock_task):
+                response = self.view.prepare_for_restore_export_data_process(None, self.export_data.id,
+                                                                             self.region.id, [], self.user)
+        nt.assert_equal(response.status_code, status.HTTP_200_OK)
+        nt.assert_equal(mock_task.call_args[0][2], stopped_restore.pk)
+        nt.assert_equal(ExportDataRestore.objects.filter(export=self.export_data, destination=self.region).count(), 1)
+        stopped_restore.reload()
+        nt.assert_equal(stopped_restore.status, ExportData.STATUS_RUNNING)
+        nt.assert_equal(stopped_restore.creator, self.user)
+
     # restore_export_data_process
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.create_folder_in_destination')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_tag_and_timestamp_to_database')
@@ -759,6 +783,32 @@ class TestRestoreDataFunction(AdminTestCase):
         mock_copy_to_destination.assert_called()
         mock_add_tag_and_timestamp.assert_called()
 
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.create_folder_in_destination')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_tag_and_timestamp_to_database')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.copy_files_from_export_data_to_destination')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.move_all_files_to_backup_folder')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.check_if_restore_process_stopped')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.read_file_info_and_check_schema')
+    def test_restore_export_data_process_resume(self, mock_read_file_info, mock_check_process, mock_move_to_backup,
+                                                mock_copy_to_destination, mock_add_tag_and_timestamp, mock_create_folder_path):
+        task = AbortableTask()
+        task.request_stack = LocalStack()
+        task.request.id = FAKE_TASK_ID
+
+        mock_read_file_info.return_value = {'folders': [{'project': {'id': 1}}], 'files': [{'project': {'id': 1}}]}
+        mock_copy_to_destination.return_value = [[], []]
+        self.addon_data_restore.update(process_step=2)
+
+        self.view.restore_export_data_process(task, {}, self.addon_data_restore.export.id,
+                                              self.addon_data_restore.id, ['vcu'])
+        # the backup folder is made by the stopped restore process
+        mock_move_to_backup.assert_not_called()
+        mock_copy_to_destination.assert_called()
+        mock_add_tag_and_timestamp.assert_called()
+        self.addon_data_restore.reload()
+        nt.assert_equal(self.addon_data_restore.process_step, 4)
+        nt.assert_equal(self.addon_data_restore.status, ExportData.STATUS_COMPLETED)
+
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.create_folder_in_destination')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_tag_and_timestamp_to_database')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.copy_files_from_export_data_to_destination')
@@ -905,47 +955,6 @@ class TestRestoreDataFunction(AdminTestCase):
         task.request.id = FAKE_TASK_ID + '1'
         nt.assert_is_none(self.view.check_if_restore_process_stopped(task, 1))
 
-    # add_tags_to_file_node
-    def test_add_tags_to_file_node_empty_tags(self):
-        node = OsfStorageFileFactory()
-        clone_node = node.clone()
-        self.view.add_tags_to_file_node(node, [])
-        nt.assert_equal(node.tags.count(), 0)
-        nt.assert_not_equal(clone_node, node)
-
-    def test_add_tags_to_file_node_with_tags(self):
-        tags = ['tag1', 'tag2']
-        node = OsfStorageFileFactory()
-        clone_node = node.clone()
-        self.view.add_tags_to_file_node(node, tags)
-        nt.assert_not_equal(clone_node, node)
-        nt.assert_equal(node.tags.count(), 2)
-
-    # add_timestamp_to_file_node
-    def test_add_timestamp_to_file_node_missing_args(self):
-        add_result = self.view.add_timestamp_to_file_node(None, None, None)
-        nt.assert_is_none(add_result)
-
-    def test_add_timestamp_to_file_node_existing_timestamp(self):
-        node = OsfStorageFileFactory()
-        project_id = 1
-        timestamp = {
-            'key_file_name': 'mocked.txt'
-        }
-        result = RdmFileTimestamptokenVerifyResult()
-        result.save()
-        add_result = self.view.add_timestamp_to_file_node(node, project_id, timestamp)
-        nt.assert_is_none(add_result)
-
-    def test_add_timestamp_to_file_node_new_timestamp(self):
-        node = OsfStorageFileFactory()
-        project_id = 1
-        timestamp = {
-            'key_file_name': 'mocked.txt'
-        }
-        add_result = self.view.add_timestamp_to_file_node(node, project_id, timestamp)
-        nt.assert_is_none(add_result)
-
     # read_export_data_and_check_schema
     def test_read_export_data_and_check_schema_valid_file(self):
         test_response = requests.Response()
@@ -1194,6 +1203,40 @@ class TestRestoreDataFunction(AdminTestCase):
         mock_create_folder.assert_called()
         nt.assert_equal(result, None)
 
+    @mock.patch(f'{EXPORT_DATA_UTIL_PATH}.create_folder_path')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.check_if_restore_process_stopped')
+    def test_create_folder_in_destination_parent_folders_first(self, mock_check_progress, mock_create_folder):
+        export_data_folder = [
+            {'materialized_path': path, 'project': {'id': 'pmockt'}}
+            for path in ['/a/b/c/', '/a/', '/b/', '/a/b/', '/b/c/']
+        ]
+        task = AbortableTask()
+        task.request_stack = LocalStack()
+        task.request.id = FAKE_TASK_ID
+
+        with mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.admin_settings.EXPORT_DATA_RESTORE_MAX_WORKERS', 3):
+            self.view.create_folder_in_destination(task, 1, export_data_folder, self.addon_data_restore, None)
+        created_paths = [call[0][2] for call in mock_create_folder.call_args_list]
+        nt.assert_equal(sorted(created_paths), sorted(folder['materialized_path'] for folder in export_data_folder))
+        nt.assert_equal(sorted(created_paths[:2]), ['/a/', '/b/'])
+        nt.assert_equal(sorted(created_paths[2:4]), ['/a/b/', '/b/c/'])
+        nt.assert_equal(created_paths[4], '/a/b/c/')
+
+    # run_in_workers
+    def test_run_in_workers(self):
+        check_abort_task = mock.MagicMock()
+        results = dict(self.view.run_in_workers(lambda item: item * 2, range(10), check_abort_task, max_workers=3))
+        nt.assert_equal(results, {item: item * 2 for item in range(10)})
+        nt.assert_equal(check_abort_task.call_count, 10)
+
+    def test_run_in_workers_aborted(self):
+        check_abort_task = mock.MagicMock()
+        check_abort_task.side_effect = [None, None, ProcessError('Mock test abort process')]
+        func = mock.MagicMock(return_value=None)
+        with nt.assert_raises(ProcessError):
+            list(self.view.run_in_workers(func, range(10), check_abort_task, max_workers=3))
+        nt.assert_true(func.call_count <= 2)
+
     # copy_files_from_export_data_to_destination
     @mock.patch(f'{EXPORT_DATA_UTIL_PATH}.copy_file_from_location_to_destination')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.generate_new_file_path')
@@ -1526,54 +1569,146 @@ class TestRestoreDataFunction(AdminTestCase):
                     None)
                 nt.assert_equal(result, None)
 
+    @mock.patch(f'{EXPORT_DATA_UTIL_PATH}.copy_file_from_location_to_destination')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.check_if_restore_process_stopped')
+    def test_copy_files_from_export_data_to_destination_with_workers(self, mock_check_progress, mock_copy):
+        export_files = []
+        for file_id in range(1, 7):
+            export_file = json.loads(json.dumps(self.test_export_data_files[0]))
+            export_file['id'] = file_id
+            export_file['materialized_path'] = f'/file_{file_id}.txt'
+            export_file['version'].append(dict(export_file['version'][0], identifier='2'))
+            export_files.append(export_file)
+
+        task = AbortableTask()
+        task.request_stack = LocalStack()
+        task.request.id = FAKE_TASK_ID
+
+        # the copy of file 3 fails
+        def copy_file(export_data, project_id, provider, location_file_path, destination_file_path, *args, **kwargs):
+            if destination_file_path == '/file_3.txt':
+                return None
+            return {'data': {'id': 'box/fake_id'}}
+        mock_copy.side_effect = copy_file
+
+        with mock.patch(f'{EXPORT_DATA_UTIL_PATH}.is_add_on_storage', return_value=False):
+            with mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.admin_settings.EXPORT_DATA_RESTORE_MAX_WORKERS', 3):
+                result = self.view.copy_files_from_export_data_to_destination(task, 1, export_files,
+                                                                              self.bulk_mount_data_restore, None)
+        nt.assert_equal(mock_copy.call_count, 12)
+        nt.assert_equal(mock_check_progress.call_count, 6)
+        nt.assert_equal(result[0], [])
+        nt.assert_equal([file['id'] for file in result[1]], [3])
+        restored_files = self.bulk_mount_data_restore.restored_files.values_list('file_id', 'version_id')
+        nt.assert_equal(
+            sorted(restored_files),
+            [(file_id, version_id) for file_id in [1, 2, 4, 5, 6] for version_id in ['1', '2']])
+
+    @mock.patch(f'{EXPORT_DATA_UTIL_PATH}.copy_file_from_location_to_destination')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.check_if_restore_process_stopped')
+    def test_copy_files_from_export_data_to_destination_resume(self, mock_check_progress, mock_copy):
+        export_files = self.test_export_data_files
+        export_files[0]['version'].append(dict(export_files[0]['version'][0], identifier='2'))
+        node = OsfStorageFileFactory()
+        ExportDataRestoredFile.objects.create(export_data_restore=self.bulk_mount_data_restore,
+                                              file_id=995, version_id='1', file_node=node)
+
+        task = AbortableTask()
+        task.request_stack = LocalStack()
+        task.request.id = FAKE_TASK_ID
+        mock_copy.return_value = {'data': {'id': 'box/fake_id'}}
+
+        with mock.patch(f'{EXPORT_DATA_UTIL_PATH}.is_add_on_storage', return_value=False):
+            result = self.view.copy_files_from_export_data_to_destination(task, 1, export_files,
+                                                                          self.bulk_mount_data_restore, None)
+        # only the version which is not restored yet is copied
+        mock_copy.assert_called_once()
+        nt.assert_equal([item['node'] for item in result[0]], [node])
+        nt.assert_equal(result[0][0]['file_tags'], ['hello', 'world'])
+        nt.assert_equal(self.bulk_mount_data_restore.restored_files.count(), 2)
+
     # add_tag_and_timestamp_to_database
-    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_timestamp_to_file_node')
-    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_tags_to_file_node')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.check_if_restore_process_stopped')
-    def test_add_tag_and_timestamp_to_database(self, mock_check_process, mock_add_tags, mock_add_timestamp):
+    def test_add_tag_and_timestamp_to_database(self, mock_check_process):
         task = AbortableTask()
         task.request_stack = LocalStack()
         task.request.id = FAKE_TASK_ID
+        node_1 = OsfStorageFileFactory()
+        node_2 = OsfStorageFileFactory()
+        node_2.tags.add(Tag.objects.create(name='tag1'))
+        source_timestamp = RdmFileTimestamptokenVerifyResult.objects.create(
+            file_id='source_file', project_id=self.project_id, key_file_name='source.txt',
+            timestamp_token=b'token', inspection_result_status=1)
+        existing_timestamp = RdmFileTimestamptokenVerifyResult.objects.create(
+            file_id=node_2._id, project_id=self.project_id, key_file_name='old.txt')
         list_file_nodes = [
             {
-                'node': 1,
+                'node': node_1,
                 'file_tags': ['tag1', 'tag2'],
-                'file_timestamp': {},
+                'file_timestamp': {'timestamp_id': source_timestamp.id, 'key_file_name': 'new.txt'},
                 'project_id': self.project_id
             },
             {
-                'node': 2,
-                'file_tags': ['tag1'],
-                'file_timestamp': {},
+                'node': node_2,
+                'file_tags': ['tag1', 'tag3'],
+                'file_timestamp': {'key_file_name': 'new.txt', 'inspection_result_status': 1},
                 'project_id': self.project_id
             }
         ]
 
-        mock_check_process.return_value = None
-        mock_add_tags.return_value = None
-        mock_add_timestamp.return_value = None
-
         self.view.add_tag_and_timestamp_to_database(task, 1, list_file_nodes)
-        nt.assert_equal(mock_check_process.call_count, 3)
-        nt.assert_equal(mock_add_tags.call_count, 2)
-        nt.assert_equal(mock_add_timestamp.call_count, 2)
+        mock_check_process.assert_called_once()
+        nt.assert_equal(sorted(node_1.tags.values_list('name', flat=True)), ['tag1', 'tag2'])
+        nt.assert_equal(sorted(node_2.tags.values_list('name', flat=True)), ['tag1', 'tag3'])
+
+        new_timestamp = RdmFileTimestamptokenVerifyResult.objects.get(file_id=node_1._id)
+        nt.assert_equal(bytes(new_timestamp.timestamp_token), b'token')
+        nt.assert_equal(new_timestamp.key_file_name, 'new.txt')
+        existing_timestamp.reload()
+        nt.assert_equal(existing_timestamp.key_file_name, 'new.txt')
+        nt.assert_equal(existing_timestamp.inspection_result_status, 1)
 
-    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_timestamp_to_file_node')
-    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_tags_to_file_node')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.check_if_restore_process_stopped')
-    def test_add_tag_and_timestamp_to_database_empty_nodes(self, mock_check_process, mock_add_tags, mock_add_timestamp):
+    def test_add_tag_and_timestamp_to_database_query_count(self, mock_check_process):
         task = AbortableTask()
         task.request_stack = LocalStack()
         task.request.id = FAKE_TASK_ID
 
-        mock_check_process.return_value = None
-        mock_add_tags.return_value = None
-        mock_add_timestamp.return_value = None
+        def count_queries(number_of_nodes):
+            list_file_nodes = [
+                {
+                    'node': OsfStorageFileFactory(),
+                    'file_tags': ['tag1', f'tag{number_of_nodes}'],
+                    'file_timestamp': {'key_file_name': 'mocked.txt'},
+                    'project_id': self.project_id
+                } for _ in range(number_of_nodes)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                self.view.add_tag_and_timestamp_to_database(task, 1, list_file_nodes)
+            return len(queries)
+
+        nt.assert_equal(count_queries(2), count_queries(10))
 
-        self.view.add_tag_and_timestamp_to_database(task, 1, [])
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.check_if_restore_process_stopped')
+    def test_add_tag_and_timestamp_to_database_empty_nodes(self, mock_check_process):
+        task = AbortableTask()
+        task.request_stack = LocalStack()
+        task.request.id = FAKE_TASK_ID
+
+        mock_check_process.return_value = None
+        tag_count = Tag.all_tags.count()
+        timestamp_count = RdmFileTimestamptokenVerifyResult.objects.count()
+
+        with mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.bulk_add_tags_to_file_nodes',
+                        wraps=self.view.bulk_add_tags_to_file_nodes) as mock_add_tags, \
+                mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.bulk_add_timestamps_to_file_nodes',
+                           wraps=self.view.bulk_add_timestamps_to_file_nodes) as mock_add_timestamps:
+            self.view.add_tag_and_timestamp_to_database(task, 1, [])
         mock_check_process.assert_called_once()
-        mock_add_tags.assert_not_called()
-        mock_add_timestamp.assert_not_called()
+        mock_add_tags.assert_called_once_with([])
+        mock_add_timestamps.assert_called_once_with([])
+        nt.assert_equal(Tag.all_tags.count(), tag_count)
+        nt.assert_equal(RdmFileTimestamptokenVerifyResult.objects.count(), timestamp_count)
 
     # restore_export_data_rollback_process
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.move_all_files_from_backup_folder_to_root')
@@ -1912,6 +2047,46 @@ class TestStopRestoreDataActionView(AdminTestCase):
         nt.assert_equal(response.data, {'task_id': self.new_task_id})
         nt.assert_equal(response.status_code, status.HTTP_200_OK)
 
+    @mock.patch(f'{EXPORT_DATA_TASK_PATH}.run_restore_export_data_rollback_process.delay')
+    def test_post_keep_progress(self, mock_rollback_process):
+        self.task.update_state(state=states.PENDING, meta={'current_restore_step': 2})
+        # Same form encoded payload as the stop button of the restore page
+        request = APIRequestFactory().post('stop_restore_export_data', urlencode({
+            'task_id': FAKE_TASK_ID,
+            'destination_id': self.export_data_restore.destination.id,
+            'keep_progress': 'true',
+        }), content_type='application/x-www-form-urlencoded')
+        request.user = AuthUserFactory()
+
+        self.view.export_data_restore = self.export_data_restore
+        self.view.export_id = self.export_data_restore.export.id
+        self.view.task_id = FAKE_TASK_ID
+        response = self.view.post(request)
+        mock_rollback_process.assert_not_called()
+        nt.assert_equal(response.data, {'message': 'Stop restore data successfully.'})
+        nt.assert_equal(response.status_code, status.HTTP_200_OK)
+        self.export_data_restore.reload()
+        nt.assert_equal(self.export_data_restore.status, ExportData.STATUS_STOPPED)
+
+    @mock.patch(f'{EXPORT_DATA_TASK_PATH}.run_restore_export_data_rollback_process.delay')
+    def test_post_keep_progress_false(self, mock_rollback_process):
+        self.task.update_state(state=states.PENDING, meta={'current_restore_step': 2})
+        request = APIRequestFactory().post('stop_restore_export_data', urlencode({
+            'task_id': FAKE_TASK_ID,
+            'destination_id': self.export_data_restore.destination.id,
+            'keep_progress': 'false',
+        }), content_type='application/x-www-form-urlencoded')
+        request.user = AuthUserFactory()
+
+        mock_rollback_process.return_value = self.new_task
+        self.view.export_data_restore = self.export_data_restore
+        self.view.export_id = self.export_data_restore.export.id
+        self.view.task_id = FAKE_TASK_ID
+        response = self.view.post(request)
+        mock_rollback_process.assert_called()
+        nt.assert_equal(response.data, {'task_id': self.new_task_id})
+        nt.assert_equal(response.status_code, status.HTTP_200_OK)
+
     @mock.patch(f'{EXPORT_DATA_TASK_PATH}.run_restore_export_data_rollback_process.delay')
     def test_post_restore_data_not_found(self, mock_rollback_process):
         request = APIRequestFactory().post('stop_restore_export_data', {
@@ -1,10 +1,12 @@
 import json
 from nose import tools as nt
 
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import RequestFactory
 
 from tests.base import AdminTestCase
 from osf_tests.factories import AuthUserFactory
+from addons.metadata.models import ERadRecord
 
 
 from admin.rdm_metadata import views
@@ -69,6 +71,28 @@ class TestRecords(AdminTestCase):
         nt.assert_equal(res.status_code, 200)
         nt.assert_equal(res.content, b'{"status": "OK", "records": 10}')
 
+    def test_post_uploaded_files(self, *args, **kwargs):
+        data = '\ufeff' + '\t'.join(erad.ERAD_COLUMNS) + '\n'
+        for row in range(10):
+            data += '\t'.join(['値{}-{}'.format(row, i) if col != 'NENDO' else '2022'
+                               for i, col in enumerate(erad.ERAD_COLUMNS)]) + '\n'
+        request = RequestFactory().post(
+            self.request_url,
+            data={
+                'files': [
+                    SimpleUploadedFile('valid_data.tsv', data.encode('utf-8')),
+                    SimpleUploadedFile('other_data.tsv', data.encode('utf-8')),
+                ],
+            },
+        )
+        view = views.ERadRecords()
+        view = setup_user_view(view, request, user=self.user)
+        res = view.post(request, *args, **kwargs)
+        nt.assert_equal(res.status_code, 200)
+        nt.assert_equal(res.content, b'{"status": "OK", "records": 20}')
+        record = ERadRecord.objects.get(recordset__code='valid_data', kenkyusha_no='値0-0')
+        nt.assert_equal(record.nendo, 2022)
+
     def test_post_bad_data(self, *args, **kwargs):
         request = RequestFactory().post(
             self.request_url,
@@ -90,3 +114,60 @@ class TestRecords(AdminTestCase):
             res.content,
             b'{"status": "error", "message": "Column \\"KENKYUSHA_NO\\" not exists (record=0)"}'
         )
+
+
+class TestImportRecords(AdminTestCase):
+    def rows(self, numbers, kadai_mei='kadai'):
+        return [
+            dict([(col, 'value{}-{}'.format(row, i)) for i, col in enumerate(erad.ERAD_COLUMNS)] + [
+                ('NENDO', '2022'),
+                ('KADAI_MEI', '{}{}'.format(kadai_mei, row)),
+            ])
+            for row in numbers
+        ]
+
+    def records(self):
+        return {
+            record.kenkyusha_no: record
+            for record in ERadRecord.objects.filter(recordset__code='test')
+        }
+
+    def test_import_in_chunks(self):
+        rows = self.rows(range(10))
+        # A later row of the same record wins
+        rows.append(dict(rows[0], KADAI_MEI='updated'))
+
+        nt.assert_equal(erad.import_records('test', iter(rows), chunk_size=3), 11)
+
+        records = self.records()
+        nt.assert_equal(len(records), 10)
+        nt.assert_equal(records['value0-0'].kadai_mei, 'updated')
+        nt.assert_equal(records['value0-0'].nendo, 2022)
+        nt.assert_equal(records['value1-0'].kadai_mei, 'kadai1')
+
+    def test_reimport_marks_removed_records(self):
+        erad.import_records('test', self.rows(range(5)), chunk_size=2)
+        created = self.records()['value0-0'].created
+
+        nt.assert_equal(erad.import_records('test', self.rows(range(3), kadai_mei='new'), chunk_size=2), 3)
+
+        records = self.records()
+        nt.assert_equal(len(records), 5)
+        nt.assert_equal(records['value0-0'].kadai_mei, 'new0')
+        nt.assert_equal(records['value0-0'].created, created)
+        nt.assert_is_none(records['value2-0'].removed)
+        nt.assert_is_not_none(records['value3-0'].removed)
+        nt.assert_is_not_none(records['value4-0'].removed)
+
+        # Records back in the data are not removed anymore
+        erad.import_records('test', self.rows(range(5)))
+        nt.assert_true(all(record.removed is None for record in self.records().values()))
+
+    def test_invalid_row_imports_nothing(self):
+        rows = self.rows(range(3))
+        rows[2]['NENDO'] = ''
+
+        with nt.assert_raises(ValueError):
+            erad.import_records('test', rows, chunk_size=1)
+
+        nt.assert_equal(self.records(), {})
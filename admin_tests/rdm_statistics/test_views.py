@@ -22,7 +22,7 @@ import os
 import uuid
 import shutil
 import json
-from osf.models import OSFUser
+from osf.models import OSFUser, RdmStatistics
 
 
 class TestInstitutionListViewStat(AdminTestCase):
@@ -425,6 +425,44 @@ class TestGatherView(AdminTestCase):
         resp = json.loads(self.view.get(self, self.request, self.view.args, self.view.kwargs).content)
         nt.assert_equal(len(resp), 2)
 
+    @patch('admin.rdm_statistics.views.requests.Session.get', side_effect=mocked_requests_get)
+    def test_get_database_mode(self, *args, **kwargs):
+        request = RequestFactory().get('/fake_path', {'mode': views.GATHER_MODE_DATABASE})
+        view = setup_user_view(views.GatherView(), request, user=self.user)
+        view.kwargs = self.view.kwargs
+        resp = json.loads(view.get(request).content)
+        nt.assert_in([self.institution1.name, self.project._id, 'osfstorage'], resp)
+        # osfstorage files are counted in database
+        stat = RdmStatistics.objects.get(project=self.project, provider='osfstorage')
+        nt.assert_equal(stat.extention_type, 'unknown')
+        nt.assert_equal(stat.subtotal_file_number, 1)
+        nt.assert_equal(stat.subtotal_file_size, 1337)
+        nt.assert_equal(stat.owner, self.user)
+        nt.assert_equal(stat.institution, self.institution1)
+        nt.assert_equal(stat.storage_account_id, self.project._id)
+
+        # gathering again on the same day updates the statistics
+        create_test_file(node=self.project, user=self.user, filename='other_file.some_extension')
+        view.get(request)
+        stat = RdmStatistics.objects.get(project=self.project, provider='osfstorage')
+        nt.assert_equal(stat.subtotal_file_number, 2)
+        nt.assert_equal(stat.subtotal_file_size, 1337 * 2)
+
+    @patch('admin.rdm_statistics.views.requests.Session.get', side_effect=mocked_requests_get)
+    def test_gather_from_database_extensions(self, *args, **kwargs):
+        names = ['a.txt', 'b.TXT', '.bashrc', 'c.tar.gz', 'd.', 'noext', '..e.csv', 'f..csv']
+        for name in names:
+            create_test_file(node=self.project, user=self.user, filename=name)
+        expected = {}
+        for name in names + ['some_file.some_extension']:
+            ext = views.get_statistics_extension(os.path.splitext(name)[1])
+            expected[ext] = expected.get(ext, 0) + 1
+
+        self.view.session = views.requests.Session()
+        self.view.gather_from_database(views.get_current_date())
+        stats = RdmStatistics.objects.filter(project=self.project, provider='osfstorage')
+        nt.assert_equal({stat.extention_type: stat.subtotal_file_number for stat in stats}, expected)
+
     def test_send_stat_mail(self, *args, **kwargs):
         nt.assert_equal(views.send_stat_mail(self.request).status_code, 200)
 
@@ -564,12 +564,25 @@ class RelationshipField(ser.HyperlinkedIdentityField):
         self_view_kwargs={'node_id': '<node._id>'},
         filter={'target': '<_id>'})
     )
+
+    Field can declare a ``bulk_loader`` used when the relationship is embedded in a list
+    response. It is called once per page with ``(items, request)`` and returns a dict of
+    ``{item.pk: related object}``; the embedded views then reuse those objects instead of
+    loading them one item at a time. Items missing from the dict (or mapped to None) are
+    loaded by the embedded view as usual. ::
+
+        parent = RelationshipField(
+            related_view='nodes:node-detail',
+            related_view_kwargs={'node_id': '<parent_id>'},
+            bulk_loader=load_parent_nodes,
+        )
     """
     json_api_link = True  # serializes to a links object
 
     def __init__(
         self, related_view=None, related_view_kwargs=None, self_view=None, self_view_kwargs=None,
-        self_meta=None, related_meta=None, always_embed=False, filter=None, filter_key=None, required=False, **kwargs
+        self_meta=None, related_meta=None, always_embed=False, filter=None, filter_key=None, required=False,
+        bulk_loader=None, **kwargs
     ):
         related_view = related_view
         self_view = self_view
@@ -582,6 +595,7 @@ class RelationshipField(ser.HyperlinkedIdentityField):
         self.always_embed = always_embed
         self.filter = filter
         self.filter_key = filter_key
+        self.bulk_loader = bulk_loader
 
         assert (related_view is not None or self_view is not None), 'Self or related view must be specified.'
         if related_view:
@@ -321,6 +321,26 @@ NPLUSONE_RAISE = False
 # Timestamp - number of requests to send to cloud storages per minute
 TS_REQUESTS_PER_MIN = 30
 
+# Timestamp - number of verify results resolved per page of the error list
+TS_ERROR_LIST_PAGE_SIZE = 500
+
+# Timestamp - concurrent WaterButler folder listings and BaseFileNode upsert batch size
+TS_CRAWLER_MAX_WORKERS = 8
+TS_CRAWLER_BATCH_SIZE = 100
+
+# Timestamp - verify/add runs are split into at most this many concurrent shards per node,
+# each holding at least TS_SHARD_MIN_FILES files. The shards share TS_REQUESTS_PER_MIN.
+# Sharding plans over the whole file list, so a sharded verify run waits for the crawl to
+# finish; with 1, files are verified as the crawler finds them.
+TS_MAX_SHARDS_PER_NODE = 1
+TS_SHARD_MIN_FILES = 50
+# Timestamp - seconds after which the checkpoint of an interrupted run is no longer resumed
+TS_CHECKPOINT_EXPIRATION = 60 * 60 * 24
+# Timestamp - the checkpoint is saved every TS_CHECKPOINT_FILES processed files or every
+# TS_CHECKPOINT_INTERVAL seconds, whichever comes first
+TS_CHECKPOINT_FILES = 50
+TS_CHECKPOINT_INTERVAL = 30
+
 # salt used for generating hashids
 HASHIDS_SALT = 'pinkhimalayan'
 
@@ -336,6 +356,8 @@ ELASTICSEARCH_METRICS_DATE_FORMAT = '%Y'
 
 WAFFLE_CACHE_NAME = 'waffle_cache'
 STORAGE_USAGE_CACHE_NAME = 'storage_usage'
+WATERBUTLER_AUTH_CACHE_NAME = 'waterbutler_auth'
+WATERBUTLER_AUTH_GENERATION_CACHE_NAME = 'waterbutler_auth_generation'
 
 
 CACHES = {
@@ -349,6 +371,15 @@ CACHES = {
     WAFFLE_CACHE_NAME: {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     },
+    WATERBUTLER_AUTH_CACHE_NAME: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': WATERBUTLER_AUTH_CACHE_NAME,
+    },
+    # Shared by all processes so that invalidating the WaterButler auth cache reaches every worker
+    WATERBUTLER_AUTH_GENERATION_CACHE_NAME: {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'osf_cache_table',
+    },
 }
 
 SLOAN_ID_COOKIE_NAME = 'sloan_id'
@@ -500,3 +531,7 @@ WARNING_THRESHOLD = 0.9
 BASE_FOR_METRIC_PREFIX = 1000
 SIZE_UNIT_GB = BASE_FOR_METRIC_PREFIX ** 3
 NII_STORAGE_REGION_ID = 1
+# Users per batch of the all-users quota recalculation job
+QUOTA_RECALC_BATCH_SIZE = 500
+# Seconds without progress after which an unfinished job is resumed anew
+QUOTA_RECALC_STALE_TIMEOUT = 60 * 30
@@ -5,6 +5,7 @@ from future.moves.urllib.parse import urlunsplit, urlsplit, parse_qs, urlencode
 from distutils.version import StrictVersion
 from hashids import Hashids
 
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import QuerySet, F
 from rest_framework.exceptions import NotFound
@@ -16,7 +17,7 @@ from api.base.settings import HASHIDS_SALT
 from framework.auth import Auth
 from framework.auth.cas import CasResponse
 from framework.auth.oauth_scopes import ComposedScopes, normalize_scopes
-from osf.models import OSFUser, Node, Registration
+from osf.models import AbstractNode, OSFUser, Node, Registration
 from osf.models.base import GuidMixin
 from osf.utils.requests import check_select_for_update
 from website import settings as website_settings
@@ -146,6 +147,71 @@ def default_node_list_queryset(model_cls):
     assert model_cls in {Node, Registration}
     return model_cls.objects.filter(is_deleted=False).annotate(region=F('addons_osfstorage_node_settings__region___id'))
 
+def embeddable_node_queryset():
+    """Nodes annotated with their osfstorage region, the way the node detail view loads them."""
+    return AbstractNode.objects.annotate(region=F('addons_osfstorage_node_settings__region___id'))
+
+def is_embeddable_node(node):
+    """Whether a prefetched node may be handed to an embedded detail view as is.
+
+    Deleted nodes and nodes without an osfstorage region are left for the embedded
+    view to load itself, so that it reports the usual error.
+    """
+    return not node.is_deleted and node.region is not None
+
+def embeddable_nodes_by_id(node_ids):
+    """Return ``{pk: node}`` for the embeddable nodes among ``node_ids``, fetched in one query."""
+    if not node_ids:
+        return {}
+    nodes = embeddable_node_queryset().filter(id__in=set(node_ids))
+    return {node.id: node for node in nodes if is_embeddable_node(node)}
+
+def load_parent_nodes(nodes, request):
+    """Bulk loader for ``parent`` relationships: fetch the parents of a page of nodes in one query."""
+    parents = {
+        parent.annotated_child_id: parent
+        for parent in embeddable_node_queryset().filter(
+            node_relations__child__in=[node.id for node in nodes],
+            node_relations__is_node_link=False,
+        ).annotate(annotated_child_id=F('node_relations__child_id'))
+    }
+    loaded = {}
+    for node in nodes:
+        parent = parents.get(node.id)
+        # Prime the cached property so serializing the relationship link does not query again
+        node.__dict__['parent_node'] = parent
+        loaded[node.id] = parent if parent is not None and is_embeddable_node(parent) else None
+    return loaded
+
+def load_registered_from_nodes(registrations, request):
+    """Bulk loader for ``registered_from``: fetch the source nodes of a page of registrations at once."""
+    sources = embeddable_nodes_by_id([
+        registration.registered_from_id for registration in registrations if registration.registered_from_id
+    ])
+    loaded = {}
+    for registration in registrations:
+        source = sources.get(registration.registered_from_id)
+        if source is not None:
+            registration.registered_from = source
+        loaded[registration.id] = source
+    return loaded
+
+def load_file_target_nodes(files, request):
+    """Bulk loader for a file's ``node``: fetch the nodes a page of files belong to at once."""
+    node_content_type_id = ContentType.objects.get_for_model(AbstractNode).id
+    targets = embeddable_nodes_by_id([
+        file_node.target_object_id for file_node in files if file_node.target_content_type_id == node_content_type_id
+    ])
+    loaded = {}
+    for file_node in files:
+        target = None
+        if file_node.target_content_type_id == node_content_type_id:
+            target = targets.get(file_node.target_object_id)
+        if target is not None:
+            file_node.target = target
+        loaded[file_node.id] = target
+    return loaded
+
 def default_node_permission_queryset(user, model_cls):
     """
     Return nodes that are either public or you have perms because you're a contributor.
@@ -65,6 +65,10 @@ class JSONAPIBaseView(generics.GenericAPIView):
         if getattr(field, 'field', None):
             field = field.field
 
+        bulk_loader = getattr(field, 'bulk_loader', None)
+        # {item.pk: related object} filled in once per page by bulk_load below
+        prefetched = {}
+
         def partial(item):
             # resolve must be implemented on the field
             v, view_args, view_kwargs = field.resolve(item, field_name, self.request)
@@ -78,6 +82,10 @@ class JSONAPIBaseView(generics.GenericAPIView):
             cache = request._request._embed_cache
 
             request.parents.setdefault(type(item), {})[item._id] = item
+            related = prefetched.get(item.pk)
+            if related is not None:
+                # Embedded views look their object up in request.parents before querying for it
+                request.parents.setdefault(type(related), {})[related._id] = related
 
             view_kwargs.update({
                 'request': request,
@@ -94,6 +102,11 @@ class JSONAPIBaseView(generics.GenericAPIView):
             view.format_kwarg = view.get_format_suffix(**view_kwargs)
 
             if not isinstance(view, ListModelMixin):
+                if related is not None:
+                    _cache_key = (v.cls, field_name, view.get_serializer_class(), (type(related), related.id))
+                    if _cache_key in cache:
+                        # Already loaded, permission checked and serialized for an earlier item of this page
+                        return cache[_cache_key]
                 try:
                     item = view.get_object()
                 except Exception as e:
@@ -137,8 +150,27 @@ class JSONAPIBaseView(generics.GenericAPIView):
 
             return ret
 
+        def bulk_load(items):
+            if items:
+                prefetched.update(bulk_loader(items, self.request))
+
+        partial.bulk_load = bulk_load if bulk_loader is not None else None
         return partial
 
+    def get_serializer(self, *args, **kwargs):
+        """Batch the embeds of a list response: fields that declare a ``bulk_loader`` fetch
+        their related objects for the whole page before any item is serialized.
+        """
+        serializer = super(JSONAPIBaseView, self).get_serializer(*args, **kwargs)
+        embeds = serializer.context.get('embed') or {}
+        bulk_loads = [embed_partial.bulk_load for embed_partial in embeds.values() if embed_partial.bulk_load is not None]
+        if kwargs.get('many') and args and bulk_loads:
+            # Evaluates a queryset once; the serializer reuses its result cache
+            items = list(args[0])
+            for bulk_load in bulk_loads:
+                bulk_load(items)
+        return serializer
+
     def get_serializer_context(self):
         """Inject request into the serializer context. Additionally, inject partial functions
         (request, object -> embed items) if the query string contains embeds.  Allows
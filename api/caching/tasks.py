@@ -1,5 +1,6 @@
 from future.moves.urllib.parse import urlparse
-from django.db import connection
+from django.db import connection, transaction
+from django.utils import timezone
 
 import requests
 import logging
@@ -102,13 +103,10 @@ def ban_url(instance):
                     ))
 
 
-@app.task(max_retries=5, default_retry_delay=10)
-def update_storage_usage_cache(target_id, target_guid, per_page=500000):
-    if not settings.ENABLE_STORAGE_USAGE_CACHE:
-        return
-    sql = """
-        SELECT count(size), sum(size) from
-        (SELECT size FROM osf_basefileversionsthrough AS obfnv
+STORAGE_USAGE_PAGE_SQL = """
+    WITH file_page AS (
+        SELECT version.id AS version_id, obfnv.id AS through_id, version.size AS size
+        FROM osf_basefileversionsthrough AS obfnv
         LEFT JOIN osf_basefilenode file ON obfnv.basefilenode_id = file.id
         LEFT JOIN osf_fileversion version ON obfnv.fileversion_id = version.id
         LEFT JOIN django_content_type type on file.target_content_type_id = type.id
@@ -116,26 +114,83 @@ def update_storage_usage_cache(target_id, target_guid, per_page=500000):
         AND type.model = 'abstractnode'
         AND file.deleted_on IS NULL
         AND file.target_object_id=%s
-        ORDER BY version.id
-        LIMIT %s OFFSET %s) file_page
-    """
+        AND (version.id, obfnv.id) > (%s, %s)
+        ORDER BY version.id, obfnv.id
+        LIMIT %s
+    )
+    SELECT count(*), sum(size), max(version_id),
+        max(through_id) FILTER (WHERE version_id = (SELECT max(version_id) FROM file_page))
+    FROM file_page
+"""
+
+
+def compute_storage_usage(target_id, per_page=500000):
+    """Sum the size of the osfstorage file versions of a node, paging with a
+    keyset on (version id, through id) so that each page starts from an index
+    seek instead of re-scanning the earlier rows."""
     count = per_page
-    offset = 0
+    last_version_id = last_through_id = 0
     storage_usage_total = 0
     with connection.cursor() as cursor:
-        while count:
-            cursor.execute(sql, [target_id, per_page, offset])
-            result = cursor.fetchall()
-            storage_usage_total += int(result[0][1]) if result[0][1] else 0
-            count = int(result[0][0]) if result[0][0] else 0
-            offset += count
+        while count == per_page:
+            cursor.execute(STORAGE_USAGE_PAGE_SQL, [target_id, last_version_id, last_through_id, per_page])
+            count, size, last_version_id, last_through_id = cursor.fetchone()
+            storage_usage_total += int(size) if size else 0
+    return storage_usage_total
 
+
+def _incr_storage_usage(key, delta):
+    """Add ``delta`` to a cached storage usage, keeping the expiry of the cached total so that
+    it is still recomputed in full when it expires.
+
+    ``incr`` of the database cache is a get followed by a set, so concurrent deltas would be
+    lost: the cache row is locked for the read and write instead.
+
+    :return: False when nothing is cached
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT expires FROM {} WHERE cache_key = %s FOR UPDATE'.format(
+                    connection.ops.quote_name(storage_usage_cache._table)),
+                [storage_usage_cache.make_key(key)],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return False
+        expires = row[0]
+        if timezone.is_naive(expires):
+            expires = timezone.make_aware(expires, timezone.utc)
+        timeout = (expires - timezone.now()).total_seconds()
+        total = storage_usage_cache.get(key)
+        if timeout <= 0 or total is None:
+            return False
+        storage_usage_cache.set(key, total + delta, timeout)
+    return True
+
+
+@app.task(max_retries=5, default_retry_delay=10)
+def update_storage_usage_cache(target_id, target_guid, per_page=500000, delta=None):
+    """Cache the storage usage of a node. Given a ``delta`` of bytes added or
+    removed, the cached total is adjusted when there is one, otherwise it is
+    recomputed."""
+    if not settings.ENABLE_STORAGE_USAGE_CACHE:
+        return
     key = cache_settings.STORAGE_USAGE_KEY.format(target_id=target_guid)
+    if delta is not None and _incr_storage_usage(key, delta):
+        return
+
+    storage_usage_total = compute_storage_usage(target_id, per_page=per_page)
     storage_usage_cache.set(key, storage_usage_total, cache_settings.FIVE_MIN_TIMEOUT)
 
 
-def update_storage_usage(target):
+def update_storage_usage(target, delta=None):
     Preprint = apps.get_model('osf.preprint')
 
     if settings.ENABLE_STORAGE_USAGE_CACHE and not isinstance(target, Preprint) and not target.is_quickfiles:
-        enqueue_postcommit_task(update_storage_usage_cache, (target.id, target._id,), {}, celery=True)
+        if delta is None:
+            enqueue_postcommit_task(update_storage_usage_cache, (target.id, target._id,), {}, celery=True)
+        else:
+            # every delta counts, even the same one twice in a request
+            enqueue_postcommit_task(update_storage_usage_cache, (target.id, target._id,), {'delta': delta},
+                                    celery=True, once_per_request=False)
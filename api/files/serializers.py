@@ -32,7 +32,7 @@ from api.base.serializers import (
     HideIfPreprint,
     ShowIfVersion,
 )
-from api.base.utils import absolute_reverse, get_user_auth
+from api.base.utils import absolute_reverse, get_user_auth, load_file_target_nodes
 from api.base.exceptions import Conflict, InvalidModelValueError
 from api.base.schemas.utils import from_json
 from api.base.versioning import get_kebab_snake_case_field
@@ -357,6 +357,7 @@ class FileSerializer(BaseFileSerializer):
             related_view='nodes:node-detail',
             related_view_kwargs={'node_id': '<target._id>'},
             help_text='The project that this file belongs to',
+            bulk_loader=load_file_target_nodes,
         ),
         min_version='2.0', max_version='2.7',
     )
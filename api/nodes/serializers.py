@@ -19,7 +19,7 @@ from api.base.serializers import (
 from api.base.settings import ADDONS_FOLDER_CONFIGURABLE, WARNING_THRESHOLD
 from api.base.utils import (
     absolute_reverse, get_object_or_error,
-    get_user_auth, is_truthy,
+    get_user_auth, is_truthy, load_parent_nodes,
 )
 from api.base.versioning import get_kebab_snake_case_field
 from api.taxonomies.serializers import TaxonomizableSerializerMixin
@@ -460,6 +460,7 @@ class NodeSerializer(TaxonomizableSerializerMixin, JSONAPISerializer):
         related_view='nodes:node-detail',
         related_view_kwargs={'node_id': '<parent_id>'},
         filter_key='parent_node',
+        bulk_loader=load_parent_nodes,
     )
 
     identifiers = RelationshipField(
@@ -183,6 +183,8 @@ class NodeMixin(object):
             )
 
         try:
+            # Only a request carrying a new pattern updates it; skip the lookups otherwise
+            timestamp_pattern_division = int(self.request.data['timestampPattern'])
             institution_id = None
             user_institution = None
             if self.request.user:
@@ -196,7 +198,7 @@ class NodeMixin(object):
             else:
                 timestamp_pattern = RdmTimestampGrantPattern.objects.filter(node_guid=self.kwargs['node_id']).first()
             if timestamp_pattern:
-                timestamp_pattern.timestamp_pattern_division = int(self.request.data['timestampPattern'])
+                timestamp_pattern.timestamp_pattern_division = timestamp_pattern_division
                 timestamp_pattern.save()
         except Exception:
             pass
@@ -8,7 +8,7 @@ from rest_framework import serializers as ser
 from rest_framework import exceptions
 from api.base.exceptions import Conflict, InvalidModelValueError, JSONAPIException
 from api.base.serializers import is_anonymized
-from api.base.utils import absolute_reverse, get_user_auth, is_truthy
+from api.base.utils import absolute_reverse, get_user_auth, is_truthy, load_parent_nodes, load_registered_from_nodes
 from api.base.versioning import CREATE_REGISTRATION_FIELD_CHANGE_VERSION
 from website.project.model import NodeUpdateError
 
@@ -148,6 +148,7 @@ class RegistrationSerializer(NodeSerializer):
     registered_from = RelationshipField(
         related_view='nodes:node-detail',
         related_view_kwargs={'node_id': '<registered_from._id>'},
+        bulk_loader=load_registered_from_nodes,
     )
 
     children = HideIfWithdrawal(RelationshipField(
@@ -252,6 +253,7 @@ class RegistrationSerializer(NodeSerializer):
         related_view='registrations:registration-detail',
         related_view_kwargs={'node_id': '<parent_node._id>'},
         filter_key='parent_node',
+        bulk_loader=load_parent_nodes,
     )
 
     root = RelationshipField(
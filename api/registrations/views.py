@@ -73,13 +73,20 @@ class RegistrationMixin(NodeMixin):
     node_lookup_url_kwarg = 'node_id'
 
     def get_node(self, check_object_permissions=True):
-        node = get_object_or_error(
-            AbstractNode,
-            self.kwargs[self.node_lookup_url_kwarg],
-            self.request,
-            display_name='node',
+        node = None
 
-        )
+        if self.kwargs.get('is_embedded') is True:
+            # If this is an embedded request, the registration might be cached somewhere
+            node = self.request.parents.get(Registration, {}).get(self.kwargs[self.node_lookup_url_kwarg])
+
+        if node is None:
+            node = get_object_or_error(
+                AbstractNode,
+                self.kwargs[self.node_lookup_url_kwarg],
+                self.request,
+                display_name='node',
+
+            )
         # Nodes that are folders/collections are treated as a separate resource, so if the client
         # requests a collection through a node endpoint, we return a 404
         if node.is_collection or not node.is_registration:
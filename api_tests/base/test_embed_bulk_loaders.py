@@ -0,0 +1,161 @@
+from __future__ import unicode_literals
+
+import logging
+import os
+import time
+
+import mock
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.base.settings.defaults import API_BASE
+from api.files.serializers import FileSerializer
+from api.nodes.serializers import NodeSerializer
+from api.registrations.serializers import RegistrationSerializer
+from api_tests.utils import create_test_file
+from osf_tests.factories import (
+    AuthUserFactory,
+    NodeFactory,
+    ProjectFactory,
+    RegistrationFactory,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_counting_queries(app, url, user):
+    with CaptureQueriesContext(connection) as ctx:
+        res = app.get(url, auth=user.auth)
+    assert res.status_code == 200
+    return res, len(ctx.captured_queries)
+
+
+def without_bulk_loader(field):
+    # Serializer fields are deep copied from their constructor kwargs for every serializer instance
+    field = getattr(field, 'field', field)
+    return mock.patch.dict(field._kwargs, {'bulk_loader': None})
+
+
+@pytest.fixture()
+def user():
+    return AuthUserFactory()
+
+
+@pytest.mark.django_db
+class TestNodeParentBulkLoader:
+
+    @pytest.fixture()
+    def components(self, user):
+        return [NodeFactory(parent=ProjectFactory(creator=user), creator=user) for _ in range(5)]
+
+    @pytest.fixture()
+    def url(self):
+        return '/{}nodes/?embed=parent&page[size]=100'.format(API_BASE)
+
+    def test_embeds_each_parent(self, app, user, components, url):
+        res = app.get(url, auth=user.auth)
+        embedded = {node['id']: node['embeds']['parent'] for node in res.json['data']}
+        for component in components:
+            assert embedded[component._id]['data']['id'] == component.parent_node._id
+
+    def test_checks_parent_permissions(self, app, user, url):
+        private_parent = ProjectFactory(is_public=False)
+        component = NodeFactory(parent=private_parent, creator=private_parent.creator, is_public=True)
+        res = app.get(url, auth=user.auth)
+        embedded = {node['id']: node['embeds']['parent'] for node in res.json['data']}
+        assert 'errors' in embedded[component._id]
+        assert 'data' not in embedded[component._id]
+
+    def test_fewer_queries(self, app, user, components, url):
+        res, queries = get_counting_queries(app, url, user)
+        with without_bulk_loader(NodeSerializer._declared_fields['parent']):
+            res_without, queries_without = get_counting_queries(app, url, user)
+        assert res.json['data'] == res_without.json['data']
+        assert queries < queries_without
+
+
+@pytest.mark.django_db
+class TestRegisteredFromBulkLoader:
+
+    @pytest.fixture()
+    def registrations(self, user):
+        return [RegistrationFactory(creator=user, project=ProjectFactory(creator=user)) for _ in range(3)]
+
+    @pytest.fixture()
+    def url(self):
+        return '/{}registrations/?embed=registered_from&page[size]=100'.format(API_BASE)
+
+    def test_fewer_queries(self, app, user, registrations, url):
+        res, queries = get_counting_queries(app, url, user)
+        embedded = {registration['id']: registration['embeds']['registered_from'] for registration in res.json['data']}
+        for registration in registrations:
+            assert embedded[registration._id]['data']['id'] == registration.registered_from._id
+
+        with without_bulk_loader(RegistrationSerializer._declared_fields['registered_from']):
+            res_without, queries_without = get_counting_queries(app, url, user)
+        assert res.json['data'] == res_without.json['data']
+        assert queries < queries_without
+
+
+@pytest.mark.django_db
+class TestFileNodeBulkLoader:
+
+    @pytest.fixture()
+    def node(self, user):
+        node = ProjectFactory(creator=user)
+        for i in range(5):
+            create_test_file(node, user, filename='file{}'.format(i))
+        return node
+
+    @pytest.fixture()
+    def url(self, node):
+        return '/{}nodes/{}/files/osfstorage/?embed=node&version=2.7&page[size]=100'.format(API_BASE, node._id)
+
+    def test_fewer_queries(self, app, user, node, url):
+        res, queries = get_counting_queries(app, url, user)
+        assert len(res.json['data']) == 5
+        for file_data in res.json['data']:
+            assert file_data['embeds']['node']['data']['id'] == node._id
+
+        with without_bulk_loader(FileSerializer._declared_fields['node']):
+            res_without, queries_without = get_counting_queries(app, url, user)
+        assert res.json['data'] == res_without.json['data']
+        assert queries < queries_without
+
+
+@pytest.mark.django_db
+class TestEmbedBulkLoaderBenchmark:
+
+    def test_benchmark(self, app, user):
+        items_numb = int(os.environ.get('EMBED_BENCHMARK_ITEMS', 10))
+        node = ProjectFactory(creator=user)
+        for i in range(items_numb):
+            parent = ProjectFactory(creator=user)
+            NodeFactory(parent=parent, creator=user)
+            RegistrationFactory(creator=user, project=parent)
+            create_test_file(node, user, filename='file{}'.format(i))
+
+        endpoints = [
+            ('nodes', '/{}nodes/?embed=parent&page[size]=100'.format(API_BASE),
+             NodeSerializer._declared_fields['parent']),
+            ('registrations', '/{}registrations/?embed=registered_from&page[size]=100'.format(API_BASE),
+             RegistrationSerializer._declared_fields['registered_from']),
+            ('files', '/{}nodes/{}/files/osfstorage/?embed=node&version=2.7&page[size]=100'.format(API_BASE, node._id),
+             FileSerializer._declared_fields['node']),
+        ]
+        for name, url, field in endpoints:
+            start = time.time()
+            _, queries = get_counting_queries(app, url, user)
+            elapsed = time.time() - start
+
+            with without_bulk_loader(field):
+                start = time.time()
+                _, queries_without = get_counting_queries(app, url, user)
+                elapsed_without = time.time() - start
+
+            logger.info(
+                '%s list with %d items: %d queries in %.3fs batched, %d queries in %.3fs per item',
+                name, items_numb, queries, elapsed, queries_without, elapsed_without,
+            )
+            assert queries < queries_without
@@ -0,0 +1,172 @@
+from __future__ import unicode_literals
+
+import logging
+import os
+import threading
+import time
+
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from api.caching import settings as cache_settings
+from api.caching.tasks import compute_storage_usage, update_storage_usage_cache
+from api.caching.utils import storage_usage_cache
+from api_tests.utils import create_test_file
+from osf.models import BaseFileVersionsThrough, FileVersion
+from osf_tests.factories import AuthUserFactory, ProjectFactory
+
+logger = logging.getLogger(__name__)
+
+# The OFFSET paging replaced by compute_storage_usage, kept to compare their times
+OFFSET_STORAGE_USAGE_SQL = """
+    SELECT count(size), sum(size) from
+    (SELECT size FROM osf_basefileversionsthrough AS obfnv
+    LEFT JOIN osf_basefilenode file ON obfnv.basefilenode_id = file.id
+    LEFT JOIN osf_fileversion version ON obfnv.fileversion_id = version.id
+    LEFT JOIN django_content_type type on file.target_content_type_id = type.id
+    WHERE file.provider = 'osfstorage'
+    AND type.model = 'abstractnode'
+    AND file.deleted_on IS NULL
+    AND file.target_object_id=%s
+    ORDER BY version.id
+    LIMIT %s OFFSET %s) file_page
+"""
+
+
+def offset_storage_usage(target_id, per_page):
+    count = per_page
+    offset = 0
+    storage_usage_total = 0
+    with connection.cursor() as cursor:
+        while count:
+            cursor.execute(OFFSET_STORAGE_USAGE_SQL, [target_id, per_page, offset])
+            result = cursor.fetchall()
+            storage_usage_total += int(result[0][1]) if result[0][1] else 0
+            count = int(result[0][0]) if result[0][0] else 0
+            offset += count
+    return storage_usage_total
+
+
+def add_versions(file, user, sizes):
+    versions = FileVersion.objects.bulk_create([
+        FileVersion(creator=user, identifier=str(index), size=size, location={'object': 'object_{}'.format(index)})
+        for index, size in enumerate(sizes, start=2)
+    ])
+    BaseFileVersionsThrough.objects.bulk_create([
+        BaseFileVersionsThrough(basefilenode=file, fileversion=version, version_name=file.name)
+        for version in versions
+    ])
+    return versions
+
+
+@pytest.fixture()
+def user():
+    return AuthUserFactory()
+
+@pytest.fixture()
+def node(user):
+    return ProjectFactory(creator=user)
+
+@pytest.fixture()
+def key(node):
+    key = cache_settings.STORAGE_USAGE_KEY.format(target_id=node._id)
+    storage_usage_cache.delete(key)
+    yield key
+    storage_usage_cache.delete(key)
+
+
+@pytest.mark.django_db
+class TestComputeStorageUsage:
+
+    def test_pages(self, node, user):
+        file = create_test_file(node, user, filename='file', size=1)
+        add_versions(file, user, [10, 100, 1000, 10000])
+        other_file = create_test_file(node, user, filename='other_file', size=100000)
+        # a version shared by two files is counted for each of them
+        BaseFileVersionsThrough.objects.create(
+            basefilenode=other_file, fileversion=file.versions.get(size=100), version_name='other_file')
+
+        for per_page in [1, 2, 3, 500000]:
+            assert compute_storage_usage(node.id, per_page=per_page) == 111211
+
+    def test_deleted_files_and_other_nodes(self, node, user):
+        create_test_file(node, user, filename='file', size=1)
+        create_test_file(node, user, filename='deleted_file', size=10).delete()
+        create_test_file(ProjectFactory(creator=user), user, filename='file', size=100)
+        assert compute_storage_usage(node.id, per_page=1) == 1
+
+    def test_empty(self, node):
+        assert compute_storage_usage(node.id) == 0
+
+
+@pytest.mark.django_db
+class TestUpdateStorageUsageCache:
+
+    def test_recompute(self, node, user, key):
+        create_test_file(node, user, size=1337)
+        update_storage_usage_cache(node.id, node._id)
+        assert storage_usage_cache.get(key) == 1337
+
+    def test_delta_adjusts_the_cached_total(self, node, user, key):
+        storage_usage_cache.set(key, 1000, cache_settings.FIVE_MIN_TIMEOUT)
+        update_storage_usage_cache(node.id, node._id, delta=337)
+        assert storage_usage_cache.get(key) == 1337
+        update_storage_usage_cache(node.id, node._id, delta=-1000)
+        assert storage_usage_cache.get(key) == 337
+
+    def test_delta_keeps_the_expiry(self, node, user, key):
+        storage_usage_cache.set(key, 1000, 60)
+        update_storage_usage_cache(node.id, node._id, delta=337)
+        assert storage_usage_cache.get(key) == 1337
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT expires FROM {} WHERE cache_key = %s'.format(storage_usage_cache._table),
+                [storage_usage_cache.make_key(key)],
+            )
+            expires = cursor.fetchone()[0]
+        assert (expires - timezone.now()).total_seconds() <= 60
+
+    def test_delta_without_cached_total_recomputes(self, node, user, key):
+        create_test_file(node, user, size=1337)
+        update_storage_usage_cache(node.id, node._id, delta=-1337)
+        assert storage_usage_cache.get(key) == 1337
+
+    def test_benchmark(self, node, user):
+        versions_numb = int(os.environ.get('STORAGE_USAGE_BENCHMARK_VERSIONS', 2000))
+        per_page = int(os.environ.get('STORAGE_USAGE_BENCHMARK_PER_PAGE', 100))
+        file = create_test_file(node, user, size=1)
+        for start in range(0, versions_numb, 10000):
+            add_versions(file, user, [1] * min(10000, versions_numb - start))
+
+        started = time.time()
+        offset_total = offset_storage_usage(node.id, per_page)
+        offset_elapsed = time.time() - started
+        started = time.time()
+        keyset_total = compute_storage_usage(node.id, per_page=per_page)
+        keyset_elapsed = time.time() - started
+        logger.info(
+            'storage usage benchmark: versions={} per_page={} offset={:.3f}s keyset={:.3f}s'.format(
+                versions_numb + 1, per_page, offset_elapsed, keyset_elapsed))
+        assert offset_total == keyset_total == versions_numb + 1
+
+
+@pytest.mark.django_db(transaction=True)
+class TestUpdateStorageUsageCacheConcurrently:
+
+    def test_concurrent_deltas_are_not_lost(self, node, key):
+        storage_usage_cache.set(key, 0, cache_settings.FIVE_MIN_TIMEOUT)
+
+        def add_files():
+            try:
+                for _ in range(10):
+                    update_storage_usage_cache(node.id, node._id, delta=1)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add_files) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert storage_usage_cache.get(key) == 40
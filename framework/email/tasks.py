@@ -1,5 +1,6 @@
 import smtplib
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 
 from framework.celery_tasks import app
@@ -9,6 +10,11 @@ import sendgrid
 
 logger = logging.getLogger(__name__)
 
+# Outcomes of the emails sent by send_emails
+EMAIL_SENT = 'sent'
+EMAIL_FAILED = 'failed'  # transient, e.g. the connection dropped or a 4xx SMTP reply: worth sending again
+EMAIL_REFUSED = 'refused'  # permanent, e.g. the recipient was refused, is not whitelisted or mail is not configured
+
 
 @app.task
 def send_email(from_addr, to_addr, subject, message, mimetype='html', ttls=True, login=True,
@@ -73,6 +79,18 @@ def _send_with_smtp(from_addr, to_addr, subject, message, mimetype='html', ttls=
         logger.error('Mail username and password not set; skipping send.')
         return
 
+    msg, to_addrs = _build_smtp_message(from_addr, to_addr, subject, message, mimetype, cc_addr, replyto, _charset)
+    s = _open_smtp_connection(ttls, login, username, password)
+    s.sendmail(
+        from_addr=from_addr,
+        to_addrs=to_addrs,
+        msg=msg.as_string()
+    )
+    s.quit()
+    return True
+
+
+def _build_smtp_message(from_addr, to_addr, subject, message, mimetype, cc_addr, replyto, _charset):
     message = message.encode(_charset, 'replace')
 
     msg = MIMEText(message, mimetype, _charset)
@@ -86,7 +104,10 @@ def _send_with_smtp(from_addr, to_addr, subject, message, mimetype='html', ttls=
         to_addrs += cc_addr.split(',')
     if replyto is not None:
         msg['Reply-To'] = replyto
+    return msg, [a for a in to_addrs if len(a) > 0]
+
 
+def _open_smtp_connection(ttls, login, username, password):
     s = smtplib.SMTP(settings.MAIL_SERVER, settings.MAIL_PORT)
     s.ehlo()
     if ttls:
@@ -94,13 +115,7 @@ def _send_with_smtp(from_addr, to_addr, subject, message, mimetype='html', ttls=
         s.ehlo()
     if login:
         s.login(username, password)
-    s.sendmail(
-        from_addr=from_addr,
-        to_addrs=[a for a in to_addrs if len(a) > 0],
-        msg=msg.as_string()
-    )
-    s.quit()
-    return True
+    return s
 
 
 def _send_with_sendgrid(from_addr, to_addr, subject, message, mimetype='html', categories=None, attachment_name=None, attachment_content=None, client=None,
@@ -140,3 +155,117 @@ def _send_with_sendgrid(from_addr, to_addr, subject, message, mimetype='html', c
         sentry.log_message(
             'SENDGRID_WHITELIST_MODE is True. Failed to send emails to non-whitelisted recipient {}.'.format(to_addr)
         )
+
+
+class _SMTPSender(object):
+    """Send emails one after another over a single SMTP connection."""
+
+    def __init__(self):
+        self.connection = None
+
+    def send(self, from_addr, to_addr, subject, message, mimetype='html', ttls=True, login=True, username=None,
+             password=None, cc_addr=None, replyto=None, _charset='utf-8', **kwargs):
+        username = username or settings.MAIL_USERNAME
+        password = password or settings.MAIL_PASSWORD
+
+        if login and (username is None or password is None):
+            logger.error('Mail username and password not set; skipping send.')
+            # Sending again cannot help until mail is configured
+            return EMAIL_REFUSED
+
+        msg, to_addrs = _build_smtp_message(from_addr, to_addr, subject, message, mimetype, cc_addr, replyto, _charset)
+        if self.connection is None:
+            self.connection = _open_smtp_connection(ttls, login, username, password)
+        try:
+            self.connection.sendmail(from_addr=from_addr, to_addrs=to_addrs, msg=msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            self.connection = _open_smtp_connection(ttls, login, username, password)
+            self.connection.sendmail(from_addr=from_addr, to_addrs=to_addrs, msg=msg.as_string())
+        return EMAIL_SENT
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except smtplib.SMTPException:
+                pass
+            self.connection = None
+
+
+class _SendgridSender(object):
+    """Send emails one after another with a single SendGrid client."""
+
+    def __init__(self):
+        self.client = sendgrid.SendGridClient(settings.SENDGRID_API_KEY)
+
+    def send(self, from_addr, to_addr, subject, message, mimetype='html', categories=None, attachment_name=None,
+             attachment_content=None, cc_addr=None, replyto=None, **kwargs):
+        sent = _send_with_sendgrid(
+            from_addr=from_addr,
+            to_addr=to_addr,
+            subject=subject,
+            message=message,
+            mimetype=mimetype,
+            categories=categories,
+            attachment_name=attachment_name,
+            attachment_content=attachment_content,
+            client=self.client,
+            cc_addr=cc_addr,
+            replyto=replyto,
+        )
+        if sent is None:
+            # Not sent to a recipient outside of the whitelist
+            return EMAIL_REFUSED
+        return EMAIL_SENT if sent else EMAIL_FAILED
+
+    def close(self):
+        pass
+
+
+def _failure_status(error):
+    """Whether an error raised while sending an email is worth sending it again.
+
+    Only a permanent (5xx) refusal of the recipients or of the message itself is final; connection,
+    login and sender errors concern every email and 4xx replies are temporary.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and all(
+            500 <= code < 600 for code, _ in error.recipients.values()):
+        return EMAIL_REFUSED
+    if isinstance(error, smtplib.SMTPDataError) and 500 <= error.smtp_code < 600:
+        return EMAIL_REFUSED
+    return EMAIL_FAILED
+
+
+def send_emails(emails, max_connections=1):
+    """Send many emails at once, outside of celery.
+
+    The emails are split between at most ``max_connections`` threads. Each thread keeps one SMTP
+    connection (or SendGrid client) open and sends its share in turn.
+
+    :param list emails: dicts of ``send_email`` keyword arguments
+    :param int max_connections: number of emails sent concurrently
+    :return: list of ``EMAIL_SENT``, ``EMAIL_FAILED`` or ``EMAIL_REFUSED``, the outcome of each email
+    """
+    results = [EMAIL_FAILED] * len(emails)
+    if not settings.USE_EMAIL or not emails:
+        return results
+
+    def send_share(indices):
+        sender = _SendgridSender() if settings.SENDGRID_API_KEY else _SMTPSender()
+        try:
+            for index in indices:
+                try:
+                    results[index] = sender.send(**emails[index])
+                except Exception as e:
+                    logger.exception('Failed to send email to {}'.format(emails[index].get('to_addr')))
+                    sentry.log_exception()
+                    results[index] = _failure_status(e)
+        finally:
+            sender.close()
+
+    workers = max(1, min(max_connections, len(emails)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(send_share, range(worker, len(emails), workers)) for worker in range(workers)]
+        for future in futures:
+            future.result()
+    return results
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# This is a management command, rather than a migration script, because it only changes database
+# content and has to walk the whole file table in chunks.
+
+from __future__ import unicode_literals
+import logging
+
+import django
+django.setup()
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from scripts import utils as script_utils
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHUNK_SQL = """
+    WITH chunk AS (
+        SELECT id FROM osf_basefilenode
+        WHERE version_count IS NULL
+        AND id > %s
+        ORDER BY id
+        LIMIT %s
+    ), aggregates AS (
+        SELECT chunk.id
+            , COUNT(osf_fileversion.id) AS version_count
+            , (array_agg(osf_fileversion.id ORDER BY osf_fileversion.created DESC)
+               FILTER (WHERE osf_fileversion.id IS NOT NULL))[1] AS latest_version_id
+        FROM chunk
+        LEFT JOIN osf_basefileversionsthrough ON osf_basefileversionsthrough.basefilenode_id = chunk.id
+        LEFT JOIN osf_fileversion ON osf_fileversion.id = osf_basefileversionsthrough.fileversion_id
+        GROUP BY chunk.id
+    )
+    UPDATE osf_basefilenode
+    SET version_count = aggregates.version_count, latest_version_id = aggregates.latest_version_id
+    FROM aggregates
+    WHERE osf_basefilenode.id = aggregates.id
+    RETURNING osf_basefilenode.id
+"""
+
+
+def backfill_file_version_aggregates(chunk_size=10000, dry_run=False):
+    """Fill in BaseFileNode.version_count and latest_version for rows that predate them."""
+    last_id = 0
+    total = 0
+    while True:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(BACKFILL_CHUNK_SQL, [last_id, chunk_size])
+                updated_ids = [row[0] for row in cursor.fetchall()]
+            if dry_run:
+                transaction.set_rollback(True)
+        if not updated_ids:
+            break
+        last_id = max(updated_ids)
+        total += len(updated_ids)
+        logger.info('Backfilled version aggregates of {} file nodes (up to id {})'.format(total, last_id))
+    return total
+
+
+class Command(BaseCommand):
+    """
+    Backfill BaseFileNode.version_count and BaseFileNode.latest_version.
+    """
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--dry',
+            action='store_true',
+            dest='dry_run',
+            help='Run the backfill and roll back changes to db',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10000,
+            dest='chunk_size',
+            help='Number of file nodes updated per transaction',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options.get('dry_run', False)
+        if not dry_run:
+            script_utils.add_file_logger(logger, __file__)
+        total = backfill_file_version_aggregates(chunk_size=options['chunk_size'], dry_run=dry_run)
+        logger.info('Done: {} file nodes {}'.format(total, 'would be backfilled' if dry_run else 'backfilled'))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Fill in the stored materialized paths of osfstorage file nodes, one batch of
+root folders (and the trees below them) per transaction.
+
+    python manage.py backfill_materialized_paths [--chunk-size N] [--dry]
+"""
+from __future__ import unicode_literals
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from addons.osfstorage.models import OsfStorageFolder, rebuild_materialized_paths
+
+logger = logging.getLogger(__name__)
+
+
+def iter_root_folder_ids(chunk_size):
+    last_id = 0
+    while True:
+        root_ids = list(
+            OsfStorageFolder.objects.filter(parent__isnull=True, id__gt=last_id)
+            .order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not root_ids:
+            return
+        yield root_ids
+        last_id = root_ids[-1]
+
+
+def backfill_materialized_paths(chunk_size=500, dry_run=False):
+    total = 0
+    for root_ids in iter_root_folder_ids(chunk_size):
+        with transaction.atomic():
+            total += rebuild_materialized_paths(root_ids)
+            if dry_run:
+                transaction.set_rollback(True)
+        logger.info('Backfilled materialized paths of {} file nodes (root folders up to id {})'.format(total, root_ids[-1]))
+    return total
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            dest='chunk_size',
+            help='Number of root folders whose trees are rebuilt per transaction',
+        )
+        parser.add_argument(
+            '--dry',
+            action='store_true',
+            dest='dry_run',
+            help='Run the backfill and roll back changes to db',
+        )
+
+    def handle(self, *args, **options):
+        total = backfill_materialized_paths(chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        self.stdout.write('{} file node(s) {}'.format(total, 'would be updated' if options['dry_run'] else 'updated'))
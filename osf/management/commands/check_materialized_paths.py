@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Compare the stored materialized paths of osfstorage file nodes with the paths
+derived from their parent chains and report the ones that drifted.
+
+    python manage.py check_materialized_paths [--fix]
+"""
+from __future__ import unicode_literals
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from addons.osfstorage.models import find_drifted_materialized_paths, rebuild_materialized_paths
+from osf.management.commands.backfill_materialized_paths import iter_root_folder_ids
+
+logger = logging.getLogger(__name__)
+
+
+def check_materialized_paths(fix=False, chunk_size=500):
+    drifted = []
+    for root_ids in iter_root_folder_ids(chunk_size):
+        chunk_drifted = find_drifted_materialized_paths(root_ids)
+        if chunk_drifted and fix:
+            with transaction.atomic():
+                rebuild_materialized_paths(root_ids)
+        drifted.extend(chunk_drifted)
+    logger.info('Materialized path consistency check: {} drifted file node(s){}'.format(
+        len(drifted), ', fixed' if fix and drifted else ''))
+    return drifted
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            dest='fix',
+            help='Rebuild the stored paths of the trees that drifted',
+        )
+
+    def handle(self, *args, **options):
+        for file_id, stored, expected in check_materialized_paths(fix=options['fix']):
+            self.stdout.write('{}: stored {!r}, expected {!r}'.format(file_id, stored, expected))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Compare the incrementally maintained used quotas with a full recomputation
+from FileInfo and report the users whose quota drifted.
+
+    python manage.py check_quota_consistency [--fix]
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+
+from framework.celery_tasks import app as celery_app
+from osf.models import OSFUser, UserQuota
+from website.util import quota
+
+logger = logging.getLogger(__name__)
+
+
+@celery_app.task(name='management.commands.check_quota_consistency')
+def check_quota_consistency(fix=False):
+    drifted = []
+    user_quotas = UserQuota.objects.filter(
+        user__in=OSFUser.objects.exclude(deleted__isnull=False)
+    ).values_list('user_id', 'storage_type').order_by('user_id', 'storage_type')
+    for user_id, storage_type in user_quotas.iterator():
+        user = OSFUser.objects.get(id=user_id)
+        drift = quota.check_used_quota(user, storage_type, fix=fix)
+        if drift:
+            drifted.append({'user': user._id, 'storage_type': storage_type, 'drift': drift})
+    logger.info('Quota consistency check: {} drifted quota(s){}'.format(
+        len(drifted), ', fixed' if fix and drifted else ''))
+    return drifted
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            dest='fix',
+            help='Rebuild the project rollups and used quotas that drifted',
+        )
+
+    def handle(self, *args, **options):
+        for drifted in check_quota_consistency(fix=options['fix']):
+            self.stdout.write('{user} (storage_type={storage_type}): {drift:+d} bytes'.format(**drifted))
@@ -19,6 +19,7 @@ def remove_logs_and_files(node_guid):
         for file in n.files.exclude(parent__isnull=True):
             try:
                 file.versions.exclude(id=file.versions.latest('date_created').id).delete()
+                file.update_version_aggregates()
             except file.versions.model.DoesNotExist:
                 # No FileVersions, skip
                 pass
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Report the depth and lag of the search index queue (website.search.index_queue),
+optionally flushing every queued update right away.
+
+    python manage.py search_index_queue [--flush]
+"""
+from django.core.management.base import BaseCommand
+
+from website.search import index_queue
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--flush',
+            action='store_true',
+            dest='flush',
+            help='Send every queued update now, without waiting for SEARCH_INDEX_QUEUE_DELAY',
+        )
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            flushed = index_queue.flush(delay=0)
+            self.stdout.write('flushed: {} {}'.format(sum(flushed.values()), dict(flushed)))
+        metrics = index_queue.get_metrics()
+        self.stdout.write('depth: {depth}'.format(**metrics))
+        self.stdout.write('lag: {lag:.1f}s'.format(**metrics))
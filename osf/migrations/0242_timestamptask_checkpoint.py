@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 10:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0241_ensure_schema_mappings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timestamptask',
+            name='checkpointed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='timestamptask',
+            name='completed_file_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=24), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='timestamptask',
+            name='operation',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='timestamptask',
+            name='shard_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='timestamptask',
+            name='total_files',
+            field=models.IntegerField(default=0),
+        ),
+    ]
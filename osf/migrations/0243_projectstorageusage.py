@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 11:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+# Same files as website.util.quota.used_quota: non-deleted files, and only
+# osfstorage files for projects on the NII storage.
+BACKFILL_SQL = """
+INSERT INTO osf_projectstorageusage (node_id, used, created, modified)
+SELECT F.target_object_id, SUM(I.file_size), now(), now()
+FROM osf_fileinfo AS I
+  JOIN osf_basefilenode AS F ON F.id = I.file_id
+  LEFT JOIN osf_projectstoragetype AS PST ON PST.node_id = F.target_object_id
+WHERE F.target_content_type_id = (
+    SELECT id FROM django_content_type WHERE app_label = 'osf' AND model = 'abstractnode'
+  )
+  AND F.deleted_on IS NULL
+  AND F.deleted_by_id IS NULL
+  AND (COALESCE(PST.storage_type, 1) != 1 OR F.type IN ('osf.osfstoragefile', 'osf.osfstoragefolder'))
+GROUP BY F.target_object_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0242_timestamptask_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectStorageUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('used', models.BigIntegerField(default=0)),
+                ('node', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='storage_usage', to='osf.AbstractNode')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
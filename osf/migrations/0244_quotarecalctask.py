@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0243_projectstorageusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaRecalcTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('task_id', models.CharField(blank=True, default='', max_length=80)),
+                ('last_user_id', models.IntegerField(default=0)),
+                ('total_users', models.IntegerField(default=0)),
+                ('processed_users', models.IntegerField(default=0)),
+                ('elapsed', models.FloatField(default=0)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 13:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+import osf.models.base
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0244_quotarecalctask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportDataCopiedFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('file_name', models.CharField(max_length=255)),
+                ('export_data', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='copied_files', to='osf.ExportData')),
+            ],
+            options={
+                'db_table': 'osf_export_data_copied_file',
+            },
+            bases=(models.Model, osf.models.base.QuerySetExplainMixin),
+        ),
+        migrations.AlterUniqueTogether(
+            name='exportdatacopiedfile',
+            unique_together=set([('export_data', 'file_name')]),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 14:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+import osf.models.base
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0245_exportdatacopiedfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportdatarestore',
+            name='process_step',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ExportDataRestoredFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('file_id', models.IntegerField()),
+                ('version_id', models.CharField(max_length=255)),
+                ('export_data_restore', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='restored_files', to='osf.ExportDataRestore')),
+                ('file_node', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='osf.BaseFileNode')),
+            ],
+            options={
+                'db_table': 'osf_export_data_restored_file',
+            },
+            bases=(models.Model, osf.models.base.QuerySetExplainMixin),
+        ),
+        migrations.AlterUniqueTogether(
+            name='exportdatarestoredfile',
+            unique_together=set([('export_data_restore', 'file_id', 'version_id')]),
+        ),
+    ]
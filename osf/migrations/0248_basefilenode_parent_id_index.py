@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 16:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    atomic = False  # CREATE INDEX CONCURRENTLY cannot be run in a txn
+
+    dependencies = [
+        ('osf', '0247_basefilenode_version_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunSQL([
+            # Lets folder listings walk a parent's children in id order, one page at a time
+            'CREATE INDEX CONCURRENTLY basefilenode_parent_id_idx ON osf_basefilenode (parent_id, id);',
+        ], [
+            'DROP INDEX IF EXISTS basefilenode_parent_id_idx, RESTRICT;'
+        ])
+    ]
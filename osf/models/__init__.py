@@ -62,8 +62,11 @@ from osf.models.timestamp_task import TimestampTask  # noqa
 from osf.models.fileinfo import FileInfo  # noqa
 from osf.models.user_quota import UserQuota  # noqa
 from osf.models.project_storage_type import ProjectStorageType  # noqa
+from osf.models.project_storage_usage import ProjectStorageUsage  # noqa
+from osf.models.quota_recalc_task import QuotaRecalcTask  # noqa
 from osf.models.region_external_account import RegionExternalAccount  # noqa
 from osf.models.institution_entitlement import InstitutionEntitlement  # noqa
 from osf.models.export_data_location import ExportDataLocation  # noqa
-from osf.models.export_data import ExportData  # noqa
-from osf.models.export_data_restore import ExportDataRestore  # noqa
+from osf.models.export_data import ExportData, ExportDataCopiedFile  # noqa
+from osf.models.export_data_restore import ExportDataRestore, ExportDataRestoredFile  # noqa
+from osf.models.search_queue import PendingSearchUpdate  # noqa
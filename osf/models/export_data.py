@@ -1,11 +1,13 @@
 from __future__ import unicode_literals
 
+import json
 import logging
 import os.path
 
 import requests
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models import DateTimeField, Q
+from django.db.models import DateTimeField, Exists, OuterRef, Q
 
 from addons.osfstorage.models import Region
 from api.base.utils import waterbutler_api_url_for
@@ -14,9 +16,9 @@ from osf.models import (
     BaseFileNode,
     BaseFileVersionsThrough,
     ExportDataLocation,
+    Guid,
     Institution,
     RdmFileTimestamptokenVerifyResult,
-    FileVersion,
     AbstractNode,
 )
 from admin.base import settings as admin_settings
@@ -30,9 +32,25 @@ __all__ = [
     'DateTruncMixin',
     'SecondDateTimeField',
     'ExportData',
+    'ExportDataCopiedFile',
 ]
 
 
+def _dumps_indented(obj, level):
+    # same layout as write_json_file, nested ``level`` levels deep
+    return json.dumps(obj, ensure_ascii=False, indent=2, sort_keys=False).replace('\n', '\n' + '  ' * level)
+
+
+def _write_json_array(write_file, items):
+    write_file.write('[')
+    separator = '\n    '
+    for item in items:
+        write_file.write(separator)
+        write_file.write(_dumps_indented(item, 2))
+        separator = ',\n    '
+    write_file.write('\n  ]' if separator != '\n    ' else ']')
+
+
 class DateTruncMixin:
     def truncate_date(self, dt):
         return dt
@@ -106,50 +124,20 @@ class ExportData(base.BaseModel):
 
     __str__ = __repr__
 
-    def extract_file_information_json_from_source_storage(self):
+    def _source_institution_json(self):
         # Get region guid == institution guid
         source_storage_guid = self.source.guid
         # Get Institution by guid
         institution = Institution.load(source_storage_guid)
-
         if not institution:
-            return None
-
-        institution_json = {
+            return None, None
+        return institution, {
             'id': institution.id,
             'guid': institution.guid,
             'name': institution.name,
         }
 
-        export_data_json = {
-            'institution': institution_json,
-            'process_start': self.process_start.strftime('%Y-%m-%d %H:%M:%S'),
-            'process_end': self.process_end.strftime('%Y-%m-%d %H:%M:%S') if self.process_end else None,
-            'storage': {
-                'name': self.source.name,
-                'type': self.source.provider_full_name,
-            },
-            'projects_numb': self.project_number,
-            'files_numb': self.file_number,
-            'size': self.total_size,
-            'file_path': self.get_file_info_file_path(),
-        }
-
-        file_info_json = {
-            'institution': institution_json,
-        }
-
-        # If source institutional storage is the same as default storage, also get default storage for export
-        if self.source.has_same_settings_as_default_region and self.source.id != 1:
-            # get list FileVersion linked to source storage, default storage
-            file_versions = FileVersion.objects.filter(region_id__in=[1, self.source.id])
-        else:
-            # get list FileVersion linked to source storage
-            file_versions = self.source.fileversion_set.all()
-
-        # get base_file_nodes__ids by file_versions__ids above via the BaseFileVersionsThrough model
-        base_file_versions_set = BaseFileVersionsThrough.objects.filter(fileversion__in=file_versions)
-        base_file_nodes__ids = base_file_versions_set.values_list('basefilenode_id', flat=True).distinct('basefilenode_id')
+    def _source_projects_ids(self, institution):
         # get project list, includes public/private/deleted projects
         projects = institution.nodes.filter(type='osf.node', is_deleted=False)
         institution_users = institution.osfuser_set.all()
@@ -159,136 +147,328 @@ class ExportData(base.BaseModel):
             projects = projects.filter(addons_osfstorage_node_settings__region=self.source)
             institution_users_projects = institution_users_projects.filter(addons_osfstorage_node_settings__region=self.source)
         # Combine two project lists and remove duplicates if have
-        projects = projects.union(institution_users_projects)
-        projects__ids = projects.values_list('id', flat=True)
-        source_project_ids = set()
+        return sorted(
+            set(projects.values_list('id', flat=True)) | set(institution_users_projects.values_list('id', flat=True))
+        )
+
+    def _source_region_ids(self):
+        # If source institutional storage is the same as default storage, also get default storage for export
+        if self.source.has_same_settings_as_default_region and self.source.id != 1:
+            return [1, self.source.id]
+        return [self.source.id]
+
+    @staticmethod
+    def _iter_chunks(queryset, chunk_size):
+        """Iterate over ``queryset`` ordered by id, ``chunk_size`` rows per query."""
+        last_id = 0
+        while True:
+            chunk = list(queryset.filter(id__gt=last_id).order_by('id')[:chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_id = chunk[-1].id
+
+    @staticmethod
+    def _load_projects(projects, projects_ids):
+        """Add guid and title of the not yet loaded ``projects_ids`` to ``projects``."""
+        missing_ids = set(projects_ids) - set(projects)
+        if not missing_ids:
+            return
+        guids = {}
+        for object_id, _id in Guid.objects.filter(
+            content_type=ContentType.objects.get_for_model(AbstractNode),
+            object_id__in=missing_ids,
+        ).order_by('-created').values_list('object_id', '_id'):
+            guids.setdefault(object_id, _id)
+        for project_id, title in AbstractNode.objects.filter(id__in=missing_ids).values_list('id', 'title'):
+            projects[project_id] = {
+                'id': guids.get(project_id),
+                'name': title,
+            }
 
-        # get folder nodes
+    def _load_file_relations(self, files, projects):
+        """Load tags, timestamps and versions of a chunk of files in bulk."""
+        file_ids = [file.id for file in files]
+        self._load_projects(projects, [file.target_object_id for file in files])
+
+        tags = {}
+        for file_id, name in BaseFileNode.tags.through.objects.filter(
+            basefilenode_id__in=file_ids, tag__system=False,
+        ).order_by('tag__name').values_list('basefilenode_id', 'tag__name'):
+            tags.setdefault(file_id, []).append(name)
+
+        timestamps = {}
+        for timestamp in RdmFileTimestamptokenVerifyResult.objects.filter(
+            file_id__in=[file._id for file in files],
+            project_id__in=[projects[file.target_object_id]['id'] for file in files],
+        ).order_by('id'):
+            timestamps.setdefault((timestamp.project_id, timestamp.file_id), timestamp)
+
+        versions = {}
+        for version in BaseFileVersionsThrough.objects.filter(
+            basefilenode_id__in=file_ids,
+        ).order_by('basefilenode_id', '-fileversion__created').values(
+            'basefilenode_id', 'version_name', 'fileversion__identifier', 'fileversion__created',
+            'fileversion__modified', 'fileversion__size', 'fileversion__creator__username',
+            'fileversion__metadata', 'fileversion__location',
+        ):
+            versions.setdefault(version['basefilenode_id'], []).append(version)
+
+        return tags, timestamps, versions
+
+    def iter_folder_information(self, projects_ids, chunk_size=None):
+        """Yield the information of the folders of ``projects_ids``."""
+        chunk_size = chunk_size or admin_settings.EXPORT_DATA_MANIFEST_CHUNK_SIZE
         base_folder_nodes = BaseFileNode.objects.filter(
             # type='osf.{}folder'.format(self.source.provider_short_name),
             type__endswith='folder',
-            target_object_id__in=projects__ids,
+            target_object_id__in=projects_ids,
         ).exclude(
             # exclude deleted folders
             Q(deleted__isnull=False) | Q(deleted_on__isnull=False) | Q(deleted_by_id__isnull=False),
         )
-        folders = []
-        for folder in base_folder_nodes:
-            folder_info = {
-                'path': folder.path,
-                'materialized_path': folder.materialized_path,
-                'project': {}
-            }
-            # project
-            project = folder.target
-            source_project_ids.add(project.id)
-            project_info = {
-                'id': project._id,
-                'name': project.title,
-            }
-            folder_info['project'] = project_info
-            folders.append(folder_info)
+        projects = {}
+        for folders in self._iter_chunks(base_folder_nodes, chunk_size):
+            self._load_projects(projects, [folder.target_object_id for folder in folders])
+            for folder in folders:
+                yield {
+                    'path': folder.path,
+                    'materialized_path': folder.materialized_path,
+                    'project': projects[folder.target_object_id],
+                }
 
-        # get base_file_nodes
-        base_file_nodes = BaseFileNode.objects.filter(
-            id__in=base_file_nodes__ids,
-            target_object_id__in=projects__ids,
+    def iter_file_information(self, projects_ids, chunk_size=None):
+        """Yield the information of the files of ``projects_ids`` which have a
+        version in the source storage, loading their related rows chunk by chunk.
+        """
+        chunk_size = chunk_size or admin_settings.EXPORT_DATA_MANIFEST_CHUNK_SIZE
+        base_file_nodes = BaseFileNode.objects.annotate(
+            has_source_version=Exists(BaseFileVersionsThrough.objects.filter(
+                basefilenode_id=OuterRef('id'),
+                fileversion__region_id__in=self._source_region_ids(),
+            ))
+        ).filter(
+            has_source_version=True,
+            target_object_id__in=projects_ids,
         ).exclude(
             # exclude deleted files
             Q(deleted__isnull=False) | Q(deleted_on__isnull=False) | Q(deleted_by_id__isnull=False),
         )
-
-        total_size = 0
-        total_file = 0
-        files = []
-        # get file information
-        for file in base_file_nodes:
-            file_info = {
-                'id': file.id,
-                'path': file.path,
-                'materialized_path': file.materialized_path,
-                'name': file.name,
-                'provider': file.provider,
-                'created_at': str(file.created),
-                'modified_at': str(file.modified),
-                'project': {},
-                'tags': [],
-                'version': [],
-                'size': 0,
-                'location': {},
-                'timestamp': {},
-                'checkout_id': file.checkout_id or None,
-            }
-
-            # project
-            project = file.target
-            source_project_ids.add(project.id)
-            project_info = {
-                'id': project._id,
-                'name': project.title,
-            }
-            file_info['project'] = project_info
-
-            # file's tags
-            if not file._state.adding:
-                tags = list(file.tags.filter(system=False).values_list('name', flat=True))
-                file_info['tags'] = tags
-
-            # timestamp by project_id and file_id
-            timestamp = RdmFileTimestamptokenVerifyResult.objects.filter(
-                project_id=file.target._id, file_id=file._id).first()
-            if timestamp:
-                timestamp_info = {
-                    'timestamp_id': timestamp.id,
-                    'inspection_result_status': timestamp.inspection_result_status,
-                    'provider': timestamp.provider,
-                    'upload_file_modified_user': timestamp.upload_file_modified_user,
-                    'project_id': timestamp.project_id,
-                    'path': timestamp.path,
-                    'key_file_name': timestamp.key_file_name,
-                    'upload_file_created_user': timestamp.upload_file_created_user,
-                    'upload_file_size': timestamp.upload_file_size,
-                    'verify_file_size': timestamp.verify_file_size,
-                    'verify_user': timestamp.verify_user,
+        projects = {}
+        for files in self._iter_chunks(base_file_nodes, chunk_size):
+            tags, timestamps, versions = self._load_file_relations(files, projects)
+            for file in files:
+                project_info = projects[file.target_object_id]
+                file_info = {
+                    'id': file.id,
+                    'path': file.path,
+                    'materialized_path': file.materialized_path,
+                    'name': file.name,
+                    'provider': file.provider,
+                    'created_at': str(file.created),
+                    'modified_at': str(file.modified),
+                    'project': project_info,
+                    'tags': tags.get(file.id, []),
+                    'version': [],
+                    'size': 0,
+                    'location': {},
+                    'timestamp': {},
+                    'checkout_id': file.checkout_id or None,
                 }
-                file_info['timestamp'] = timestamp_info
-
-            # file versions
-            file_versions = file.versions.order_by('-created')
-            file_versions_info = []
-            for version in file_versions:
-                file_version_thru = version.get_basefilenode_version(file)
-                version_info = {
-                    'identifier': version.identifier,
-                    'created_at': str(version.created),
-                    'modified_at': str(version.modified),
-                    'size': version.size,
-                    'version_name': file_version_thru.version_name if file_version_thru else file.name,
-                    'contributor': version.creator.username,
-                    'metadata': version.metadata,
-                    'location': version.location,
-                }
-                file_versions_info.append(version_info)
-                total_file += 1
-                total_size += version.size
 
-            file_info['version'] = file_versions_info
-            file_info['size'] = file_versions_info[0]['size']
-            file_info['location'] = file_versions_info[0]['location']
-            files.append(file_info)
+                # timestamp by project_id and file_id
+                timestamp = timestamps.get((project_info['id'], file._id))
+                if timestamp:
+                    file_info['timestamp'] = {
+                        'timestamp_id': timestamp.id,
+                        'inspection_result_status': timestamp.inspection_result_status,
+                        'provider': timestamp.provider,
+                        'upload_file_modified_user': timestamp.upload_file_modified_user,
+                        'project_id': timestamp.project_id,
+                        'path': timestamp.path,
+                        'key_file_name': timestamp.key_file_name,
+                        'upload_file_created_user': timestamp.upload_file_created_user,
+                        'upload_file_size': timestamp.upload_file_size,
+                        'verify_file_size': timestamp.verify_file_size,
+                        'verify_user': timestamp.verify_user,
+                    }
+
+                # file versions
+                file_info['version'] = [{
+                    'identifier': version['fileversion__identifier'],
+                    'created_at': str(version['fileversion__created']),
+                    'modified_at': str(version['fileversion__modified']),
+                    'size': version['fileversion__size'],
+                    'version_name': version['version_name'] or file.name,
+                    'contributor': version['fileversion__creator__username'],
+                    'metadata': version['fileversion__metadata'],
+                    'location': version['fileversion__location'],
+                } for version in versions.get(file.id, [])]
+                file_info['size'] = file_info['version'][0]['size']
+                file_info['location'] = file_info['version'][0]['location']
+                yield file_info
+
+    def _export_data_json(self, institution_json, projects_numb, files_numb, size):
+        return {
+            'institution': institution_json,
+            'process_start': self.process_start.strftime('%Y-%m-%d %H:%M:%S'),
+            'process_end': self.process_end.strftime('%Y-%m-%d %H:%M:%S') if self.process_end else None,
+            'storage': {
+                'name': self.source.name,
+                'type': self.source.provider_full_name,
+            },
+            'projects_numb': projects_numb,
+            'files_numb': files_numb,
+            'size': size,
+            'file_path': self.get_file_info_file_path(),
+        }
 
-        file_info_json['folders'] = folders
-        file_info_json['files'] = files
+    def extract_file_information_json_from_source_storage(self):
+        """Build the export data JSON and the whole file information JSON in memory.
 
-        export_data_json['files_numb'] = total_file
-        export_data_json['size'] = total_size
-        export_data_json['projects_numb'] = len(projects__ids)
+        The export process streams the file information with
+        ``write_file_information_json`` instead.
+        """
+        institution, institution_json = self._source_institution_json()
+        if not institution:
+            return None
 
+        projects_ids = self._source_projects_ids(institution)
+        files = list(self.iter_file_information(projects_ids))
+        file_info_json = {
+            'institution': institution_json,
+            'folders': list(self.iter_folder_information(projects_ids)),
+            'files': files,
+        }
+        export_data_json = self._export_data_json(
+            institution_json,
+            projects_numb=len(projects_ids),
+            files_numb=sum(len(file['version']) for file in files),
+            size=sum(version['size'] for file in files for version in file['version']),
+        )
         return export_data_json, file_info_json
 
-    def get_source_file_versions_min(self, file_info_json):
+    @staticmethod
+    def _iter_snapshot(snapshot_file, kind):
+        """Yield the ``kind`` ('folder' or 'file') items recorded in ``snapshot_file``."""
+        with open(snapshot_file, encoding='utf-8') as read_file:
+            for line in read_file:
+                item = json.loads(line)
+                if kind in item:
+                    yield item[kind]
+
+    @staticmethod
+    def _read_snapshot_header(snapshot_file):
+        with open(snapshot_file, encoding='utf-8') as read_file:
+            header = json.loads(read_file.readline())
+        return header['institution'], header['projects_numb']
+
+    def write_file_information_json(self, output_file, exclude_versions=None, snapshot_file=None):
+        """Stream the file information JSON of the source storage to ``output_file``.
+
+        Files are written one by one as they are read, so memory use does not
+        depend on the number of files. Versions listed in ``exclude_versions``
+        (file id -> version identifiers) are left out of the file and returned
+        as file information of their own, like ``separate_failed_files`` does.
+
+        With ``snapshot_file``, the first call also records the information read
+        from the database in that file, one JSON line per folder or file, and
+        later calls read it from there instead of the database. Every file
+        information JSON of one export then lists the same file versions.
+
+        Returns the export data JSON and the list of excluded files, or None if
+        the source storage has no institution.
+        """
+        snapshot = None
+        if snapshot_file and os.path.exists(snapshot_file):
+            institution_json, projects_numb = self._read_snapshot_header(snapshot_file)
+            folders = self._iter_snapshot(snapshot_file, 'folder')
+            source_files = self._iter_snapshot(snapshot_file, 'file')
+        else:
+            institution, institution_json = self._source_institution_json()
+            if not institution:
+                return None
+            projects_ids = self._source_projects_ids(institution)
+            projects_numb = len(projects_ids)
+            folders = self.iter_folder_information(projects_ids)
+            source_files = self.iter_file_information(projects_ids)
+            if snapshot_file:
+                # renamed into place once complete, a broken snapshot is never read back
+                snapshot = open(snapshot_file + '.part', 'w', encoding='utf-8')
+                snapshot.write(json.dumps({'institution': institution_json, 'projects_numb': projects_numb},
+                                          ensure_ascii=False) + '\n')
+        exclude_versions = exclude_versions or {}
+        excluded_files = []
+        files_numb = size = 0
+
+        def record(kind, items):
+            for item in items:
+                if snapshot:
+                    snapshot.write(json.dumps({kind: item}, ensure_ascii=False) + '\n')
+                yield item
+
+        def iter_files():
+            nonlocal files_numb, size
+            for file_info in record('file', source_files):
+                excluded_ids = exclude_versions.get(file_info['id'])
+                if excluded_ids:
+                    excluded = [version for version in file_info['version'] if version['identifier'] in excluded_ids]
+                    if excluded:
+                        excluded_file = dict(file_info)
+                        excluded_file['version'] = excluded
+                        excluded_files.append(excluded_file)
+                        file_info['version'] = [
+                            version for version in file_info['version'] if version['identifier'] not in excluded_ids
+                        ]
+                        if not file_info['version']:
+                            continue
+                files_numb += len(file_info['version'])
+                size += sum(version['size'] for version in file_info['version'])
+                yield file_info
+
+        try:
+            with open(output_file, 'w', encoding='utf-8') as write_file:
+                try:
+                    write_file.write('{\n  "institution": ')
+                    write_file.write(_dumps_indented(institution_json, 1))
+                    write_file.write(',\n  "folders": ')
+                    _write_json_array(write_file, record('folder', folders))
+                    write_file.write(',\n  "files": ')
+                    _write_json_array(write_file, iter_files())
+                    write_file.write('\n}')
+                except Exception as exc:
+                    raise Exception(f'Cannot write json file. Exception: {str(exc)}')
+        except Exception:
+            if snapshot:
+                snapshot.close()
+                os.remove(snapshot_file + '.part')
+            raise
+        if snapshot:
+            snapshot.close()
+            os.replace(snapshot_file + '.part', snapshot_file)
+
+        export_data_json = self._export_data_json(
+            institution_json, projects_numb=projects_numb, files_numb=files_numb, size=size)
+        return export_data_json, excluded_files
+
+    def get_source_file_versions_min(self, file_info_json=None, snapshot_file=None):
+        """List (project id, provider, path, version, hash, file id) of every
+        file version to export, from ``file_info_json``, the ``snapshot_file``
+        recorded by ``write_file_information_json`` or, if neither is given,
+        straight from the database.
+        """
+        if file_info_json is not None:
+            files = file_info_json.get('files', [])
+        elif snapshot_file is not None:
+            files = self._iter_snapshot(snapshot_file, 'file')
+        else:
+            institution, _ = self._source_institution_json()
+            if not institution:
+                return []
+            files = self.iter_file_information(self._source_projects_ids(institution))
+
         file_versions = []
-        for file in file_info_json.get('files', []):
+        for file in files:
             project_id = file.get('project').get('id')
             provider = file.get('provider')
             file_path = file.get('path')
@@ -353,6 +533,11 @@ class ExportData(base.BaseModel):
         """/tmp/_export_{source.id}_{process_start_timestamp}.json as temporary file"""
         return os.path.join(admin_settings.TEMPORARY_PATH, '_' + self.export_data_folder_name + '.json')
 
+    @property
+    def export_data_snapshot_temp_file_path(self):
+        """/tmp/_export_{source.id}_{process_start_timestamp}.snapshot.jsonl as temporary file"""
+        return os.path.join(admin_settings.TEMPORARY_PATH, '_' + self.export_data_folder_name + '.snapshot.jsonl')
+
     def get_export_data_filename(self, institution_guid=None):
         """get export_data_{institution_guid}_{process_start_timestamp}.json file name for each institution"""
         if not institution_guid:
@@ -552,6 +737,54 @@ class ExportData(base.BaseModel):
         )
         return requests.get(url, cookies=cookies, stream=True)
 
+    def get_incremental_base(self):
+        """Get the latest completed export of the same source to the same location, or None."""
+        return ExportData.objects.filter(
+            source=self.source,
+            location=self.location,
+            status__in=self.EXPORT_DATA_AVAILABLE,
+            is_deleted=False,
+            process_start__lt=self.process_start,
+        ).order_by('-process_start').first()
+
+    def take_over_copied_files(self, file_names):
+        """Record the data files in ``file_names`` that the incremental base export
+        already holds as data files of this export, without copying them.
+
+        Returns the set of file names taken over.
+        """
+        base_export = self.get_incremental_base()
+        if base_export is None:
+            return set()
+        file_names = set(file_names) - set(self.copied_files.values_list('file_name', flat=True))
+        taken_over = []
+        for file_name, stored_in_id in base_export.copied_files.values_list('file_name', 'stored_in_id').iterator():
+            if file_name in file_names:
+                taken_over.append(ExportDataCopiedFile(
+                    export_data=self, file_name=file_name, stored_in_id=stored_in_id or base_export.id,
+                ))
+        ExportDataCopiedFile.objects.bulk_create(taken_over, batch_size=admin_settings.EXPORT_DATA_MANIFEST_CHUNK_SIZE)
+        return {copied_file.file_name for copied_file in taken_over}
+
+    def holds_taken_over_files(self):
+        """Whether later exports list data files stored in the files folder of this export"""
+        return ExportDataCopiedFile.objects.filter(stored_in=self).exclude(export_data=self).exists()
+
+    def get_data_files_folders(self):
+        """Get file name -> /export_{source.id}_{process_start_timestamp}/files folder
+        path of the data files that are stored in the files folder of an earlier export.
+        """
+        folders = {}
+        stored_in = {}
+        for file_name, stored_in_id in self.copied_files.filter(
+            stored_in__isnull=False,
+        ).values_list('file_name', 'stored_in_id').iterator():
+            if stored_in_id not in stored_in:
+                stored_in_folder_name = ExportData.objects.get(id=stored_in_id).export_data_folder_name
+                stored_in[stored_in_id] = f'/{stored_in_folder_name}/{self.EXPORT_DATA_FILES_FOLDER}'
+            folders[file_name] = stored_in[stored_in_id]
+        return folders
+
     def get_all_restored(self):
         return self.exportdatarestore_set.filter(status__in=self.EXPORT_DATA_AVAILABLE)
 
@@ -563,3 +796,23 @@ class ExportData(base.BaseModel):
 
     def get_latest_restored_data_with_destination_id(self, destination_id):
         return self.get_all_restored().filter(destination_id=destination_id).latest('process_end')
+
+
+class ExportDataCopiedFile(base.BaseModel):
+    """A hashed data file of an export, so that a resumed export process does
+    not copy it again.
+
+    The data file is in the files folder of ``stored_in``, an earlier export of
+    the same location it was taken over from, or of the export itself if
+    ``stored_in`` is None. Together the rows of an export index every data file
+    it lists.
+    """
+    export_data = models.ForeignKey(ExportData, related_name='copied_files', on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    # The holding export cannot be deleted permanently while other exports
+    # list its data files, see ExportData.holds_taken_over_files
+    stored_in = models.ForeignKey(ExportData, related_name='+', null=True, blank=True, on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'osf_export_data_copied_file'
+        unique_together = ('export_data', 'file_name')
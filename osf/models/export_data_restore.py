@@ -23,6 +23,7 @@ logger = logging.getLogger(__name__)
 
 __all__ = [
     'ExportDataRestore',
+    'ExportDataRestoredFile',
 ]
 
 
@@ -35,6 +36,8 @@ class ExportDataRestore(base.BaseModel):
     status = models.CharField(choices=ExportData.EXPORT_DATA_STATUS_CHOICES, max_length=255)
     task_id = models.CharField(max_length=255, null=True, blank=True)
     creator = models.ForeignKey('OSFUser', on_delete=models.CASCADE)
+    # the last restore step reached, kept to resume a stopped restore
+    process_step = models.IntegerField(default=0)
 
     class Meta:
         db_table = 'osf_export_data_restore'
@@ -214,3 +217,17 @@ class ExportDataRestore(base.BaseModel):
         for name, value in kwargs.items():
             setattr(self, name, value)
         self.save()
+
+
+class ExportDataRestoredFile(base.BaseModel):
+    """A file version of the export data already copied to the destination
+    storage, so that a resumed restore process does not copy it again."""
+    export_data_restore = models.ForeignKey(ExportDataRestore, related_name='restored_files', on_delete=models.CASCADE)
+    # id of the file in the file information of the export data
+    file_id = models.IntegerField()
+    version_id = models.CharField(max_length=255)
+    file_node = models.ForeignKey(BaseFileNode, null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        db_table = 'osf_export_data_restored_file'
+        unique_together = ('export_data_restore', 'file_id', 'version_id')
@@ -90,6 +90,10 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
     _history = DateTimeAwareJSONField(default=list, blank=True)
     # A concrete version of a FileNode, must have an identifier
     versions = models.ManyToManyField('FileVersion', through='BaseFileVersionsThrough')
+    # Aggregates of ``versions`` kept up to date by ``update_version_aggregates`` so that folder
+    # listings don't have to scan the versions of every child. NULL until backfilled
+    version_count = models.PositiveIntegerField(blank=True, null=True)
+    latest_version = models.ForeignKey('FileVersion', blank=True, null=True, related_name='+', on_delete=models.SET_NULL)
 
     target_content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     target_object_id = models.PositiveIntegerField()
@@ -103,6 +107,8 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
     name = models.TextField(blank=True)
     _path = models.TextField(blank=True, null=True)  # 1950 on prod
     _materialized_path = models.TextField(blank=True, null=True)  # 482 on staging
+    # Materialized path of an osfstorage node, maintained on save (see OsfStorageFileNode). NULL until backfilled
+    _stored_materialized_path = models.TextField(blank=True, null=True)
 
     is_deleted = False
     deleted_on = NonNaiveDateTimeField(blank=True, null=True)
@@ -272,8 +278,21 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
         """
         version_name = name or self.name
         BaseFileVersionsThrough.objects.create(fileversion=version, basefilenode=self, version_name=version_name)
+        self.update_version_aggregates()
         return version
 
+    def update_version_aggregates(self):
+        """Recompute ``version_count`` and ``latest_version`` from the versions table.
+
+        Written with an UPDATE so that callers holding other unsaved changes are not saved as a side effect.
+        """
+        self.version_count = self.versions.count()
+        self.latest_version = self.versions.order_by('-created').first()
+        BaseFileNode.objects.filter(id=self.id).update(
+            version_count=self.version_count,
+            latest_version=self.latest_version,
+        )
+
     @classmethod
     def files_checked_out(cls, user):
         """
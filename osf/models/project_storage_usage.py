@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from django.db import models
+
+from osf.models.base import BaseModel
+
+
+class ProjectStorageUsage(BaseModel):
+    """Rollup of the FileInfo sizes of a project's files.
+
+    Maintained incrementally from the file added/updated/removed deltas, so a
+    user's used quota is the sum of a handful of rows instead of a scan over
+    every file of every project they created.
+    """
+    node = models.OneToOneField('AbstractNode', on_delete=models.CASCADE, related_name='storage_usage')
+    used = models.BigIntegerField(default=0)
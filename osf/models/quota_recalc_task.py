@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from django.db import models
+
+from osf.models.base import BaseModel
+
+
+class QuotaRecalcTask(BaseModel):
+    """Progress of the celery job that recalculates every user's used quota.
+
+    Users are processed in ascending id order; ``last_user_id`` is the cursor an
+    interrupted job resumes from.
+    """
+    task_id = models.CharField(max_length=80, blank=True, default='')
+    last_user_id = models.IntegerField(default=0)
+    total_users = models.IntegerField(default=0)
+    processed_users = models.IntegerField(default=0)
+    elapsed = models.FloatField(default=0)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def throughput(self):
+        """Processed users per second."""
+        return self.processed_users / self.elapsed if self.elapsed else 0.0
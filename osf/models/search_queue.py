@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from django.db import models
+from django.utils import timezone
+
+from osf.models.base import BaseModel
+
+
+class PendingSearchUpdate(BaseModel):
+    """A search document waiting to be reindexed by ``website.search.index_queue``.
+
+    Repeated updates of one document before the queue is flushed share a single row:
+    ``created`` is the time of the oldest pending update and ``last_queued`` the time of
+    the newest one. ``claimed_at`` is set while a flush sends the document and cleared when
+    the document is queued again in the meantime.
+    """
+    NODE = 'node'
+    FILE = 'file'
+    USER = 'user'
+    DOC_TYPES = (
+        (NODE, 'node'),
+        (FILE, 'file'),
+        (USER, 'user'),
+    )
+
+    doc_type = models.CharField(max_length=8, choices=DOC_TYPES)
+    object_id = models.PositiveIntegerField()
+    index = models.CharField(max_length=255)
+    last_queued = models.DateTimeField(default=timezone.now, db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('doc_type', 'object_id', 'index')
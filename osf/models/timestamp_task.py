@@ -1,3 +1,4 @@
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from osf.models.base import BaseModel, ObjectIDMixin
 
@@ -7,3 +8,11 @@ class TimestampTask(ObjectIDMixin, BaseModel):
     node = models.OneToOneField('Node', on_delete=models.CASCADE)
     task_id = models.CharField(max_length=80)
     requester = models.ForeignKey('OSFUser', on_delete=models.CASCADE)
+
+    # Progress checkpoint shared by the shards of a run, so that a restarted
+    # run of the same operation skips the files that are already done.
+    operation = models.CharField(max_length=16, blank=True, default='')
+    total_files = models.IntegerField(default=0)
+    shard_count = models.IntegerField(default=0)
+    completed_file_ids = ArrayField(models.CharField(max_length=24), default=list, blank=True)
+    checkpointed_at = models.DateTimeField(null=True, blank=True)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from addons.osfstorage.tests.factories import FileVersionFactory
+from osf.management.commands.backfill_file_version_aggregates import backfill_file_version_aggregates
+from osf.models import BaseFileNode
+from osf_tests.factories import ProjectFactory
+
+
+@pytest.mark.django_db
+class TestBackfillFileVersionAggregates:
+
+    @pytest.fixture()
+    def root(self):
+        return ProjectFactory().get_addon('osfstorage').get_root()
+
+    @pytest.fixture()
+    def files(self, root):
+        with_versions = root.append_file('with_versions')
+        versions = [FileVersionFactory() for _ in range(3)]
+        for version in versions:
+            with_versions.add_version(version)
+        without_versions = root.append_file('without_versions')
+        BaseFileNode.objects.filter(id__in=[with_versions.id, without_versions.id]).update(
+            version_count=None, latest_version=None,
+        )
+        return with_versions, without_versions, versions
+
+    def test_backfill(self, files):
+        with_versions, without_versions, versions = files
+        assert backfill_file_version_aggregates(chunk_size=1) >= 2
+
+        with_versions.reload()
+        without_versions.reload()
+        assert with_versions.version_count == 3
+        assert with_versions.latest_version == versions[-1]
+        assert without_versions.version_count == 0
+        assert without_versions.latest_version is None
+
+        # Everything is filled in, so a second run has nothing to do
+        assert backfill_file_version_aggregates() == 0
+
+    def test_dry_run(self, files):
+        with_versions, _, _ = files
+        assert backfill_file_version_aggregates(dry_run=True) >= 2
+
+        with_versions.reload()
+        assert with_versions.version_count is None
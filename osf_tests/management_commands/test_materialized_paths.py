@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from osf.management.commands.backfill_materialized_paths import backfill_materialized_paths
+from osf.management.commands.check_materialized_paths import check_materialized_paths
+from osf.models import BaseFileNode
+from osf_tests.factories import ProjectFactory
+
+
+@pytest.mark.django_db
+class TestMaterializedPaths:
+
+    @pytest.fixture()
+    def tree(self):
+        root = ProjectFactory().get_addon('osfstorage').get_root()
+        folder = root.append_folder('Cloud')
+        nested = folder.append_folder('Rain')
+        child = nested.append_file('Carp')
+        return root, folder, nested, child
+
+    def test_consistent(self, tree):
+        assert check_materialized_paths() == []
+
+    def test_backfill(self, tree):
+        root, folder, nested, child = tree
+        BaseFileNode.objects.filter(id__in=[node.id for node in tree]).update(_stored_materialized_path=None)
+
+        assert len(check_materialized_paths()) == 4
+        assert backfill_materialized_paths(chunk_size=1) == 4
+
+        expected = {root.id: '/', folder.id: '/Cloud/', nested.id: '/Cloud/Rain/', child.id: '/Cloud/Rain/Carp'}
+        stored = dict(BaseFileNode.objects.filter(id__in=expected.keys()).values_list('id', '_stored_materialized_path'))
+        assert stored == expected
+        assert check_materialized_paths() == []
+
+    def test_backfill_dry_run(self, tree):
+        _, _, _, child = tree
+        BaseFileNode.objects.filter(id=child.id).update(_stored_materialized_path=None)
+
+        assert backfill_materialized_paths(dry_run=True) == 1
+        assert BaseFileNode.objects.get(id=child.id)._stored_materialized_path is None
+
+    def test_check_and_fix(self, tree):
+        _, _, nested, child = tree
+        BaseFileNode.objects.filter(id=nested.id).update(_stored_materialized_path='/Wrong/')
+
+        drifted = check_materialized_paths(fix=True)
+        assert drifted == [(nested.id, '/Wrong/', '/Cloud/Rain/')]
+        assert BaseFileNode.objects.get(id=nested.id)._stored_materialized_path == '/Cloud/Rain/'
+        assert check_materialized_paths() == []
@@ -2,13 +2,17 @@
 import re
 import datetime
 import functools
+import logging
+import os
 import random
+import time
 from contextlib import ExitStack, contextmanager
 
 import responses
 import mock  # noqa
 from django.utils import timezone
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
 from mock import call
 import pytest
 from nose.tools import *  # noqa: F403
@@ -28,7 +32,7 @@ from website.archiver.decorators import fail_archive_on_error
 
 from website import mails
 from website import settings
-from osf.models import RegistrationSchema, Registration
+from osf.models import Guid, RegistrationSchema, Registration
 from osf.utils.sanitize import strip_html
 from addons.base.models import BaseStorageAddon
 from api.base.utils import waterbutler_api_url_for
@@ -48,6 +52,8 @@ SILENT_LOGGERS = (
 for each in SILENT_LOGGERS:
     logging.getLogger(each).setLevel(logging.CRITICAL)
 
+logger = logging.getLogger(__name__)
+
 sha256_factory = _unique(fake.sha256)
 name_factory = _unique(fake.ean13)
 
@@ -978,6 +984,88 @@ class TestArchiverUtils(ArchiverTestCase):
             archiver_utils.get_file_map(node)
             assert_equal(mock_get_file_tree.call_count, call_count)
 
+    def test_find_registration_file_with_index(self):
+        file_tree = file_tree_factory(3, 3, 3)
+        duplicate = file_factory(name='duplicate')
+        file_tree['children'] += [duplicate, dict(duplicate, path='/other')]
+        with mock.patch.object(BaseStorageAddon, '_get_file_tree', mock.Mock(return_value=file_tree)):
+            index = archiver_utils.get_file_map_index(self.dst)
+
+        value = {
+            'sha256': duplicate['extra']['hashes']['sha256'],
+            'selectedFileName': 'duplicate',
+            'nodeId': self.src._id,
+        }
+        # The first file in file map order wins, as with the former linear scan
+        file_info, node_id = archiver_utils.find_registration_file(value, self.dst, file_map_index=index)
+        assert_equal(file_info['path'], duplicate['path'])
+        assert_equal(node_id, self.dst._id)
+
+        assert_equal(
+            archiver_utils.find_registration_file(dict(value, nodeId=self.dst._id), self.dst, file_map_index=index),
+            (None, None),
+        )
+        assert_equal(
+            archiver_utils.find_registration_file(dict(value, selectedFileName='other'), self.dst, file_map_index=index),
+            (None, None),
+        )
+
+    def test_get_file_map_index_uses_first_guid_of_registered_from(self):
+        old_guid = Guid.objects.create(referent=self.src)
+        Guid.objects.filter(id=old_guid.id).update(created=self.src.guids.last().created - datetime.timedelta(days=1))
+        new_guid = Guid.objects.create(referent=self.src)
+        assert_equal(self.src._id, new_guid._id)
+
+        file_tree = file_tree_factory(0, 0, 0)
+        file_tree['children'] = [file_factory(name='file')]
+        with mock.patch.object(BaseStorageAddon, '_get_file_tree', mock.Mock(return_value=file_tree)):
+            index = archiver_utils.get_file_map_index(self.dst)
+
+        registered_from_ids = {registered_from_id for _, _, registered_from_id in index}
+        assert_equal(registered_from_ids, {new_guid._id})
+
+    def test_find_registration_files_benchmark(self):
+        files_numb = int(os.environ.get('ARCHIVER_FILE_MAP_BENCHMARK_FILES', 2000))
+        lookups_numb = int(os.environ.get('ARCHIVER_FILE_MAP_BENCHMARK_LOOKUPS', 200))
+        file_tree = file_tree_factory(0, 0, 0)
+        file_tree['children'] = [file_factory() for _ in range(files_numb)]
+        values = {
+            'extra': [
+                {
+                    'sha256': file_info['extra']['hashes']['sha256'],
+                    'selectedFileName': file_info['name'],
+                    'nodeId': self.src._id,
+                }
+                for file_info in random.sample(file_tree['children'], min(lookups_numb, files_numb))
+            ],
+        }
+
+        with mock.patch.object(BaseStorageAddon, '_get_file_tree', mock.Mock(return_value=file_tree)):
+            started = time.time()
+            with CaptureQueriesContext(connection) as queries:
+                found = archiver_utils.find_registration_files(values, self.dst)
+            indexed_elapsed = time.time() - started
+
+            # The former lookup: a scan of the whole file map per selected file, without its
+            # query per file map entry for the source node
+            file_map = list(archiver_utils.get_file_map(self.dst))
+            started = time.time()
+            for value in values['extra']:
+                next((
+                    (file_info, node_id) for sha256, file_info, node_id in file_map
+                    if sha256 == value['sha256'] and file_info['name'] == value['selectedFileName']
+                ), None)
+            linear_elapsed = time.time() - started
+
+        logger.info(
+            'archiver file map benchmark: files={} lookups={} indexed={:.3f}s queries={} '
+            'linear_scan={:.3f}s'.format(
+                files_numb, len(values['extra']), indexed_elapsed, len(queries), linear_elapsed))
+        assert_true(all(file_info for file_info, _, _ in found))
+        assert_true(all(node_id == self.dst._id for _, node_id, _ in found))
+        # The source nodes of the whole file map are loaded with one query
+        assert_true(len(queries) < 10)
+
 
 class TestArchiverListeners(ArchiverTestCase):
 
@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import datetime
 import mock
+import os
+import shutil
+import tempfile
 import time
 import unittest
 import logging
 import functools
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from elasticsearch2 import helpers
 from nose.tools import *  # noqa: F403
 import pytest
 
@@ -15,9 +23,13 @@ from framework.auth.core import Auth
 from website import settings
 import website.search.search as search
 from website.search import elastic_search
+from website.search import index_queue
 from website.search.util import build_query
-from website.search_migration.migrate import migrate
+from website.search_migration import JSON_UPDATE_NODES_SQL
+from website.search_migration.migrate import Checkpoint, migrate, sql_migrate
 from osf.models import (
+    Guid,
+    PendingSearchUpdate,
     Retraction,
     NodeLicense,
     OSFGroup,
@@ -1403,6 +1415,177 @@ class TestSearchMigration(OsfTestCase):
         res = self.es.search(index=settings.ELASTIC_INDEX, doc_type='collectionSubmission', search_type='count', body=count_query)
         assert res['hits']['total'] == 2
 
+    def test_migration_comments_from_sql(self):
+        comment = factories.CommentFactory(node=self.project, user=self.user, content='Ground Control')
+        factories.CommentFactory(node=self.project, user=self.user, is_deleted=True)
+
+        migrate(delete=False, index=settings.ELASTIC_INDEX, app=self.app.app)
+
+        doc = self.es.get(index=settings.ELASTIC_INDEX, doc_type='project', id=self.project._id)
+        assert doc['_source']['comments'] == {str(comment.id): 'Ground Control'}
+
+    def test_migration_resumes_from_checkpoint(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        checkpoint = os.path.join(tmp_dir, 'checkpoint.json')
+
+        with mock.patch('website.search_migration.migrate.migrate_wikis', side_effect=RuntimeError):
+            with assert_raises(RuntimeError):
+                migrate(delete=False, index=settings.ELASTIC_INDEX, app=self.app.app, checkpoint=checkpoint)
+        state = Checkpoint(checkpoint).state
+        assert state['index'] == settings.ELASTIC_INDEX + '_v1'
+        assert state['steps'] == ['nodes', 'files']
+        assert state['ranges']['nodes']
+
+        with mock.patch('website.search_migration.migrate.migrate_nodes') as mock_migrate_nodes:
+            migrate(delete=False, index=settings.ELASTIC_INDEX, app=self.app.app, checkpoint=checkpoint)
+        assert not mock_migrate_nodes.called
+        var = self.es.indices.get_aliases()
+        assert_equal(list(var[settings.ELASTIC_INDEX + '_v1']['aliases'].keys())[0], settings.ELASTIC_INDEX)
+        assert not os.path.exists(checkpoint)
+
+    def test_sql_migrate_skips_finished_ranges(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        checkpoint = Checkpoint(os.path.join(tmp_dir, 'checkpoint.json'))
+        checkpoint.start(settings.ELASTIC_INDEX)
+        checkpoint.finish_range('nodes', 0, 10)
+
+        with mock.patch('website.search_migration.migrate._migrate_range', side_effect=lambda task: (task[1], task[2], {})) as mock_range:
+            sql_migrate(settings.ELASTIC_INDEX, JSON_UPDATE_NODES_SQL, 25, 10, checkpoint=checkpoint, label='nodes',
+                        spam_flagged_removed_from_search=False)
+        assert [call[0][0][1:3] for call in mock_range.call_args_list] == [(10, 20), (20, 30), (30, 40)]
+        assert checkpoint.finished_ranges('nodes') == {(0, 10), (10, 20), (20, 30), (30, 40)}
+
+@pytest.mark.enable_search
+@pytest.mark.enable_enqueue_task
+class TestSearchIndexQueue(OsfTestCase):
+
+    def setUp(self):
+        super(TestSearchIndexQueue, self).setUp()
+        self.node = factories.ProjectFactory(is_public=True, title='Otis')
+        self.root = self.node.get_addon('osfstorage').get_root()
+        patcher = mock.patch.object(settings, 'SEARCH_INDEX_QUEUE_ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def flush(self):
+        flushed = index_queue.flush(delay=0)
+        elastic_search.client().indices.refresh()
+        return flushed
+
+    def test_updates_coalesce(self):
+        file_ = self.root.append_file('Shake.wav')
+        file_.save()
+        file_.save()
+        assert PendingSearchUpdate.objects.filter(doc_type='file', object_id=file_.id).count() == 1
+        assert_equal(len(query_file('Shake.wav')['results']), 0)
+
+        with mock.patch('website.search.index_queue.helpers.bulk', wraps=helpers.bulk) as mock_bulk:
+            flushed = self.flush()
+        assert flushed['file'] == 1
+        assert mock_bulk.call_count == 1
+        assert_equal(len(query_file('Shake.wav')['results']), 1)
+        assert not PendingSearchUpdate.objects.filter(doc_type='file').exists()
+
+    def test_update_queued_during_flush_is_kept(self):
+        file_ = self.root.append_file('Shake.wav')
+
+        def bulk(client, actions, **kwargs):
+            # The file is saved again while its previous update is being sent
+            index_queue.enqueue('file', [file_.id])
+            return helpers.bulk(client, actions, **kwargs)
+
+        with mock.patch('website.search.index_queue.helpers.bulk', side_effect=bulk):
+            index_queue.flush(delay=0, batch_size=1000)
+        entry = PendingSearchUpdate.objects.get(doc_type='file', object_id=file_.id)
+        assert entry.claimed_at is None
+
+        self.flush()
+        assert not PendingSearchUpdate.objects.filter(doc_type='file', object_id=file_.id).exists()
+
+    def test_stale_claims_are_flushed_again(self):
+        file_ = self.root.append_file('Shake.wav')
+        # Claimed by a flush that is still running
+        PendingSearchUpdate.objects.filter(doc_type='file', object_id=file_.id).update(claimed_at=timezone.now())
+        assert not self.flush()['file']
+
+        PendingSearchUpdate.objects.filter(doc_type='file', object_id=file_.id).update(
+            claimed_at=timezone.now() - datetime.timedelta(seconds=settings.SEARCH_INDEX_QUEUE_CLAIM_TIMEOUT + 1),
+        )
+        assert self.flush()['file'] == 1
+        assert not PendingSearchUpdate.objects.filter(doc_type='file', object_id=file_.id).exists()
+
+    def test_recent_updates_wait(self):
+        self.root.append_file('Shake.wav')
+        assert not index_queue.flush(delay=60)
+        assert index_queue.get_metrics()['depth'] >= 1
+
+    def test_updates_that_keep_coming_are_flushed_after_max_wait(self):
+        file_ = self.root.append_file('Shake.wav')
+        PendingSearchUpdate.objects.filter(doc_type='file', object_id=file_.id).update(
+            created=timezone.now() - datetime.timedelta(seconds=61),
+        )
+        # Queued again just now
+        index_queue.enqueue('file', [file_.id])
+        assert index_queue.flush(delay=60, max_wait=60)['file'] == 1
+        assert not PendingSearchUpdate.objects.filter(doc_type='file', object_id=file_.id).exists()
+
+    def test_rejected_documents_are_queued_again(self):
+        file_ = self.root.append_file('Shake.wav')
+        other = self.root.append_file('Respect.wav')
+
+        def bulk(client, actions, **kwargs):
+            return len(actions) - 1, [{'index': {
+                '_index': elastic_search.es_index(None), '_type': 'file', '_id': file_._id, 'status': 400,
+            }}]
+
+        with mock.patch('website.search.index_queue.helpers.bulk', side_effect=bulk) as mock_bulk:
+            index_queue.flush(delay=0)
+        assert mock_bulk.call_count == 1
+        entry = PendingSearchUpdate.objects.get(doc_type='file', object_id=file_.id)
+        assert entry.claimed_at is None
+        assert not PendingSearchUpdate.objects.filter(doc_type='file', object_id=other.id).exists()
+
+    def test_document_that_cannot_be_built_is_dropped(self):
+        file_ = self.root.append_file('Shake.wav')
+        self.root.append_file('Respect.wav')
+        serialize_file = elastic_search.serialize_file
+
+        def serialize(file_node, **kwargs):
+            if file_node.id == file_.id:
+                raise ValueError('broken document')
+            return serialize_file(file_node, **kwargs)
+
+        with mock.patch('website.search.elastic_search.serialize_file', side_effect=serialize):
+            assert self.flush()['file'] == 2
+        assert_equal(len(query_file('Respect.wav')['results']), 1)
+        assert not PendingSearchUpdate.objects.filter(doc_type='file').exists()
+
+    def test_node_update_queues_files(self):
+        file_ = self.root.append_file('Pain In My Heart.mp3')
+        PendingSearchUpdate.objects.all().delete()
+
+        self.node.title = 'Redding'
+        self.node.save()
+        self.flush()
+        assert_equal(len(query('Redding')['results']), 1)
+        # The node's files are queued again rather than indexed with the node
+        assert PendingSearchUpdate.objects.filter(doc_type='file', object_id=file_.id).exists()
+
+    def test_delete_discards_pending_update(self):
+        file_ = self.root.append_file('Dreams.wav')
+        file_.delete()
+        assert not PendingSearchUpdate.objects.filter(doc_type='file', object_id=file_.id).exists()
+
+    def test_metrics(self):
+        assert index_queue.get_metrics() == {'depth': 0, 'lag': 0.0}
+        index_queue.enqueue('user', [factories.UserFactory().id])
+        metrics = index_queue.get_metrics()
+        assert metrics['depth'] == 1
+        assert metrics['lag'] >= 0
+
+
 @pytest.mark.enable_search
 @pytest.mark.enable_enqueue_task
 class TestSearchFiles(OsfTestCase):
@@ -1544,3 +1727,86 @@ class TestSearchFiles(OsfTestCase):
 
         find = query_file('GreenLight.mp3')['results']
         assert_equal(len(find), 0)
+
+
+class TestFormatResults(OsfTestCase):
+
+    def setUp(self):
+        super(TestFormatResults, self).setUp()
+        self.user = factories.UserFactory(jobs=[{
+            'institution': 'Lab', 'department': 'Physics', 'title': 'PI', 'ongoing': True,
+        }])
+        self.project = factories.ProjectFactory(creator=self.user, is_public=True)
+
+    def build_page(self, size):
+        results = []
+        for i in range(size):
+            user = factories.UserFactory()
+            component = factories.NodeFactory(parent=self.project, creator=user, is_public=True)
+            wiki = WikiPage.objects.create_for_node(component, 'page{}'.format(i), 'content', Auth(user))
+            file_node = component.get_addon('osfstorage').get_root().append_file('file{}'.format(i))
+            results.extend([
+                {'category': 'user', 'id': user._id},
+                {'category': 'wiki', 'id': wiki._id, 'creator_id': user._id, 'modifier_id': self.user._id},
+                {'category': 'file', 'id': file_node._id, 'parent_id': component._id,
+                 'creator_id': user._id, 'modifier_id': None},
+                {'category': 'component', 'parent_id': self.project._id, 'contributors': [], 'url': component.url,
+                 'title': component.title, 'tags': [], 'is_registration': False, 'is_retracted': False,
+                 'is_pending_retraction': False, 'embargo_end_date': None, 'is_pending_embargo': False,
+                 'description': '', 'wikis': [], 'creator_id': user._id, 'modifier_id': self.user._id},
+            ])
+        results.append({'category': 'user', 'id': self.user._id})
+        return results
+
+    def count_queries(self, func, *args):
+        with CaptureQueriesContext(connection) as ctx:
+            func(*args)
+        return len(ctx.captured_queries)
+
+    def test_format_results(self):
+        results = self.build_page(1)
+        expected_component = elastic_search.format_result(dict(results[3]), self.project._id)
+
+        expected_folder_name = os.path.dirname(elastic_search.get_file_path(results[2]['id']))
+
+        user_result, wiki_result, file_result, component_result, self_result = elastic_search.format_results(results)
+        assert_equal(user_result['url'], '/profile/' + results[0]['id'])
+        assert_equal(self_result['ongoing_job'], 'Lab')
+        assert_equal(self_result['ongoing_job_department'], 'Physics')
+        assert_equal(wiki_result['name'], 'page0')
+        assert_equal(wiki_result['modifier_name'], self.user.fullname)
+        assert_equal(file_result['folder_name'], expected_folder_name)
+        assert_equal(file_result['parent_title'], results[3]['title'])
+        assert_equal(file_result['modifier_name'], '')
+        assert_equal(component_result, expected_component)
+        assert_equal(component_result['parent_title'], self.project.title)
+
+    def test_format_results_query_count(self):
+        small = self.count_queries(elastic_search.format_results, self.build_page(1))
+        large = self.count_queries(elastic_search.format_results, self.build_page(5))
+        assert_equal(small, large)
+
+    def build_hits(self, size):
+        hits = []
+        for _ in range(size):
+            comment = factories.CommentFactory(node=self.project, user=self.user)
+            reply = factories.CommentFactory(node=self.project, user=factories.UserFactory(), target=Guid.load(comment._id))
+            hits.append({'_source': {'highlight': {
+                'comments.{}'.format(comment.id): ['comment'],
+                'comments.{}'.format(reply.id): ['reply'],
+                'title': ['title'],
+            }}})
+        hits.append({'_source': {'highlight': {'title': ['title']}}})
+        return hits
+
+    def test_set_last_comment(self):
+        hits = elastic_search.set_last_comment(self.build_hits(1))
+        assert_equal(hits[0]['_source']['comment']['text'], 'reply')
+        assert_equal(hits[0]['_source']['comment']['replyto_user_id'], self.user._id)
+        assert_equal(hits[0]['_source']['comment']['replyto_user_name'], self.user.fullname)
+        assert_is_none(hits[1]['_source']['comment'])
+
+    def test_set_last_comment_query_count(self):
+        small = self.count_queries(elastic_search.set_last_comment, self.build_hits(1))
+        large = self.count_queries(elastic_search.set_last_comment, self.build_hits(5))
+        assert_equal(small, large)
@@ -1,11 +1,20 @@
 import copy
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
 from datetime import datetime
 
 import mock
 import pytest
 from addons.osfstorage.tests.factories import FileVersionFactory
+from django.db import connection
 from django.http import JsonResponse
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from nose import tools as nt
 
 from addons.osfstorage.models import Region
@@ -26,6 +35,8 @@ from osf_tests.factories import (
 )
 from admin_tests.rdm_custom_storage_location.export_data.test_utils import FAKE_DATA
 
+logger = logging.getLogger(__name__)
+
 
 @pytest.mark.feature_202210
 @pytest.mark.django_db
@@ -449,6 +460,146 @@ class TestExportData(TestCase):
         nt.assert_equal(res, expected_value)
 
 
+@pytest.mark.feature_202210
+@pytest.mark.django_db
+class TestExportDataManifest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        default_region = Region.objects.get(_id=DEFAULT_REGION_ID)
+        cls.inst_region = inst_region = RegionFactory(
+            name=default_region.name,
+            waterbutler_credentials=default_region.waterbutler_credentials,
+            waterbutler_settings=default_region.waterbutler_settings
+        )
+        cls.institution = InstitutionFactory.create(_id=inst_region.guid)
+        cls.export_data = ExportDataFactory(source=inst_region)
+        cls.project = ProjectFactory()
+        cls.institution.nodes.set([cls.project])
+
+    def setUp(self):
+        super(TestExportDataManifest, self).setUp()
+        self.output_file = tempfile.NamedTemporaryFile(suffix='.json', delete=False).name
+
+    def tearDown(self):
+        super(TestExportDataManifest, self).tearDown()
+        os.remove(self.output_file)
+
+    def seed_files(self, files_numb, versions_numb):
+        target = AbstractNode(id=self.project.id)
+        files = []
+        for i in range(files_numb):
+            file = OsfStorageFileFactory.create(name='file{}.txt'.format(i), target=target)
+            for _ in range(versions_numb):
+                BaseFileVersionsThroughFactory.create(
+                    version_name=file.name,
+                    basefilenode=file,
+                    fileversion=FileVersionFactory(region=self.inst_region, size=3),
+                )
+            files.append(file)
+        return files
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as ctx:
+            result = func()
+        # osfstorage materialized paths are still computed per file
+        queries = [query for query in ctx.captured_queries if 'materialized_path_cte' not in query['sql']]
+        return result, len(queries)
+
+    def test_write_file_information_json(self):
+        files = self.seed_files(3, 2)
+        files[0].tags.set([TagFactory(name='tag1', system=False)])
+
+        export_data_json, excluded_files = self.export_data.write_file_information_json(self.output_file)
+
+        with open(self.output_file, encoding='utf-8') as f:
+            file_info_json = json.load(f)
+        expected_export_data_json, expected_file_info_json = \
+            self.export_data.extract_file_information_json_from_source_storage()
+        nt.assert_equal(export_data_json, expected_export_data_json)
+        nt.assert_equal(file_info_json, expected_file_info_json)
+        nt.assert_equal(excluded_files, [])
+        nt.assert_equal(export_data_json['files_numb'], 6)
+        nt.assert_equal(file_info_json['files'][0]['tags'], ['tag1'])
+
+    def test_write_file_information_json_exclude_versions(self):
+        files = self.seed_files(2, 2)
+        identifiers = [version.identifier for version in files[0].versions.all()]
+
+        export_data_json, excluded_files = self.export_data.write_file_information_json(
+            self.output_file, exclude_versions={
+                files[0].id: identifiers,
+                files[1].id: [files[1].versions.first().identifier],
+            })
+
+        with open(self.output_file, encoding='utf-8') as f:
+            file_info_json = json.load(f)
+        nt.assert_equal([file['id'] for file in file_info_json['files']], [files[1].id])
+        nt.assert_equal(len(file_info_json['files'][0]['version']), 1)
+        nt.assert_equal(export_data_json['files_numb'], 1)
+        nt.assert_equal(export_data_json['size'], 3)
+        nt.assert_equal([(file['id'], len(file['version'])) for file in excluded_files], [(files[0].id, 2), (files[1].id, 1)])
+
+    def test_write_file_information_json_from_snapshot(self):
+        files = self.seed_files(2, 2)
+        snapshot_file = self.output_file + '.snapshot.jsonl'
+        self.addCleanup(os.remove, snapshot_file)
+
+        first_json, _ = self.export_data.write_file_information_json(self.output_file, snapshot_file=snapshot_file)
+        with open(self.output_file, encoding='utf-8') as f:
+            first_file_info_json = json.load(f)
+        file_versions = self.export_data.get_source_file_versions_min(snapshot_file=snapshot_file)
+        nt.assert_equal(file_versions, self.export_data.get_source_file_versions_min(first_file_info_json))
+
+        # Uploaded while the export runs: not copied, so not listed either
+        self.seed_files(1, 1)
+        BaseFileVersionsThroughFactory.create(
+            version_name=files[1].name,
+            basefilenode=files[1],
+            fileversion=FileVersionFactory(region=self.inst_region, size=3),
+        )
+        identifier = files[0].versions.first().identifier
+        with mock.patch.object(self.export_data, 'iter_file_information') as mock_iter:
+            export_data_json, excluded_files = self.export_data.write_file_information_json(
+                self.output_file, exclude_versions={files[0].id: [identifier]}, snapshot_file=snapshot_file)
+        nt.assert_false(mock_iter.called)
+        nt.assert_equal(self.export_data.get_source_file_versions_min(snapshot_file=snapshot_file), file_versions)
+
+        with open(self.output_file, encoding='utf-8') as f:
+            file_info_json = json.load(f)
+        nt.assert_equal(file_info_json['folders'], first_file_info_json['folders'])
+        nt.assert_equal([file['id'] for file in file_info_json['files']], [files[0].id, files[1].id])
+        nt.assert_equal([len(file['version']) for file in file_info_json['files']], [1, 2])
+        nt.assert_equal([(file['id'], len(file['version'])) for file in excluded_files], [(files[0].id, 1)])
+        nt.assert_equal(export_data_json['files_numb'], first_json['files_numb'] - 1)
+
+    def test_query_count_does_not_depend_on_files_numb(self):
+        self.seed_files(2, 2)
+        _, few = self.count_queries(lambda: self.export_data.write_file_information_json(self.output_file))
+        self.seed_files(10, 2)
+        _, many = self.count_queries(lambda: self.export_data.write_file_information_json(self.output_file))
+        nt.assert_equal(few, many)
+
+    def test_manifest_benchmark(self):
+        files_numb = int(os.environ.get('EXPORT_MANIFEST_BENCHMARK_FILES', 50))
+        versions_numb = int(os.environ.get('EXPORT_MANIFEST_BENCHMARK_VERSIONS', 3))
+        self.seed_files(files_numb, versions_numb)
+
+        tracemalloc.start()
+        started = time.time()
+        (export_data_json, _), queries = self.count_queries(
+            lambda: self.export_data.write_file_information_json(self.output_file))
+        elapsed = time.time() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        logger.info(
+            'export manifest benchmark: files={} versions={} elapsed={:.3f}s queries={} '
+            'peak_traced={}KiB max_rss={}KiB'.format(
+                files_numb, versions_numb, elapsed, queries, peak // 1024,
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+        nt.assert_equal(export_data_json['files_numb'], files_numb * versions_numb)
+
+
 @pytest.mark.feature_202210
 @pytest.mark.django_db
 class TestExportDataWithRestoreData(TestCase):
@@ -18,8 +18,7 @@ django.setup()
 from scripts import utils as script_utils
 
 from website.app import init_app
-from addons.metadata.models import ERadRecordSet
-from admin.rdm_metadata.erad import ERAD_COLUMNS, validate_record
+from admin.rdm_metadata.erad import import_records
 
 
 logger = logging.getLogger(__name__)
@@ -29,21 +28,9 @@ def do_populate(file):
     _, filename = os.path.split(file)
     code, _ = os.path.splitext(filename)
 
-    recordset = ERadRecordSet.get_or_create(code=code)
-
+    # Rows are read and imported chunk by chunk
     with open(file, encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        for record_num, row in enumerate(reader):
-            validate_record(record_num, row)
-            kenkyusha_no = row['KENKYUSHA_NO']
-            kadai_id = row['KADAI_ID']
-            nendo = int(row['NENDO'])
-            record = recordset.get_or_create_record(kenkyusha_no, kadai_id, nendo)
-            for key in ERAD_COLUMNS:
-                setattr(record, key.lower(), row[key])
-            record.save()
-            logger.info(f'Row inserted: {kenkyusha_no}, {kadai_id}')
-    recordset.save()
+        import_records(code, csv.DictReader(f))
 
 
 def main(files, dry=True):
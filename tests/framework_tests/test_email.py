@@ -6,10 +6,13 @@ import mock
 from nose.tools import *  # noqa: F403
 import sendgrid
 
-from framework.email.tasks import send_email, _send_with_sendgrid
+from framework.email.tasks import (
+    send_email, send_emails, _send_with_sendgrid, _SMTPSender, EMAIL_SENT, EMAIL_FAILED, EMAIL_REFUSED
+)
 from website import settings
 from tests.base import fake
 from osf_tests.factories import fake_email
+from tests.utils import LocalSMTPServer
 
 # Check if local mail server is running
 SERVER_RUNNING = True
@@ -77,5 +80,55 @@ class TestEmail(unittest.TestCase):
         assert_false(ret)
 
 
+    @mock.patch('framework.email.tasks.sendgrid.SendGridClient')
+    def test_send_emails_whitelist_skip_is_refused(self, mock_client_class):
+        mock_client_class.return_value.send.return_value = 200, 'success'
+        whitelisted, other = fake_email(), fake_email()
+        emails = [
+            {'from_addr': fake_email(), 'to_addr': to_addr, 'subject': fake.bs(), 'message': fake.text()}
+            for to_addr in (whitelisted, other)
+        ]
+        with mock.patch.multiple(settings, USE_EMAIL=True, SENDGRID_API_KEY='key', SENDGRID_WHITELIST_MODE=True,
+                                 SENDGRID_EMAIL_WHITELIST=[whitelisted]):
+            results = send_emails(emails)
+        assert_equal(results, [EMAIL_SENT, EMAIL_REFUSED])
+
+    def test_send_emails_over_local_smtp(self):
+        emails = [
+            {'from_addr': fake_email(), 'to_addr': to_addr, 'subject': fake.bs(), 'message': fake.text(),
+             'ttls': False, 'login': False}
+            for to_addr in ('ok@example.com', 'refused@example.com', 'busy@example.com')
+        ]
+        with LocalSMTPServer() as server, \
+                mock.patch.multiple(settings, MAIL_SERVER=server.host, MAIL_PORT=server.port, USE_EMAIL=True,
+                                    SENDGRID_API_KEY=None):
+            results = send_emails(emails)
+        assert_equal(results, [EMAIL_SENT, EMAIL_REFUSED, EMAIL_FAILED])
+        assert_equal(server.recipients, [['ok@example.com']])
+
+    def test_smtp_sender_reconnects_after_disconnect(self):
+        with LocalSMTPServer() as server, \
+                mock.patch.multiple(settings, MAIL_SERVER=server.host, MAIL_PORT=server.port):
+            sender = _SMTPSender()
+            try:
+                for to_addr in ('first@example.com', 'second@example.com'):
+                    result = sender.send(fake_email(), to_addr, fake.bs(), fake.text(), ttls=False, login=False)
+                    assert_equal(result, EMAIL_SENT)
+                    # Drop the connection as a server closing idle connections would
+                    sender.connection.close()
+            finally:
+                sender.close()
+        assert_equal(server.recipients, [['first@example.com'], ['second@example.com']])
+
+    def test_send_emails_without_credentials_is_refused(self):
+        emails = [{'from_addr': fake_email(), 'to_addr': 'ok@example.com', 'subject': fake.bs(), 'message': fake.text()}]
+        with LocalSMTPServer() as server, \
+                mock.patch.multiple(settings, MAIL_SERVER=server.host, MAIL_PORT=server.port, USE_EMAIL=True,
+                                    SENDGRID_API_KEY=None, MAIL_USERNAME=None, MAIL_PASSWORD=None):
+            results = send_emails(emails)
+        assert_equal(results, [EMAIL_REFUSED])
+        assert_equal(server.recipients, [])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,6 +2,7 @@
 
 import os
 import datetime
+import logging
 import time
 import functools
 
@@ -11,6 +12,7 @@ import jwe
 import jwt
 import mock
 import pytest
+from django.core.cache.backends.locmem import LocMemCache
 from django.utils import timezone
 from framework.auth import cas, signing
 from framework.auth.core import Auth
@@ -27,7 +29,7 @@ from osf_tests.factories import (
 )
 from website import settings
 from api.base import settings as api_settings
-from addons.base import views
+from addons.base import auth_cache, views
 from addons.github.exceptions import ApiError
 from addons.github.models import GithubFolder, GithubFile, GithubFileNode
 from addons.github.tests.factories import GitHubAccountFactory, GoogleDriveAccountFactory
@@ -54,6 +56,8 @@ from dateutil.parser import parse as parse_date
 from framework import sentry
 from tests.test_timestamp import create_test_file
 
+logger = logging.getLogger(__name__)
+
 
 class SetEnvironMiddleware(object):
 
@@ -305,6 +309,87 @@ class TestAddonAuth(OsfTestCase):
         res = self.app.get(url, auth=none_auth, expect_errors=True)
         assert_equal(res.status_code, 401)
 
+    def test_auth_reuses_granted_access_until_contributors_change(self):
+        contrib = AuthUserFactory()
+        self.node.add_contributor(contrib, permissions=READ, auth=self.auth_obj, save=True)
+        url = self.build_url()
+        assert_equal(self.app.get(url, auth=contrib.auth).status_code, 200)
+
+        with mock.patch('addons.base.views.check_access') as mock_check_access:
+            assert_equal(self.app.get(url, auth=contrib.auth).status_code, 200)
+        assert_false(mock_check_access.called)
+
+        self.node.remove_contributor(contrib, auth=self.auth_obj)
+        res = self.app.get(url, auth=contrib.auth, expect_errors=True)
+        assert_equal(res.status_code, 403)
+
+    def test_auth_does_not_cache_denied_access(self):
+        noncontrib = AuthUserFactory()
+        url = self.build_url()
+        assert_equal(self.app.get(url, auth=noncontrib.auth, expect_errors=True).status_code, 403)
+
+        self.node.add_contributor(noncontrib, permissions=READ, auth=self.auth_obj, save=True)
+        assert_equal(self.app.get(url, auth=noncontrib.auth).status_code, 200)
+
+    @mock.patch('osf.models.node.AbstractNode.serialize_waterbutler_credentials')
+    def test_auth_reuses_credentials_until_addon_changes(self, mock_credentials):
+        mock_credentials.return_value = {'token': 'abc'}
+        url = self.build_url()
+        self.app.get(url, auth=self.user.auth)
+        self.app.get(url, auth=self.user.auth)
+        assert_equal(mock_credentials.call_count, 1)
+
+        self.node_addon.save()
+        self.app.get(url, auth=self.user.auth)
+        assert_equal(mock_credentials.call_count, 2)
+
+    def test_auth_cache_invalidation_reaches_other_processes(self):
+        contrib = AuthUserFactory()
+        self.node.add_contributor(contrib, permissions=READ, auth=self.auth_obj, save=True)
+        url = self.build_url()
+        assert_equal(self.app.get(url, auth=contrib.auth).status_code, 200)
+
+        # Another worker only shares the generation cache, not the cached entries
+        other_process_cache = LocMemCache('other-process', {})
+        with mock.patch.object(auth_cache, 'get_cache', return_value=other_process_cache):
+            auth_cache.invalidate_target('node', self.node.pk)
+
+        with mock.patch('addons.base.views.check_access') as mock_check_access:
+            assert_equal(self.app.get(url, auth=contrib.auth).status_code, 200)
+        assert_true(mock_check_access.called)
+
+        assert_equal(self.app.get(url, auth=contrib.auth).status_code, 200)
+        with mock.patch.object(auth_cache, 'get_cache', return_value=other_process_cache):
+            auth_cache.clear()
+        with mock.patch('addons.base.views.check_access') as mock_check_access:
+            assert_equal(self.app.get(url, auth=contrib.auth).status_code, 200)
+        assert_true(mock_check_access.called)
+
+    @mock.patch('osf.models.node.AbstractNode.serialize_waterbutler_credentials')
+    def test_auth_cache_disabled(self, mock_credentials):
+        mock_credentials.return_value = {'token': 'abc'}
+        url = self.build_url()
+        with mock.patch.object(settings, 'WATERBUTLER_AUTH_CACHE_TIMEOUT', 0):
+            self.app.get(url, auth=self.user.auth)
+            self.app.get(url, auth=self.user.auth)
+        assert_equal(mock_credentials.call_count, 2)
+
+    def test_benchmark_callbacks(self):
+        callbacks = int(os.environ.get('WATERBUTLER_AUTH_BENCHMARK_CALLBACKS', 50))
+        test_file = create_test_file(self.node, self.user)
+        url = self.build_url(action='download', provider='osfstorage', path=test_file.path)
+
+        def callbacks_per_second():
+            start = time.time()
+            for _ in range(callbacks):
+                assert_equal(self.app.get(url, auth=self.user.auth).status_code, 200)
+            return callbacks / (time.time() - start)
+
+        with mock.patch.object(settings, 'WATERBUTLER_AUTH_CACHE_TIMEOUT', 0):
+            uncached = callbacks_per_second()
+        cached = callbacks_per_second()
+        logger.info('get_auth: {:.1f} callbacks/s without cache, {:.1f} callbacks/s with cache'.format(uncached, cached))
+
 
 class TestAddonLogs(OsfTestCase):
 
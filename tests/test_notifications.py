@@ -2,14 +2,17 @@ import collections
 import mock
 from babel import dates, Locale
 from schema import Schema, And, Use, Or
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from nose.tools import *  # noqa PEP8 asserts
 
 from framework.auth import Auth
-from osf.models import Comment, NotificationDigest, NotificationSubscription, Guid, OSFUser
+from osf.models import AbstractNode, Comment, NotificationDigest, NotificationSubscription, Guid, OSFUser
 
 from website.notifications.tasks import get_users_emails, send_users_email, group_by_node, remove_notifications
+from website.notifications.tasks import _send_global_and_node_emails
 from website.notifications.exceptions import InvalidSubscriptionError
 from website.notifications import constants
 from website.notifications import emails
@@ -26,6 +29,7 @@ from osf_tests import factories
 from osf.utils import permissions
 from tests.base import capture_signals
 from tests.base import OsfTestCase, NotificationTestCase
+from tests.utils import LocalSMTPServer
 
 
 
@@ -1282,6 +1286,38 @@ class TestCompileSubscriptions(NotificationTestCase):
         subs = emails.compile_subscriptions(node5, 'file_updated')
         assert_equal(subs, {'email_transactional': [], 'email_digest': [self.user_1._id], 'none': []})
 
+    def test_parent_admin_listed_on_child(self):
+        parent_admin = factories.UserFactory()
+        self.base_project.add_contributor(parent_admin, permissions=permissions.ADMIN)
+        self.base_sub.email_digest.add(parent_admin)
+        result = emails.compile_subscriptions(self.private_node, 'file_updated')
+        assert_equal({'email_transactional': [], 'none': [], 'email_digest': [parent_admin._id]}, result)
+
+    def test_disabled_user_not_listed(self):
+        self.base_sub.email_transactional.add(self.user_1)
+        self.user_1.is_disabled = True
+        self.user_1.save()
+        result = emails.compile_subscriptions(self.base_project, 'file_updated')
+        assert_equal({'email_transactional': [], 'none': [], 'email_digest': []}, result)
+
+    def test_query_count_does_not_depend_on_subscribers(self):
+        def count_queries():
+            node = AbstractNode.objects.get(pk=self.shared_node.pk)
+            with CaptureQueriesContext(connection) as ctx:
+                emails.compile_subscriptions(node, 'file_updated', 'xyz42_file_updated')
+            return len(ctx.captured_queries)
+
+        self.base_sub.email_transactional.add(self.user_1)
+        few = count_queries()
+        for _ in range(10):
+            user = factories.UserFactory()
+            self.base_project.add_contributor(user, permissions=permissions.READ)
+            self.shared_node.add_contributor(user, permissions=permissions.READ)
+            self.base_sub.email_transactional.add(user)
+        result = emails.compile_subscriptions(self.shared_node, 'file_updated')
+        assert_equal(len(result['email_transactional']), 11)
+        assert_equal(count_queries(), few)
+
 
 class TestMoveSubscription(NotificationTestCase):
     def setUp(self):
@@ -1705,6 +1741,37 @@ class TestSendEmails(NotificationTestCase):
         formatted_datetime = u'{time} on {date}'.format(time=formatted_time, date=formatted_date)
         assert_equal(emails.localize_timestamp(timestamp, self.user), formatted_datetime)
 
+    def create_recipients(self):
+        recipients = [
+            factories.UserFactory(locale='en_US', timezone='Etc/UTC'),
+            factories.UserFactory(locale='en_US', timezone='Etc/UTC'),
+            factories.UserFactory(locale='ja', timezone='Asia/Tokyo'),
+        ]
+        disabled = factories.UserFactory()
+        disabled.is_disabled = True
+        disabled.save()
+        return recipients, disabled
+
+    @mock.patch('website.notifications.emails.mails.render_message', return_value='message')
+    def test_store_emails_renders_once_per_locale_and_timezone(self, mock_render):
+        recipients, disabled = self.create_recipients()
+        recipient_ids = [self.user._id, disabled._id] + [recipient._id for recipient in recipients]
+        emails.store_emails(recipient_ids, 'email_digest', 'comments', self.user, self.node, timezone.now())
+
+        assert_equal(mock_render.call_count, 2)
+        digests = NotificationDigest.objects.filter(event='comments', send_type='email_digest')
+        assert_equal(set(digests.values_list('user', flat=True)), {recipient.id for recipient in recipients})
+        assert_equal(digests.first().node_lineage, [self.project._id, self.node._id])
+
+    @mock.patch('website.notifications.emails.mails.template_uses', return_value=True)
+    @mock.patch('website.notifications.emails.mails.render_message', return_value='message')
+    def test_store_emails_renders_per_recipient(self, mock_render, mock_template_uses):
+        recipients, _ = self.create_recipients()
+        emails.store_emails([recipient._id for recipient in recipients], 'email_digest', 'comments', self.user, self.node, timezone.now())
+
+        assert_equal([call[1]['recipient'] for call in mock_render.call_args_list], recipients)
+        assert_equal(NotificationDigest.objects.filter(event='comments').count(), 3)
+
 
 class TestSendDigest(OsfTestCase):
     def setUp(self):
@@ -1880,6 +1947,55 @@ class TestSendDigest(OsfTestCase):
         with assert_raises(NotificationDigest.DoesNotExist):
             NotificationDigest.objects.get(_id=digest_id)
 
+    def test_send_digests_over_local_smtp(self):
+        send_type = 'email_transactional'
+        project = factories.ProjectFactory()
+        users = [self.user_1, self.user_2, factories.UserFactory(username='refused@example.com'),
+                 factories.UserFactory(username='busy@example.com')]
+        for user in users:
+            factories.NotificationDigestFactory(
+                user=user,
+                send_type=send_type,
+                event='comment_replies',
+                timestamp=timezone.now(),
+                message='Hello',
+                node_lineage=[project._id]
+            )
+
+        with LocalSMTPServer() as server, \
+                mock.patch.multiple(settings, MAIL_SERVER=server.host, MAIL_PORT=server.port, USE_EMAIL=True,
+                                    SENDGRID_API_KEY=None, DEBUG_MODE=True, TO_EMAIL_FOR_DEBUG=None,
+                                    NOTIFICATION_DIGEST_BATCH_SIZE=2, NOTIFICATION_DIGEST_SMTP_CONNECTIONS=2, create=True):
+            stats = _send_global_and_node_emails(send_type)
+
+        assert_equal((stats['users'], stats['sent'], stats['failed'], stats['refused']), (4, 2, 1, 1))
+        assert_equal(sorted(recipient for recipients in server.recipients for recipient in recipients),
+                     sorted([self.user_1.username, self.user_2.username]))
+        # The temporarily rejected digest stays for the next run, the refused one is dropped
+        remaining = NotificationDigest.objects.filter(send_type=send_type)
+        assert_equal(list(remaining.values_list('user', flat=True)), [users[3].id])
+
+    def test_send_digests_without_mail_credentials_drops_them(self):
+        send_type = 'email_transactional'
+        factories.NotificationDigestFactory(
+            user=self.user_1,
+            send_type=send_type,
+            event='comment_replies',
+            timestamp=timezone.now(),
+            message='Hello',
+            node_lineage=[factories.ProjectFactory()._id]
+        )
+
+        with LocalSMTPServer() as server, \
+                mock.patch.multiple(settings, MAIL_SERVER=server.host, MAIL_PORT=server.port, USE_EMAIL=True,
+                                    SENDGRID_API_KEY=None, DEBUG_MODE=False, MAIL_USERNAME=None, MAIL_PASSWORD=None):
+            stats = _send_global_and_node_emails(send_type)
+
+        assert_equal((stats['users'], stats['sent'], stats['failed'], stats['refused']), (1, 0, 0, 1))
+        assert_equal(server.recipients, [])
+        assert_false(NotificationDigest.objects.filter(send_type=send_type).exists())
+
+
 class TestNotificationsReviews(OsfTestCase):
     def setUp(self):
         super(TestNotificationsReviews, self).setUp()
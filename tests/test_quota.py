@@ -8,8 +8,10 @@ from addons.osfstorage.models import OsfStorageFileNode
 from api.base import settings as api_settings
 from framework.auth import signing
 from tests.base import OsfTestCase
+from osf.management.commands.check_quota_consistency import check_quota_consistency
 from osf.models import (
-    FileLog, FileInfo, TrashedFileNode, TrashedFolder, UserQuota, ProjectStorageType, BaseFileNode
+    FileLog, FileInfo, TrashedFileNode, TrashedFolder, UserQuota, ProjectStorageType, BaseFileNode,
+    ProjectStorageUsage
 )
 from osf_tests.factories import (
     AuthUserFactory, ProjectFactory, UserFactory, InstitutionFactory, RegionFactory
@@ -1463,7 +1465,7 @@ class TestUpdateUserUsedQuota(OsfTestCase):
                                                    used=1000)
 
     @mock.patch.object(UserQuota, 'save')
-    @mock.patch('website.util.quota.used_quota')
+    @mock.patch('website.util.quota.rollup_used_quota')
     def test_update_user_used_quota_method_with_user_quota_exist(self, mock_used, mock_user_quota_save):
 
         mock_used.return_value = 500
@@ -1474,7 +1476,7 @@ class TestUpdateUserUsedQuota(OsfTestCase):
 
         mock_user_quota_save.assert_called()
 
-    @mock.patch('website.util.quota.used_quota')
+    @mock.patch('website.util.quota.rollup_used_quota')
     def test_update_user_used_quota_method_with_user_quota_not_exist(self, mock_used):
         another_user = UserFactory()
         mock_used.return_value = 500
@@ -1494,7 +1496,7 @@ class TestUpdateUserUsedQuota(OsfTestCase):
         user_quota = user_quota[0]
         assert_equal(user_quota.used, 500)
 
-    @mock.patch('website.util.quota.used_quota')
+    @mock.patch('website.util.quota.rebuild_project_storage_usage')
     def test_update_user_used_quota_method_for_recalculate_quota_process__nii_default_storage(self, mock_used):
         mock_used.return_value = 500
         quota.update_user_used_quota(
@@ -1512,7 +1514,7 @@ class TestUpdateUserUsedQuota(OsfTestCase):
         user_quota = user_quota.first()
         assert_equal(user_quota.used, 500)
 
-    @mock.patch('website.util.quota.used_quota')
+    @mock.patch('website.util.quota.rebuild_project_storage_usage')
     def test_update_user_used_quota_method_for_recalculate_quota_process__nii_custom_storage(self, mock_used):
         mock_used.return_value = 500
         UserQuota.objects.create(user=self.user, storage_type=UserQuota.CUSTOM_STORAGE, max_quota=300,
@@ -1661,3 +1663,140 @@ class TestQuotaApiBrowser(OsfTestCase):
         assert_equal(response.status_code, 200)
         assert_equal(response.json['max'], 200 * api_settings.SIZE_UNIT_GB)
         assert_equal(response.json['used'], 100 * api_settings.SIZE_UNIT_GB)
+
+
+class TestProjectStorageUsage(OsfTestCase):
+    def setUp(self):
+        super(TestProjectStorageUsage, self).setUp()
+        self.user = UserFactory()
+        self.project_creator = UserFactory()
+        self.node = ProjectFactory(creator=self.project_creator)
+        self.file = OsfStorageFileNode.create(
+            target=self.node,
+            path='/testfile',
+            _id='testfile',
+            name='testfile',
+            materialized_path='/testfile'
+        )
+        self.file.save()
+
+    def _update_used_quota(self, event_type, size):
+        quota.update_used_quota(
+            self=None,
+            target=self.node,
+            user=self.user,
+            event_type=event_type,
+            payload={
+                'provider': 'osfstorage',
+                'metadata': {
+                    'provider': 'osfstorage',
+                    'name': 'testfile',
+                    'materialized': '/testfile',
+                    'path': '/' + self.file._id,
+                    'kind': 'file',
+                    'size': size,
+                    'created_utc': '',
+                    'modified_utc': '',
+                    'extra': {'version': '1'}
+                }
+            }
+        )
+
+    def _project_used(self):
+        return ProjectStorageUsage.objects.get(node=self.node).used
+
+    def test_rollup_follows_file_events(self):
+        self._update_used_quota(FileLog.FILE_ADDED, 1000)
+        assert_equal(self._project_used(), 1000)
+
+        self._update_used_quota(FileLog.FILE_UPDATED, 1500)
+        assert_equal(self._project_used(), 1500)
+
+        self.file.deleted_on = datetime.datetime.now()
+        self.file.deleted_by = self.user
+        self.file.type = 'osf.trashedfile'
+        self.file.save()
+        self._update_used_quota(FileLog.FILE_REMOVED, 1500)
+        assert_equal(self._project_used(), 0)
+
+        user_quota = UserQuota.objects.get(user=self.project_creator, storage_type=UserQuota.NII_STORAGE)
+        assert_equal(user_quota.used, 0)
+
+    def test_rollup_follows_moves_to_other_projects(self):
+        self._update_used_quota(FileLog.FILE_ADDED, 1000)
+        destination_node = ProjectFactory(creator=self.user)
+        self.file.target = destination_node
+        self.file.save()
+
+        quota.update_used_quota(
+            self=None,
+            target=destination_node,
+            user=self.user,
+            event_type=FileLog.FILE_MOVED,
+            payload={
+                'source': {'provider': 'osfstorage', 'nid': self.node._id, 'materialized': '/testfile'},
+                'destination': {
+                    'provider': 'osfstorage', 'nid': destination_node._id,
+                    'materialized': '/testfile', 'path': '/' + self.file._id,
+                },
+            }
+        )
+
+        assert_equal(self._project_used(), 0)
+        assert_equal(ProjectStorageUsage.objects.get(node=destination_node).used, 1000)
+        assert_equal(quota.rollup_used_quota(self.user._id, UserQuota.NII_STORAGE),
+                     quota.used_quota(self.user._id, UserQuota.NII_STORAGE))
+
+    def test_recalculation_rewrites_drifted_rollups(self):
+        self._update_used_quota(FileLog.FILE_ADDED, 1000)
+        ProjectStorageUsage.objects.filter(node=self.node).update(used=5)
+
+        quota.update_user_used_quota(self.project_creator, UserQuota.NII_STORAGE, is_recalculating_quota=True)
+
+        assert_equal(self._project_used(), 1000)
+        assert_equal(UserQuota.objects.get(user=self.project_creator, storage_type=UserQuota.NII_STORAGE).used, 1000)
+
+    def test_recalculation_sums_the_rebuilt_rollups(self):
+        self._update_used_quota(FileLog.FILE_ADDED, 1000)
+        ProjectStorageUsage.objects.filter(node=self.node).delete()
+
+        with mock.patch('website.util.quota.used_quota') as mock_used:
+            quota.update_user_used_quota(self.project_creator, UserQuota.NII_STORAGE, is_recalculating_quota=True)
+
+        # FileInfo is scanned once, by the rebuild of the rollups
+        mock_used.assert_not_called()
+        assert_equal(self._project_used(), 1000)
+        assert_equal(UserQuota.objects.get(user=self.project_creator, storage_type=UserQuota.NII_STORAGE).used, 1000)
+
+    def test_rollup_used_quota_skips_deleted_projects(self):
+        self._update_used_quota(FileLog.FILE_ADDED, 1000)
+        other_node = ProjectFactory(creator=self.project_creator)
+        ProjectStorageUsage.objects.create(node=other_node, used=300)
+        assert_equal(quota.rollup_used_quota(self.project_creator._id, UserQuota.NII_STORAGE), 1300)
+        assert_equal(quota.rollup_used_quota(self.project_creator._id, UserQuota.CUSTOM_STORAGE), 0)
+
+        other_node.is_deleted = True
+        other_node.save()
+        assert_equal(quota.rollup_used_quota(self.project_creator._id, UserQuota.NII_STORAGE), 1000)
+
+    def test_check_used_quota_reports_and_fixes_drift(self):
+        self._update_used_quota(FileLog.FILE_ADDED, 1000)
+        assert_equal(quota.check_used_quota(self.project_creator, UserQuota.NII_STORAGE), 0)
+
+        UserQuota.objects.filter(user=self.project_creator).update(used=400)
+        ProjectStorageUsage.objects.filter(node=self.node).update(used=0)
+        assert_equal(quota.check_used_quota(self.project_creator, UserQuota.NII_STORAGE), -600)
+        assert_equal(self._project_used(), 0)
+
+        quota.check_used_quota(self.project_creator, UserQuota.NII_STORAGE, fix=True)
+        assert_equal(self._project_used(), 1000)
+        assert_equal(UserQuota.objects.get(user=self.project_creator).used, 1000)
+        assert_equal(quota.check_used_quota(self.project_creator, UserQuota.NII_STORAGE), 0)
+
+    def test_check_quota_consistency_task(self):
+        self._update_used_quota(FileLog.FILE_ADDED, 1000)
+        UserQuota.objects.filter(user=self.project_creator).update(used=1)
+
+        drifted = check_quota_consistency()
+
+        assert_equal(drifted, [{'user': self.project_creator._id, 'storage_type': UserQuota.NII_STORAGE, 'drift': -999}])
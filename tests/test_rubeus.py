@@ -1,16 +1,23 @@
 #!/usr/bin/env python3
 # encoding: utf-8
 
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import mock
+from django.db import connections
 from nose.tools import *  # noqa: F403
 
 from tests.base import OsfTestCase
 from osf_tests.factories import (UserFactory, ProjectFactory, NodeFactory,
-                             AuthFactory, PrivateLinkFactory)
+                             AuthFactory, PrivateLinkFactory, OSFGroupFactory)
 from framework.auth import Auth
+from osf.utils import permissions
 from website.util import rubeus
 from website.util.rubeus import sort_by_name
 
+# Worker threads do not see the rows of the test transaction
+@mock.patch.object(rubeus.settings, 'RUBEUS_ADDON_MAX_WORKERS', 0)
 class TestRubeus(OsfTestCase):
 
     def setUp(self):
@@ -288,6 +295,36 @@ class TestRubeus(OsfTestCase):
 
         assert 'Private Component' not in ret
 
+    def test_osf_group_components_shown(self):
+        user = UserFactory()
+        public_project = ProjectFactory(is_public=True)
+        private_child = NodeFactory(parent=public_project, is_public=False)
+        group = OSFGroupFactory(creator=user)
+        private_child.add_osf_group(group, permissions.WRITE)
+
+        serializer = rubeus.NodeFileCollector(node=public_project, auth=Auth(user))
+        ret = serializer.to_hgrid()
+
+        children = ret[0]['children']
+        assert private_child._id == children[1]['nodeID']
+        assert True == children[1]['permissions']['edit']
+
+    def test_components_of_private_pointer_shown(self):
+        user = UserFactory()
+        project = ProjectFactory(creator=user)
+        private_pointed = ProjectFactory(is_public=False)
+        public_component = NodeFactory(parent=private_pointed, creator=private_pointed.creator, is_public=True)
+        project.add_pointer(private_pointed, auth=Auth(user))
+
+        serializer = rubeus.NodeFileCollector(node=project, auth=Auth(user))
+        ret = serializer.to_hgrid()
+
+        children = ret[0]['children']
+        assert 2 == len(children)
+        assert public_component._id == children[1]['nodeID']
+        assert False == children[1]['isPointer']
+        assert False == children[1]['permissions']['edit']
+
 
 # TODO: Make this more reusable across test modules
 mock_addon = mock.Mock()
@@ -319,6 +356,68 @@ class TestSerializingNodeWithAddon(OsfTestCase):
         ret = self.serializer._collect_addons(self.project)
         assert_equal(ret, [serialized])
 
+    @mock.patch.object(rubeus.settings, 'RUBEUS_ADDON_MAX_WORKERS', 2)
+    @mock.patch.object(rubeus.settings, 'RUBEUS_ADDON_TIMEOUT', 0.05)
+    def test_collect_addons_timeout(self):
+        slow_addon = mock.Mock()
+        slow_addon.config.get_hgrid_data.side_effect = lambda *args, **kwargs: time.sleep(0.5)
+        slow_addon.config.full_name = 'Slow Addon'
+        slow_addon.config.short_name = 'slowaddon'
+        self.project.get_addons.return_value = [mock_addon, slow_addon]
+
+        ret = self.serializer._collect_addons(self.project)
+        assert_equal(ret[0], serialized)
+        assert_true(ret[1]['unavailable'])
+        assert_equal(ret[1]['provider'], 'slowaddon')
+
+    @mock.patch.object(rubeus.settings, 'RUBEUS_ADDON_MAX_WORKERS', 1)
+    @mock.patch.object(rubeus.settings, 'RUBEUS_ADDON_TIMEOUT', 0.2)
+    def test_collect_addons_timeout_is_shared_by_all_addons(self):
+        slow_addons = []
+        for i in range(3):
+            slow_addon = mock.Mock()
+            slow_addon.config.get_hgrid_data.side_effect = lambda *args, **kwargs: time.sleep(0.15) or [serialized]
+            slow_addon.config.full_name = 'Slow Addon {}'.format(i)
+            slow_addon.config.short_name = 'slowaddon{}'.format(i)
+            slow_addons.append(slow_addon)
+        self.project.get_addons.return_value = slow_addons
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        with mock.patch.object(rubeus, '_executor', executor):
+            start = time.time()
+            ret = self.serializer._collect_addons(self.project)
+            elapsed = time.time() - start
+        executor.shutdown(wait=True)
+
+        assert_less(elapsed, 0.4)
+        assert_equal(ret[0], serialized)
+        assert_true(ret[1]['unavailable'])
+        assert_true(ret[2]['unavailable'])
+        # The addon that never got a worker is not asked at all
+        assert_equal(slow_addons[2].config.get_hgrid_data.call_count, 0)
+
+    @mock.patch.object(rubeus.settings, 'RUBEUS_ADDON_MAX_WORKERS', 2)
+    def test_collect_addons_in_worker_threads_closes_their_connections(self):
+        worker_connections = []
+
+        def get_hgrid_data(*args, **kwargs):
+            connection = connections['default']
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            worker_connections.append(connection)
+            return [serialized]
+
+        db_addon = mock.Mock()
+        db_addon.config.get_hgrid_data.side_effect = get_hgrid_data
+        self.project.get_addons.return_value = [db_addon, db_addon]
+
+        ret = self.serializer._collect_addons(self.project)
+        assert_equal(ret, [serialized, serialized])
+        assert_equal(len(worker_connections), 2)
+        assert_not_in(connections['default'], worker_connections)
+        for connection in worker_connections:
+            assert_is_none(connection.connection)
+
     def test_sort_by_name(self):
         files = [
             {'name': 'F.png'},
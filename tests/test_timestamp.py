@@ -1,24 +1,36 @@
 # -*- coding: utf-8 -*-
 import datetime
+import json
+import logging
 import mock
 import os
 import pytz
 import shutil
+import threading
+import time
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from addons.osfstorage import settings as osfstorage_settings
 from api.base import settings as api_settings
 from framework.auth import Auth
 from nose import tools as nt
-from osf.models import RdmUserKey, RdmFileTimestamptokenVerifyResult, Guid
-from osf_tests.factories import ProjectFactory, AuthUserFactory
+from osf.models import BaseFileNode, RdmUserKey, RdmFileTimestamptokenVerifyResult, Guid, TimestampTask
+from osf_tests.factories import ProjectFactory, AuthUserFactory, InstitutionFactory
 from tests.base import ApiTestCase, OsfTestCase
 from website.util import timestamp
 import tempfile
 from website.util.timestamp import (
     AddTimestamp, TimeStampTokenVerifyCheck,
     userkey_generation, userkey_generation_check,
-    OSFAbortableAsyncResult
+    OSFAbortableAsyncResult, WaterButlerFileCrawler
 )
 
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+logger = logging.getLogger(__name__)
+
 
 def create_test_file(node, user, filename='test_file', create_guid=True):
     osfstorage = node.get_addon('osfstorage')
@@ -646,3 +658,352 @@ class TestOSFAbortableResult(OsfTestCase):
         nt.assert_true(task.ready())
         mock_logger.error.assert_any_call('Failed to get task status! Exception message:')
         mock_logger.error.assert_any_call(msg)
+
+
+class TestGetErrorList(OsfTestCase):
+    def setUp(self):
+        super(TestGetErrorList, self).setUp()
+        self.project = ProjectFactory()
+        self.user = self.project.creator
+        self.institution = InstitutionFactory()
+        self.user.affiliated_institutions.add(self.institution)
+
+    def _create_error_results(self, count, start=0):
+        for i in range(start, start + count):
+            file_node = create_test_file(node=self.project, user=self.user, filename='error_file_{}'.format(i))
+            RdmFileTimestamptokenVerifyResult.objects.create(
+                file_id=file_node._id,
+                project_id=self.project._id,
+                provider='osfstorage',
+                path='/error_file_{}'.format(i),
+                inspection_result_status=api_settings.TIME_STAMP_TOKEN_CHECK_NG,
+                verify_user=self.user.id,
+            )
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            provider_error_list = timestamp.get_error_list(self.project._id)
+        return len(ctx.captured_queries), provider_error_list
+
+    def test_get_error_list(self):
+        self._create_error_results(2)
+        RdmFileTimestamptokenVerifyResult.objects.create(
+            file_id='success_file',
+            project_id=self.project._id,
+            provider='osfstorage',
+            inspection_result_status=api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS,
+        )
+
+        provider_error_list = timestamp.get_error_list(self.project._id)
+
+        nt.assert_equal(len(provider_error_list), 1)
+        nt.assert_equal(provider_error_list[0]['provider'], 'osfstorage')
+        error_list = provider_error_list[0]['error_list']
+        nt.assert_equal([e['file_path'] for e in error_list], ['/error_file_0', '/error_file_1'])
+        error_info = error_list[0]
+        nt.assert_equal(error_info['creator_id'], self.user._id)
+        nt.assert_equal(error_info['creator_email'], self.user.username)
+        nt.assert_equal(error_info['verify_user_id'], self.user._id.upper())
+        nt.assert_equal(error_info['organization_id'], self.institution._id)
+        nt.assert_equal(error_info['file_version'], 1)
+        nt.assert_equal(error_info['verify_result_title'], api_settings.TIME_STAMP_TOKEN_CHECK_NG_MSG)
+
+    def test_get_error_list_pages_are_merged_by_provider(self):
+        self._create_error_results(5)
+
+        with mock.patch.object(api_settings, 'TS_ERROR_LIST_PAGE_SIZE', 2):
+            pages = list(timestamp.iter_error_list(self.project._id))
+            provider_error_list = timestamp.get_error_list(self.project._id)
+
+        nt.assert_equal([len(page['error_list']) for page in pages], [2, 2, 1])
+        nt.assert_equal(len(provider_error_list), 1)
+        nt.assert_equal(len(provider_error_list[0]['error_list']), 5)
+
+    def test_get_error_list_query_count_does_not_grow_with_files(self):
+        self._create_error_results(2)
+        num_queries, provider_error_list = self._count_queries()
+        nt.assert_equal(len(provider_error_list[0]['error_list']), 2)
+
+        self._create_error_results(8, start=2)
+        nt.assert_equal(self._count_queries()[0], num_queries)
+
+
+class FakeWaterButlerTree(object):
+    """Serve the folder listings of a synthetic WaterButler tree over local HTTP.
+
+    Every folder holds ``fanout`` files and, down to ``depth`` levels below the
+    top level folders, ``fanout`` subfolders.
+    """
+
+    def __init__(self, depth, fanout, latency=0):
+        self.depth = depth
+        self.fanout = fanout
+        self.latency = latency
+        tree = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(tree.latency)
+                body = json.dumps({'data': tree.children(self.path.split('?')[0])}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def file_count(self):
+        """Number of files below one top level folder."""
+        return sum(self.fanout ** level for level in range(1, self.depth + 1))
+
+    def children(self, path):
+        level = path.strip('/').count('/') + 1
+        children = []
+        for i in range(self.fanout):
+            file_path = '{}file{}.txt'.format(path, i)
+            children.append({'attributes': {
+                'kind': 'file', 'name': 'file{}.txt'.format(i), 'path': file_path,
+                'materialized': file_path, 'extra': {},
+            }})
+            if level < self.depth:
+                folder_path = '{}folder{}/'.format(path, i)
+                children.append({'attributes': {
+                    'kind': 'folder', 'name': 'folder{}'.format(i), 'path': folder_path,
+                    'materialized': folder_path, 'extra': {},
+                }})
+        return children
+
+    def api_url_for(self, pid, provider, path, **kwargs):
+        return self.url + path
+
+
+class TestWaterButlerFileCrawler(OsfTestCase):
+    def setUp(self):
+        super(TestWaterButlerFileCrawler, self).setUp()
+        self.project = ProjectFactory()
+
+    def _crawl(self, tree, **kwargs):
+        with mock.patch('website.util.timestamp.waterbutler_api_url_for', side_effect=tree.api_url_for):
+            with WaterButlerFileCrawler(self.project._id, 's3', self.project, {}, {}, **kwargs) as crawler:
+                return list(crawler.iter_files(['/folder0/']))
+
+    def test_crawl_creates_file_nodes_in_batches(self):
+        with FakeWaterButlerTree(depth=2, fanout=3) as tree:
+            with CaptureQueriesContext(connection) as ctx:
+                results = self._crawl(tree, batch_size=100)
+
+        # /folder0/ holds 3 files and 3 folders, each of which holds 3 more files
+        nt.assert_equal(len(results), 3 + 3 * 3)
+        paths = sorted(file_node._path for _, file_node in results)
+        nt.assert_in('/folder0/folder2/file1.txt', paths)
+        nt.assert_true(all(file_node.pk for _, file_node in results))
+        nt.assert_equal(BaseFileNode.objects.filter(target_object_id=self.project.id, provider='s3').count(), 12)
+        nt.assert_less(len(ctx.captured_queries), 5)
+
+    def test_crawl_is_idempotent(self):
+        with FakeWaterButlerTree(depth=2, fanout=4) as tree:
+            first = self._crawl(tree)
+            second = self._crawl(tree)
+
+        nt.assert_equal(
+            sorted(file_node.id for _, file_node in first),
+            sorted(file_node.id for _, file_node in second),
+        )
+        nt.assert_equal(BaseFileNode.objects.filter(target_object_id=self.project.id, provider='s3').count(), 4 + 4 * 4)
+
+    def test_osfstorage_names_are_not_renamed(self):
+        root = self.project.get_addon('osfstorage').get_root()
+        folder = root.append_folder('Cloud')
+        file_node = folder.append_file('file.txt')
+        file_data = {'attributes': {
+            'kind': 'file', 'name': 'renamed.txt', 'path': '/' + file_node._id,
+            'materialized': '/Cloud/renamed.txt', 'extra': {},
+        }}
+
+        with WaterButlerFileCrawler(self.project._id, 'osfstorage', self.project, {}, {}) as crawler:
+            results = crawler.upsert_file_nodes([file_data])
+
+        nt.assert_equal([result.id for _, result in results], [file_node.id])
+        file_node.reload()
+        nt.assert_equal(file_node.name, 'file.txt')
+        nt.assert_equal(file_node._stored_materialized_path, '/Cloud/file.txt')
+
+    def test_waterbutler_folder_file_info(self):
+        with FakeWaterButlerTree(depth=2, fanout=2) as tree:
+            with mock.patch('website.util.timestamp.waterbutler_api_url_for', side_effect=tree.api_url_for):
+                file_list = timestamp.waterbutler_folder_file_info(
+                    self.project._id, 's3', '/folder1/', self.project, {}, {})
+
+        nt.assert_equal(len(file_list), 2 + 2 * 2)
+        nt.assert_equal(set(file_list[0].keys()), {'file_name', 'file_path', 'file_kind', 'file_id', 'version'})
+
+    def test_crawl_benchmark(self):
+        depth = int(os.environ.get('TS_CRAWLER_BENCHMARK_DEPTH', 4))
+        fanout = int(os.environ.get('TS_CRAWLER_BENCHMARK_FANOUT', 4))
+        latency = float(os.environ.get('TS_CRAWLER_BENCHMARK_LATENCY', 0.01))
+        with FakeWaterButlerTree(depth=depth, fanout=fanout, latency=latency) as tree:
+            for max_workers in (1, 8):
+                BaseFileNode.objects.filter(target_object_id=self.project.id, provider='s3').delete()
+                started = time.time()
+                results = self._crawl(tree, max_workers=max_workers)
+                elapsed = time.time() - started
+                logger.info('crawler benchmark: depth={} fanout={} workers={} files={} elapsed={:.3f}s'.format(
+                    depth, fanout, max_workers, len(results), elapsed))
+                nt.assert_equal(len(results), tree.file_count)
+
+
+class TestTimestampShards(OsfTestCase):
+    def setUp(self):
+        super(TestTimestampShards, self).setUp()
+        self.project = ProjectFactory()
+        self.user = self.project.creator
+        self.timestamp_task = TimestampTask.objects.create(
+            node=self.project, requester=self.user, task_id='abcd')
+        self.file_list = [
+            {'file_id': 'file{}'.format(i), 'provider': 'osfstorage'} for i in range(6)
+        ]
+        self.task = mock.Mock()
+        self.task.is_aborted.return_value = False
+
+    def _processed_file_ids(self, mock_check):
+        return sorted(call[0][2]['file_id'] for call in mock_check.call_args_list)
+
+    @mock.patch('website.util.timestamp.add_log_verify_all')
+    @mock.patch('website.util.timestamp.check_file_timestamp', return_value=None)
+    def test_restarted_run_skips_checkpointed_files(self, mock_check, mock_log):
+        self.timestamp_task.operation = timestamp.TIMESTAMP_OPERATION_VERIFY
+        self.timestamp_task.completed_file_ids = ['file0', 'file1']
+        self.timestamp_task.checkpointed_at = timezone.now()
+        self.timestamp_task.save()
+
+        timestamp._run_timestamp_files(
+            self.task, timestamp.TIMESTAMP_OPERATION_VERIFY, self.user.id, self.project, self.file_list)
+
+        nt.assert_equal(self._processed_file_ids(mock_check), ['file2', 'file3', 'file4', 'file5'])
+        nt.assert_equal(mock_log.call_count, 1)
+        self.timestamp_task.reload()
+        nt.assert_equal(self.timestamp_task.completed_file_ids, [])
+
+    @mock.patch('website.util.timestamp.add_log_add_all')
+    @mock.patch('website.util.timestamp.add_token', return_value=None)
+    def test_checkpoint_of_other_operation_is_discarded(self, mock_add, mock_log):
+        self.timestamp_task.operation = timestamp.TIMESTAMP_OPERATION_VERIFY
+        self.timestamp_task.completed_file_ids = ['file0', 'file1']
+        self.timestamp_task.save()
+
+        timestamp._run_timestamp_files(
+            self.task, timestamp.TIMESTAMP_OPERATION_ADD, self.user.id, self.project, self.file_list)
+
+        nt.assert_equal(mock_add.call_count, 6)
+
+    @mock.patch.object(api_settings, 'TS_MAX_SHARDS_PER_NODE', 4)
+    @mock.patch('website.util.timestamp.add_log_verify_all')
+    @mock.patch('website.util.timestamp.check_file_timestamp', return_value=None)
+    def test_aborted_run_keeps_checkpoint(self, mock_check, mock_log):
+        self.task.is_aborted.side_effect = lambda: mock_check.call_count >= 2
+
+        timestamp._run_timestamp_files(
+            self.task, timestamp.TIMESTAMP_OPERATION_VERIFY, self.user.id, self.project, self.file_list)
+
+        self.timestamp_task.reload()
+        nt.assert_equal(self.timestamp_task.completed_file_ids, ['file0', 'file1'])
+        nt.assert_equal(self.timestamp_task.total_files, 6)
+
+        timestamp._release_timestamp_task(self.project)
+        self.timestamp_task.reload()
+        nt.assert_equal(self.timestamp_task.task_id, '')
+
+    @mock.patch.object(api_settings, 'TS_CHECKPOINT_FILES', 4)
+    @mock.patch('website.util.timestamp.add_log_verify_all')
+    @mock.patch('website.util.timestamp.check_file_timestamp', return_value=None)
+    def test_checkpoint_is_saved_in_batches(self, mock_check, mock_log):
+        self.task.is_aborted.side_effect = lambda: mock_check.call_count >= 5
+
+        with mock.patch('website.util.timestamp._save_checkpoint', wraps=timestamp._save_checkpoint) as mock_save:
+            timestamp._run_timestamp_files(
+                self.task, timestamp.TIMESTAMP_OPERATION_VERIFY, self.user.id, self.project, self.file_list)
+
+        nt.assert_equal(
+            [list(call[0][1]) for call in mock_save.call_args_list],
+            [['file0', 'file1', 'file2', 'file3'], ['file4']]
+        )
+        self.timestamp_task.reload()
+        nt.assert_equal(self.timestamp_task.completed_file_ids, ['file0', 'file1', 'file2', 'file3', 'file4'])
+
+    @mock.patch.object(api_settings, 'TS_SHARD_MIN_FILES', 2)
+    @mock.patch.object(api_settings, 'TS_MAX_SHARDS_PER_NODE', 2)
+    @mock.patch('website.util.timestamp.add_log_verify_all')
+    @mock.patch('website.util.timestamp.check_file_timestamp', return_value=None)
+    def test_sharded_run(self, mock_check, mock_log):
+        timestamp._run_timestamp_files(
+            self.task, timestamp.TIMESTAMP_OPERATION_VERIFY, self.user.id, self.project, self.file_list)
+
+        nt.assert_equal(self._processed_file_ids(mock_check), ['file{}'.format(i) for i in range(6)])
+        nt.assert_equal(mock_log.call_count, 1)
+        self.timestamp_task.reload()
+        nt.assert_equal(self.timestamp_task.shard_count, 2)
+        nt.assert_equal(self.timestamp_task.total_files, 6)
+        nt.assert_not_equal(self.timestamp_task.task_id, 'abcd')
+        nt.assert_equal(self.timestamp_task.completed_file_ids, [])
+
+    @mock.patch.object(api_settings, 'TS_SHARD_MIN_FILES', 2)
+    @mock.patch.object(api_settings, 'TS_MAX_SHARDS_PER_NODE', 2)
+    @mock.patch('website.util.timestamp.chord')
+    @mock.patch('website.util.timestamp.add_log_verify_all')
+    def test_sharded_run_cancelled_during_crawl(self, mock_log, mock_chord):
+        self.task.is_aborted.return_value = True
+        timestamp._release_timestamp_task(self.project)
+
+        timestamp._run_timestamp_files(
+            self.task, timestamp.TIMESTAMP_OPERATION_VERIFY, self.user.id, self.project, self.file_list)
+
+        nt.assert_false(mock_chord.called)
+        nt.assert_equal(mock_log.call_count, 1)
+        nt.assert_false(TimestampTask.objects.filter(node=self.project).exists())
+
+    @mock.patch.object(api_settings, 'TS_SHARD_MIN_FILES', 2)
+    @mock.patch.object(api_settings, 'TS_MAX_SHARDS_PER_NODE', 2)
+    @mock.patch('website.util.timestamp.chord')
+    @mock.patch('website.util.timestamp.add_log_verify_all')
+    def test_sharded_run_not_dispatched_after_release(self, mock_log, mock_chord):
+        # Cancelled after the crawl, while the shards were being planned
+        self.timestamp_task.task_id = ''
+        self.timestamp_task.save()
+
+        timestamp._run_timestamp_files(
+            self.task, timestamp.TIMESTAMP_OPERATION_VERIFY, self.user.id, self.project, self.file_list)
+
+        nt.assert_false(mock_chord.called)
+        self.timestamp_task.reload()
+        nt.assert_equal(self.timestamp_task.task_id, '')
+
+    @mock.patch('website.util.timestamp.OSFAbortableAsyncResult')
+    def test_progress_is_aggregated_across_shards(self, mock_task):
+        mock_task.return_value.ready.return_value = False
+        self.timestamp_task.total_files = 6
+        self.timestamp_task.shard_count = 3
+        self.timestamp_task.completed_file_ids = ['file0', 'file3']
+        self.timestamp_task.save()
+
+        status = timestamp.get_celery_task_progress(self.project)
+
+        nt.assert_equal(status, {'ready': False, 'total': 6, 'completed': 2, 'shards': 3})
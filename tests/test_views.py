@@ -4988,6 +4988,8 @@ class TestConfigureMailingListViews(OsfTestCase):
         settings.ENABLE_EMAIL_SUBSCRIPTIONS = cls._original_enable_email_subscriptions
 
 # TODO: Move to OSF Storage
+# Worker threads do not see the rows of the test transaction
+@mock.patch.object(settings, 'RUBEUS_ADDON_MAX_WORKERS', 0)
 class TestFileViews(OsfTestCase):
 
     def setUp(self):
@@ -6059,29 +6061,19 @@ class TestTimestampView(OsfTestCase):
         assert 's3_test_file1.status_3' in res
 
     @mock.patch('website.util.timestamp.check_file_timestamp')
-    @mock.patch('website.util.timestamp.get_full_list')
+    @mock.patch('website.util.timestamp.iter_full_list')
     @mock.patch('celery.contrib.abortable.AbortableTask.is_aborted')
     @mock.patch('website.util.waterbutler.shutil')
     @mock.patch('requests.get')
     def test_verify_timestamp_token(self, mock_get, mock_shutil, mock_aborted, mock_getfulllist, mock_checkfilets):
         mock_get.return_value.content = ''
         mock_aborted.return_value = False
-        mock_getfulllist.return_value = [
-            {
-                'provider': 'osfstorage',
-                'provider_file_list': [
-                    { 'file_name': 'file1.txt' },
-                    { 'file_name': 'file2.txt' },
-                    { 'file_name': 'file3.txt' },
-                ]
-            },
-            {
-                'provider': 'github',
-                'provider_file_list': [
-                    { 'file_name': 'file1.txt' },
-                ]
-            },
-        ]
+        mock_getfulllist.return_value = iter([
+            { 'provider': 'osfstorage', 'file_name': 'file1.txt' },
+            { 'provider': 'osfstorage', 'file_name': 'file2.txt' },
+            { 'provider': 'osfstorage', 'file_name': 'file3.txt' },
+            { 'provider': 'github', 'file_name': 'file1.txt' },
+        ])
 
         file_node = create_test_file(node=self.node, user=self.user, filename='test_get_timestamp_error_data')
         api_url_get_timestamp_error_data = self.project.url + 'timestamp/json/'
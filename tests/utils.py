@@ -1,7 +1,10 @@
+import asyncore
 import contextlib
 import datetime
 import functools
 import mock
+import smtpd
+import threading
 
 from django.http import HttpRequest
 from django.utils import timezone
@@ -263,3 +266,36 @@ def run_celery_tasks():
     yield
     celery_teardown_request()
     celery_before_request()
+
+
+class LocalSMTPServer(smtpd.SMTPServer):
+    """SMTP stand-in on a free local port that accepts every message except those to refused@example.com,
+    refused for good, and to busy@example.com, rejected temporarily."""
+
+    def __init__(self):
+        self.socket_map = {}
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None, map=self.socket_map, decode_data=True)
+        self.host, self.port = self.socket.getsockname()
+        self.recipients = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.serve)
+
+    def serve(self):
+        while not self.stopped.is_set():
+            asyncore.loop(timeout=0.05, map=self.socket_map, count=1)
+        asyncore.close_all(map=self.socket_map)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        if 'refused@example.com' in rcpttos:
+            return '550 Mailbox unavailable'
+        if 'busy@example.com' in rcpttos:
+            return '451 Try again later'
+        self.recipients.append(rcpttos)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
@@ -290,13 +290,10 @@ def archive_success(dst_pk, job_pk):
 
     :param str dst_pk: primary key of registration Node
 
-    note:: At first glance this task makes redundant calls to utils.get_file_map (which
-    returns a generator yielding  (<sha256>, <file_metadata>) pairs) on the dst Node. Two
-    notes about utils.get_file_map: 1) this function memoizes previous results to reduce
-    overhead and 2) this function returns a generator that lazily fetches the file metadata
-    of child Nodes (it is possible for a selected file to belong to a child Node) using a
-    non-recursive DFS. Combined this allows for a relatively effient implementation with
-    seemingly redundant calls.
+    note:: The files of the dst Node and its child Nodes (it is possible for a selected file
+    to belong to a child Node) are indexed once by utils.get_file_map_index, keyed by
+    (<sha256>, <file name>, <source Node id>), and the index is shared by all schemas, so
+    each selected file is resolved with a single dict lookup.
     """
     create_app_context()
     dst = AbstractNode.load(dst_pk)
@@ -309,9 +306,12 @@ def archive_success(dst_pk, job_pk):
     # questions. These files are references to files on the unregistered Node, and
     # consequently we must migrate those file paths after archiver has run. Using
     # sha256 hashes is a convenient way to identify files post-archival.
+    file_map_index = None
     for schema in dst.registered_schema.all():
         if schema.has_files:
-            utils.migrate_file_metadata(dst, schema)
+            if file_map_index is None:
+                file_map_index = utils.get_file_map_index(dst)
+            utils.migrate_file_metadata(dst, schema, file_map_index=file_map_index)
     job = ArchiveJob.load(job_pk)
     if not job.sent:
         job.sent = True
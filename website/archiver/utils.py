@@ -1,3 +1,4 @@
+from collections import deque
 import functools
 
 from framework.auth import Auth
@@ -184,13 +185,13 @@ def _do_get_file_map(file_tree):
     """Reduces a tree of folders and files into a list of (<sha256>, <file_metadata>) pairs
     """
     file_map = []
-    stack = [file_tree]
-    while len(stack):
-        tree_node = stack.pop(0)
+    queue = deque([file_tree])
+    while queue:
+        tree_node = queue.popleft()
         if tree_node['kind'] == 'file':
             file_map.append((tree_node['extra']['hashes']['sha256'], tree_node))
         else:
-            stack = stack + tree_node['children']
+            queue.extend(tree_node['children'])
     return file_map
 
 def _memoize_get_file_map(func):
@@ -218,17 +219,39 @@ def get_file_map(node, file_map):
         for key, value, node_id in get_file_map(child):
             yield (key, value, node_id)
 
-def find_registration_file(value, node):
+def get_file_map_index(node):
+    """
+    Index the files of a registration and its primary descendants for `find_registration_file`.
+
+    - `node` is a Registration instance
+    - returns a dict mapping `(<sha256>, <file name>, <_id of the node the file's registration was registered from>)`
+        to the `(file_info, node_id)` of the first such file in `get_file_map` order
+    """
+    from osf.models import AbstractNode
+    file_map = list(get_file_map(node))
+    # A node may have several guids: the newest one comes last and wins, as it is the
+    # `registered_from._id` (`guids.first()`) the files used to be matched against
+    registered_from = dict(
+        AbstractNode.objects.filter(
+            guids___id__in={node_id for _, _, node_id in file_map},
+        ).order_by('registered_from__guids__created').values_list('guids___id', 'registered_from__guids___id')
+    )
+    index = {}
+    for sha256, file_info, node_id in file_map:
+        index.setdefault((sha256, file_info['name'], registered_from.get(node_id)), (file_info, node_id))
+    return index
+
+def find_registration_file(value, node, file_map_index=None):
     """
     some annotations:
 
     - `value` is  the `extra` from a file upload in `registered_meta`
         (see `Uploader.addFile` in website/static/js/registrationEditorExtensions.js)
     - `node` is a Registration instance
+    - `file_map_index` is the `get_file_map_index` of `node`, built on each call if omitted
     - returns a `(file_info, node_id)` or `(None, None)` tuple, where `file_info` is from waterbutler's api
         (see `addons.base.models.BaseStorageAddon._get_fileobj_child_metadata` and `waterbutler.core.metadata.BaseMetadata`)
     """
-    from osf.models import AbstractNode
     orig_sha256 = value['sha256']
     orig_name = unescape_entities(
         value['selectedFileName'],
@@ -238,14 +261,11 @@ def find_registration_file(value, node):
         }
     )
     orig_node = value['nodeId']
-    file_map = get_file_map(node)
-    for sha256, file_info, node_id in file_map:
-        registered_from_id = AbstractNode.load(node_id).registered_from._id
-        if sha256 == orig_sha256 and registered_from_id == orig_node and orig_name == file_info['name']:
-            return file_info, node_id
-    return None, None
+    if file_map_index is None:
+        file_map_index = get_file_map_index(node)
+    return file_map_index.get((orig_sha256, orig_name, orig_node), (None, None))
 
-def find_registration_files(values, node):
+def find_registration_files(values, node, file_map_index=None):
     """
     some annotations:
 
@@ -254,9 +274,11 @@ def find_registration_files(values, node):
     - returns a list of `(file_info, node_id, index)` or `(None, None, index)` tuples,
         where `file_info` is from `find_registration_file` above
     """
+    if file_map_index is None:
+        file_map_index = get_file_map_index(node)
     ret = []
     for i in range(len(values.get('extra', []))):
-        ret.append(find_registration_file(values['extra'][i], node) + (i,))
+        ret.append(find_registration_file(values['extra'][i], node, file_map_index=file_map_index) + (i,))
     return ret
 
 def get_title_for_question(schema, path):
@@ -319,15 +341,17 @@ def deep_get(obj, path):
         item = item[key]
     return item
 
-def migrate_file_metadata(dst, schema):
+def migrate_file_metadata(dst, schema, file_map_index=None):
     metadata = dst.registered_meta[schema._id]
     missing_files = []
     selected_files = find_selected_files(schema, metadata)
+    if selected_files and file_map_index is None:
+        file_map_index = get_file_map_index(dst)
 
     for path, selected in selected_files.items():
         target = deep_get(metadata, path)
 
-        for archived_file_info, node_id, index in find_registration_files(selected, dst):
+        for archived_file_info, node_id, index in find_registration_files(selected, dst, file_map_index=file_map_index):
             if not archived_file_info:
                 missing_files.append({
                     'file_name': selected['extra'][index]['selectedFileName'],
@@ -19,6 +19,7 @@ Usage: ::
 
 """
 import os
+import re
 import logging
 import waffle
 
@@ -87,6 +88,12 @@ def render_message(tpl_name, **context):
     return tpl.render_unicode(**context)
 
 
+def template_uses(tpl_name, name):
+    """Return whether an email template refers to the context variable ``name``."""
+    tpl = _tpl_lookup.get_template(tpl_name)
+    return re.search(r'\b{}\b'.format(re.escape(name)), tpl.code) is not None
+
+
 def send_mail(
         to_addr, mail, mimetype='html', from_addr=None, mailer=None, celery=True,
         username=None, password=None, callback=None, attachment_name=None,
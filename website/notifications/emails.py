@@ -1,6 +1,7 @@
 from babel import dates, core, Locale
 
 from osf.models import AbstractNode, OSFUser, NotificationDigest, NotificationSubscription
+from osf.models.node import NodeGroupObjectPermission
 from osf.utils.permissions import ADMIN, READ
 from website import mails
 from website.notifications import constants
@@ -99,69 +100,130 @@ def store_emails(recipient_ids, notification_type, event, user, node, timestamp,
     context['user'] = user
     node_lineage_ids = get_node_lineage(node) if node else []
 
-    for recipient_id in recipient_ids:
-        if recipient_id == user._id:
-            continue
-        recipient = OSFUser.load(recipient_id)
-        if recipient.is_disabled:
-            continue
-        context['localized_timestamp'] = localize_timestamp(timestamp, recipient)
-        context['recipient'] = recipient
-        message = mails.render_message(template, **context)
-        digest = NotificationDigest(
+    recipients_by_id = {
+        recipient._id: recipient
+        for recipient in OSFUser.objects.filter(guids___id__in=recipient_ids, date_disabled__isnull=True)
+    }
+    recipients = [
+        recipients_by_id[recipient_id] for recipient_id in recipient_ids
+        if recipient_id != user._id and recipient_id in recipients_by_id
+    ]
+
+    # The message only differs by the localized timestamp, so it is rendered once per locale and
+    # timezone unless the template addresses the recipient directly.
+    per_recipient = mails.template_uses(template, 'recipient')
+    messages = {}
+    digests = []
+    for recipient in recipients:
+        key = recipient.pk if per_recipient else (recipient.locale, recipient.timezone)
+        if key not in messages:
+            context['localized_timestamp'] = localize_timestamp(timestamp, recipient)
+            if per_recipient:
+                context['recipient'] = recipient
+            messages[key] = mails.render_message(template, **context)
+        digests.append(NotificationDigest(
             timestamp=timestamp,
             send_type=notification_type,
             event=event,
             user=recipient,
-            message=message,
+            message=messages[key],
             node_lineage=node_lineage_ids,
             provider=abstract_provider
-        )
-        digest.save()
+        ))
+    NotificationDigest.objects.bulk_create(digests)
 
 
-def compile_subscriptions(node, event_type, event=None, level=0):
-    """Recurse through node and parents for subscriptions.
+def compile_subscriptions(node, event_type, event=None):
+    """Collect the subscribers of a node, letting subscriptions on a node override those of its parents.
 
     :param node: current node
     :param event_type: Generally node_subscriptions_available
     :param event: Particular event such a file_updated that has specific file subs
-    :param level: How deep the recursion is
     :return: a dict of notification types with lists of users.
     """
-    subscriptions = check_node(node, event_type)
+    lineage = get_node_lineage_objects(node)
+    levels = [(ancestor, utils.to_subscription_key(ancestor._id, event_type)) for ancestor in lineage]
     if event:
-        subscriptions = check_node(node, event)  # Gets particular event subscriptions
-        parent_subscriptions = compile_subscriptions(node, event_type, level=level + 1)  # get node and parent subs
-    elif getattr(node, 'parent_id', False):
-        parent_subscriptions = \
-            compile_subscriptions(AbstractNode.load(node.parent_id), event_type, level=level + 1)
-    else:
-        parent_subscriptions = check_node(None, event_type)
-    for notification_type in parent_subscriptions:
-        p_sub_n = parent_subscriptions[notification_type]
-        p_sub_n.extend(subscriptions[notification_type])
-        for nt in subscriptions:
-            if notification_type != nt:
-                p_sub_n = list(set(p_sub_n).difference(set(subscriptions[nt])))
-        if level == 0:
-            p_sub_n, removed = utils.separate_users(node, p_sub_n)
-        parent_subscriptions[notification_type] = p_sub_n
-    return parent_subscriptions
+        # Subscriptions to the particular event take precedence over the node ones
+        levels.append((node, utils.to_subscription_key(node._id, event)))
+    subscribers = get_subscribers([key for _, key in levels])
+    readers = get_reader_ids(lineage, {user_pk for users in subscribers.values() for user_pk in users})
+
+    compiled = {notification_type: set() for notification_type in constants.NOTIFICATION_TYPES}
+    for level_node, key in levels:
+        level = {
+            notification_type: subscribers.get(key, {}).get(notification_type, set()) & readers[level_node.pk]
+            for notification_type in constants.NOTIFICATION_TYPES
+        }
+        for notification_type in compiled:
+            overridden = set().union(*(users for nt, users in level.items() if nt != notification_type))
+            compiled[notification_type] = (compiled[notification_type] | level[notification_type]) - overridden
+    return to_guid_lists(compiled, readers[node.pk])
 
 
 def check_node(node, event):
     """Return subscription for a particular node and event."""
-    node_subscriptions = {key: [] for key in constants.NOTIFICATION_TYPES}
-    if node:
-        subscription = NotificationSubscription.load(utils.to_subscription_key(node._id, event))
-        for notification_type in node_subscriptions:
-            users = getattr(subscription, notification_type, [])
-            if users:
-                for user in users.exclude(date_disabled__isnull=False):
-                    if node.has_permission(user, READ):
-                        node_subscriptions[notification_type].append(user._id)
-    return node_subscriptions
+    if not node:
+        return {key: [] for key in constants.NOTIFICATION_TYPES}
+    key = utils.to_subscription_key(node._id, event)
+    subscribers = get_subscribers([key]).get(key, {})
+    readers = get_reader_ids(get_node_lineage_objects(node), {user_pk for users in subscribers.values() for user_pk in users})
+    return to_guid_lists(
+        {notification_type: subscribers.get(notification_type, set()) for notification_type in constants.NOTIFICATION_TYPES},
+        readers[node.pk],
+    )
+
+
+def get_subscribers(subscription_keys):
+    """Return ``{subscription key: {notification type: set of user pks}}`` for active users."""
+    subscribers = {}
+    for notification_type in constants.NOTIFICATION_TYPES:
+        through = getattr(NotificationSubscription, notification_type).through
+        rows = through.objects.filter(
+            notificationsubscription___id__in=subscription_keys,
+            osfuser__date_disabled__isnull=True,
+        ).values_list('notificationsubscription___id', 'osfuser_id')
+        for key, user_pk in rows:
+            subscribers.setdefault(key, {}).setdefault(notification_type, set()).add(user_pk)
+    return subscribers
+
+
+def get_reader_ids(lineage, user_pks):
+    """Map each node of ``lineage`` (ordered from the top most project) to the pks in ``user_pks``
+    that may read it.
+
+    Follows ``node.has_permission(user, READ)``: users with read permission on the node through
+    contributorship or group membership, and admins of the node or any of its parents.
+    """
+    if not isinstance(lineage[-1], AbstractNode):
+        users = OSFUser.objects.filter(pk__in=user_pks)
+        return {lineage[-1].pk: {user.pk for user in users if lineage[-1].has_permission(user, READ)}}
+
+    permissions = NodeGroupObjectPermission.objects.filter(
+        content_object_id__in=[node.pk for node in lineage],
+        permission__codename__in=['{}_node'.format(READ), '{}_node'.format(ADMIN)],
+        group__user__in=user_pks,
+    ).values_list('content_object_id', 'permission__codename', 'group__user')
+    granted = {}
+    for node_pk, codename, user_pk in permissions:
+        granted.setdefault((node_pk, codename), set()).add(user_pk)
+
+    readers = {}
+    admins = set()
+    for node in lineage:
+        admins |= granted.get((node.pk, '{}_node'.format(ADMIN)), set())
+        readers[node.pk] = granted.get((node.pk, '{}_node'.format(READ)), set()) | admins
+    return readers
+
+
+def to_guid_lists(user_pks_by_type, allowed_pks):
+    """Turn ``{notification type: set of user pks}`` into sorted lists of user guids, keeping only ``allowed_pks``."""
+    user_pks = set().union(*user_pks_by_type.values()) & allowed_pks
+    guids = dict(OSFUser.objects.filter(pk__in=user_pks).values_list('pk', 'guids___id')) if user_pks else {}
+    return {
+        notification_type: sorted(guids[user_pk] for user_pk in users if user_pk in guids)
+        for notification_type, users in user_pks_by_type.items()
+    }
 
 
 def get_user_subscriptions(user, event):
@@ -174,6 +236,15 @@ def get_user_subscriptions(user, event):
         return {key: [] for key in constants.NOTIFICATION_TYPES}
 
 
+def get_node_lineage_objects(node):
+    """Get a list of nodes in order from the top most project to the node"""
+    lineage = [node]
+    while getattr(node, 'parent_id', None):
+        node = node.parent_node
+        lineage.insert(0, node)
+    return lineage
+
+
 def get_node_lineage(node):
     """ Get a list of node ids in order from the node to top most project
         e.g. [parent._id, node._id]
@@ -2,10 +2,13 @@
 Tasks for making even transactional emails consolidated.
 """
 import itertools
+import logging
+import time
 
 from django.db import connection
 
 from framework.celery_tasks import app as celery_app
+from framework.email import tasks as email_tasks
 from framework.sentry import log_exception
 from osf.models import OSFUser, AbstractNode, AbstractProvider
 from osf.models import NotificationDigest
@@ -13,6 +16,8 @@ from osf.utils.permissions import ADMIN
 from website import mails, settings
 from website.notifications.utils import NotificationsDict
 
+logger = logging.getLogger(__name__)
+
 
 @celery_app.task(name='website.notifications.tasks.send_users_email', max_retries=0)
 def send_users_email(send_type):
@@ -28,10 +33,41 @@ def send_users_email(send_type):
 def _send_global_and_node_emails(send_type):
     """
     Called by `send_users_email`. Send all global and node-related notification emails.
+
+    Digests are handled ``NOTIFICATION_DIGEST_BATCH_SIZE`` users at a time: the users and nodes of a
+    batch are loaded together, its emails are sent over ``NOTIFICATION_DIGEST_SMTP_CONNECTIONS``
+    connections, and the delivered notifications are removed at once. Notifications whose email
+    failed transiently are kept for the next run, the ones refused for good are dropped.
+
+    :return: dict of run statistics
     """
+    stats = {'users': 0, 'sent': 0, 'failed': 0, 'refused': 0, 'skipped': 0}
+    start = time.time()
     grouped_emails = get_users_emails(send_type)
-    for group in grouped_emails:
-        user = OSFUser.load(group['user_id'])
+    while True:
+        batch = list(itertools.islice(grouped_emails, settings.NOTIFICATION_DIGEST_BATCH_SIZE))
+        if not batch:
+            break
+        _send_digest_batch(batch, stats)
+    elapsed = time.time() - start
+    stats['seconds'] = elapsed
+    logger.info(
+        'Sent {} {} digests to {} users in {:.1f}s ({:.1f} emails/s), {} failed, {} refused, {} skipped'.format(
+            stats['sent'], send_type, stats['users'], elapsed, stats['sent'] / elapsed if elapsed else 0,
+            stats['failed'], stats['refused'], stats['skipped'],
+        )
+    )
+    return stats
+
+
+def _send_digest_batch(batch, stats):
+    users = {
+        user._id: user
+        for user in OSFUser.objects.filter(guids___id__in=[group['user_id'] for group in batch])
+    }
+    digests = []
+    for group in batch:
+        user = users.get(group['user_id'])
         if not user:
             log_exception()
             continue
@@ -39,21 +75,59 @@ def _send_global_and_node_emails(send_type):
         notification_ids = [message['_id'] for message in info]
         sorted_messages = group_by_node(info)
         if sorted_messages:
-            if not user.is_disabled:
-                # If there's only one node in digest we can show it's preferences link in the template.
-                notification_nodes = list(sorted_messages['children'].keys())
-                node = AbstractNode.load(notification_nodes[0]) if len(
-                    notification_nodes) == 1 else None
-                mails.send_mail(
-                    to_addr=user.username,
-                    mimetype='html',
-                    can_change_node_preferences=bool(node),
-                    node=node,
-                    mail=mails.DIGEST,
-                    name=user.fullname,
-                    message=sorted_messages,
-                )
-            remove_notifications(email_notification_ids=notification_ids)
+            digests.append((user, notification_ids, sorted_messages))
+    stats['users'] += len(digests)
+
+    # If there's only one node in digest we can show it's preferences link in the template.
+    single_node_ids = {
+        list(sorted_messages['children'].keys())[0]
+        for _, _, sorted_messages in digests
+        if len(sorted_messages['children']) == 1
+    }
+    nodes = {node._id: node for node in AbstractNode.objects.filter(guids___id__in=single_node_ids)}
+
+    sent_notification_ids = []
+    outgoing = []
+    for user, notification_ids, sorted_messages in digests:
+        if user.is_disabled:
+            stats['skipped'] += 1
+            sent_notification_ids.extend(notification_ids)
+            continue
+        notification_nodes = list(sorted_messages['children'].keys())
+        node = nodes.get(notification_nodes[0]) if len(notification_nodes) == 1 else None
+        queued = len(outgoing)
+        mails.send_mail(
+            to_addr=user.username,
+            mimetype='html',
+            can_change_node_preferences=bool(node),
+            node=node,
+            mail=mails.DIGEST,
+            name=user.fullname,
+            message=sorted_messages,
+            celery=False,
+            mailer=lambda **kwargs: outgoing.append((notification_ids, kwargs)),
+        )
+        if len(outgoing) == queued:
+            # Nothing to deliver, e.g. emails are turned off
+            sent_notification_ids.extend(notification_ids)
+
+    results = email_tasks.send_emails(
+        [kwargs for _, kwargs in outgoing],
+        max_connections=settings.NOTIFICATION_DIGEST_SMTP_CONNECTIONS,
+    )
+    for (notification_ids, kwargs), result in zip(outgoing, results):
+        if result == email_tasks.EMAIL_SENT:
+            stats['sent'] += 1
+            sent_notification_ids.extend(notification_ids)
+        elif result == email_tasks.EMAIL_REFUSED:
+            # Sending it again would be refused again
+            logger.warning('Dropped the digest of {} notifications refused for {}'.format(
+                len(notification_ids), kwargs.get('to_addr')))
+            stats['refused'] += 1
+            sent_notification_ids.extend(notification_ids)
+        else:
+            stats['failed'] += 1
+    remove_notifications(email_notification_ids=sent_notification_ids)
 
 
 def _send_reviews_moderator_emails(send_type):
@@ -9,7 +9,6 @@ from website.project.decorators import must_be_contributor_or_public
 from website.project.views.node import _view_project
 from website.util import timestamp
 from website import settings
-from osf.models import TimestampTask
 
 logger = logging.getLogger(__name__)
 
@@ -29,22 +28,16 @@ def get_init_timestamp_error_data_list(auth, node, **kwargs):
 
 @must_be_contributor_or_public
 def verify_timestamp_token(auth, node, **kwargs):
-    async_task = timestamp.celery_verify_timestamp_token.delay(auth.user.id, node.id)
-    TimestampTask.objects.update_or_create(
-        node=node,
-        defaults={'task_id': async_task.id, 'requester': auth.user}
-    )
+    timestamp.start_celery_task(
+        timestamp.celery_verify_timestamp_token, node, auth.user, auth.user.id, node.id)
     return {'status': 'OK'}
 
 @must_be_contributor_or_public
 def add_timestamp_token(auth, node, **kwargs):
     """Timestamptoken add method
     """
-    async_task = timestamp.celery_add_timestamp_token.delay(auth.user.id, node.id, request.json)
-    TimestampTask.objects.update_or_create(
-        node=node,
-        defaults={'task_id': async_task.id, 'requester': auth.user}
-    )
+    timestamp.start_celery_task(
+        timestamp.celery_add_timestamp_token, node, auth.user, auth.user.id, node.id, request.json)
     return {'status': 'OK'}
 
 @must_be_contributor_or_public
@@ -28,6 +28,7 @@ from osf.models import QuickFilesNode
 from osf.models import Preprint
 from osf.models import SpamStatus
 from osf.models import Guid
+from osf.models import PendingSearchUpdate
 from addons.wiki.models import WikiPage
 from osf.models import CollectionSubmission
 from osf.models import Comment
@@ -428,6 +429,18 @@ def merge_highlight(hits):
     return hits
 
 def set_last_comment(hits):
+    comment_ids = set()
+    for hit in hits:
+        for key in hit['_source']['highlight']:
+            if not key.startswith('comments.'):
+                continue
+            try:
+                comment_ids.add(int(key.split('.')[1]))
+            except Exception:
+                continue  # unexpected type, ignore
+    comments = Comment.objects.filter(id__in=comment_ids).select_related('target').in_bulk() if comment_ids else {}
+
+    last_comments = {}
     for hit in hits:
         s = hit['_source']
         highlight = s['highlight']
@@ -440,38 +453,61 @@ def set_last_comment(hits):
                 comment_id = int(key.split('.')[1])
             except Exception:
                 continue  # unexpected type, ignore
-            c = Comment.objects.get(id=comment_id)
+            c = comments.get(comment_id)
+            if c is None:
+                continue
             if last_comment is None or c.created > last_comment.created:
                 last_comment = c
                 last_text = value[0]
         if last_comment is None:
             s['comment'] = None
             continue  # no comment, skip
+        last_comments[id(hit)] = (last_comment, last_text)
+
+    # Replies point at the guid of the comment they answer
+    comment_content_type = ContentType.objects.get_for_model(Comment)
+    replyto_ids = {
+        comment.target.object_id for comment, _ in last_comments.values()
+        if comment.target and comment.target.content_type_id == comment_content_type.id
+    }
+    replytos = Comment.objects.filter(id__in=replyto_ids).in_bulk() if replyto_ids else {}
+    user_ids = {comment.user_id for comment, _ in last_comments.values()}
+    user_ids.update(comment.user_id for comment in replytos.values())
+    users = OSFUser.objects.filter(id__in=user_ids).in_bulk() if user_ids else {}
+
+    for hit in hits:
+        if id(hit) not in last_comments:
+            continue
+        last_comment, last_text = last_comments[id(hit)]
+        last_comment_user = users.get(last_comment.user_id)
         d = {}
         d['text'] = last_text
-        d['user_id'] = last_comment.user._id
-        d['user_name'] = last_comment.user.fullname
+        d['user_id'] = last_comment_user._id
+        d['user_name'] = last_comment_user.fullname
         d['date_created'] = last_comment.created.isoformat()
         d['date_modified'] = last_comment.modified.isoformat()
         replyto_user_id = None
         replyto_username = None
         replyto_date_created = None
         replyto_date_modified = None
-        replyto = last_comment.target.referent
-        if isinstance(replyto, Comment):
-            replyto_user_id = replyto.user._id
-            replyto_username = replyto.user.fullname
+        replyto = None
+        if last_comment.target and last_comment.target.content_type_id == comment_content_type.id:
+            replyto = replytos.get(last_comment.target.object_id)
+        if replyto is not None:
+            replyto_user = users.get(replyto.user_id)
+            replyto_user_id = replyto_user._id
+            replyto_username = replyto_user.fullname
             replyto_date_created = replyto.created.isoformat()
             replyto_date_modified = replyto.modified.isoformat()
         d['replyto_user_id'] = replyto_user_id
         d['replyto_user_name'] = replyto_username
         d['replyto_date_created'] = replyto_date_created
         d['replyto_date_modified'] = replyto_date_modified
-        s['comment'] = d
+        hit['_source']['comment'] = d
     return hits
 
-def get_file_path(file_id):
-    file_node = BaseFileNode.load(file_id)
+def get_file_path(file_id, files=None):
+    file_node = BaseFileNode.load(file_id) if files is None else files.get(file_id)
     if file_node is None:
         return None
     app_config = settings.ADDONS_AVAILABLE_DICT.get(file_node.provider)
@@ -481,14 +517,54 @@ def get_file_path(file_id):
         provider_name = file_node.provider
     return u'{}{}'.format(provider_name, file_node.materialized_path)
 
+def load_result_objects(results):
+    """Load the users, wikis, files and parent nodes a page of search results refers to,
+    one query per model.
+    """
+    user_ids, wiki_ids, file_ids, node_ids = set(), set(), set(), set()
+    for result in results:
+        category = result.get('category')
+        if category == 'user':
+            user_ids.add(result['id'])
+        elif category in {'wiki', 'file', 'project', 'component', 'registration'}:
+            user_ids.update([result.get('creator_id'), result.get('modifier_id')])
+            if category == 'wiki':
+                wiki_ids.add(result['id'])
+            elif category == 'file':
+                file_ids.add(result.get('id'))
+            if category != 'wiki':
+                node_ids.add(result.get('parent_id'))
+
+    def by_guid(model, guids):
+        guids = {guid for guid in guids if guid}
+        if not guids:
+            return {}
+        object_ids = dict(
+            Guid.objects.filter(_id__in=guids, content_type=ContentType.objects.get_for_model(model))
+            .values_list('_id', 'object_id')
+        )
+        objects = model.objects.in_bulk(set(object_ids.values()))
+        return {guid: objects[object_id] for guid, object_id in object_ids.items() if object_id in objects}
+
+    file_ids = {file_id for file_id in file_ids if file_id}
+    return {
+        'users': by_guid(OSFUser, user_ids),
+        'wikis': by_guid(WikiPage, wiki_ids),
+        'files': {file_node._id: file_node for file_node in BaseFileNode.objects.filter(_id__in=file_ids)} if file_ids else {},
+        'nodes': by_guid(AbstractNode, node_ids),
+    }
+
+
 def format_results(results):
+    loaded = load_result_objects(results)
+    users = loaded['users']
     ret = []
     for result in results:
         category = result.get('category')
         if category == 'user':
             result['url'] = '/profile/' + result['id']
             # unnormalized
-            user = OSFUser.load(result['id'])
+            user = users.get(result['id'])
             if user:
                 job, school = user.get_ongoing_job_school()
                 if job is None:
@@ -503,13 +579,13 @@ def format_results(results):
                 result['ongoing_school_degree'] = school.get('degree', '')
         elif category == 'wiki':
             # get unnormalized names
-            wiki = WikiPage.load(result['id'])
+            wiki = loaded['wikis'].get(result['id'])
             if wiki:
                 result['name'] = wiki.page_name
             creator_id, creator_name = user_id_fullname(
-                result.get('creator_id'))
+                result.get('creator_id'), users)
             modifier_id, modifier_name = user_id_fullname(
-                result.get('modifier_id'))
+                result.get('modifier_id'), users)
             result['creator_name'] = creator_name
             result['modifier_name'] = modifier_name
         elif category == 'comment':
@@ -521,24 +597,24 @@ def format_results(results):
             else:
                 result['replyto_user_url'] = None
         elif category == 'file':
-            file_path = get_file_path(result.get('id'))
+            file_path = get_file_path(result.get('id'), loaded['files'])
             if file_path:
                 folder_name = os.path.dirname(file_path)
             else:
                 folder_name = None
             result['folder_name'] = folder_name
-            parent_info = load_parent(result.get('parent_id'))
+            parent_info = load_parent(result.get('parent_id'), loaded['nodes'])
             result['parent_url'] = parent_info.get('url') if parent_info else None
             result['parent_title'] = parent_info.get('title') if parent_info else None
             # get unnormalized names
             creator_id, creator_name = user_id_fullname(
-                result.get('creator_id'))
+                result.get('creator_id'), users)
             modifier_id, modifier_name = user_id_fullname(
-                result.get('modifier_id'))
+                result.get('modifier_id'), users)
             result['creator_name'] = creator_name
             result['modifier_name'] = modifier_name
         elif category in {'project', 'component', 'registration'}:
-            result = format_result(result, result.get('parent_id'))
+            result = format_result(result, result.get('parent_id'), loaded)
         elif category in {'preprint'}:
             result = format_preprint_result(result)
         elif category == 'collectionSubmission':
@@ -551,21 +627,23 @@ def format_results(results):
 
 
 # return (guid, fullname)
-def user_id_fullname(guid_id):
+def user_id_fullname(guid_id, users=None):
     if guid_id:
-        user = OSFUser.load(guid_id)
+        user = OSFUser.load(guid_id) if users is None else users.get(guid_id)
         if user:
             return (guid_id, user.fullname)
     return ('', '')
 
 
 # for 'project', 'component', 'registration'
-def format_result(result, parent_id=None):
-    parent_info = load_parent(parent_id)
+def format_result(result, parent_id=None, loaded=None):
+    # objects from load_result_objects, looked up one by one when not given
+    loaded = loaded or {}
+    parent_info = load_parent(parent_id, loaded.get('nodes'))
 
     # get unnormalized names
-    creator_id, creator_name = user_id_fullname(result.get('creator_id'))
-    modifier_id, modifier_name = user_id_fullname(result.get('modifier_id'))
+    creator_id, creator_name = user_id_fullname(result.get('creator_id'), loaded.get('users'))
+    modifier_id, modifier_name = user_id_fullname(result.get('modifier_id'), loaded.get('users'))
 
     formatted_result = {
         'contributors': result['contributors'],
@@ -636,8 +714,8 @@ def format_preprint_result(result):
     return formatted_result
 
 
-def load_parent(parent_id):
-    parent = AbstractNode.load(parent_id)
+def load_parent(parent_id, nodes=None):
+    parent = AbstractNode.load(parent_id) if nodes is None else nodes.get(parent_id)
     if parent and parent.is_public:
         return {
             'title': parent.title,
@@ -1071,7 +1149,12 @@ def update_file_metadata(file_metadata, index=None, bulk=False):
         client().index(index=index, doc_type=category, id=file_metadata._id, body=elastic_document, refresh=True)
 
 @requires_search
-def update_node(node, index=None, bulk=False, async_update=False, wiki_page=None):
+def update_node(node, index=None, bulk=False, async_update=False, wiki_page=None, queue_files=False):
+    """Index ``node`` and its files, wikis and file metadata.
+
+    With ``queue_files`` the files go to ``website.search.index_queue`` instead of being
+    indexed one by one.
+    """
     if wiki_page:
         update_wiki(wiki_page, index=index)
         # NOTE: update_node() may be called twice after WikiPage.save()
@@ -1082,8 +1165,13 @@ def update_node(node, index=None, bulk=False, async_update=False, wiki_page=None
 
     from addons.osfstorage.models import OsfStorageFile
     index = es_index(index)
-    for file_ in paginated(OsfStorageFile, Q(target_content_type=ContentType.objects.get_for_model(type(node)), target_object_id=node.id)):
-        update_file(file_, index=index)
+    files_query = Q(target_content_type=ContentType.objects.get_for_model(type(node)), target_object_id=node.id)
+    if queue_files:
+        from website.search import index_queue
+        index_queue.enqueue(PendingSearchUpdate.FILE, OsfStorageFile.objects.filter(files_query).values_list('id', flat=True), index=index)
+    else:
+        for file_ in paginated(OsfStorageFile, files_query):
+            update_file(file_, index=index)
 
     is_qa_node = bool(set(settings.DO_NOT_INDEX_LIST['tags']).intersection(node.tags.all().values_list('name', flat=True))) or any(substring in node.title for substring in settings.DO_NOT_INDEX_LIST['titles'])
     if node.is_deleted or (not settings.ENABLE_PRIVATE_SEARCH and not node.is_public) or node.archiving or node.is_spam or (node.spam_status == SpamStatus.FLAGGED and settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH) or node.is_quickfiles or is_qa_node:
@@ -1260,6 +1348,16 @@ def bulk_update_cgm(cgms, actions=None, op='update', index=None):
     except helpers.BulkIndexError as e:
         raise exceptions.BulkUpdateError(e.errors)
 
+def serialize_node_contributors(target):
+    # Contributors for Access control
+    return [
+        {
+            'id': x['guids___id']
+        }
+        for x in target._contributors.all().order_by('contributor___order')
+        .values('guids___id')
+    ]
+
 def serialize_contributors(node):
     return {
         'contributors': [
@@ -1308,6 +1406,9 @@ def update_user(user, index=None):
             pass
         return
 
+    client().index(index=index, doc_type='user', body=serialize_user(user), id=user._id, refresh=True)
+
+def serialize_user(user):
     names = dict(
         fullname=user.fullname,
         given_name=user.given_name,
@@ -1333,7 +1434,7 @@ def update_user(user, index=None):
     ongoing_school_department = unicode_normalize(ogschool.get('department', ''))
     ongoing_school_degree = unicode_normalize(ogschool.get('degree', ''))
 
-    user_doc = {
+    return {
         'id': user._id,
         'user': user.fullname,
         'sort_user_name': user.fullname,
@@ -1361,21 +1462,11 @@ def update_user(user, index=None):
         'emails': list(user.emails.values_list('address', flat=True))
     }
 
-    client().index(index=index, doc_type='user', body=user_doc, id=user._id, refresh=True)
-
 @requires_search
 def update_file(file_, index=None, delete=False):
     index = es_index(index)
-    target = file_.target
-
-    # TODO: Can remove 'not file_.name' if we remove all base file nodes with name=None
-    file_node_is_qa = bool(
-        set(settings.DO_NOT_INDEX_LIST['tags']).intersection(file_.tags.all().values_list('name', flat=True))
-    ) or bool(
-        set(settings.DO_NOT_INDEX_LIST['tags']).intersection(target.tags.all().values_list('name', flat=True))
-    ) or any(substring in target.title for substring in settings.DO_NOT_INDEX_LIST['titles'])
-    if not file_.name or (not settings.ENABLE_PRIVATE_SEARCH and not target.is_public) or delete or file_node_is_qa or getattr(target, 'is_deleted', False) or getattr(target, 'archiving', False) or target.is_spam or (
-            target.spam_status == SpamStatus.FLAGGED and settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH):
+    file_doc = None if delete else serialize_file(file_)
+    if file_doc is None:
         client().delete(
             index=index,
             doc_type='file',
@@ -1385,17 +1476,40 @@ def update_file(file_, index=None, delete=False):
         )
         return
 
+    client().index(
+        index=index,
+        doc_type='file',
+        body=file_doc,
+        id=file_._id,
+        refresh=True
+    )
+
+def serialize_file(file_, target_tags=None, node_contributors=None):
+    """Return the search document of ``file_``, or None if the file must not be searchable.
+
+    :param list target_tags: Names of all tags of the file's target, loaded if None
+    :param list node_contributors: ``node_contributors`` of the document, loaded if None
+    """
+    target = file_.target
+    if target_tags is None:
+        target_tags = list(target.tags.all().values_list('name', flat=True))
+    # Read through tags.all() so that prefetched tags are used
+    file_tags = [(tag.name, tag.system) for tag in file_.tags.all()]
+
+    # TODO: Can remove 'not file_.name' if we remove all base file nodes with name=None
+    file_node_is_qa = bool(
+        set(settings.DO_NOT_INDEX_LIST['tags']).intersection(name for name, _ in file_tags)
+    ) or bool(
+        set(settings.DO_NOT_INDEX_LIST['tags']).intersection(target_tags)
+    ) or any(substring in target.title for substring in settings.DO_NOT_INDEX_LIST['titles'])
+    if not file_.name or (not settings.ENABLE_PRIVATE_SEARCH and not target.is_public) or file_node_is_qa or getattr(target, 'is_deleted', False) or getattr(target, 'archiving', False) or target.is_spam or (
+            target.spam_status == SpamStatus.FLAGGED and settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH):
+        return None
+
     if isinstance(target, Preprint):
         if not getattr(target, 'verified_publishable', False) or target.primary_file != file_ or target.is_spam or (
                 target.spam_status == SpamStatus.FLAGGED and settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH):
-            client().delete(
-                index=index,
-                doc_type='file',
-                id=file_._id,
-                refresh=True,
-                ignore=[404]
-            )
-            return
+            return None
 
     # We build URLs manually here so that this function can be
     # run outside of a Flask request context (e.g. in a celery task)
@@ -1409,7 +1523,7 @@ def update_file(file_, index=None, delete=False):
     else:
         node_url = '/{target_id}/'.format(target_id=target._id)
 
-    tags = list(file_.tags.filter(system=False).values_list('name', flat=True))
+    tags = [name for name, system in file_tags if not system]
     normalized_tags = [unicode_normalize(tag) for tag in tags]
 
     # FileVersion ordering is '-created'. (reversed order)
@@ -1440,7 +1554,7 @@ def update_file(file_, index=None, delete=False):
         guid_url = '/{file_guid}/'.format(file_guid=file_guid._id)
     # File URL's not provided for preprint files, because the File Detail Page will
     # just reroute to preprints detail
-    file_doc = {
+    return {
         'id': file_._id,
         'date_created': date_created,
         'date_modified': date_modified,
@@ -1464,25 +1578,11 @@ def update_file(file_, index=None, delete=False):
         'is_retracted': getattr(target, 'is_retracted', False),
         'extra_search_terms': clean_splitters(file_.name),
         # Contributors for Access control
-        'node_contributors': [
-            {
-                'id': x['guids___id']
-            }
-            for x in target._contributors.all().order_by('contributor___order')
-            .values('guids___id')
-        ],
+        'node_contributors': node_contributors if node_contributors is not None else serialize_node_contributors(target),
         'node_public': target.is_public,
         'comments': comments_to_doc(file_guid._id) if file_guid else {}
     }
 
-    client().index(
-        index=index,
-        doc_type='file',
-        body=file_doc,
-        id=file_._id,
-        refresh=True
-    )
-
 @requires_search
 def update_institution(institution, index=None):
     index = es_index(index)
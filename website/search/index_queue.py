@@ -0,0 +1,230 @@
+"""Debounced queue of search index updates for nodes, files and users.
+
+With ``SEARCH_INDEX_QUEUE_ENABLED``, ``website.search.search`` records the objects to reindex
+as ``PendingSearchUpdate`` rows instead of sending one index request, with a forced refresh,
+per saved object. Repeated updates of one document coalesce into a single row. The
+``flush_search_index_queue`` task sends the documents that have not been updated for
+``SEARCH_INDEX_QUEUE_DELAY`` seconds, or whose oldest pending update is older than
+``SEARCH_INDEX_QUEUE_MAX_WAIT`` seconds, to Elasticsearch in one ``helpers.bulk`` call per
+batch and leaves refreshing to the index refresh interval.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+import logging
+
+from django.db import connection, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from elasticsearch2 import helpers
+
+from framework.celery_tasks import app as celery_app
+from framework.celery_tasks.handlers import enqueue_task
+from osf.models import AbstractNode, OSFUser, PendingSearchUpdate
+from website import settings
+from website.search import elastic_search
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(doc_type, object_ids, index=None):
+    """Queue the objects of ``doc_type`` with the given pks to be reindexed.
+
+    Within a request the queue rows are written after the request, so that its transaction
+    never holds their locks.
+    """
+    object_ids = sorted(set(object_ids))
+    if not object_ids:
+        return
+    enqueue_task(upsert_pending_updates.si(doc_type, object_ids, elastic_search.es_index(index)))
+
+
+@celery_app.task(ignore_results=True)
+def upsert_pending_updates(doc_type, object_ids, index):
+    now = timezone.now()
+    # One statement that never waits for a flush: a document queued again while a flush sends
+    # it loses the claim of that flush, which then leaves the row for the next flush
+    sql = (
+        'INSERT INTO {table} (created, modified, doc_type, object_id, "index", last_queued, claimed_at) '
+        'VALUES {values} '
+        'ON CONFLICT (doc_type, object_id, "index") DO UPDATE SET '
+        'modified = EXCLUDED.modified, last_queued = EXCLUDED.last_queued, claimed_at = NULL'
+    ).format(
+        table=PendingSearchUpdate._meta.db_table,
+        values=', '.join(['(%s, %s, %s, %s, %s, %s, NULL)'] * len(object_ids)),
+    )
+    params = []
+    for object_id in object_ids:
+        params.extend([now, now, doc_type, object_id, index, now])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def discard(doc_type, object_ids, index=None):
+    """Drop pending updates, e.g. of documents that were just deleted from the index."""
+    PendingSearchUpdate.objects.filter(
+        doc_type=doc_type, index=elastic_search.es_index(index), object_id__in=list(object_ids),
+    ).delete()
+
+
+def get_metrics():
+    """Return the number of queued documents and the age in seconds of the oldest update."""
+    stats = PendingSearchUpdate.objects.aggregate(depth=Count('id'), oldest=Min('created'))
+    lag = (timezone.now() - stats['oldest']).total_seconds() if stats['oldest'] else 0.0
+    return {'depth': stats['depth'], 'lag': lag}
+
+
+def _build_actions(objects, build):
+    """Yield ``(pk, action)`` for the objects whose ``build`` returns an action.
+
+    A document that cannot be built is logged and left out, so that it does not hold back
+    the documents flushed with it.
+    """
+    for obj in objects:
+        try:
+            action = build(obj)
+        except Exception:
+            logger.exception('Failed to build the search document of {!r}'.format(obj))
+            continue
+        if action:
+            yield obj.id, action
+
+
+def _node_actions(node_ids, index):
+    def build(node):
+        # Deleted and private nodes are removed from the index by update_node itself
+        doc = elastic_search.update_node(node, index=index, bulk=True, queue_files=True)
+        if doc:
+            return {
+                '_op_type': 'index',
+                '_index': index,
+                '_type': elastic_search.get_doctype_from_node(node),
+                '_id': node._id,
+                '_source': doc,
+            }
+
+    return _build_actions(AbstractNode.objects.filter(id__in=node_ids), build)
+
+
+def _file_actions(file_ids, index):
+    from addons.osfstorage.models import OsfStorageFile
+
+    target_tags = {}
+    node_contributors = {}
+
+    def build(file_):
+        target = file_.target
+        target_key = (file_.target_content_type_id, file_.target_object_id)
+        if target_key not in target_tags:
+            target_tags[target_key] = list(target.tags.all().values_list('name', flat=True))
+            node_contributors[target_key] = elastic_search.serialize_node_contributors(target)
+        doc = elastic_search.serialize_file(
+            file_, target_tags=target_tags[target_key], node_contributors=node_contributors[target_key],
+        )
+        if doc is None:
+            return {'_op_type': 'delete', '_index': index, '_type': 'file', '_id': file_._id}
+        return {'_op_type': 'index', '_index': index, '_type': 'file', '_id': file_._id, '_source': doc}
+
+    return _build_actions(OsfStorageFile.objects.filter(id__in=file_ids).prefetch_related('tags'), build)
+
+
+def _user_actions(user_ids, index):
+    def build(user):
+        if user.is_active:
+            return {
+                '_op_type': 'index',
+                '_index': index,
+                '_type': 'user',
+                '_id': user._id,
+                '_source': elastic_search.serialize_user(user),
+            }
+        # Also removes the files of spam users' quickfiles nodes
+        elastic_search.update_user(user, index=index)
+
+    return _build_actions(OSFUser.objects.filter(id__in=user_ids), build)
+
+
+ACTION_BUILDERS = {
+    PendingSearchUpdate.NODE: _node_actions,
+    PendingSearchUpdate.FILE: _file_actions,
+    PendingSearchUpdate.USER: _user_actions,
+}
+
+
+@elastic_search.requires_search
+def flush(delay=None, batch_size=None, max_wait=None):
+    """Reindex the queued documents that have not been updated for ``delay`` seconds, or
+    that have been waiting for more than ``max_wait`` seconds.
+
+    Documents that Elasticsearch rejects are queued again.
+
+    :return Counter: Number of flushed queue entries per doc type
+    """
+    delay = settings.SEARCH_INDEX_QUEUE_DELAY if delay is None else delay
+    max_wait = settings.SEARCH_INDEX_QUEUE_MAX_WAIT if max_wait is None else max_wait
+    batch_size = batch_size or settings.SEARCH_INDEX_QUEUE_BATCH_SIZE
+    flushed = Counter()
+    # Rejected documents wait for the next flush instead of being sent again by this one
+    requeued_ids = []
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            # Claim the batch and release the row locks right away, so that enqueue never
+            # waits for Elasticsearch. Claims of a flush that died expire.
+            entries = list(
+                PendingSearchUpdate.objects.select_for_update(skip_locked=True)
+                .filter(
+                    Q(last_queued__lte=now - timedelta(seconds=delay)) |
+                    Q(created__lte=now - timedelta(seconds=max_wait))
+                )
+                .filter(
+                    Q(claimed_at__isnull=True) |
+                    Q(claimed_at__lt=now - timedelta(seconds=settings.SEARCH_INDEX_QUEUE_CLAIM_TIMEOUT))
+                )
+                .exclude(id__in=requeued_ids)
+                .order_by('created')[:batch_size]
+            )
+            if not entries:
+                break
+            PendingSearchUpdate.objects.filter(id__in=[entry.id for entry in entries]).update(claimed_at=now)
+        grouped = defaultdict(list)
+        for entry in entries:
+            grouped[(entry.doc_type, entry.index)].append(entry.object_id)
+        actions = []
+        for (doc_type, index), object_ids in grouped.items():
+            for object_id, action in ACTION_BUILDERS[doc_type](object_ids, index):
+                actions.append(((doc_type, index, object_id), action))
+            flushed[doc_type] += len(object_ids)
+        failed = set()
+        if actions:
+            _, errors = helpers.bulk(elastic_search.client(), [action for _, action in actions], raise_on_error=False)
+            errors = [error for error in errors if error.get('delete', {}).get('status') != 404]
+            if errors:
+                logger.error('{} search index updates failed: {}'.format(len(errors), errors[:10]))
+                failed_docs = {
+                    (item['_index'], item['_type'], item['_id'])
+                    for error in errors for item in error.values()
+                }
+                failed = {
+                    key for key, action in actions
+                    if (action['_index'], action['_type'], action['_id']) in failed_docs
+                }
+        failed_ids = [entry.id for entry in entries if (entry.doc_type, entry.index, entry.object_id) in failed]
+        if failed_ids:
+            PendingSearchUpdate.objects.filter(id__in=failed_ids, claimed_at=now).update(claimed_at=None)
+            requeued_ids.extend(failed_ids)
+        # Rows queued again since the claim are no longer claimed and stay for the next flush
+        PendingSearchUpdate.objects.filter(
+            id__in=[entry.id for entry in entries], claimed_at=now,
+        ).delete()
+        if len(entries) < batch_size:
+            break
+    return flushed
+
+
+@celery_app.task(ignore_results=True)
+def flush_search_index_queue():
+    flushed = flush()
+    metrics = get_metrics()
+    logger.info('Flushed {} queued search updates ({}); {} pending, lag {:.1f}s'.format(
+        sum(flushed.values()), dict(flushed), metrics['depth'], metrics['lag'],
+    ))
@@ -8,6 +8,7 @@ logger = logging.getLogger(__name__)
 
 if settings.SEARCH_ENGINE == 'elastic':
     import website.search.elastic_search as search_engine
+    from website.search import index_queue
 else:
     search_engine = None
     logger.warn('Elastic search is not set to load')
@@ -26,6 +27,9 @@ def search(query, index=None, doc_type=None, raw=None, private=False, ext=False)
 
 @requires_search
 def update_node(node, index=None, bulk=False, async_update=True, saved_fields=None, wiki_page=None):
+    if async_update and not bulk and not wiki_page and settings.SEARCH_INDEX_QUEUE_ENABLED:
+        index_queue.enqueue(PendingSearchUpdate.NODE, [node.id], index=index)
+        return
     kwargs = {
         'index': index,
         'bulk': bulk
@@ -149,6 +153,9 @@ def update_contributors_async(user_id):
 
 @requires_search
 def update_user(user, index=None, async_update=True):
+    if async_update and settings.SEARCH_INDEX_QUEUE_ENABLED:
+        index_queue.enqueue(PendingSearchUpdate.USER, [user.id], index=index)
+        return
     if async_update:
         user_id = user.id
         if settings.USE_CELERY:
@@ -160,6 +167,12 @@ def update_user(user, index=None, async_update=True):
 
 @requires_search
 def update_file(file_, index=None, delete=False):
+    if settings.SEARCH_INDEX_QUEUE_ENABLED:
+        if not delete:
+            index_queue.enqueue(PendingSearchUpdate.FILE, [file_.id], index=index)
+            return
+        # Deleted files leave the index right away; a pending update would add them back
+        index_queue.discard(PendingSearchUpdate.FILE, [file_.id], index=index)
     search_engine.update_file(file_, index=index, delete=delete)
 
 @requires_search
@@ -201,6 +214,7 @@ def search_contributor(query, page=0, size=10, exclude=None, current_user=None):
 from django.dispatch import receiver
 from django.db.models.signals import post_save, post_delete
 from osf.models.contributor import Contributor
+from osf.models.search_queue import PendingSearchUpdate
 
 @receiver(post_save, sender=Contributor)
 def update_contributor(sender, instance, **kwargs):
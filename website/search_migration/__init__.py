@@ -133,12 +133,16 @@ SELECT json_agg(
                        ELSE
                          '{{}}'::JSON
                        END
+            , 'comments', (SELECT json_object_agg(C.id, C.content)
+                           FROM osf_comment AS C
+                           WHERE C.root_target_id = NODE_GUID.id
+                                 AND C.is_deleted IS FALSE)
         )
     )
 )
 FROM osf_abstractnode AS N
   LEFT JOIN LATERAL (
-            SELECT _id
+            SELECT id, _id
             FROM osf_guid
             WHERE object_id = N.id
                   AND content_type_id = (SELECT id FROM django_content_type WHERE model = 'abstractnode')
@@ -413,12 +417,16 @@ SELECT json_agg(
                                  ON (U.id = USER_GUID.object_id AND (USER_GUID.content_type_id = (SELECT id FROM django_content_type WHERE model = 'osfuser')))
                              WHERE (CONTRIB.node_id = (NODE.DATA ->> 'id')::integer))
             , 'node_public', NODE.DATA ->> 'public'
+            , 'comments', (SELECT json_object_agg(C.id, C.content)
+                           FROM osf_comment AS C
+                           WHERE C.root_target_id = FILE_GUID.id
+                                 AND C.is_deleted IS FALSE)
         )
     )
 )
 FROM osf_basefilenode AS F
   LEFT JOIN LATERAL (
-            SELECT _id
+            SELECT id, _id
             FROM osf_guid
             WHERE object_id = F.id
                   AND content_type_id = (SELECT id FROM django_content_type WHERE model = 'basefilenode')
@@ -2,15 +2,20 @@
 # -*- coding: utf-8 -*-
 """Migration script for Search-enabled Models."""
 from __future__ import absolute_import
-from math import ceil
+from collections import Counter
 import functools
+import json
 import logging
+import multiprocessing
+import os
+import time
 
-from django.db import connection
+from django.db import connection, connections
 from django.core.paginator import Paginator
 from elasticsearch2 import helpers
 
 import website.search.search as search
+from website.search import elastic_search
 from website.search.elastic_search import client
 from website.search_migration import (
     enable_private_search,
@@ -25,12 +30,11 @@ from website.search.elastic_search import client as es_client
 from website.search.elastic_search import bulk_update_cgm
 from website.search.elastic_search import PROJECT_LIKE_TYPES
 from website.search.elastic_search import es_index
-from website.search.elastic_search import comments_to_doc
+from website.search.elastic_search import remove_newline
 from website.search.elastic_search import node_includes_wiki
 from website.search.search import update_institution, bulk_update_collected_metadata
 from website.search.util import unicode_normalize
 from addons.wiki.models import WikiPage
-from addons.osfstorage.models import OsfStorageFile
 from addons.metadata.search import migrate_file_metadata
 
 logger = logging.getLogger(__name__)
@@ -40,6 +44,13 @@ logger = logging.getLogger(__name__)
 # - website.search.elastic_search.update_file
 # - website.search.elastic_search.serialize_node
 # - website.search.elastic_search.create_index
+# - website.search.elastic_search.comments_to_doc
+def normalize_comments(comments):
+    # The SQL aggregates {comment id: content}, or NULL when there is no comment
+    if not comments:
+        return {}
+    return {cid: remove_newline(unicode_normalize(content)) for cid, content in comments.items()}
+
 def fill_and_normalize(docs):
     assert docs
 
@@ -80,13 +91,7 @@ def fill_and_normalize(docs):
             d['creator_name'] = unicode_normalize(creator_name)
             modifier_name = d['modifier_name']
             d['modifier_name'] = unicode_normalize(modifier_name)
-            f = OsfStorageFile.load(d['id'])
-            comments = {}
-            if f:
-                file_guid = f.get_guid(create=False)
-                if file_guid:
-                    comments = comments_to_doc(file_guid._id)
-            d['comments'] = comments
+            d['comments'] = normalize_comments(d['comments'])
     elif doc_type in PROJECT_LIKE_TYPES:
         for doc in docs:
             d = doc['doc']
@@ -127,54 +132,142 @@ def fill_and_normalize(docs):
             else:  # clear
                 d['wikis'] = None
                 d['wiki_names'] = None
-            node = AbstractNode.load(doc['_id'])
-            d['comments'] = comments_to_doc(node._id)
+            d['comments'] = normalize_comments(d['comments'])
+
+class Checkpoint(object):
+    """Progress of a reindex, kept in a JSON file so that a restarted reindex resumes.
+
+    Records the versioned index being filled, the id ranges each SQL migration has finished
+    and the migration steps that have completed. Resume with the same page size, otherwise
+    the recorded ranges do not line up and are migrated again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {'index': None, 'ranges': {}, 'steps': []}
+        if os.path.exists(path):
+            with open(path) as fp:
+                self.state = json.load(fp)
+
+    @property
+    def index(self):
+        return self.state['index']
+
+    def start(self, index):
+        self.state = {'index': index, 'ranges': {}, 'steps': []}
+        self.save()
+
+    def finished_ranges(self, label):
+        return {tuple(r) for r in self.state['ranges'].get(label, [])}
+
+    def finish_range(self, label, page_start, page_end):
+        self.state['ranges'].setdefault(label, []).append([page_start, page_end])
+        self.save()
+
+    def is_finished(self, step):
+        return step in self.state['steps']
+
+    def finish(self, step):
+        self.state['steps'].append(step)
+        self.save()
+
+    def save(self):
+        # Write aside and rename so that a crash never leaves a truncated file behind
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as fp:
+            json.dump(self.state, fp)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
-def sql_migrate(index, sql, max_id, increment, es_args=None, **kwargs):
+def id_ranges(max_id, increment):
+    """Yield the ``(page_start, page_end]`` id ranges covering ``max_id``.
+
+    An extra page is included to cover the edge case where:
+          max_id == (total_pages * increment) - 1
+    and two additional objects are created during runtime.
+    """
+    page_start = 0
+    while page_start <= max_id + increment:
+        yield page_start, page_start + increment
+        page_start += increment
+
+def _init_worker():
+    # The Elasticsearch connection pool is not shared with the parent process
+    elastic_search.CLIENT = None
+
+def _migrate_range(task):
+    query, page_start, page_end, es_args = task
+    counts = Counter()
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        ser_objs = cursor.fetchone()[0]
+    if ser_objs:
+        counts.update(doc['_type'] for doc in ser_objs)
+        fill_and_normalize(ser_objs)
+        for _ in helpers.parallel_bulk(client(), ser_objs, **es_args):
+            pass
+    return page_start, page_end, counts
+
+def sql_migrate(index, sql, max_id, increment, es_args=None, processes=1, checkpoint=None, label='documents', **kwargs):
     """ Run provided SQL and send output to elastic.
 
+    Id ranges are migrated by a pool of `processes` worker processes, or in this process when
+    `processes` is 1. Each range is a single query whose results go to `helpers.parallel_bulk`.
+
     :param str index: Elastic index to update (formatted into `sql`)
     :param str sql: SQL to format and run. See __init__.py in this module
     :param int max_id: Last known object id. Indicates when to stop paging
     :param int increment: Page size
-    :param  dict es_args:  Dict or None, to pass to `helpers.bulk`
+    :param  dict es_args:  Dict or None, to pass to `helpers.parallel_bulk`
+    :param int processes: Number of worker processes
+    :param Checkpoint checkpoint: Checkpoint or None. Finished ranges are recorded under `label`
+        and ranges recorded before are skipped
+    :param str label: Name of this migration in the checkpoint and the log
     :kwargs: Additional format arguments for `sql` arg
 
     :return int: Number of migrated objects
     """
     if es_args is None:
         es_args = {}
-    total_pages = int(ceil(max_id / float(increment)))
-    total_objs = 0
-    page_start = 0
-    page_end = 0
-    page = 0
-    while page_end <= (max_id + increment):
-        page += 1
-        page_end += increment
-        if page <= total_pages:
-            logger.info('Updating page {} / {}'.format(page_end / increment, total_pages))
-        else:
-            # An extra page is included to cover the edge case where:
-            #       max_id == (total_pages * increment) - 1
-            # and two additional objects are created during runtime.
-            logger.info('Cleaning up...')
-        with connection.cursor() as cursor:
-            cursor.execute(sql.format(
-                index=index,
-                page_start=page_start,
-                page_end=page_end,
-                enable_private_search=enable_private_search(settings.ENABLE_PRIVATE_SEARCH),
-                **kwargs))
-            ser_objs = cursor.fetchone()[0]
-            if ser_objs:
-                total_objs += len(ser_objs)
-                fill_and_normalize(ser_objs)
-                helpers.bulk(client(), ser_objs, **es_args)
-        page_start = page_end
-    return total_objs
-
-def migrate_nodes(index, delete, increment=10000):
+    ranges = list(id_ranges(max_id, increment))
+    finished = checkpoint.finished_ranges(label) if checkpoint else set()
+    pending = [r for r in ranges if r not in finished]
+    if len(pending) < len(ranges):
+        logger.info('{}: {} / {} pages were migrated before, resuming'.format(label, len(ranges) - len(pending), len(ranges)))
+    private_search = enable_private_search(settings.ENABLE_PRIVATE_SEARCH)
+    tasks = (
+        (sql.format(index=index, page_start=page_start, page_end=page_end, enable_private_search=private_search, **kwargs),
+         page_start, page_end, es_args)
+        for page_start, page_end in pending
+    )
+
+    counts = Counter()
+    started = time.time()
+
+    def record(results):
+        for page, (page_start, page_end, page_counts) in enumerate(results, len(ranges) - len(pending) + 1):
+            counts.update(page_counts)
+            if checkpoint:
+                checkpoint.finish_range(label, page_start, page_end)
+            logger.info('{}: page {} / {} done, {} objects so far'.format(label, page, len(ranges), sum(counts.values())))
+
+    if processes > 1:
+        # Forked workers must open their own database connections
+        connections.close_all()
+        with multiprocessing.Pool(processes, initializer=_init_worker) as pool:
+            record(pool.imap_unordered(_migrate_range, tasks))
+    else:
+        record(map(_migrate_range, tasks))
+
+    elapsed = max(time.time() - started, 1e-6)
+    for doc_type, count in sorted(counts.items()):
+        logger.info('{}: {} {} documents, {:.1f} docs/sec'.format(label, count, doc_type, count / elapsed))
+    return sum(counts.values())
+
+def migrate_nodes(index, delete, increment=10000, processes=1, checkpoint=None):
     logger.info('Migrating nodes to index: {}'.format(index))
     last = AbstractNode.objects.last()
     if last is None:
@@ -186,6 +279,9 @@ def migrate_nodes(index, delete, increment=10000):
         JSON_UPDATE_NODES_SQL,
         max_nid,
         increment,
+        processes=processes,
+        checkpoint=checkpoint,
+        label='nodes',
         spam_flagged_removed_from_search=settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH)
     logger.info('{} nodes migrated'.format(total_nodes))
     if delete:
@@ -196,6 +292,9 @@ def migrate_nodes(index, delete, increment=10000):
             JSON_DELETE_NODES_SQL,
             max_nid,
             increment,
+            processes=processes,
+            checkpoint=checkpoint,
+            label='deleted nodes',
             es_args={'raise_on_error': False},  # ignore 404s
             spam_flagged_removed_from_search=settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH)
         logger.info('{} nodes marked deleted'.format(total_nodes))
@@ -248,7 +347,7 @@ def migrate_comments(index, delete):
         search.bulk_update_comments(paginator.page(page_number).object_list, index=index)
     logger.info('{} comments migrated'.format(comments.count()))
 
-def migrate_files(index, delete, increment=10000):
+def migrate_files(index, delete, increment=10000, processes=1, checkpoint=None):
     logger.info('Migrating files to index: {}'.format(index))
     last = BaseFileNode.objects.last()
     if last is None:
@@ -260,6 +359,9 @@ def migrate_files(index, delete, increment=10000):
         JSON_UPDATE_FILES_SQL,
         max_fid,
         increment,
+        processes=processes,
+        checkpoint=checkpoint,
+        label='files',
         spam_flagged_removed_from_search=settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH)
     logger.info('{} files migrated'.format(total_files))
     if delete:
@@ -270,11 +372,14 @@ def migrate_files(index, delete, increment=10000):
             JSON_DELETE_FILES_SQL,
             max_fid,
             increment,
+            processes=processes,
+            checkpoint=checkpoint,
+            label='deleted files',
             es_args={'raise_on_error': False},  # ignore 404s
             spam_flagged_removed_from_search=settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH)
         logger.info('{} files marked deleted'.format(total_files))
 
-def migrate_users(index, delete, increment=10000):
+def migrate_users(index, delete, increment=10000, processes=1, checkpoint=None):
     logger.info('Migrating users to index: {}'.format(index))
     last = OSFUser.objects.last()
     if last is None:
@@ -285,7 +390,10 @@ def migrate_users(index, delete, increment=10000):
         index,
         JSON_UPDATE_USERS_SQL,
         max_uid,
-        increment)
+        increment,
+        processes=processes,
+        checkpoint=checkpoint,
+        label='users')
     logger.info('{} users migrated'.format(total_users))
     if delete:
         logger.info('Preparing to delete old user documents')
@@ -295,6 +403,9 @@ def migrate_users(index, delete, increment=10000):
             JSON_DELETE_USERS_SQL,
             max_uid,
             increment,
+            processes=processes,
+            checkpoint=checkpoint,
+            label='deleted users',
             es_args={'raise_on_error': False})  # ignore 404s
         logger.info('{} users marked deleted'.format(total_users))
 
@@ -327,13 +438,16 @@ def migrate_institutions(index):
     for inst in Institution.objects.filter(is_deleted=False):
         update_institution(inst, index)
 
-def migrate(delete, remove=False, remove_all=False, index=None, app=None):
+def migrate(delete, remove=False, remove_all=False, index=None, app=None, processes=1, checkpoint=None):
     """Reindexes relevant documents in ES
 
     :param bool delete: Delete documents that should not be indexed
     :param bool remove: Removes old index after migrating
     :param str index: index alias to version and migrate
     :param App app: Flask app for context
+    :param int processes: Number of worker processes for nodes, files and users
+    :param str checkpoint: Path of a checkpoint file. An unfinished reindex recorded there is
+        resumed; the file is removed once the alias points to the new index
     """
     index = es_index(index)
     app = app or init_app('website.settings', set_backends=True, routes=True)
@@ -345,29 +459,50 @@ def migrate(delete, remove=False, remove_all=False, index=None, app=None):
     ctx = app.test_request_context()
     ctx.push()
 
-    new_index = set_up_index(index)
-
-    if settings.ENABLE_INSTITUTIONS:
-        migrate_institutions(new_index)
-    migrate_nodes(new_index, delete=delete)
-    migrate_files(new_index, delete=delete)
-    migrate_wikis(new_index, delete=delete)
-    migrate_comments(new_index, delete=delete)
-    migrate_users(new_index, delete=delete)
-    migrate_preprints(new_index, delete=delete)
-    migrate_preprint_files(new_index, delete=delete)
-    migrate_collected_metadata(new_index, delete=delete)
-    migrate_groups(new_index, delete=delete)
-    migrate_file_metadata(search, new_index, delete=delete)
-
-    set_up_alias(index, new_index)
-
-    if remove:
-        remove_old_index(new_index)
-    if remove_all:
-        remove_all_old_index(new_index)
-
-    ctx.pop()
+    try:
+        checkpoint = Checkpoint(checkpoint) if checkpoint else None
+        if checkpoint and checkpoint.index and checkpoint.index.startswith('{}_v'.format(index)):
+            new_index = checkpoint.index
+            logger.info('Resuming migration to {}'.format(new_index))
+        else:
+            new_index = set_up_index(index)
+            if checkpoint:
+                checkpoint.start(new_index)
+
+        sql_args = {'processes': processes, 'checkpoint': checkpoint}
+        steps = [
+            ('nodes', functools.partial(migrate_nodes, **sql_args)),
+            ('files', functools.partial(migrate_files, **sql_args)),
+            ('wikis', migrate_wikis),
+            ('comments', migrate_comments),
+            ('users', functools.partial(migrate_users, **sql_args)),
+            ('preprints', migrate_preprints),
+            ('preprint_files', migrate_preprint_files),
+            ('collected_metadata', migrate_collected_metadata),
+            ('groups', migrate_groups),
+            ('file_metadata', functools.partial(migrate_file_metadata, search)),
+        ]
+
+        if settings.ENABLE_INSTITUTIONS:
+            migrate_institutions(new_index)
+        for step, migrate_step in steps:
+            if checkpoint and checkpoint.is_finished(step):
+                logger.info('Skipping {}, migrated before'.format(step))
+                continue
+            migrate_step(new_index, delete=delete)
+            if checkpoint:
+                checkpoint.finish(step)
+
+        set_up_alias(index, new_index)
+        if checkpoint:
+            checkpoint.remove()
+
+        if remove:
+            remove_old_index(new_index)
+        if remove_all:
+            remove_all_old_index(new_index)
+    finally:
+        ctx.pop()
 
 def set_up_index(idx):
     try:
@@ -117,6 +117,15 @@ ELASTIC_KWARGS = {
     # 'client_cert': None,
     # 'client_key': None
 }
+# Queue node, file and user index updates and send them in bulk, see website.search.index_queue.
+# Updates of a document are held until it has not changed for SEARCH_INDEX_QUEUE_DELAY seconds.
+SEARCH_INDEX_QUEUE_ENABLED = False
+SEARCH_INDEX_QUEUE_DELAY = 10
+# A document updated again and again is still flushed this many seconds after its oldest pending update
+SEARCH_INDEX_QUEUE_MAX_WAIT = 60
+SEARCH_INDEX_QUEUE_BATCH_SIZE = 1000
+# Queued updates claimed by a flush that did not finish are flushed again after this many seconds
+SEARCH_INDEX_QUEUE_CLAIM_TIMEOUT = 5 * 60
 
 # Sessions
 COOKIE_NAME = 'osf'
@@ -173,6 +182,10 @@ SENDGRID_API_KEY = None
 SENDGRID_WHITELIST_MODE = False
 SENDGRID_EMAIL_WHITELIST = []
 
+# Notification digests are delivered in batches of this many users, over this many SMTP connections
+NOTIFICATION_DIGEST_BATCH_SIZE = 500
+NOTIFICATION_DIGEST_SMTP_CONNECTIONS = 4
+
 # Mailchimp
 MAILCHIMP_API_KEY = None
 MAILCHIMP_WEBHOOK_SECRET_KEY = 'CHANGEME'  # OSF secret key to ensure webhook is secure
@@ -419,6 +432,7 @@ class CeleryConfig:
         'scripts.populate_new_and_noteworthy_projects',
         'scripts.populate_popular_projects_and_registrations',
         'website.search.elastic_search',
+        'website.search.index_queue',
         'scripts.generate_sitemap',
         'scripts.analytics.run_keen_summaries',
         'scripts.analytics.run_keen_snapshots',
@@ -430,7 +444,9 @@ class CeleryConfig:
         'osf.management.commands.migrate_deleted_date',
         'osf.management.commands.addon_deleted_date',
         'osf.management.commands.migrate_registration_responses',
-        'osf.management.commands.update_institution_project_counts'
+        'osf.management.commands.update_institution_project_counts',
+        'osf.management.commands.check_quota_consistency',
+        'admin.quota_recalc.tasks',
     }
 
     med_pri_modules = {
@@ -498,6 +514,7 @@ class CeleryConfig:
         'website.notifications.tasks',
         'website.archiver.tasks',
         'website.search.search',
+        'website.search.index_queue',
         'website.project.tasks',
         'scripts.populate_new_and_noteworthy_projects',
         'scripts.populate_popular_projects_and_registrations',
@@ -519,8 +536,10 @@ class CeleryConfig:
         'osf.management.commands.deactivate_requested_accounts',
         'osf.management.commands.check_crossref_dois',
         'osf.management.commands.update_institution_project_counts',
+        'osf.management.commands.check_quota_consistency',
         'nii.mapcore_refresh_tokens',
         'admin.rdm_custom_storage_location.tasks',
+        'admin.quota_recalc.tasks',
     )
 
     # Modules that need metrics and release requirements
@@ -590,6 +609,10 @@ class CeleryConfig:
                 'schedule': crontab(minute=0, hour=5),  # Daily 12 a.m
                 'kwargs': {'dry_run': False},
             },
+            'flush_search_index_queue': {
+                'task': 'website.search.index_queue.flush_search_index_queue',
+                'schedule': SEARCH_INDEX_QUEUE_DELAY,  # Seconds
+            },
             'clear_sessions': {
                 'task': 'scripts.clear_sessions',
                 'schedule': crontab(minute=0, hour=5),  # Daily 12 a.m
@@ -668,6 +691,11 @@ class CeleryConfig:
                 'task': 'management.commands.update_institution_project_counts',
                 'schedule': crontab(minute=0, hour=9), # Daily 05:00 a.m. EDT
             },
+            'check_quota_consistency': {
+                'task': 'management.commands.check_quota_consistency',
+                'schedule': crontab(minute=0, hour=18),  # Daily 3:00 a.m. JST
+                'kwargs': {'fix': False},
+            },
             'mapcore_refresh_token': {
                 'task': 'nii.mapcore_refresh_tokens',
                 'schedule': crontab(minute=0, hour=10),  # Daily 5:00 a.m. EST (-5h)
@@ -697,6 +725,15 @@ WATERBUTLER_JWE_SECRET = 'CirclesAre4Squares'
 WATERBUTLER_JWT_SECRET = 'ILiekTrianglesALot'
 WATERBUTLER_JWT_ALGORITHM = 'HS256'
 WATERBUTLER_JWT_EXPIRATION = 15
+# Seconds the WaterButler auth callback reuses permission decisions and provider credentials
+# of a node. 0 disables the cache.
+WATERBUTLER_AUTH_CACHE_TIMEOUT = 10
+
+# Addon root folders of the file grid (website.util.rubeus) are collected by a pool of this many
+# threads shared by all requests of a process, 0 collects them in the request thread. Addons that
+# have not answered RUBEUS_ADDON_TIMEOUT seconds after the grid asked them are shown as unavailable.
+RUBEUS_ADDON_MAX_WORKERS = 4
+RUBEUS_ADDON_TIMEOUT = 10
 
 SENSITIVE_DATA_SALT = 'yusaltydough'
 SENSITIVE_DATA_SECRET = 'TrainglesAre5Squares'
@@ -5,12 +5,13 @@ from addons.base import signals as file_signals
 from addons.osfstorage.models import OsfStorageFileNode, Region
 from api.base import settings as api_settings
 from django.contrib.contenttypes.models import ContentType
-from django.db import transaction, IntegrityError
-from django.db.models import Sum
-from django.db.models.functions import Coalesce
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F, Min, Sum
+from django.db.models.functions import Coalesce, Greatest
+from django_bulk_update.helper import bulk_update
 from osf.models import (
-    AbstractNode, BaseFileNode, FileLog, FileInfo, Guid, OSFUser, UserQuota,
-    ProjectStorageType
+    AbstractNode, BaseFileNode, FileLog, FileInfo, Guid, Institution, OSFUser, UserQuota,
+    ProjectStorageType, ProjectStorageUsage
 )
 from django.utils import timezone
 from osf.utils.requests import check_select_for_update
@@ -22,55 +23,291 @@ PROVIDERS = ['s3compatinstitutions']
 logger = logging.getLogger(__name__)
 
 
-def used_quota(user_id, storage_type=UserQuota.NII_STORAGE):
+def _quota_file_ids(projects_ids, storage_type):
+    if storage_type != UserQuota.NII_STORAGE:
+        file_class = BaseFileNode
+    else:
+        file_class = OsfStorageFileNode
+    return file_class.objects.filter(
+        target_object_id__in=projects_ids,
+        target_content_type_id=ContentType.objects.get_for_model(AbstractNode),
+        deleted_on=None,
+        deleted_by_id=None,
+    ).values_list('id', flat=True)
+
+
+def _quota_projects_ids(user_id, storage_type):
     guid = Guid.objects.get(
         _id=user_id,
         content_type_id=ContentType.objects.get_for_model(OSFUser).id
     )
-    projects_ids = AbstractNode.objects.filter(
+    return AbstractNode.objects.filter(
         projectstoragetype__storage_type=storage_type,
         is_deleted=False,
         creator_id=guid.object_id
     ).values_list('id', flat=True)
-    if storage_type != UserQuota.NII_STORAGE:
-        files_ids = BaseFileNode.objects.filter(
-            target_object_id__in=projects_ids,
-            target_content_type_id=ContentType.objects.get_for_model(AbstractNode),
-            deleted_on=None,
-            deleted_by_id=None,
-        ).values_list('id', flat=True)
-    else:
-        files_ids = OsfStorageFileNode.objects.filter(
-            target_object_id__in=projects_ids,
-            target_content_type_id=ContentType.objects.get_for_model(AbstractNode),
-            deleted_on=None,
-            deleted_by_id=None,
-        ).values_list('id', flat=True)
+
+
+def used_quota(user_id, storage_type=UserQuota.NII_STORAGE):
+    """Recompute the used quota of a user from FileInfo.
+
+    This scans every file of every project the user created; request paths
+    should use ``rollup_used_quota`` instead.
+    """
+    projects_ids = _quota_projects_ids(user_id, storage_type)
+    files_ids = _quota_file_ids(projects_ids, storage_type)
     db_sum = FileInfo.objects.filter(file_id__in=files_ids).aggregate(
         filesize_sum=Coalesce(Sum('file_size'), 0))
     return db_sum['filesize_sum'] if db_sum['filesize_sum'] is not None else 0
 
 
-def update_user_used_quota(user, storage_type=UserQuota.NII_STORAGE, is_recalculating_quota=False):
+def rollup_used_quota(user_id, storage_type=UserQuota.NII_STORAGE):
+    """Used quota of a user summed over the ProjectStorageUsage rollups of
+    their non-deleted projects.
+    """
+    db_sum = ProjectStorageUsage.objects.filter(
+        node_id__in=_quota_projects_ids(user_id, storage_type)
+    ).aggregate(filesize_sum=Coalesce(Sum('used'), 0))
+    return db_sum['filesize_sum'] if db_sum['filesize_sum'] is not None else 0
+
+
+def update_project_storage_usage(node, delta):
+    """Add ``delta`` bytes to the storage rollup of a project."""
+    if not delta:
+        return
+    if ProjectStorageUsage.objects.filter(node=node).update(used=Greatest(F('used') + delta, 0)):
+        return
+    try:
+        with transaction.atomic():
+            ProjectStorageUsage.objects.create(node=node, used=max(delta, 0))
+    except IntegrityError:
+        ProjectStorageUsage.objects.filter(node=node).update(used=Greatest(F('used') + delta, 0))
+
+
+def rebuild_project_storage_usage(user_id, storage_type=UserQuota.NII_STORAGE):
+    """Recompute the storage rollups of a user's projects from FileInfo.
+
+    :return: the used quota of the user, the total of the rollups
+    """
+    projects_ids = list(_quota_projects_ids(user_id, storage_type))
+    usage = {
+        row['file__target_object_id']: row['used'] or 0
+        for row in FileInfo.objects.filter(
+            file_id__in=_quota_file_ids(projects_ids, storage_type)
+        ).values('file__target_object_id').annotate(used=Sum('file_size'))
+    }
+    _write_project_storage_usage(
+        ProjectStorageUsage.objects.filter(node_id__in=projects_ids),
+        {node_id: usage.get(node_id, 0) for node_id in projects_ids},
+    )
+    return sum(usage.values())
+
+
+def recalculate_used_quota(user_id, storage_type=UserQuota.NII_STORAGE):
+    """Recompute the used quota of a user from FileInfo, rewriting the storage
+    rollups of their projects on the way so that any drift of them is corrected.
+    """
+    return rebuild_project_storage_usage(user_id, storage_type)
+
+
+def check_used_quota(user, storage_type=UserQuota.NII_STORAGE, fix=False):
+    """Compare the stored used quota of a user with a full recomputation.
+
+    Returns the drift (stored - recomputed) of the UserQuota, or None if the
+    user has no UserQuota for the storage type. With ``fix``, the project
+    rollups and the UserQuota are rebuilt when they drifted.
+    """
+    user_quota = UserQuota.objects.filter(user=user, storage_type=storage_type).first()
+    if user_quota is None:
+        return None
+    used = used_quota(user._id, storage_type)
+    drift = user_quota.used - used
+    rollup_drift = rollup_used_quota(user._id, storage_type) - used
+    if drift or rollup_drift:
+        logger.warning(u'Used quota drift: user={}, storage_type={}, used={}, recomputed={}, rollup_drift={}'.format(
+            user._id, storage_type, user_quota.used, used, rollup_drift))
+        if fix:
+            rebuild_project_storage_usage(user._id, storage_type)
+            UserQuota.objects.filter(pk=user_quota.pk).update(used=used)
+    return drift
+
+
+BULK_USED_QUOTA_SQL = """
+    SELECT N.id, N.creator_id, SUM(I.file_size)
+    FROM osf_fileinfo AS I
+      JOIN osf_basefilenode AS F ON F.id = I.file_id
+      JOIN osf_abstractnode AS N ON N.id = F.target_object_id
+      JOIN osf_projectstoragetype AS PST ON PST.node_id = N.id
+    WHERE F.target_content_type_id = %(content_type_id)s
+      AND F.deleted_on IS NULL
+      AND F.deleted_by_id IS NULL
+      AND N.is_deleted = FALSE
+      AND N.creator_id = ANY(%(user_ids)s)
+      AND PST.storage_type = %(storage_type)s
+      AND (%(storage_type)s != {nii_storage} OR F.type = ANY(%(osfstorage_types)s))
+    GROUP BY N.id, N.creator_id;
+""".format(nii_storage=UserQuota.NII_STORAGE)
+
+
+def _quota_storage_types(user_ids):
+    """Storage types to recalculate per user, as admin.quota_recalc does: NII
+    storage always, and custom storage when the user's first institution has
+    a region.
+    """
+    first_institution_ids = dict(
+        OSFUser.affiliated_institutions.through.objects.filter(
+            osfuser_id__in=user_ids
+        ).values('osfuser_id').annotate(
+            institution_id=Min('institution_id')
+        ).values_list('osfuser_id', 'institution_id')
+    )
+    institution_guids = dict(
+        Institution.objects.filter(
+            id__in=set(first_institution_ids.values())
+        ).values_list('id', '_id')
+    )
+    region_guids = set(
+        Region.objects.filter(
+            _id__in=institution_guids.values()
+        ).values_list('_id', flat=True)
+    )
+    storage_types = {user_id: [UserQuota.NII_STORAGE] for user_id in user_ids}
+    for user_id, institution_id in first_institution_ids.items():
+        if institution_guids.get(institution_id) in region_guids:
+            storage_types[user_id].append(UserQuota.CUSTOM_STORAGE)
+    return storage_types
+
+
+def bulk_recalculate_used_quota(user_ids):
+    """Recalculate the used quota of many users from FileInfo with one grouped
+    query per storage type, refreshing the project rollups on the way, and
+    write the results with bulk_update.
+
+    The UserQuota rows of the batch are locked before FileInfo is read, so a
+    concurrent upload waits for the batch and then adds its size to the
+    recalculated value instead of being overwritten by it.
+    """
+    user_ids = list(user_ids)
+    storage_types = _quota_storage_types(user_ids)
+    content_type_id = ContentType.objects.get_for_model(AbstractNode).id
+    osfstorage_types = list(OsfStorageFileNode._typedmodels_subtypes)
+
+    with transaction.atomic():
+        _create_missing_user_quotas([
+            (user_id, storage_type)
+            for user_id in user_ids
+            for storage_type in storage_types[user_id]
+        ])
+        user_quotas = UserQuota.objects.filter(user_id__in=user_ids).order_by('id')
+        if check_select_for_update():
+            user_quotas = user_quotas.select_for_update()
+        user_quotas = list(user_quotas)
+
+        used = {}
+        for storage_type in (UserQuota.NII_STORAGE, UserQuota.CUSTOM_STORAGE):
+            type_user_ids = [user_id for user_id in user_ids if storage_type in storage_types[user_id]]
+            if not type_user_ids:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(BULK_USED_QUOTA_SQL, {
+                    'content_type_id': content_type_id,
+                    'user_ids': type_user_ids,
+                    'storage_type': storage_type,
+                    'osfstorage_types': osfstorage_types,
+                })
+                project_usage = cursor.fetchall()
+            for user_id in type_user_ids:
+                used[(user_id, storage_type)] = 0
+            for node_id, user_id, size in project_usage:
+                used[(user_id, storage_type)] += size
+            _bulk_update_project_storage_usage(type_user_ids, storage_type, project_usage)
+
+        updated = []
+        for user_quota in user_quotas:
+            key = (user_quota.user_id, user_quota.storage_type)
+            if key in used:
+                user_quota.used = used[key]
+                user_quota.modified = timezone.now()
+                updated.append(user_quota)
+        bulk_update(updated, update_fields=['used', 'modified'])
+
+
+def _create_missing_user_quotas(keys):
+    """Create the UserQuota rows of the ``(user_id, storage_type)`` pairs that
+    do not exist yet, skipping the ones a concurrent upload creates meanwhile.
+    """
+    if not keys:
+        return
+    now = timezone.now()
+    sql = (
+        'INSERT INTO {table} (created, modified, user_id, storage_type, max_quota, used) '
+        'VALUES {values} '
+        'ON CONFLICT (user_id, storage_type) DO NOTHING'
+    ).format(
+        table=UserQuota._meta.db_table,
+        values=', '.join(['(%s, %s, %s, %s, %s, 0)'] * len(keys)),
+    )
+    params = []
+    for user_id, storage_type in keys:
+        params.extend([now, now, user_id, storage_type, api_settings.DEFAULT_MAX_QUOTA])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _bulk_update_project_storage_usage(user_ids, storage_type, project_usage):
+    _write_project_storage_usage(
+        ProjectStorageUsage.objects.filter(
+            node__creator_id__in=user_ids,
+            node__is_deleted=False,
+            node__projectstoragetype__storage_type=storage_type,
+        ),
+        {node_id: size for node_id, _, size in project_usage},
+    )
+
+
+def _write_project_storage_usage(usages, usage):
+    """Set the rollups of ``usages`` from the ``usage`` of their nodes, 0 for nodes missing
+    from it, and create the rollups of the other nodes of ``usage``, in bulk.
+    """
+    usage = dict(usage)
+    usages = list(usages)
+    for project_storage_usage in usages:
+        project_storage_usage.used = usage.pop(project_storage_usage.node_id, 0)
+    bulk_update(usages, update_fields=['used'])
+    ProjectStorageUsage.objects.bulk_create([
+        ProjectStorageUsage(node_id=node_id, used=size) for node_id, size in usage.items()
+    ])
+
+
+def update_user_used_quota(user, storage_type=UserQuota.NII_STORAGE, is_recalculating_quota=False, recompute=False):
     """Update user's used quota
 
     - If the function is called in recalculate quota process and storage_type parameter is 2 (for NII Storage),
       update used quota for storage_type = 2 with total file size from projects with storage_type = 1 and 2
     - Otherwise, update used quota for specified storage_type with total file size from projects with that storage_type
 
+    The recalculate quota process and ``recompute`` recompute the used quota from FileInfo and rewrite
+    the project storage rollups; otherwise the rollups are summed.
+
     :param user: user to be updated used quota
     :param storage_type: storage type
     :param is_recalculating_quota: a boolean to know whether the function is used in recalculate quota process or not
+    :param recompute: a boolean to recompute the used quota from FileInfo outside the recalculate quota process
     """
+    if is_recalculating_quota or recompute:
+        get_used_quota = recalculate_used_quota
+    else:
+        get_used_quota = rollup_used_quota
+
     if is_recalculating_quota and storage_type == UserQuota.CUSTOM_STORAGE:
         # If the function is called in recalculate quota process and storage_type parameter is 2 (for NII Storage),
         # get total file size of projects with storage_type 1 and 2
-        used_quota_for_nii_default_storage = used_quota(user._id, UserQuota.NII_STORAGE)
-        used_quota_for_nii_custom_storage = used_quota(user._id, UserQuota.CUSTOM_STORAGE)
+        used_quota_for_nii_default_storage = get_used_quota(user._id, UserQuota.NII_STORAGE)
+        used_quota_for_nii_custom_storage = get_used_quota(user._id, UserQuota.CUSTOM_STORAGE)
         used = used_quota_for_nii_default_storage + used_quota_for_nii_custom_storage
     else:
         # Get total file size of projects with specified storage_type
-        used = used_quota(user._id, storage_type)
+        used = get_used_quota(user._id, storage_type)
 
     try:
         if check_select_for_update():
@@ -96,11 +333,11 @@ def update_user_used_quota(user, storage_type=UserQuota.NII_STORAGE, is_recalcul
                 )
         except IntegrityError:
             if is_recalculating_quota and storage_type == UserQuota.CUSTOM_STORAGE:
-                used_quota_for_nii_default_storage = used_quota(user._id, UserQuota.NII_STORAGE)
-                used_quota_for_nii_custom_storage = used_quota(user._id, UserQuota.CUSTOM_STORAGE)
+                used_quota_for_nii_default_storage = get_used_quota(user._id, UserQuota.NII_STORAGE)
+                used_quota_for_nii_custom_storage = get_used_quota(user._id, UserQuota.CUSTOM_STORAGE)
                 used = used_quota_for_nii_default_storage + used_quota_for_nii_custom_storage
             else:
-                used = used_quota(user._id, storage_type)
+                used = get_used_quota(user._id, storage_type)
 
             if check_select_for_update():
                 user_quota = UserQuota.objects.filter(
@@ -142,6 +379,9 @@ def get_project_storage_type(node):
 
 @file_signals.file_updated.connect
 def update_used_quota(self, target, user, event_type, payload):
+    if event_type == FileLog.FILE_MOVED:
+        file_moved(payload)
+        return
     data = dict(payload.get('metadata')) if payload.get('metadata') else None
     metadata_provider = data.get('provider') if payload.get('metadata') else None
     if metadata_provider == 'osfstorage' or metadata_provider in PROVIDERS:
@@ -260,6 +500,7 @@ def file_added(target, payload, file_node, storage_type):
             user_quota.save()
 
     FileInfo.objects.create(file=file_node, file_size=file_size)
+    update_project_storage_usage(target, file_size)
 
 def node_removed(target, user, payload, file_node, storage_type):
     if check_select_for_update():
@@ -277,6 +518,7 @@ def node_removed(target, user, payload, file_node, storage_type):
             logging.error('FileNode is not trashed, cannot update used quota!')
             return
 
+        removed_size = 0
         for removed_file in get_node_file_list(file_node):
             try:
                 if check_select_for_update():
@@ -290,9 +532,11 @@ def node_removed(target, user, payload, file_node, storage_type):
             user_quota.used -= file_info.file_size
             if user_quota.used < 0:
                 user_quota.used = 0
+            removed_size += file_info.file_size
             file_info.file_size = 0
             file_info.save()
         user_quota.save()
+        update_project_storage_usage(target, -removed_size)
 
 def file_modified(target, user, payload, file_node, storage_type):
     file_size = int(payload['metadata']['size'])
@@ -327,13 +571,45 @@ def file_modified(target, user, payload, file_node, storage_type):
     except FileInfo.DoesNotExist:
         file_info = FileInfo(file=file_node, file_size=0)
 
-    user_quota.used += file_size - file_info.file_size
+    delta = file_size - file_info.file_size
+    user_quota.used += delta
     if user_quota.used < 0:
         user_quota.used = 0
     user_quota.save()
 
     file_info.file_size = file_size
     file_info.save()
+    update_project_storage_usage(target, delta)
+
+def file_moved(payload):
+    """Move the size of osfstorage files moved to another project from the storage
+    rollup of the source project to the one of the destination project, as their
+    FileInfo now counts for the destination.
+    """
+    source = payload.get('source') or {}
+    destination = payload.get('destination') or {}
+    if source.get('provider') != 'osfstorage' or destination.get('provider') != 'osfstorage':
+        return
+    if not destination.get('path') or source.get('nid') == destination.get('nid'):
+        return
+    source_node = AbstractNode.load(source.get('nid'))
+    destination_node = AbstractNode.load(destination.get('nid'))
+    if source_node is None or destination_node is None:
+        return
+    try:
+        file_node = BaseFileNode.objects.get(
+            _id=destination['path'].strip('/'),
+            target_object_id=destination_node.id,
+            target_content_type_id=ContentType.objects.get_for_model(AbstractNode),
+        )
+    except BaseFileNode.DoesNotExist:
+        logging.error('FileNode not found, cannot update project storage usage!')
+        return
+    moved_size = FileInfo.objects.filter(
+        file__in=get_node_file_list(file_node)
+    ).aggregate(filesize_sum=Coalesce(Sum('file_size'), 0))['filesize_sum']
+    update_project_storage_usage(source_node, -moved_size)
+    update_project_storage_usage(destination_node, moved_size)
 
 def update_default_storage(user):
     # logger.info('----{}::{}({})from:{}::{}({})'.format(inspect.getframeinfo(inspect.currentframe())[0], inspect.getframeinfo(inspect.currentframe())[2], inspect.getframeinfo(inspect.currentframe())[1], inspect.stack()[1][1], inspect.stack()[1][3], inspect.stack()[1][2]))
@@ -3,20 +3,22 @@
 formatted hgrid list/folders.
 """
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
 
 from django.utils import timezone
+from flask import copy_current_request_context, has_request_context
 
 from framework import sentry
 from framework.auth.decorators import Auth
 
 from django.apps import apps
-from django.db.models import Exists, OuterRef, Case, When, Value, IntegerField
+from django.db import connection, connections
 
 from website import settings
 from website.util import paths
 from website.settings import DISK_SAVING_MODE
 from osf.utils import sanitize
-from osf.utils.permissions import WRITE_NODE
 
 
 logger = logging.getLogger(__name__)
@@ -150,6 +152,41 @@ def sort_by_name(hgrid_data):
     return return_value
 
 
+# Components of a node with the user's permissions on them. Node links are listed but not
+# followed; the linked nodes are loaded as the roots of their own trees when needed.
+NODE_TREE_SQL = """
+    WITH RECURSIVE tree AS (
+        SELECT R.parent_id, R.child_id, R.is_node_link, R._order, 1 AS depth
+        FROM osf_noderelation AS R
+        JOIN osf_abstractnode AS N ON N.id = R.child_id
+        WHERE R.parent_id = %(root_id)s AND N.is_deleted IS FALSE
+    UNION ALL
+        SELECT R.parent_id, R.child_id, R.is_node_link, R._order, T.depth + 1
+        FROM tree AS T
+        JOIN osf_noderelation AS R ON R.parent_id = T.child_id
+        JOIN osf_abstractnode AS N ON N.id = R.child_id
+        WHERE T.is_node_link IS FALSE AND N.is_deleted IS FALSE
+    )
+    SELECT T.parent_id, T.child_id, T.is_node_link, N.is_public,
+        ARRAY(
+            SELECT P.codename
+            FROM osf_nodegroupobjectpermission AS G
+            JOIN auth_permission AS P ON P.id = G.permission_id
+            JOIN osf_osfuser_groups AS UG ON UG.group_id = G.group_id
+            WHERE G.content_object_id = T.child_id AND UG.osfuser_id = %(user_id)s
+        ) AS permissions,
+        EXISTS(
+            SELECT 1
+            FROM osf_privatelink_nodes AS PN
+            JOIN osf_privatelink AS L ON L.id = PN.privatelink_id
+            WHERE PN.abstractnode_id = T.child_id AND L.key = %(private_key)s AND L.is_deleted IS FALSE
+        ) AS has_private_link
+    FROM tree AS T
+    JOIN osf_abstractnode AS N ON N.id = T.child_id
+    ORDER BY T.depth, T.parent_id, T._order
+"""
+
+
 class NodeFileCollector(object):
 
     """A utility class for creating rubeus formatted node data"""
@@ -160,6 +197,12 @@ class NodeFileCollector(object):
         self.extra = kwargs
         self.can_view = self.node.can_view(auth)
         self.can_edit = self.node.can_edit(auth) and not self.node.is_registration
+        # node id -> [(child id, is node link)], for every node whose tree is loaded
+        self._relations = {}
+        # node id -> (can view, can edit)
+        self._permissions = {}
+        # node id -> whether the user is admin on the node or one of its parents
+        self._admin_parent = {}
 
     def to_hgrid(self):
         """
@@ -170,51 +213,78 @@ class NodeFileCollector(object):
         root = self._get_nodes(self.node, grid_root=self.node)
         return [root]
 
-    def find_readable_descendants(self, node, visited):
+    @property
+    def _user(self):
+        return self.auth.user if self.auth else None
+
+    def _is_admin_parent(self, node_id):
+        if node_id not in self._admin_parent:
+            Node = apps.get_model('osf.AbstractNode')
+            user = self._user
+            self._admin_parent[node_id] = bool(user) and Node.objects.get(id=node_id).is_admin_parent(user)
+        return self._admin_parent[node_id]
+
+    def _load_tree(self, root_id):
+        """Load the components below the node with ``root_id`` with one query and
+        work out which of them the user can view and edit.
+        """
+        user = self._user
+        with connection.cursor() as cursor:
+            cursor.execute(NODE_TREE_SQL, {
+                'root_id': root_id,
+                'user_id': user.id if user else None,
+                'private_key': self.auth.private_key if self.auth else None,
+            })
+            rows = cursor.fetchall()
+
+        anonymous_link = self.auth and getattr(self.auth.private_link, 'anonymous', False)
+        self._relations[root_id] = []
+        # Admins of a node can read its components; rows are ordered parents first
+        self._is_admin_parent(root_id)
+        for parent_id, child_id, is_node_link, is_public, permissions, has_private_link in rows:
+            self._relations[parent_id].append((child_id, is_node_link))
+            is_admin = user is not None and 'admin_node' in permissions
+            if not is_node_link:
+                self._relations[child_id] = []
+                self._admin_parent[child_id] = is_admin or self._admin_parent[parent_id]
+            elif is_admin:
+                self._admin_parent[child_id] = True
+            if anonymous_link:
+                can_view = has_private_link
+            else:
+                can_view = (
+                    is_public or has_private_link or
+                    (user is not None and 'read_node' in permissions) or
+                    # A linked node inherits admin from its own parents
+                    (user is not None and self._is_admin_parent(child_id))
+                )
+            self._permissions[child_id] = (can_view, user is not None and 'write_node' in permissions)
+
+    def find_readable_descendants(self, node_id, visited):
         """
-        Returns a generator of first descendant node(s) readable by <user>
-        in each descendant branch.
+        Returns a generator of (node id, is node link) of the first descendant
+        node(s) readable by <user> in each descendant branch.
         """
-        Node = apps.get_model('osf.node')
+        if node_id not in self._relations:
+            self._load_tree(node_id)
 
         new_branches = []
-
-        linked_node_sqs = node.node_relations.filter(is_node_link=True, child=OuterRef('pk'))
-        if self.auth and self.auth.user:
-            can_write = Node.objects.get_nodes_for_user(self.auth.user, WRITE_NODE, node._nodes.all())
-        else:
-            can_write = node._nodes.none()
-        descendants_qs = (
-            node._nodes
-            .filter(is_deleted=False)
-            .annotate(is_linked_node=Exists(linked_node_sqs))
-            .annotate(has_write_perm=Case(When(id__in=can_write, then=Value(1)), default=Value(0), output_field=IntegerField()))
-            .order_by('_parents')
-        )
-
-        for descendant in descendants_qs:
-            if descendant.can_view(self.auth):
+        for child_id, is_node_link in self._relations[node_id]:
+            if self._permissions[child_id][0]:
+                yield child_id, is_node_link
+            elif child_id not in visited:
+                new_branches.append(child_id)
+                visited.add(child_id)
+
+        for branch_id in new_branches:
+            for descendant in self.find_readable_descendants(branch_id, visited=visited):
                 yield descendant
-            elif descendant._id not in visited:
-                new_branches.append(descendant)
-                visited.append(descendant._id)
 
-        for bnode in new_branches:
-            for descendant in self.find_readable_descendants(bnode, visited=visited):
-                yield descendant
-
-    def _serialize_node(self, node, parent=None, grid_root=None, children=None):
-        children = children or []
-        is_pointer = parent and node.is_linked_node
-        can_edit = node.has_write_perm if hasattr(node, 'has_write_perm') else node.can_edit(auth=self.auth)
-
-        # Determines if `node` is within two levels of `grid_root`
-        # Used to prevent complete serialization of deeply nested projects
-        if parent and grid_root and parent == grid_root:
-            children = self._get_nodes(node)['children']
-
-        if not children:
-            children = []
+    def _serialize_node(self, node, parent=None, children=None, is_pointer=False):
+        if node.id in self._permissions:
+            can_edit = self._permissions[node.id][1]
+        else:
+            can_edit = node.can_edit(auth=self.auth)
 
         return {
             # TODO: Remove safe_unescape_html when mako html safe comes in
@@ -229,8 +299,8 @@ class NodeFileCollector(object):
                 'upload': None,
                 'fetch': None,
             },
-            'children': children,
-            'isPointer': is_pointer,
+            'children': children or [],
+            'isPointer': bool(parent and is_pointer),
             'isSmartFolder': False,
             'nodeType': 'component' if parent else 'project',
             'nodeID': node._id,
@@ -239,60 +309,158 @@ class NodeFileCollector(object):
     def _get_nodes(self, node, grid_root=None):
         data = []
         if node.can_view(auth=self.auth):
-            serialized_addons = self._collect_addons(node)
-            serialized_children = [
-                self._serialize_node(child, parent=node, grid_root=grid_root)
-                for child in self.find_readable_descendants(node, visited=[])
-            ]
-            data = serialized_addons + serialized_children
+            Node = apps.get_model('osf.AbstractNode')
+            children = list(self.find_readable_descendants(node.id, visited=set()))
+            # Determines if the children are within two levels of `grid_root`
+            # Used to prevent complete serialization of deeply nested projects
+            expand = grid_root is not None and node == grid_root
+            grandchildren = {
+                child_id: list(self.find_readable_descendants(child_id, visited=set()))
+                for child_id, _ in children
+            } if expand else {}
+
+            node_ids = {child_id for child_id, _ in children}
+            node_ids.update(grandchild_id for nodes in grandchildren.values() for grandchild_id, _ in nodes)
+            nodes = Node.objects.in_bulk(node_ids)
+
+            serialized_addons = self._collect_addons_of_nodes(
+                [node] + ([nodes[child_id] for child_id, _ in children] if expand else [])
+            )
+            serialized_children = []
+            for child_id, is_node_link in children:
+                child = nodes[child_id]
+                child_data = None
+                if expand:
+                    child_data = serialized_addons[child.id] + [
+                        self._serialize_node(nodes[grandchild_id], parent=child, is_pointer=is_grandchild_link)
+                        for grandchild_id, is_grandchild_link in grandchildren[child_id]
+                    ]
+                serialized_children.append(
+                    self._serialize_node(child, parent=node, children=child_data, is_pointer=is_node_link)
+                )
+            data = serialized_addons[node.id] + serialized_children
         return self._serialize_node(node, children=data)
 
     def _collect_addons(self, node):
-        rv = []
+        return self._collect_addons_of_nodes([node])[node.id]
 
+    def _collect_addons_of_nodes(self, nodes):
+        """Returns node id -> serialized addon root folders of each node.
+        The hgrid data of all addons is collected concurrently.
+        """
         # GRDM-36019 Package Export/Import
         from addons.metadata.apps import SHORT_NAME as METADATA_SHORT_NAME
-        metadata_addon = node.get_addon(METADATA_SHORT_NAME)
 
-        for addon in node.get_addons():
-            if addon.config.has_hgrid_files:
-                # WARNING: get_hgrid_data can return None if the addon is added but has no credentials.
-                try:
-                    temp = addon.config.get_hgrid_data(addon, self.auth, **self.extra)
-                    # GRDM-36019 Package Export/Import
-                    # Display as error if add-on is not set and metadata add-on has settings
-                    if temp is None and metadata_addon is not None and metadata_addon.has_imported_addon_settings_for(addon):
-                        temp = [{
-                            KIND: FOLDER,
-                            'name': '{} is not configured'.format(addon.config.full_name),
-                            'addonFullname': addon.config.full_name,
-                            'provider': addon.config.short_name,
-                            'iconUrl': addon.config.icon_url,
-                            'permissions': {'view': False, 'edit': False},
-                            'unavailable': True,
-                        }]
-                except Exception as e:
-                    logger.warn(
-                        getattr(
-                            e,
-                            'data',
-                            'Unexpected error when fetching file contents for {0}.'.format(addon.config.full_name)
-                        )
-                    )
-                    sentry.log_exception()
-                    rv.append({
+        node_addons = []
+        metadata_addons = {}
+        for node in nodes:
+            metadata_addons[node.id] = node.get_addon(METADATA_SHORT_NAME)
+            node_addons.extend(
+                (node, addon) for addon in node.get_addons() if addon.config.has_hgrid_files
+            )
+        hgrid_data = self._get_hgrid_data([addon for _, addon in node_addons])
+
+        rv = {node.id: [] for node in nodes}
+        for (node, addon), (temp, error) in zip(node_addons, hgrid_data):
+            metadata_addon = metadata_addons[node.id]
+            # WARNING: get_hgrid_data can return None if the addon is added but has no credentials.
+            try:
+                if error is not None:
+                    raise error
+                # GRDM-36019 Package Export/Import
+                # Display as error if add-on is not set and metadata add-on has settings
+                if temp is None and metadata_addon is not None and metadata_addon.has_imported_addon_settings_for(addon):
+                    temp = [{
                         KIND: FOLDER,
-                        'unavailable': True,
-                        'iconUrl': addon.config.icon_url,
-                        'provider': addon.config.short_name,
+                        'name': '{} is not configured'.format(addon.config.full_name),
                         'addonFullname': addon.config.full_name,
+                        'provider': addon.config.short_name,
+                        'iconUrl': addon.config.icon_url,
                         'permissions': {'view': False, 'edit': False},
-                        'name': '{} is currently unavailable'.format(addon.config.full_name),
-                    })
-                    continue
-                rv.extend(sort_by_name(temp) or [])
+                        'unavailable': True,
+                    }]
+            except Exception as e:
+                logger.warn(
+                    getattr(
+                        e,
+                        'data',
+                        'Unexpected error when fetching file contents for {0}.'.format(addon.config.full_name)
+                    )
+                )
+                sentry.log_exception()
+                rv[node.id].append({
+                    KIND: FOLDER,
+                    'unavailable': True,
+                    'iconUrl': addon.config.icon_url,
+                    'provider': addon.config.short_name,
+                    'addonFullname': addon.config.full_name,
+                    'permissions': {'view': False, 'edit': False},
+                    'name': '{} is currently unavailable'.format(addon.config.full_name),
+                })
+                continue
+            rv[node.id].extend(sort_by_name(temp) or [])
         return rv
 
+    def _get_hgrid_data(self, addons):
+        """Returns a (hgrid data, exception) pair for each addon. With RUBEUS_ADDON_MAX_WORKERS,
+        the addons are asked in the shared worker threads and those that do not answer within
+        RUBEUS_ADDON_TIMEOUT seconds in total fail with a TimeoutError.
+        """
+        def get_hgrid_data(addon):
+            return addon.config.get_hgrid_data(addon, self.auth, **self.extra)
+
+        results = []
+        if not settings.RUBEUS_ADDON_MAX_WORKERS or len(addons) < 2:
+            for addon in addons:
+                try:
+                    results.append((get_hgrid_data(addon), None))
+                except Exception as e:
+                    results.append((None, e))
+            return results
+
+        executor = _get_executor()
+        futures = [executor.submit(_in_worker_thread(get_hgrid_data), addon) for addon in addons]
+        _, not_done = wait(futures, timeout=settings.RUBEUS_ADDON_TIMEOUT)
+        for future in futures:
+            if future in not_done:
+                # Addons still waiting for a worker are not asked anymore, those already asked
+                # keep their worker until they answer
+                future.cancel()
+                results.append((None, TimeoutError()))
+            elif future.exception() is not None:
+                results.append((None, future.exception()))
+            else:
+                results.append((future.result(), None))
+        return results
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Returns the pool of RUBEUS_ADDON_MAX_WORKERS threads shared by all requests of the process."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.RUBEUS_ADDON_MAX_WORKERS)
+        return _executor
+
+
+def _in_worker_thread(func):
+    """Wrap ``func`` to run in a worker thread with a copy of the current request
+    context, closing the database connections of the thread when done.
+    """
+    if has_request_context():
+        func = copy_current_request_context(func)
+
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+    return run
+
 
 # TODO: these might belong in addons module
 def collect_addon_assets(node):
@@ -14,16 +14,24 @@ import tempfile
 import time
 import traceback
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django_bulk_update.helper import bulk_update
 from urllib3.util.retry import Retry
 import requests
 
 from api.base import settings as api_settings
 from api.base.utils import waterbutler_api_url_for
+from celery import chord
 from celery.contrib.abortable import AbortableTask, AbortableAsyncResult
+from celery.utils import uuid
+from django.contrib.postgres.fields import ArrayField
+from django.db import models
+from django.db.models import Count, F, Func, Max, Min, Value
+from django.db.models.functions import Cast
 from django.utils import timezone
 from osf.models import (
-    AbstractNode, BaseFileNode, Guid, RdmFileTimestamptokenVerifyResult, RdmUserKey,
-    OSFUser, TimestampTask
+    AbstractNode, BaseFileNode, BaseFileVersionsThrough, FileVersion, Guid, Institution,
+    RdmFileTimestamptokenVerifyResult, RdmUserKey, OSFUser, TimestampTask
 )
 from osf.models.nodelog import NodeLog
 from website import util
@@ -108,129 +116,229 @@ def get_async_task_data(node):
         'ready': True,
         'requester': None
     }
-    timestamp_task = TimestampTask.objects.filter(node=node).first()
+    timestamp_task = TimestampTask.objects.filter(node=node).exclude(task_id='').first()
     if timestamp_task is not None:
         task = OSFAbortableAsyncResult(timestamp_task.task_id)
         task_data['ready'] = task.ready()
         task_data['requester'] = timestamp_task.requester.username
         if task_data['ready']:
-            TimestampTask.objects.filter(node=node).delete()
+            _release_timestamp_task(node)
     return task_data
 
-def get_error_list(pid):
-    '''Retrieve from the database the list of all timestamps that has an error.
+def _error_list_creator_id(data, version_stat, latest_version_creators):
+    if data.upload_file_modified_user is not None:
+        return data.upload_file_modified_user
+    if data.upload_file_created_user is not None:
+        return data.upload_file_created_user
+    if version_stat is not None:
+        return latest_version_creators.get(version_stat['latest_version_id'])
+    return None
+
+def _load_error_list_relations(data_list):
+    '''Resolve the files, versions, users and institutions referenced by a page
+    of verify results with a fixed number of set-based queries.
     '''
-    data_list = RdmFileTimestamptokenVerifyResult.objects.filter(project_id=pid).order_by('provider', 'path')
-    provider_error_list = []
-    provider = None
-    error_list = []
+    file_nodes = {
+        file_node._id: file_node
+        for file_node in BaseFileNode.objects.filter(_id__in={data.file_id for data in data_list})
+    }
+    version_stats = {
+        row['basefilenode_id']: row
+        for row in BaseFileVersionsThrough.objects.filter(
+            basefilenode_id__in=[file_node.id for file_node in file_nodes.values()]
+        ).values('basefilenode_id').annotate(
+            latest_version_id=Max('fileversion_id'),
+            version_count=Count('fileversion_id'),
+        )
+    }
+    latest_version_creators = dict(
+        FileVersion.objects.filter(
+            id__in=[row['latest_version_id'] for row in version_stats.values()]
+        ).values_list('id', 'creator_id')
+    )
 
+    creator_ids = {}
     for data in data_list:
-        if data.inspection_result_status == api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS:
-            continue
-
-        if not provider:
-            provider = data.provider
-        elif provider != data.provider:
-            provider_error_list.append({'provider': provider, 'error_list': error_list})
-            provider = data.provider
-            error_list = []
+        file_node = file_nodes.get(data.file_id)
+        version_stat = version_stats.get(file_node.id) if file_node is not None else None
+        creator_ids[data.id] = _error_list_creator_id(data, version_stat, latest_version_creators)
+
+    user_ids = set(creator_ids.values()) | {data.verify_user for data in data_list}
+    user_ids.discard(None)
+    users = OSFUser.objects.in_bulk(list(user_ids))
+
+    first_institution_ids = {
+        row['osfuser_id']: row['institution_id']
+        for row in OSFUser.affiliated_institutions.through.objects.filter(
+            osfuser_id__in={user_id for user_id in creator_ids.values() if user_id in users}
+        ).values('osfuser_id').annotate(institution_id=Min('institution_id'))
+    }
+    institutions = Institution.objects.in_bulk(list(set(first_institution_ids.values())))
+
+    return {
+        'file_nodes': file_nodes,
+        'version_stats': version_stats,
+        'creator_ids': creator_ids,
+        'users': users,
+        'institutions': {
+            user_id: institutions.get(institution_id)
+            for user_id, institution_id in first_institution_ids.items()
+        },
+    }
 
-        if data.inspection_result_status in RESULT_MESSAGE:
-            verify_result_title = RESULT_MESSAGE[data.inspection_result_status]
-        else:  # 'FILE missing(Unverify)'
-            verify_result_title = api_settings.FILE_NOT_FOUND_MSG
+def _build_error_info(data, relations):
+    from addons.osfstorage.models import OsfStorageFileNode
 
-        # User and date of the verification
-        if data.verify_date is not None:
-            verify_date = data.verify_date.strftime('%Y/%m/%d %H:%M:%S %Z')
-        else:
-            verify_date = ''
-
-        # Get file info
-        base_file_data = BaseFileNode.objects.filter(_id=data.file_id)
-        base_file_data_exists = base_file_data.exists()
-        file_versions = None
-        if base_file_data_exists:
-            base_file_data = base_file_data.get()
-            file_versions = base_file_data.versions.all()
-
-        # Get creator info
-        creator = None
-        if data.upload_file_modified_user is not None:
-            creator = OSFUser.objects.get(id=data.upload_file_modified_user)
-        elif data.upload_file_created_user is not None:
-            creator = OSFUser.objects.get(id=data.upload_file_created_user)
-        elif file_versions is not None and file_versions.exists():
-            creator = file_versions.latest('id').creator
-
-        # Change None to '' (empty string)
-        data.path = '' if data.path is None else data.path
-        data.upload_file_created_at = '' if data.upload_file_created_at is None else \
-            data.upload_file_created_at
-        data.verify_file_created_at = '' if data.verify_file_created_at is None else \
-            data.verify_file_created_at
-        data.upload_file_modified_at = '' if data.upload_file_modified_at is None else \
-            data.upload_file_modified_at
-        data.verify_file_modified_at = '' if data.verify_file_modified_at is None else \
-            data.verify_file_modified_at
-        data.upload_file_size = '' if data.upload_file_size is None else \
-            data.upload_file_size
-        data.verify_file_size = '' if data.verify_file_size is None else \
-            data.verify_file_size
-
-        # Generate error_info dictionary
-        error_info = {
-            'creator_name': '',
-            'creator_email': '',
-            'creator_id': '',
-            'file_path': data.path,
-            'file_id': data.file_id,
-            'file_create_date_on_upload': data.upload_file_created_at,
-            'file_create_date_on_verify': data.verify_file_created_at,
-            'file_modify_date_on_upload': data.upload_file_modified_at,
-            'file_modify_date_on_verify': data.verify_file_modified_at,
-            'file_size_on_upload': data.upload_file_size,
-            'file_size_on_verify': data.verify_file_size,
-            'file_version': '',
-            'project_id': data.project_id,
-            'organization_id': '',
-            'organization_name': '',
-            'verify_user_id': '',
-            'verify_user_name': '',
-            'verify_date': verify_date,
-            'verify_result_title': verify_result_title,
-        }
+    if data.inspection_result_status in RESULT_MESSAGE:
+        verify_result_title = RESULT_MESSAGE[data.inspection_result_status]
+    else:  # 'FILE missing(Unverify)'
+        verify_result_title = api_settings.FILE_NOT_FOUND_MSG
 
-        try:
-            verify_user = OSFUser.objects.get(id=data.verify_user)
-            error_info['verify_user_id'] = verify_user._id.upper()
-            error_info['verify_user_name'] = verify_user.fullname
-        except OSFUser.DoesNotExist:
-            logger.warning('Timestamp Control: verify_user not found.')
+    # User and date of the verification
+    if data.verify_date is not None:
+        verify_date = data.verify_date.strftime('%Y/%m/%d %H:%M:%S %Z')
+    else:
+        verify_date = ''
+
+    # Change None to '' (empty string)
+    data.path = '' if data.path is None else data.path
+    data.upload_file_created_at = '' if data.upload_file_created_at is None else \
+        data.upload_file_created_at
+    data.verify_file_created_at = '' if data.verify_file_created_at is None else \
+        data.verify_file_created_at
+    data.upload_file_modified_at = '' if data.upload_file_modified_at is None else \
+        data.upload_file_modified_at
+    data.verify_file_modified_at = '' if data.verify_file_modified_at is None else \
+        data.verify_file_modified_at
+    data.upload_file_size = '' if data.upload_file_size is None else \
+        data.upload_file_size
+    data.verify_file_size = '' if data.verify_file_size is None else \
+        data.verify_file_size
+
+    # Generate error_info dictionary
+    error_info = {
+        'creator_name': '',
+        'creator_email': '',
+        'creator_id': '',
+        'file_path': data.path,
+        'file_id': data.file_id,
+        'file_create_date_on_upload': data.upload_file_created_at,
+        'file_create_date_on_verify': data.verify_file_created_at,
+        'file_modify_date_on_upload': data.upload_file_modified_at,
+        'file_modify_date_on_verify': data.verify_file_modified_at,
+        'file_size_on_upload': data.upload_file_size,
+        'file_size_on_verify': data.verify_file_size,
+        'file_version': '',
+        'project_id': data.project_id,
+        'organization_id': '',
+        'organization_name': '',
+        'verify_user_id': '',
+        'verify_user_name': '',
+        'verify_date': verify_date,
+        'verify_result_title': verify_result_title,
+    }
 
-        if base_file_data_exists and provider == 'osfstorage':
+    verify_user = relations['users'].get(data.verify_user)
+    if verify_user is not None:
+        error_info['verify_user_id'] = verify_user._id.upper()
+        error_info['verify_user_name'] = verify_user.fullname
+    else:
+        logger.warning('Timestamp Control: verify_user not found.')
+
+    base_file_data = relations['file_nodes'].get(data.file_id)
+    if base_file_data is not None and data.provider == 'osfstorage':
+        if isinstance(base_file_data, OsfStorageFileNode):
+            # Same as OsfStorageFileNode.current_version_number without the COUNT query
+            version_stat = relations['version_stats'].get(base_file_data.id)
+            error_info['file_version'] = (version_stat['version_count'] if version_stat else 0) or 1
+        else:
             error_info['file_version'] = base_file_data.current_version_number
 
-        if creator is not None:
-            error_info['creator_name'] = creator.fullname
-            error_info['creator_email'] = creator.username
-            error_info['creator_id'] = creator._id
+    creator = relations['users'].get(relations['creator_ids'][data.id])
+    if creator is not None:
+        error_info['creator_name'] = creator.fullname
+        error_info['creator_email'] = creator.username
+        error_info['creator_id'] = creator._id
 
-            institution = creator.affiliated_institutions.first()
-            if institution is not None:
-                error_info['organization_id'] = institution._id
-                error_info['organization_name'] = institution.name
+        institution = relations['institutions'].get(creator.id)
+        if institution is not None:
+            error_info['organization_id'] = institution._id
+            error_info['organization_name'] = institution.name
 
-        error_list.append(error_info)
+    return error_info
 
-    if error_list:
-        provider_error_list.append({'provider': provider, 'error_list': error_list})
+def iter_error_list(pid, page_size=None):
+    '''Stream the timestamp errors of a project as pages of
+    ``{'provider': ..., 'error_list': [...]}``.
 
+    Each page resolves its related rows in bulk, so the number of queries only
+    depends on the number of pages. Consecutive pages may share a provider.
+    '''
+    page_size = page_size or api_settings.TS_ERROR_LIST_PAGE_SIZE
+    data_ids = list(
+        RdmFileTimestamptokenVerifyResult.objects.filter(
+            project_id=pid
+        ).exclude(
+            inspection_result_status=api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS
+        ).order_by('provider', 'path', 'id').values_list('id', flat=True)
+    )
+    for start in range(0, len(data_ids), page_size):
+        page_ids = data_ids[start:start + page_size]
+        page_data = RdmFileTimestamptokenVerifyResult.objects.in_bulk(page_ids)
+        data_list = [page_data[data_id] for data_id in page_ids if data_id in page_data]
+        relations = _load_error_list_relations(data_list)
+
+        provider = None
+        error_list = []
+        for data in data_list:
+            if error_list and provider != data.provider:
+                yield {'provider': provider, 'error_list': error_list}
+                error_list = []
+            provider = data.provider
+            error_list.append(_build_error_info(data, relations))
+        if error_list:
+            yield {'provider': provider, 'error_list': error_list}
+
+def get_error_list(pid):
+    '''Retrieve from the database the list of all timestamps that has an error.
+    '''
+    provider_error_list = []
+    for page in iter_error_list(pid):
+        if provider_error_list and provider_error_list[-1]['provider'] == page['provider']:
+            provider_error_list[-1]['error_list'].extend(page['error_list'])
+        else:
+            provider_error_list.append(page)
     return provider_error_list
 
-def get_full_list(uid, pid, node):
-    '''Get a full list of timestamps from all files uploaded to a storage.
+def _root_file_info(provider, file_data, basefile_node):
+    file_info = {
+        'file_id': basefile_node._id,
+        'file_name': file_data['attributes'].get('name'),
+        'file_path': file_data['attributes'].get('materialized'),
+        'size': file_data['attributes'].get('size'),
+        'created': file_data['attributes'].get('created_utc'),
+        'modified': file_data['attributes'].get('modified_utc'),
+        'file_version': ''
+    }
+    if provider == 'osfstorage':
+        file_info['file_version'] = file_data['attributes']['extra'].get('version')
+    return file_info
+
+def _folder_file_info(provider, file_data, basefile_node):
+    return {
+        'file_name': file_data['attributes']['name'],
+        'file_path': file_data['attributes']['materialized'],
+        'file_kind': file_data['attributes']['kind'],
+        'file_id': basefile_node._id,
+        'version': file_data['attributes']['extra']['version'] if provider == 'osfstorage' else ''
+    }
+
+def iter_full_list(uid, pid, node):
+    '''Iterate over the files uploaded to all storages of a project.
+
+    Yields a file info dict (with its ``provider``) as soon as the batch it
+    belongs to has been stored, so callers can start working before the whole
+    tree has been crawled.
     '''
     user_info = OSFUser.objects.get(id=uid)
     cookie = user_info.get_or_create_cookie().decode()
@@ -242,7 +350,6 @@ def get_full_list(uid, pid, node):
     file_res = requests.get(api_url, headers=headers, cookies=cookies)
     provider_json_res = file_res.json()
     file_res.close()
-    provider_list = []
 
     for provider_data in provider_json_res['data']:
         provider = provider_data['attributes']['provider']
@@ -265,55 +372,38 @@ def get_full_list(uid, pid, node):
                 inspection_result_status=api_settings.FILE_NOT_EXISTS
             ).update(inspection_result_status=api_settings.FILE_NOT_EXISTS)
 
-        file_list = []
-        child_file_list = []
+        root_files = []
+        folder_paths = []
         for file_data in waterbutler_json_res['data']:
             if file_data['attributes']['kind'] == 'folder':
                 logger.info(u'Detected: folder={}'.format(file_data['attributes']['materialized']))
-                child_file_list.extend(
-                    waterbutler_folder_file_info(
-                        pid,
-                        provider_data['attributes']['provider'],
-                        file_data['attributes']['path'],
-                        node, cookies, headers
-                    )
-                )
+                folder_paths.append(file_data['attributes']['path'])
             else:
                 logger.info(u'Detected: file={}'.format(file_data['attributes']['materialized']))
-                file_info = None
-                basefile_node = BaseFileNode.resolve_class(
-                    provider_data['attributes']['provider'],
-                    BaseFileNode.FILE
-                ).get_or_create(
-                    node,
-                    file_data['attributes']['path']
-                )
-                basefile_node.materialized_path = file_data['attributes']['materialized']
-                basefile_node.name = os.path.basename(file_data['attributes']['materialized'])
-                basefile_node.save()
-                file_info = {
-                    'file_id': basefile_node._id,
-                    'file_name': file_data['attributes'].get('name'),
-                    'file_path': file_data['attributes'].get('materialized'),
-                    'size': file_data['attributes'].get('size'),
-                    'created': file_data['attributes'].get('created_utc'),
-                    'modified': file_data['attributes'].get('modified_utc'),
-                    'file_version': ''
-                }
-                if provider_data['attributes']['provider'] == 'osfstorage':
-                    file_info['file_version'] = file_data['attributes']['extra'].get('version')
-                if file_info:
-                    file_list.append(file_info)
-
-        file_list.extend(child_file_list)
-
-        if file_list:
-            provider_files = {
-                'provider': provider_data['attributes']['provider'],
-                'provider_file_list': file_list
-            }
-            provider_list.append(provider_files)
+                root_files.append(file_data)
+
+        with WaterButlerFileCrawler(pid, provider, node, cookies, headers) as crawler:
+            for file_data, basefile_node in crawler.upsert_file_nodes(root_files):
+                file_info = _root_file_info(provider, file_data, basefile_node)
+                file_info['provider'] = provider
+                yield file_info
+            for file_data, basefile_node in crawler.iter_files(folder_paths):
+                file_info = _folder_file_info(provider, file_data, basefile_node)
+                file_info['provider'] = provider
+                yield file_info
 
+def get_full_list(uid, pid, node):
+    '''Get a full list of timestamps from all files uploaded to a storage.
+    '''
+    provider_list = []
+    for file_info in iter_full_list(uid, pid, node):
+        provider = file_info.pop('provider')
+        if not provider_list or provider_list[-1]['provider'] != provider:
+            provider_list.append({
+                'provider': provider,
+                'provider_file_list': []
+            })
+        provider_list[-1]['provider_file_list'].append(file_info)
     return provider_list
 
 def check_file_timestamp(uid, node, data, verify_external_only=False):
@@ -439,64 +529,202 @@ def add_log_download_errors(node, uid, data, save=True):
         save=save,
     )
 
-@celery_app.task(bind=True, base=AbortableTask)
-def celery_verify_timestamp_token(self, uid, node_id):
-    secs_to_wait = 60.0 / api_settings.TS_REQUESTS_PER_MIN
-    last_run = None
+TIMESTAMP_OPERATION_VERIFY = 'verify'
+TIMESTAMP_OPERATION_ADD = 'add'
 
-    celery_app.current_task.update_state(state='PROGRESS', meta={'progress': 0})
-    node = AbstractNode.objects.get(id=node_id)
-    celery_app.current_task.update_state(state='PROGRESS', meta={'progress': 50})
-    logger.info('Running timestamp verification...: uid={}, node_guid={}'.format(uid, node._id))
-    for provider_dict in get_full_list(uid, node._id, node):
-        for p_item in provider_dict['provider_file_list']:
-            if self.is_aborted():
+def _release_timestamp_task(node):
+    '''Forget the celery task of a node. The record is kept while it holds the
+    checkpoint of an unfinished run, so that the next run can resume.
+    '''
+    TimestampTask.objects.filter(node=node, completed_file_ids=[]).delete()
+    TimestampTask.objects.filter(node=node).update(task_id='')
+
+def start_celery_task(task, node, requester, *args):
+    '''Register the TimestampTask of a node before dispatching its celery task,
+    so that the task can hand the record over to its shards.
+    '''
+    task_id = uuid()
+    TimestampTask.objects.update_or_create(
+        node=node,
+        defaults={'task_id': task_id, 'requester': requester}
+    )
+    return task.apply_async(args=args, task_id=task_id)
+
+def _load_checkpoint(node, operation):
+    '''Return the IDs of the files already processed by an interrupted run of
+    the same operation, discarding checkpoints of other or expired runs.
+    '''
+    expired = timezone.now() - datetime.timedelta(seconds=api_settings.TS_CHECKPOINT_EXPIRATION)
+    timestamp_task = TimestampTask.objects.filter(node=node).first()
+    if timestamp_task is None:
+        return set()
+    if timestamp_task.operation != operation or \
+            (timestamp_task.checkpointed_at is not None and timestamp_task.checkpointed_at < expired):
+        TimestampTask.objects.filter(node=node).update(
+            operation=operation, completed_file_ids=[], checkpointed_at=None
+        )
+        return set()
+    return set(timestamp_task.completed_file_ids)
+
+def _save_checkpoint(node, file_ids):
+    TimestampTask.objects.filter(node=node).update(
+        completed_file_ids=Func(
+            F('completed_file_ids'),
+            Cast(Value(list(file_ids)), ArrayField(models.CharField(max_length=24))),
+            function='array_cat',
+        ),
+        checkpointed_at=timezone.now(),
+    )
+
+class _CheckpointBuffer(object):
+    '''Collect the IDs of processed files and append them to the checkpoint every
+    TS_CHECKPOINT_FILES files or TS_CHECKPOINT_INTERVAL seconds, as every append
+    rewrites the whole array.
+    '''
+
+    def __init__(self, node):
+        self.node = node
+        self.file_ids = []
+        self.saved_at = time.time()
+
+    def add(self, file_id):
+        self.file_ids.append(file_id)
+        if len(self.file_ids) >= api_settings.TS_CHECKPOINT_FILES or \
+                time.time() >= self.saved_at + api_settings.TS_CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        if self.file_ids:
+            _save_checkpoint(self.node, self.file_ids)
+            self.file_ids = []
+        self.saved_at = time.time()
+
+def _clear_checkpoint(node):
+    TimestampTask.objects.filter(node=node).update(completed_file_ids=[], checkpointed_at=None)
+
+def _process_timestamp_files(operation, uid, node, file_list, is_aborted, secs_to_wait,
+                             completed_file_ids=()):
+    '''Verify or add the timestamp of each file in turn, skipping the files
+    recorded in the checkpoint and recording the ones that get processed.
+    '''
+    process_file = check_file_timestamp if operation == TIMESTAMP_OPERATION_VERIFY else add_token
+    checkpoint = _CheckpointBuffer(node)
+    try:
+        for data in file_list:
+            if is_aborted():
                 break
-            p_item['provider'] = provider_dict['provider']
+            if data.get('file_id') in completed_file_ids:
+                continue
             last_run = time.time()
-            result = check_file_timestamp(uid, node, p_item)
+            result = process_file(uid, node, data)
+            if data.get('file_id'):
+                checkpoint.add(data['file_id'])
             if result is None:
                 continue
             # Do not let the task run too many requests
             while time.time() < last_run + secs_to_wait:
                 time.sleep(0.1)
-    add_log_verify_all(node, uid)
-    if self.is_aborted():
-        logger.warning('Task from project ID {} was cancelled by user ID {}'.format(node_id, uid))
+    finally:
+        checkpoint.save()
+
+def _finish_timestamp_files(operation, uid, node, aborted):
+    if operation == TIMESTAMP_OPERATION_VERIFY:
+        add_log_verify_all(node, uid)
+    else:
+        add_log_add_all(node, uid)
+    if aborted:
+        logger.warning('Task from project ID {} was cancelled by user ID {}'.format(node.id, uid))
+    else:
+        _clear_checkpoint(node)
+
+def _run_timestamp_files(task, operation, uid, node, file_list):
+    '''Process the files inline, or split them into shards running as a celery
+    chord when sharding is enabled and there is more than one shard of work.
+    '''
+    secs_to_wait = 60.0 / api_settings.TS_REQUESTS_PER_MIN
+    completed_file_ids = _load_checkpoint(node, operation)
+    if api_settings.TS_MAX_SHARDS_PER_NODE <= 1:
+        # file_list may be a generator, the total is only known at the end
+        _process_timestamp_files(
+            operation, uid, node, file_list, task.is_aborted, secs_to_wait, completed_file_ids)
+        _finish_timestamp_files(operation, uid, node, task.is_aborted())
+        return
+
+    # Shards are planned over the whole crawl, so the files are collected first
+    file_list = list(file_list)
+    if task.is_aborted():
+        # Cancelled during the crawl: the TimestampTask has already been released
+        _finish_timestamp_files(operation, uid, node, aborted=True)
+        return
+    pending_list = [data for data in file_list if data.get('file_id') not in completed_file_ids]
+    shard_count = min(
+        api_settings.TS_MAX_SHARDS_PER_NODE,
+        -(-len(pending_list) // api_settings.TS_SHARD_MIN_FILES),
+    )
+    TimestampTask.objects.filter(node=node).update(
+        total_files=len(file_list), shard_count=max(shard_count, 1))
+    if shard_count <= 1:
+        _process_timestamp_files(operation, uid, node, pending_list, task.is_aborted, secs_to_wait)
+        _finish_timestamp_files(operation, uid, node, task.is_aborted())
+        return
+
+    # The chord callback stands for the whole run: cancelling it aborts every shard.
+    callback_id = uuid()
+    shards = [
+        celery_timestamp_shard.si(
+            operation, uid, node.id, pending_list[i::shard_count], callback_id, shard_count)
+        for i in range(shard_count)
+    ]
+    callback = celery_finish_timestamp_shards.si(operation, uid, node.id).set(task_id=callback_id)
+    # A run cancelled in the meantime has no task id left to hand over, and shards
+    # dispatched without one could neither be seen nor cancelled
+    if not TimestampTask.objects.filter(node=node).exclude(task_id='').update(task_id=callback_id):
+        _finish_timestamp_files(operation, uid, node, aborted=True)
+        return
+    chord(shards)(callback)
+
+@celery_app.task(bind=True, base=AbortableTask)
+def celery_timestamp_shard(self, operation, uid, node_id, file_list, run_task_id, shard_count):
+    node = AbstractNode.objects.get(id=node_id)
+    run_task = OSFAbortableAsyncResult(run_task_id)
+    # Shards share the per-minute request budget of the node
+    secs_to_wait = 60.0 * shard_count / api_settings.TS_REQUESTS_PER_MIN
+    _process_timestamp_files(operation, uid, node, file_list, run_task.is_aborted, secs_to_wait)
+
+@celery_app.task(bind=True, base=AbortableTask)
+def celery_finish_timestamp_shards(self, operation, uid, node_id):
+    node = AbstractNode.objects.get(id=node_id)
+    _finish_timestamp_files(operation, uid, node, self.is_aborted())
+
+@celery_app.task(bind=True, base=AbortableTask)
+def celery_verify_timestamp_token(self, uid, node_id):
+    celery_app.current_task.update_state(state='PROGRESS', meta={'progress': 0})
+    node = AbstractNode.objects.get(id=node_id)
+    celery_app.current_task.update_state(state='PROGRESS', meta={'progress': 50})
+    logger.info('Running timestamp verification...: uid={}, node_guid={}'.format(uid, node._id))
+    if api_settings.TS_MAX_SHARDS_PER_NODE > 1:
+        file_list = []
+        for p_item in iter_full_list(uid, node._id, node):
+            if self.is_aborted():
+                break
+            file_list.append(p_item)
+    else:
+        # Without sharding, verify the files as the crawler finds them
+        file_list = iter_full_list(uid, node._id, node)
+    _run_timestamp_files(self, TIMESTAMP_OPERATION_VERIFY, uid, node, file_list)
     celery_app.current_task.update_state(state='SUCCESS', meta={'progress': 100})
 
 @celery_app.task(bind=True, base=AbortableTask)
 def celery_add_timestamp_token(self, uid, node_id, request_data):
     """Celery Timestamptoken add method
     """
-    secs_to_wait = 60.0 / api_settings.TS_REQUESTS_PER_MIN
-    last_run = None
-
     node = AbstractNode.objects.get(id=node_id)
     logger.info('Running add timestamp token...: uid={}, node_guid={}'.format(uid, node._id))
-    for _, data in enumerate(request_data):
-        if self.is_aborted():
-            break
-        last_run = time.time()
-        result = add_token(uid, node, data)
-        if result is None:
-            continue
-        # success
-
-        ### log per a file
-        # add_log_a_file(NodeLog.TIMESTAMP_ADDED, node, uid,
-        #                data['provider'], data['file_id'])
-
-        # Do not let the task run too many requests
-        while time.time() < last_run + secs_to_wait:
-            time.sleep(0.1)
-    add_log_add_all(node, uid)
-    if self.is_aborted():
-        logger.warning('Task from project ID {} was cancelled by user ID {}'.format(node_id, uid))
+    _run_timestamp_files(self, TIMESTAMP_OPERATION_ADD, uid, node, request_data)
 
 def get_celery_task(node):
     task = None
-    timestamp_task = TimestampTask.objects.filter(node=node).first()
+    timestamp_task = TimestampTask.objects.filter(node=node).exclude(task_id='').first()
     if timestamp_task is not None:
         task = OSFAbortableAsyncResult(timestamp_task.task_id)
     return task
@@ -509,7 +737,15 @@ def get_celery_task_progress(node):
     if task is not None:
         status['ready'] = task.ready()
         if status['ready']:
-            TimestampTask.objects.filter(node=node).delete()
+            _release_timestamp_task(node)
+        else:
+            progress = TimestampTask.objects.filter(node=node).annotate(
+                completed_files=Func(F('completed_file_ids'), function='cardinality')
+            ).values('total_files', 'completed_files', 'shard_count').first()
+            if progress is not None:
+                status['total'] = progress['total_files']
+                status['completed'] = progress['completed_files']
+                status['shards'] = progress['shard_count']
     return status
 
 def cancel_celery_task(node):
@@ -521,7 +757,7 @@ def cancel_celery_task(node):
         task.revoke()
         task.abort()
         result['success'] = True
-    TimestampTask.objects.filter(node=node).delete()
+    _release_timestamp_task(node)
     return result
 
 def add_token(uid, node, data):
@@ -882,63 +1118,155 @@ def file_node_gone(project_id, addon_name, src_path):
         inspection_result_status=api_settings.FILE_NOT_EXISTS
     ).update(inspection_result_status=tst_status)
 
-def waterbutler_folder_file_info(pid, provider, path, node, cookies, headers):
-    # get waterbutler folder file
+def _waterbutler_folder_meta_url(pid, provider, path):
     if provider == 'osfstorage':
-        waterbutler_meta_url = waterbutler_api_url_for(
-            pid, provider,
-            '/' + path,
-            meta=int(time.mktime(datetime.datetime.now().timetuple()))
-        )
-    else:
-        waterbutler_meta_url = waterbutler_api_url_for(
-            pid, provider,
-            path,
-            meta=int(time.mktime(datetime.datetime.now().timetuple()))
-        )
+        path = '/' + path
+    return waterbutler_api_url_for(
+        pid, provider,
+        path,
+        meta=int(time.mktime(datetime.datetime.now().timetuple()))
+    )
+
+class WaterButlerFileCrawler(object):
+    '''Walk the folders of a WaterButler provider breadth-first.
 
-    waterbutler_res = requests.get(waterbutler_meta_url, headers=headers, cookies=cookies)
-    waterbutler_json_res = waterbutler_res.json()
-    waterbutler_res.close()
-    file_list = []
-    child_file_list = []
-    for file_data in waterbutler_json_res['data']:
-        if file_data['attributes']['kind'] == 'folder':
-            child_file_list.extend(waterbutler_folder_file_info(
-                pid, provider, file_data['attributes']['path'],
-                node, cookies, headers))
+    Folder listings are fetched by a bounded pool of threads sharing one
+    keep-alive session. Database work stays on the calling thread: the files
+    found are upserted into ``BaseFileNode`` in batches with
+    ``bulk_create``/``bulk_update``.
+    '''
+
+    def __init__(self, pid, provider, node, cookies, headers, max_workers=None, batch_size=None):
+        self.pid = pid
+        self.provider = provider
+        self.node = node
+        self.cookies = cookies
+        self.headers = headers
+        self.max_workers = max_workers or api_settings.TS_CRAWLER_MAX_WORKERS
+        self.batch_size = batch_size or api_settings.TS_CRAWLER_BATCH_SIZE
+        self.file_class = BaseFileNode.resolve_class(provider, BaseFileNode.FILE)
+        self.content_type = ContentType.objects.get_for_model(node)
+
+        retries = Retry(
+            total=api_settings.RETRY_COUNT, backoff_factor=1,
+            status_forcelist=api_settings.ERROR_HTTP_STATUS)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_workers, max_retries=retries)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def list_folder(self, path):
+        '''Return the WaterButler metadata of the direct children of a folder.
+        Runs on worker threads, so it must not touch the database.
+        '''
+        res = self.session.get(
+            _waterbutler_folder_meta_url(self.pid, self.provider, path),
+            headers=self.headers, cookies=self.cookies)
+        try:
+            return res.json()['data']
+        finally:
+            res.close()
+
+    def iter_files(self, folder_paths):
+        '''Yield ``(file_data, basefile_node)`` for every file below the given
+        folders, batch by batch as the listings come back.
+        '''
+        batch = []
+        level = list(folder_paths)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while level:
+                next_level = []
+                futures = [executor.submit(self.list_folder, path) for path in level]
+                for future in as_completed(futures):
+                    for file_data in future.result():
+                        if file_data['attributes']['kind'] == 'folder':
+                            next_level.append(file_data['attributes']['path'])
+                        else:
+                            batch.append(file_data)
+                    if len(batch) >= self.batch_size:
+                        for item in self.upsert_file_nodes(batch):
+                            yield item
+                        batch = []
+                level = next_level
+        for item in self.upsert_file_nodes(batch):
+            yield item
+
+    def _existing_file_nodes(self, paths):
+        queryset = self.file_class.objects.filter(
+            target_object_id=self.node.id,
+            target_content_type=self.content_type,
+        )
+        if self.provider == 'osfstorage':
+            # mirrors OsfStorageFileNode.get_or_create: path is the _id of the file node
+            queryset = queryset.filter(_id__in=[path.strip('/') for path in paths])
+            return {'/' + file_node._id: file_node for file_node in queryset}
+        # keep the oldest duplicate, as BaseFileNode.get_or_create does
+        queryset = queryset.filter(_path__in=paths).order_by('-id')
+        return {file_node._path: file_node for file_node in queryset}
+
+    def upsert_file_nodes(self, file_datas):
+        '''Get or create the ``BaseFileNode`` of each file in bulk and keep its
+        name and materialized path in sync with WaterButler.
+        '''
+        if not file_datas:
+            return []
+        paths = ['/' + file_data['attributes']['path'].lstrip('/') for file_data in file_datas]
+        file_nodes = self._existing_file_nodes(paths)
+        if self.provider == 'osfstorage':
+            # names and materialized paths of osfstorage are authoritative in the database,
+            # and renaming in bulk would leave the stored materialized paths of descendants stale
+            update_fields = []
         else:
-            basefile_node = BaseFileNode.resolve_class(
-                provider,
-                BaseFileNode.FILE
-            ).get_or_create(
-                node,
-                file_data['attributes']['path']
-            )
-            basefile_node.materialized_path = file_data['attributes']['materialized']
-            basefile_node.name = os.path.basename(file_data['attributes']['materialized'])
-            basefile_node.save()
-            if provider == 'osfstorage':
-                file_info = {
-                    'file_name': file_data['attributes']['name'],
-                    'file_path': file_data['attributes']['materialized'],
-                    'file_kind': file_data['attributes']['kind'],
-                    'file_id': basefile_node._id,
-                    'version': file_data['attributes']['extra']['version']
-                }
-            else:
-                file_info = {
-                    'file_name': file_data['attributes']['name'],
-                    'file_path': file_data['attributes']['materialized'],
-                    'file_kind': file_data['attributes']['kind'],
-                    'file_id': basefile_node._id,
-                    'version': ''
-                }
-
-            file_list.append(file_info)
-
-    file_list.extend(child_file_list)
-    return file_list
+            update_fields = ['_materialized_path', 'name']
+
+        to_create = []
+        to_update = {}
+        results = []
+        for path, file_data in zip(paths, file_datas):
+            materialized = file_data['attributes']['materialized']
+            name = os.path.basename(materialized)
+            file_node = file_nodes.get(path)
+            if file_node is None:
+                # BaseFileNode.create appends the provider, bulk_create bypasses it
+                file_node = self.file_class(
+                    target=self.node, _path=path, provider=self.file_class._provider,
+                    _materialized_path='' if self.provider == 'osfstorage' else materialized,
+                    name=name,
+                )
+                file_nodes[path] = file_node
+                to_create.append(file_node)
+            elif file_node.pk is not None and update_fields and (
+                    file_node.name != name or
+                    ('_materialized_path' in update_fields and file_node._materialized_path != materialized)):
+                file_node.name = name
+                if '_materialized_path' in update_fields:
+                    file_node._materialized_path = materialized
+                to_update[file_node.pk] = file_node
+            results.append((file_data, file_node))
+
+        if to_update:
+            bulk_update(list(to_update.values()), update_fields=update_fields)
+        if to_create:
+            self.file_class.objects.bulk_create(to_create)
+        return results
+
+def waterbutler_folder_file_info(pid, provider, path, node, cookies, headers):
+    # get waterbutler folder file
+    with WaterButlerFileCrawler(pid, provider, node, cookies, headers) as crawler:
+        return [
+            _folder_file_info(provider, file_data, basefile_node)
+            for file_data, basefile_node in crawler.iter_files([path])
+        ]
 
 def user_guid_to_id(user_guid):
     return OSFUser.objects.get(guids___id=user_guid).id